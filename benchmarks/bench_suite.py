@@ -0,0 +1,353 @@
+"""
+Benchmark suite: every public scoring entry point across sequence lengths,
+vocabulary sizes and word/character granularity, with regression tracking.
+
+Every case runs in a fresh interpreter so that its peak RSS is not polluted by
+the previous cases.  For every case the suite records:
+
+* ``seconds`` -- the best wall-clock time of ``--repeat`` runs over the batch
+  (a single run for the cases taking longer than a second),
+* ``per_pair_us`` / ``per_token_ns`` -- the same time per pair and per ref token,
+* ``peak_rss_mb`` -- the peak resident set size of the process,
+* ``native_fraction`` -- the share of the time spent inside ``_kaldialign``
+  (measured in a separate run under ``cProfile``, the rest is the Python-side
+  symbol mapping and result conversion).
+
+Usage:
+    python benchmarks/bench_suite.py --output results.json
+    python benchmarks/bench_suite.py --quick --filter 'align/' --baseline results.json
+
+With ``--baseline`` the results are compared with a previous JSON file and the
+script exits with status 1 if the time or the peak RSS of any case grew by more
+than ``--threshold`` (a fraction, 0.1 = 10%).
+"""
+
+import argparse
+import cProfile
+import json
+import os
+import platform
+import pstats
+import random
+import re
+import resource
+import string
+import subprocess
+import sys
+import time
+
+import kaldialign
+
+LENGTHS = [10, 100, 1000, 10000, 100000]
+QUICK_LENGTHS = [10, 1000]
+VOCAB_SIZES = [100, 10000]
+
+# The compound DP is much slower than the plain one, don't wait for hours.
+# The bootstrap cost depends on the number of utterances, not on their length.
+MAX_LENGTH = {
+    "edit_distance_compound": 10000,
+    "align_compound": 10000,
+    "bootstrap_wer_ci": 1000,
+    "bootstrap_wer_ci_2sys": 1000,
+}
+
+# Roughly this many ref tokens are scored per case, so that the short
+# sequences are timed over a batch of pairs instead of a single call.
+TOKENS_PER_CASE = 50000
+# Cases whose first run takes longer than this are not repeated.
+MIN_REPEAT_SECONDS = 1.0
+
+
+def make_vocab(size, seed):
+    rng = random.Random(seed)
+    vocab = set()
+    while len(vocab) < size:
+        vocab.add("".join(rng.choices(string.ascii_lowercase, k=rng.randint(2, 8))))
+    return sorted(vocab)
+
+
+def make_hyp(ref, vocab, rng, err_rate=0.15):
+    """Corrupt ``ref`` with substitutions, deletions and insertions."""
+    hyp = []
+    for token in ref:
+        r = rng.random()
+        if r < err_rate / 3:
+            hyp.append(rng.choice(vocab))
+        elif r < 2 * err_rate / 3:
+            pass
+        elif r < err_rate:
+            hyp.extend((token, rng.choice(vocab)))
+        else:
+            hyp.append(token)
+    return hyp
+
+
+def make_compound_hyp(ref, vocab, rng, merge_prob=0.1):
+    """Like :func:`make_hyp`, but also fuse some adjacent words into compounds."""
+    hyp = make_hyp(ref, vocab, rng)
+    out, i = [], 0
+    while i < len(hyp):
+        if i + 1 < len(hyp) and rng.random() < merge_prob:
+            out.append(hyp[i] + hyp[i + 1])
+            i += 2
+        else:
+            out.append(hyp[i])
+            i += 1
+    return out
+
+
+def generate_pairs(case):
+    """Deterministic ``(refs, hyps, hyps2)`` for a case, with ``hyps2`` a second system."""
+    rng = random.Random(case["seed"])
+    length = case["length"]
+    compound = case["entry"].endswith("_compound")
+    if case["granularity"] == "char":
+        # Characters of running text, spaces included.
+        words = make_vocab(case["vocab"], case["seed"])
+        vocab = sorted(set("".join(words))) + [" "]
+    else:
+        vocab = make_vocab(case["vocab"], case["seed"])
+
+    refs, hyps = [], []
+    for _ in range(max(1, TOKENS_PER_CASE // length)):
+        if case["granularity"] == "char":
+            text = []
+            while len(text) < length:
+                text.extend(rng.choice(words) + " ")
+            ref = text[:length]
+        else:
+            ref = [rng.choice(vocab) for _ in range(length)]
+        refs.append(ref)
+        if compound:
+            hyps.append(make_compound_hyp(ref, vocab, rng))
+        else:
+            hyps.append(make_hyp(ref, vocab, rng))
+    hyps2 = [make_hyp(ref, vocab, rng) for ref in refs]
+    return refs, hyps, hyps2
+
+
+def make_runner(case, refs, hyps, hyps2):
+    """Return a zero-argument callable scoring the whole case."""
+    entry = case["entry"]
+    if entry in ("edit_distance", "edit_distance_compound"):
+        merge = entry == "edit_distance_compound"
+        pairs = list(zip(refs, hyps))
+
+        def run():
+            for ref, hyp in pairs:
+                kaldialign.edit_distance(ref, hyp, merge_compounds=merge)
+
+    elif entry in ("align", "align_compound"):
+        merge = entry == "align_compound"
+        pairs = list(zip(refs, hyps))
+
+        def run():
+            for ref, hyp in pairs:
+                kaldialign.align(ref, hyp, "*", merge_compounds=merge)
+
+    elif entry == "bootstrap_wer_ci":
+
+        def run():
+            kaldialign.bootstrap_wer_ci(refs, hyps)
+
+    elif entry == "bootstrap_wer_ci_2sys":
+
+        def run():
+            kaldialign.bootstrap_wer_ci(refs, hyps, hyps2)
+
+    else:
+        raise ValueError(f"Unknown entry point: {entry}")
+    return run
+
+
+def native_seconds(profile):
+    """Total time spent in functions of the ``_kaldialign`` extension."""
+    stats = pstats.Stats(profile).stats
+    return sum(
+        tt
+        for (filename, _, name), (_, _, tt, _, _) in stats.items()
+        if filename == "~" and "_kaldialign." in name
+    )
+
+
+def run_case(case, repeat):
+    """Run a single case in this process and return its measurements."""
+    refs, hyps, hyps2 = generate_pairs(case)
+    run = make_runner(case, refs, hyps, hyps2)
+    rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    # The first run is the warmup and measures the Python/native split; the
+    # profiler overhead is per Python call, so it is negligible for long runs
+    # whose time is taken from this run as well.
+    profile = cProfile.Profile()
+    start = time.perf_counter()
+    profile.enable()
+    run()
+    profile.disable()
+    profiled = time.perf_counter() - start
+    seconds = profiled
+    if profiled < MIN_REPEAT_SECONDS:
+        times = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            run()
+            times.append(time.perf_counter() - start)
+        seconds = min(times)
+
+    # ru_maxrss is in KiB on Linux and in bytes on macOS.
+    rss_scale = 1 / 2**20 if sys.platform == "darwin" else 1 / 2**10
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    num_tokens = sum(len(ref) for ref in refs)
+    return {
+        **case,
+        "pairs": len(refs),
+        "tokens": num_tokens,
+        "seconds": seconds,
+        "per_pair_us": seconds / len(refs) * 1e6,
+        "per_token_ns": seconds / max(num_tokens, 1) * 1e9,
+        "peak_rss_mb": peak_rss * rss_scale,
+        "data_rss_mb": rss_before * rss_scale,
+        "native_fraction": min(native_seconds(profile) / profiled, 1.0),
+    }
+
+
+def case_name(case):
+    return f"{case['entry']}/{case['granularity']}/V{case['vocab']}/L{case['length']}"
+
+
+def all_cases(lengths):
+    entries = [
+        "edit_distance",
+        "align",
+        "edit_distance_compound",
+        "align_compound",
+        "bootstrap_wer_ci",
+        "bootstrap_wer_ci_2sys",
+    ]
+    cases = []
+    for entry in entries:
+        for length in lengths:
+            if length > MAX_LENGTH.get(entry, length):
+                continue
+            granularities = [("word", v) for v in VOCAB_SIZES]
+            if not entry.endswith("_compound"):
+                granularities.append(("char", VOCAB_SIZES[0]))
+            for granularity, vocab in granularities:
+                case = {
+                    "entry": entry,
+                    "granularity": granularity,
+                    "vocab": vocab,
+                    "length": length,
+                    "seed": 42,
+                }
+                cases.append({"name": case_name(case), **case})
+    return cases
+
+
+def run_isolated(case, repeat):
+    """Run a case in a fresh interpreter, return its measurements."""
+    proc = subprocess.run(
+        [
+            sys.executable,
+            __file__,
+            "--run-case",
+            json.dumps(case),
+            "--repeat",
+            str(repeat),
+        ],
+        stdout=subprocess.PIPE,
+        check=True,
+        text=True,
+    )
+    return json.loads(proc.stdout)
+
+
+def compare(results, baseline, threshold):
+    """Print the change against ``baseline``, return the names of the regressions."""
+    base = {r["name"]: r for r in baseline["results"]}
+    regressions = []
+    print(f"\n{'case':45s} {'time':>9s} {'peak RSS':>9s}")
+    for result in results:
+        old = base.get(result["name"])
+        if old is None:
+            continue
+        time_ratio = result["seconds"] / old["seconds"]
+        rss_ratio = result["peak_rss_mb"] / old["peak_rss_mb"]
+        failed = time_ratio > 1 + threshold or rss_ratio > 1 + threshold
+        print(
+            f"{result['name']:45s} {time_ratio:8.2f}x {rss_ratio:8.2f}x"
+            + ("  REGRESSION" if failed else "")
+        )
+        if failed:
+            regressions.append(result["name"])
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--output", help="Write the results to this JSON file.")
+    parser.add_argument(
+        "--baseline", help="Compare with the results in this JSON file."
+    )
+    parser.add_argument(
+        "--threshold",
+        type=float,
+        default=0.1,
+        help="Allowed relative growth of time and peak RSS against the baseline.",
+    )
+    parser.add_argument("--filter", help="Only run the cases matching this regex.")
+    parser.add_argument("--quick", action="store_true", help="Only a few lengths.")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--run-case", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run_case:
+        json.dump(run_case(json.loads(args.run_case), args.repeat), sys.stdout)
+        return 0
+
+    cases = all_cases(QUICK_LENGTHS if args.quick else LENGTHS)
+    if args.filter:
+        cases = [c for c in cases if re.search(args.filter, c["name"])]
+    results = []
+    print(
+        f"{'case':45s} {'pairs':>6s} {'seconds':>9s} {'ns/token':>10s} "
+        f"{'RSS MB':>8s} {'native':>7s}"
+    )
+    for case in cases:
+        result = run_isolated(case, args.repeat)
+        results.append(result)
+        print(
+            f"{result['name']:45s} {result['pairs']:6d} {result['seconds']:9.4f} "
+            f"{result['per_token_ns']:10.1f} {result['peak_rss_mb']:8.1f} "
+            f"{100 * result['native_fraction']:6.1f}%"
+        )
+
+    report = {
+        "meta": {
+            "kaldialign": kaldialign.__version__,
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "repeat": args.repeat,
+        },
+        "results": results,
+    }
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.threshold)
+        if regressions:
+            print(
+                f"\n{len(regressions)} case(s) regressed by more than {args.threshold:.0%}."
+            )
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,79 @@
+"""
+Benchmark: thread scaling of edit_distance / align called from a thread pool.
+
+The native entry points release the GIL for the duration of the DP, so
+scoring independent pairs from a ``ThreadPoolExecutor`` should scale with
+the number of cores (and fully so on free-threaded CPython builds, where the
+Python-side symbol mapping runs in parallel as well).
+
+Usage:
+    python benchmarks/bench_threads.py
+"""
+
+import os
+import random
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from kaldialign import align, edit_distance
+
+VOCAB = [f"w{i}" for i in range(500)]
+
+
+def generate_dataset(n_pairs, min_len, max_len, seed):
+    """Generate synthetic ref/hyp pairs with ~15% substitutions."""
+    rng = random.Random(seed)
+    pairs = []
+    for _ in range(n_pairs):
+        length = rng.randint(min_len, max_len)
+        ref = [rng.choice(VOCAB) for _ in range(length)]
+        hyp = [rng.choice(VOCAB) if rng.random() < 0.15 else w for w in ref]
+        pairs.append((ref, hyp))
+    return pairs
+
+
+def run(pairs, fn, n_threads):
+    """Score all pairs with ``n_threads`` Python threads, return elapsed seconds."""
+    chunks = [pairs[i::n_threads] for i in range(n_threads)]
+
+    def work(chunk):
+        for ref, hyp in chunk:
+            fn(ref, hyp)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=n_threads) as pool:
+        list(pool.map(work, chunks))
+    return time.perf_counter() - start
+
+
+def bench(pairs, label, fn, thread_counts):
+    run(pairs[:10], fn, 1)  # Warmup
+    t_single = None
+    for n_threads in thread_counts:
+        elapsed = run(pairs, fn, n_threads)
+        if t_single is None:
+            t_single = elapsed
+        print(
+            f"  {label:15s}  threads={n_threads:<3d} total={elapsed:.4f}s  "
+            f"speedup={t_single / elapsed:.2f}x"
+        )
+
+
+def main():
+    gil_enabled = getattr(sys, "_is_gil_enabled", lambda: True)()
+    n_cpus = os.cpu_count() or 1
+    thread_counts = sorted({1, 2, 4, 8, n_cpus})
+    print(f"CPUs: {n_cpus}, GIL enabled: {gil_enabled}")
+
+    for min_len, max_len in [(10, 30), (200, 400)]:
+        pairs = generate_dataset(
+            n_pairs=2000, min_len=min_len, max_len=max_len, seed=42
+        )
+        print(f"\n--- {len(pairs)} pairs ({min_len}-{max_len} words each) ---")
+        bench(pairs, "edit_distance", edit_distance, thread_counts)
+        bench(pairs, "align", lambda r, h: align(r, h, "*"), thread_counts)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,24 +1,521 @@
-#include <random>
+#include <atomic>
+#include <cerrno>
+#include <cmath>
+#include <cstdint>
+#include <cstdlib>
+#include <cstring>
+#include <exception>
+#include <fstream>
+#include <iterator>
+#include <limits>
+#include <memory>
+#include <mutex>
+#include <stdexcept>
+#include <string_view>
+#include <thread>
 #include "kaldi_align.h"
 
-int LevenshteinEditDistance(const std::vector<int> &ref,
-                              const std::vector<int> &hyp,
+#if !defined(_WIN32)
+#include <fcntl.h>
+#include <sys/mman.h>
+#include <sys/stat.h>
+#include <unistd.h>
+#endif
+
+namespace internal {
+
+// Vectorized DP for weighted costs (sclite_mode).
+//
+// The bit-parallel engine only applies to unit costs, so the other costs are
+// vectorized in two ways:
+//  * one pair: the cells of an anti-diagonal i + j = d only depend on the two
+//    previous anti-diagonals, so they are computed a register at a time
+//    (DiagonalSweep);
+//  * many short pairs: the pairs are packed into the lanes of a register and
+//    their DP rows are computed in lockstep (PackedEditDistance).
+// Every cell holds its cost and, for the edit distance, the number of
+// substitutions on the path the tie-breaking rule of LevenshteinEditDistance
+// selects.  The ins / del counts follow from these, as every path to (i, j)
+// has j - i more insertions than deletions (see StatsFromCost).  The costs
+// are kept in 16-bit lanes whenever they cannot overflow, in 32-bit lanes
+// otherwise.  The instruction set (AVX2, or the 128-bit baseline of the
+// target: SSE2 / NEON) is chosen at run time, the scalar loops of
+// LevenshteinEditDistance / LevenshteinAlignment are the fallback.
+
+#if defined(__clang__) || (defined(__GNUC__) && __GNUC__ >= 9)
+#define KALDIALIGN_SIMD 1
+#define KALDIALIGN_ALWAYS_INLINE inline __attribute__((always_inline))
+#if defined(__x86_64__) || defined(__i386__)
+#define KALDIALIGN_SIMD_AVX2 1
+#endif
+#endif
+
+enum SimdIsa { kSimdScalar = 0, kSimdBase = 1, kSimdAvx2 = 2 };
+
+static int DetectSimdIsa() {
+#if defined(KALDIALIGN_SIMD_AVX2)
+  __builtin_cpu_init();
+  if (__builtin_cpu_supports("avx2")) return kSimdAvx2;
+#endif
+#if defined(KALDIALIGN_SIMD)
+  return kSimdBase;
+#else
+  return kSimdScalar;
+#endif
+}
+
+static std::atomic<int> &SimdIsaSetting() {
+  static std::atomic<int> isa{DetectSimdIsa()};
+  return isa;
+}
+
+static int CurrentSimdIsa() { return SimdIsaSetting().load(std::memory_order_relaxed); }
+
+// Whether the cells of an M x N table fit in 16-bit lanes: no cell costs more
+// than going around the table (i deletions, then j insertions), and the
+// candidates of a cell add at most one more step.
+static bool FitsInt16(size_t M, size_t N, int ins_cost, int del_cost, int sub_cost) {
+  const long long step = std::max(sub_cost, std::max(ins_cost, del_cost));
+  return static_cast<long long>(M + N) * std::max(ins_cost, del_cost) + step <= INT16_MAX;
+}
+
+// The ins / del / sub counts of a path to (M, N) from its cost and number of
+// substitutions: cost = ins_cost * ins + del_cost * del + sub_cost * sub and
+// ins - del = N - M.
+static void StatsFromCost(long long cost, long long n_sub, size_t M, size_t N, int ins_cost,
+                          int del_cost, int sub_cost, error_stats *stats) {
+  const long long diff = static_cast<long long>(N) - static_cast<long long>(M);
+  const long long n_ins = (cost - sub_cost * n_sub + del_cost * diff) / (ins_cost + del_cost);
+  stats->ins_num = static_cast<int>(n_ins);
+  stats->del_num = static_cast<int>(n_ins - diff);
+  stats->sub_num = static_cast<int>(n_sub);
+  stats->total_num = stats->ins_num + stats->del_num + stats->sub_num;
+  stats->total_cost = static_cast<int>(cost);
+}
+
+// Costs of all the cells of a DP table stored one anti-diagonal after the
+// other, in 16 or 32 bits, as filled by DiagonalSweep for a traceback.
+class DiagonalCosts {
+ public:
+  void Reset(size_t M, size_t N, bool narrow) {
+    M_ = M;
+    N_ = N;
+    narrow_ = narrow;
+    offset_.resize(M + N + 2);
+    offset_[0] = 0;
+    for (size_t d = 0; d <= M + N; d++) offset_[d + 1] = offset_[d] + (Hi(d) - Lo(d) + 1);
+    if (narrow) cells16_.resize(offset_.back());
+    else cells32_.resize(offset_.back());
+    Profiler::CountDp(0, offset_.back() * (narrow ? sizeof(int16_t) : sizeof(int32_t)));
+  }
+
+  // First and last i of the cells (i, d - i) of anti-diagonal d.
+  size_t Lo(size_t d) const { return d > N_ ? d - N_ : 0; }
+  size_t Hi(size_t d) const { return std::min(M_, d); }
+
+  template <typename T>
+  void SetDiagonal(size_t d, const T *cost) {
+    T *out = narrow_ ? reinterpret_cast<T *>(cells16_.data() + offset_[d])
+                     : reinterpret_cast<T *>(cells32_.data() + offset_[d]);
+    std::memcpy(out, cost + Lo(d), (Hi(d) - Lo(d) + 1) * sizeof(T));
+  }
+
+  int Get(size_t i, size_t j) const {
+    const size_t k = offset_[i + j] + i - Lo(i + j);
+    return narrow_ ? cells16_[k] : cells32_[k];
+  }
+
+ private:
+  size_t M_ = 0, N_ = 0;
+  bool narrow_ = true;
+  std::vector<size_t> offset_;
+  std::vector<int16_t> cells16_;
+  std::vector<int32_t> cells32_;
+};
+
+#if defined(KALDIALIGN_SIMD)
+
+// The vectors never cross a function call boundary (everything below is
+// inlined into the entry points), so their calling convention is moot.  The
+// warning is only emitted at the end of the file, so it stays disabled.
+#if defined(__GNUC__) && !defined(__clang__)
+#pragma GCC diagnostic ignored "-Wpsabi"
+#endif
+
+// Vectors of kBytes bytes with T lanes, and the matching vectors of symbols.
+template <typename T, int kBytes>
+struct SimdTypes {
+  static constexpr int kLanes = kBytes / sizeof(T);
+  typedef T Vec __attribute__((vector_size(kBytes)));
+  typedef int32_t Sym __attribute__((vector_size(kLanes * sizeof(int32_t))));
+};
+
+template <typename V, typename T>
+KALDIALIGN_ALWAYS_INLINE V SimdLoad(const T *p) {
+  V v;
+  std::memcpy(&v, p, sizeof(V));
+  return v;
+}
+
+template <typename V, typename T>
+KALDIALIGN_ALWAYS_INLINE void SimdStore(T *p, V v) {
+  std::memcpy(p, &v, sizeof(V));
+}
+
+// One DP cell per lane with the rule of LevenshteinEditDistance, from the
+// costs of the diagonal / upper (ins) / left (del) neighbours and the
+// equality mask (all ones where the symbols match).  take_sub / take_del
+// are set to the masks of the chosen steps.
+template <typename T, typename V>
+KALDIALIGN_ALWAYS_INLINE V SimdCell(V diag, V up, V left, V eq, int ins_cost, int del_cost,
+                                    int sub_cost, V *take_sub, V *take_del) {
+  const V sub = diag + (~eq & static_cast<T>(sub_cost));
+  const V ins = up + static_cast<T>(ins_cost);
+  const V del = left + static_cast<T>(del_cost);
+  *take_sub = (sub < ins) & (sub < del);
+  *take_del = ~*take_sub & (del < ins);
+  return (*take_sub & sub) | (*take_del & del) | (~(*take_sub | *take_del) & ins);
+}
+
+// Fills the DP table of ref x hyp one anti-diagonal at a time, calling
+// on_diagonal(d, cost) with cost[i] the cost of cell (i, d - i) for the i of
+// the diagonal.  Returns the cost of the table and, if kCountSubs, sets
+// *n_sub to the number of substitutions of the chosen path.
+template <typename T, int kBytes, bool kCountSubs, typename OnDiagonal>
+KALDIALIGN_ALWAYS_INLINE int DiagonalSweep(IntSequence ref, IntSequence hyp, int ins_cost,
+                                           int del_cost, int sub_cost, int *n_sub,
+                                           OnDiagonal on_diagonal) {
+  typedef typename SimdTypes<T, kBytes>::Vec V;
+  typedef typename SimdTypes<T, kBytes>::Sym S;
+  constexpr size_t L = SimdTypes<T, kBytes>::kLanes;
+  const size_t M = ref.size(), N = hyp.size();
+
+  // Three rotating diagonals of costs (and substitution counts), indexed by
+  // i and padded for the last partial register.  With the hyp reversed,
+  // hyp[d - i - 1] is contiguous in i as well.
+  std::vector<T> buf((kCountSubs ? 6 : 3) * (M + 1 + L));
+  Profiler::CountDp(M * N, buf.size() * sizeof(T));
+  T *cost[3], *subs[3] = {nullptr, nullptr, nullptr};
+  for (int k = 0; k < 3; k++) {
+    cost[k] = buf.data() + k * (M + 1 + L);
+    if (kCountSubs) subs[k] = buf.data() + (3 + k) * (M + 1 + L);
+  }
+  std::vector<int> ref_pad(ref.begin(), ref.end()), hyp_rev(hyp.size() + L);
+  ref_pad.resize(M + L);
+  for (size_t j = 0; j < N; j++) hyp_rev[N - 1 - j] = hyp[j];
+
+  on_diagonal(0, cost[0]);
+  for (size_t d = 1; d <= M + N; d++) {
+    T *cur = cost[d % 3];
+    const T *prev1 = cost[(d + 2) % 3], *prev2 = cost[(d + 1) % 3];
+    T *cur_subs = subs[d % 3];
+    const T *prev1_subs = subs[(d + 2) % 3], *prev2_subs = subs[(d + 1) % 3];
+    const size_t lo = d > N ? d - N : 0, hi = std::min(M, d);
+    const size_t first = std::max<size_t>(lo, 1), last = std::min(hi, d - 1);
+    for (size_t i = first; i <= last; i += L) {
+      const V eq = __builtin_convertvector(
+          SimdLoad<S>(ref_pad.data() + i - 1) == SimdLoad<S>(hyp_rev.data() + N - d + i), V);
+      V take_sub, take_del;
+      SimdStore(cur + i, SimdCell<T>(SimdLoad<V>(prev2 + i - 1), SimdLoad<V>(prev1 + i),
+                                  SimdLoad<V>(prev1 + i - 1), eq, ins_cost, del_cost,
+                                  sub_cost, &take_sub, &take_del));
+      if (kCountSubs) {
+        const V sub = SimdLoad<V>(prev2_subs + i - 1) + (~eq & static_cast<T>(1));
+        const V take_ins = ~(take_sub | take_del);
+        SimdStore(cur_subs + i, (take_sub & sub) |
+                                    (take_del & SimdLoad<V>(prev1_subs + i - 1)) |
+                                    (take_ins & SimdLoad<V>(prev1_subs + i)));
+      }
+    }
+    // The borders last, as the final register may run past them.
+    if (lo == 0) {
+      cur[0] = static_cast<T>(d * ins_cost);
+      if (kCountSubs) cur_subs[0] = 0;
+    }
+    if (hi == d) {
+      cur[d] = static_cast<T>(d * del_cost);
+      if (kCountSubs) cur_subs[d] = 0;
+    }
+    on_diagonal(d, cur);
+  }
+  if (kCountSubs) *n_sub = M + N == 0 ? 0 : subs[(M + N) % 3][M];
+  return M + N == 0 ? 0 : cost[(M + N) % 3][M];
+}
+
+// LevenshteinEditDistance of up to kLanes pairs of at most kPackedMaxLen
+// symbols, one pair per lane: the DP rows (one per hyp symbol) of all the
+// pairs are computed together, and the result of a pair is read from its
+// row when the row index reaches its hyp length.
+template <typename T, int kBytes>
+KALDIALIGN_ALWAYS_INLINE void PackedEditDistance(const IntSequence *refs,
+                                                 const IntSequence *hyps, size_t count,
+                                                 int ins_cost, int del_cost, int sub_cost,
+                                                 error_stats *stats) {
+  typedef typename SimdTypes<T, kBytes>::Vec V;
+  typedef typename SimdTypes<T, kBytes>::Sym S;
+  constexpr size_t L = SimdTypes<T, kBytes>::kLanes;
+  assert(count <= L);
+  size_t max_m = 0, max_n = 0;
+  for (size_t k = 0; k < count; k++) {
+    max_m = std::max(max_m, refs[k].size());
+    max_n = std::max(max_n, hyps[k].size());
+  }
+  // Symbols transposed to one register per position.
+  std::vector<int32_t> ref_t(max_m * L), hyp_t(max_n * L);
+  for (size_t k = 0; k < count; k++) {
+    for (size_t i = 0; i < refs[k].size(); i++) ref_t[i * L + k] = refs[k][i];
+    for (size_t j = 0; j < hyps[k].size(); j++) hyp_t[j * L + k] = hyps[k][j];
+  }
+  // One register of costs / substitution counts per ref position (plain
+  // arrays of lanes: the vector types lose their alignment in containers).
+  std::vector<T> cost_buf((max_m + 1) * L), subs_buf((max_m + 1) * L);
+  if (Profiler::Enabled()) {
+    size_t cells = 0;
+    for (size_t k = 0; k < count; k++) cells += refs[k].size() * hyps[k].size();
+    Profiler::CountDp(cells, 2 * cost_buf.size() * sizeof(T));
+  }
+  T *cost = cost_buf.data(), *subs = subs_buf.data();
+  for (size_t i = 0; i <= max_m; i++)
+    SimdStore(cost + i * L, V() + static_cast<T>(i * del_cost));
+  auto finish = [&](size_t j) {
+    for (size_t k = 0; k < count; k++) {
+      if (hyps[k].size() != j) continue;
+      const size_t m = refs[k].size();
+      StatsFromCost(cost[m * L + k], subs[m * L + k], m, j, ins_cost, del_cost, sub_cost,
+                    &stats[k]);
+    }
+  };
+  finish(0);
+  for (size_t j = 1; j <= max_n; j++) {
+    const S hyp_sym = SimdLoad<S>(hyp_t.data() + (j - 1) * L);
+    V diag = SimdLoad<V>(cost), diag_subs = SimdLoad<V>(subs);
+    V left = diag + static_cast<T>(ins_cost), left_subs = V();
+    SimdStore(cost, left);
+    SimdStore(subs, left_subs);
+    for (size_t i = 1; i <= max_m; i++) {
+      const V eq = __builtin_convertvector(SimdLoad<S>(ref_t.data() + (i - 1) * L) == hyp_sym, V);
+      const V up = SimdLoad<V>(cost + i * L), up_subs = SimdLoad<V>(subs + i * L);
+      V take_sub, take_del;
+      left = SimdCell<T>(diag, up, left, eq, ins_cost, del_cost, sub_cost, &take_sub, &take_del);
+      const V sub = diag_subs + (~eq & static_cast<T>(1));
+      left_subs = (take_sub & sub) | (take_del & left_subs) | (~(take_sub | take_del) & up_subs);
+      SimdStore(cost + i * L, left);
+      SimdStore(subs + i * L, left_subs);
+      diag = up;
+      diag_subs = up_subs;
+    }
+    finish(j);
+  }
+}
+
+// The vectorized engines for registers of kBytes bytes.
+template <int kBytes>
+KALDIALIGN_ALWAYS_INLINE int WeightedEditDistanceImpl(IntSequence ref, IntSequence hyp,
+                                                      int ins_cost, int del_cost,
+                                                      int sub_cost, error_stats *stats) {
+  int cost, n_sub;
+  auto ignore = [](size_t, const void *) {};
+  if (FitsInt16(ref.size(), hyp.size(), ins_cost, del_cost, sub_cost))
+    cost = DiagonalSweep<int16_t, kBytes, true>(ref, hyp, ins_cost, del_cost, sub_cost, &n_sub,
+                                                ignore);
+  else
+    cost = DiagonalSweep<int32_t, kBytes, true>(ref, hyp, ins_cost, del_cost, sub_cost, &n_sub,
+                                                ignore);
+  StatsFromCost(cost, n_sub, ref.size(), hyp.size(), ins_cost, del_cost, sub_cost, stats);
+  return stats->total_num;
+}
+
+template <int kBytes>
+KALDIALIGN_ALWAYS_INLINE int WeightedCostsImpl(IntSequence ref, IntSequence hyp, int ins_cost,
+                                               int del_cost, int sub_cost,
+                                               DiagonalCosts *costs) {
+  const bool narrow = FitsInt16(ref.size(), hyp.size(), ins_cost, del_cost, sub_cost);
+  costs->Reset(ref.size(), hyp.size(), narrow);
+  if (narrow)
+    return DiagonalSweep<int16_t, kBytes, false>(
+        ref, hyp, ins_cost, del_cost, sub_cost, nullptr,
+        [&](size_t d, const int16_t *cost) { costs->SetDiagonal(d, cost); });
+  return DiagonalSweep<int32_t, kBytes, false>(
+      ref, hyp, ins_cost, del_cost, sub_cost, nullptr,
+      [&](size_t d, const int32_t *cost) { costs->SetDiagonal(d, cost); });
+}
+
+template <int kBytes>
+KALDIALIGN_ALWAYS_INLINE void PackedEditDistanceImpl(const IntSequence *refs,
+                                                     const IntSequence *hyps, size_t count,
+                                                     int ins_cost, int del_cost, int sub_cost,
+                                                     error_stats *stats) {
+  PackedEditDistance<int16_t, kBytes>(refs, hyps, count, ins_cost, del_cost, sub_cost, stats);
+}
+
+static int WeightedEditDistanceBase(IntSequence ref, IntSequence hyp, int ins_cost,
+                                    int del_cost, int sub_cost, error_stats *stats) {
+  return WeightedEditDistanceImpl<16>(ref, hyp, ins_cost, del_cost, sub_cost, stats);
+}
+
+static int WeightedCostsBase(IntSequence ref, IntSequence hyp, int ins_cost, int del_cost,
+                             int sub_cost, DiagonalCosts *costs) {
+  return WeightedCostsImpl<16>(ref, hyp, ins_cost, del_cost, sub_cost, costs);
+}
+
+static void PackedEditDistanceBase(const IntSequence *refs, const IntSequence *hyps,
+                                   size_t count, int ins_cost, int del_cost, int sub_cost,
+                                   error_stats *stats) {
+  PackedEditDistanceImpl<16>(refs, hyps, count, ins_cost, del_cost, sub_cost, stats);
+}
+
+#if defined(KALDIALIGN_SIMD_AVX2)
+__attribute__((target("avx2"))) static int WeightedEditDistanceAvx2(
+    IntSequence ref, IntSequence hyp, int ins_cost, int del_cost, int sub_cost,
+    error_stats *stats) {
+  return WeightedEditDistanceImpl<32>(ref, hyp, ins_cost, del_cost, sub_cost, stats);
+}
+
+__attribute__((target("avx2"))) static int WeightedCostsAvx2(
+    IntSequence ref, IntSequence hyp, int ins_cost, int del_cost, int sub_cost,
+    DiagonalCosts *costs) {
+  return WeightedCostsImpl<32>(ref, hyp, ins_cost, del_cost, sub_cost, costs);
+}
+
+__attribute__((target("avx2"))) static void PackedEditDistanceAvx2(
+    const IntSequence *refs, const IntSequence *hyps, size_t count, int ins_cost, int del_cost,
+    int sub_cost, error_stats *stats) {
+  PackedEditDistanceImpl<32>(refs, hyps, count, ins_cost, del_cost, sub_cost, stats);
+}
+#endif
+
+#endif  // KALDIALIGN_SIMD
+
+// Number of pairs PackedEditDistance scores at once with the current
+// instruction set, 0 if it is not vectorized.
+static size_t PackedLanes() {
+  switch (CurrentSimdIsa()) {
+    case kSimdAvx2: return 16;
+    case kSimdBase: return 8;
+    default: return 0;
+  }
+}
+
+// Pairs with more symbols than this are scored one by one.
+static const size_t kPackedMaxLen = 256;
+
+// Dispatchers to the engine of the current instruction set.  They return
+// false, leaving the outputs alone, if the DP is not vectorized.
+static bool WeightedEditDistance(IntSequence ref, IntSequence hyp, int ins_cost, int del_cost,
+                                 int sub_cost, error_stats *stats) {
+  switch (CurrentSimdIsa()) {
+#if defined(KALDIALIGN_SIMD_AVX2)
+    case kSimdAvx2:
+      WeightedEditDistanceAvx2(ref, hyp, ins_cost, del_cost, sub_cost, stats);
+      return true;
+#endif
+#if defined(KALDIALIGN_SIMD)
+    case kSimdBase:
+      WeightedEditDistanceBase(ref, hyp, ins_cost, del_cost, sub_cost, stats);
+      return true;
+#endif
+    default:
+      return false;
+  }
+}
+
+static bool WeightedCosts(IntSequence ref, IntSequence hyp, int ins_cost, int del_cost,
+                          int sub_cost, DiagonalCosts *costs) {
+  switch (CurrentSimdIsa()) {
+#if defined(KALDIALIGN_SIMD_AVX2)
+    case kSimdAvx2:
+      WeightedCostsAvx2(ref, hyp, ins_cost, del_cost, sub_cost, costs);
+      return true;
+#endif
+#if defined(KALDIALIGN_SIMD)
+    case kSimdBase:
+      WeightedCostsBase(ref, hyp, ins_cost, del_cost, sub_cost, costs);
+      return true;
+#endif
+    default:
+      return false;
+  }
+}
+
+static void PackedEditDistanceDispatch(const IntSequence *refs, const IntSequence *hyps,
+                                       size_t count, int ins_cost, int del_cost, int sub_cost,
+                                       error_stats *stats) {
+  switch (CurrentSimdIsa()) {
+#if defined(KALDIALIGN_SIMD_AVX2)
+    case kSimdAvx2:
+      PackedEditDistanceAvx2(refs, hyps, count, ins_cost, del_cost, sub_cost, stats);
+      break;
+#endif
+#if defined(KALDIALIGN_SIMD)
+    case kSimdBase:
+      PackedEditDistanceBase(refs, hyps, count, ins_cost, del_cost, sub_cost, stats);
+      break;
+#endif
+    default:
+      assert(false);
+  }
+}
+
+}  // namespace internal
+
+namespace internal {
+
+static const char *SimdIsaName(int isa) {
+  switch (isa) {
+    case kSimdAvx2: return "avx2";
+#if defined(__x86_64__) || defined(__i386__)
+    case kSimdBase: return "sse2";
+#elif defined(__aarch64__) || defined(__ARM_NEON)
+    case kSimdBase: return "neon";
+#else
+    case kSimdBase: return "simd128";
+#endif
+    default: return "scalar";
+  }
+}
+
+}  // namespace internal
+
+const char *SimdBackend() { return internal::SimdIsaName(internal::CurrentSimdIsa()); }
+
+bool SetSimdBackend(const std::string &name) {
+  const int best = internal::DetectSimdIsa();
+  for (int isa = best; isa >= internal::kSimdScalar; isa--) {
+    if (name == "auto" || name == internal::SimdIsaName(isa)) {
+      internal::SimdIsaSetting().store(isa, std::memory_order_relaxed);
+      return true;
+    }
+  }
+  return false;
+}
+
+int LevenshteinEditDistance(IntSequence ref,
+                              IntSequence hyp,
                               const bool sclite_mode,
                               int *ins, int *del, int *sub) {
-  int ins_cost, del_cost, sub_cost;
-  if (sclite_mode) {
-    ins_cost = INS_COST_SCLITE;
-    del_cost = DEL_COST_SCLITE;
-    sub_cost = SUB_COST_SCLITE;
-  } else {
-    ins_cost = INS_COST;
-    del_cost = DEL_COST;
-    sub_cost = SUB_COST;
+  // Unit costs: the bit-parallel engine gives the same result much faster.
+  if (!sclite_mode)
+    return LevenshteinEditDistanceBitParallel(ref, hyp, ins, del, sub);
+  internal::ProfileScope profile(internal::kProfileDp);
+  error_stats stats;
+  if (internal::WeightedEditDistance(ref, hyp, INS_COST_SCLITE, DEL_COST_SCLITE,
+                                     SUB_COST_SCLITE, &stats)) {
+    if (ins != nullptr) *ins = stats.ins_num;
+    if (del != nullptr) *del = stats.del_num;
+    if (sub != nullptr) *sub = stats.sub_num;
+    return stats.total_num;
   }
 
+  // Only reached when WeightedEditDistance refuses the input, i.e. with the
+  // scalar backend, so the costs are always the sclite ones.
+  const int ins_cost = INS_COST_SCLITE;
+  const int del_cost = DEL_COST_SCLITE;
+  const int sub_cost = SUB_COST_SCLITE;
+
   // temp sequence to remember error type and stats.
   std::vector<error_stats> e(ref.size()+1);
   std::vector<error_stats> cur_e(ref.size()+1);
+  internal::Profiler::CountDp(ref.size() * hyp.size(), 2 * e.size() * sizeof(error_stats));
   // initialize the first hypothesis aligned to the reference at each
   // position:[hyp_index =0][ref_index]
   for (size_t i =0; i < e.size(); i ++) {
@@ -77,11 +574,54 @@ int LevenshteinEditDistance(const std::vector<int> &ref,
 }
 
 
-int LevenshteinAlignment(const std::vector<int> &a,
-                          const std::vector<int> &b,
+void LevenshteinEditDistanceMany(const std::vector<IntSequence> &refs,
+                                 const std::vector<IntSequence> &hyps,
+                                 const bool sclite_mode,
+                                 std::vector<error_stats> *stats) {
+  assert(refs.size() == hyps.size());
+  internal::ProfileScope profile(internal::kProfileDp);
+  stats->assign(refs.size(), error_stats{0, 0, 0, 0, 0});
+  const size_t lanes = sclite_mode ? internal::PackedLanes() : 0;
+  std::vector<size_t> packed;
+  for (size_t k = 0; k < refs.size(); k++) {
+    if (lanes != 0 && std::max(refs[k].size(), hyps[k].size()) <= internal::kPackedMaxLen) {
+      packed.push_back(k);
+      continue;
+    }
+    auto &st = (*stats)[k];
+    st.total_num = LevenshteinEditDistance(refs[k], hyps[k], sclite_mode, &st.ins_num,
+                                           &st.del_num, &st.sub_num);
+  }
+  // Pairs sharing registers take as many steps as the longest of them, so
+  // they are grouped by length.
+  std::sort(packed.begin(), packed.end(), [&](size_t x, size_t y) {
+    return std::make_pair(hyps[x].size(), refs[x].size()) <
+           std::make_pair(hyps[y].size(), refs[y].size());
+  });
+  std::vector<IntSequence> group_refs, group_hyps;
+  std::vector<error_stats> group_stats(lanes);
+  for (size_t begin = 0; begin < packed.size(); begin += lanes) {
+    const size_t end = std::min(packed.size(), begin + lanes);
+    group_refs.clear();
+    group_hyps.clear();
+    for (size_t k = begin; k < end; k++) {
+      group_refs.push_back(refs[packed[k]]);
+      group_hyps.push_back(hyps[packed[k]]);
+    }
+    internal::PackedEditDistanceDispatch(group_refs.data(), group_hyps.data(), end - begin,
+                                         INS_COST_SCLITE, DEL_COST_SCLITE, SUB_COST_SCLITE,
+                                         group_stats.data());
+    for (size_t k = begin; k < end; k++) (*stats)[packed[k]] = group_stats[k - begin];
+  }
+}
+
+
+int LevenshteinAlignment(IntSequence a,
+                          IntSequence b,
                           int eps_symbol,
                           const bool sclite_mode,
                           std::vector<std::pair<int, int> > *output) {
+  internal::ProfileScope profile(internal::kProfileDp);
   // Check inputs:
   {
     assert(output != NULL);
@@ -104,19 +644,29 @@ int LevenshteinAlignment(const std::vector<int> &a,
   // inthis is very memory-inefficiently implemented using a vector of vectors.
   size_t M = a.size(), N = b.size();
   size_t m, n;
-  std::vector<std::vector<int> > e(M+1);
-  for (m = 0; m <=M; m++) e[m].resize(N+1);
-  for (n = 0; n <= N; n++)
-    e[0][n]  = n*ins_cost;
-  for (m = 1; m <= M; m++) {
-    e[m][0] = e[m-1][0] + del_cost;
-    for (n = 1; n <= N; n++) {
-      int sub_or_ok = e[m-1][n-1] + (a[m-1] == b[n-1] ? 0 : sub_cost);
-      int del = e[m-1][n] + del_cost;  // assumes a == ref, b == hyp.
-      int ins = e[m][n-1] + ins_cost;
-      e[m][n] = std::min(sub_or_ok, std::min(del, ins));
+  std::vector<std::vector<int> > e;
+  internal::DiagonalCosts diagonal_costs;
+  const bool vectorized =
+      internal::WeightedCosts(a, b, ins_cost, del_cost, sub_cost, &diagonal_costs);
+  if (!vectorized) {
+    e.resize(M+1);
+    for (m = 0; m <=M; m++) e[m].resize(N+1);
+    internal::Profiler::CountDp(M * N, (M + 1) * (N + 1) * sizeof(int));
+    for (n = 0; n <= N; n++)
+      e[0][n]  = n*ins_cost;
+    for (m = 1; m <= M; m++) {
+      e[m][0] = e[m-1][0] + del_cost;
+      for (n = 1; n <= N; n++) {
+        int sub_or_ok = e[m-1][n-1] + (a[m-1] == b[n-1] ? 0 : sub_cost);
+        int del = e[m-1][n] + del_cost;  // assumes a == ref, b == hyp.
+        int ins = e[m][n-1] + ins_cost;
+        e[m][n] = std::min(sub_or_ok, std::min(del, ins));
+      }
     }
   }
+  auto at = [&](size_t m, size_t n) {
+    return vectorized ? diagonal_costs.Get(m, n) : e[m][n];
+  };
   // get time-reversed output first: trace back.
   m = M;
   n = N;
@@ -129,9 +679,9 @@ int LevenshteinAlignment(const std::vector<int> &a,
       last_m = m-1;
       last_n = n;
     } else {
-      int sub_or_ok = e[m-1][n-1] + (a[m-1] == b[n-1] ? 0 : sub_cost);
-      int del = e[m-1][n] + del_cost;  // assumes a == ref, b == hyp.
-      int ins = e[m][n-1] + ins_cost;
+      int sub_or_ok = at(m-1, n-1) + (a[m-1] == b[n-1] ? 0 : sub_cost);
+      int del = at(m-1, n) + del_cost;  // assumes a == ref, b == hyp.
+      int ins = at(m, n-1) + ins_cost;
       // choose sub_or_ok if all else equal.
       if (sub_or_ok < std::min(del, ins)) {
         last_m = m-1;
@@ -154,14 +704,153 @@ int LevenshteinAlignment(const std::vector<int> &a,
     n = last_n;
   }
   ReverseVector(output);
-  return e[M][N];
+  return at(M, N);
 }
 
+namespace internal {
+
+// Word ids and compound candidates of a pair of sequences, shared by the
+// compound-aware engines.  Every distinct word is interned once, so the DP
+// compares ints, and for every position we list the runs of 2 or more words
+// ending there whose concatenation equals some word of the other sequence.
+// The runs are found with rolling hashes of the prefix concatenations (one
+// hash and length check per run) and compared character by character only on
+// a hash hit, so no strings are built while filling the DP table.
+// Runs longer than max_span words are ignored (max_span < 0: no limit).
+class CompoundIndex {
+ public:
+  struct Candidate {
+    size_t span;  // Number of words in the run.
+    int word;     // Id of the matching word of the other sequence.
+  };
+
+  struct Candidates {
+    const Candidate *begin_, *end_;
+    const Candidate *begin() const { return begin_; }
+    const Candidate *end() const { return end_; }
+  };
+
+  CompoundIndex(const std::vector<std::string> &a, const std::vector<std::string> &b,
+                int max_span = -1) {
+    ProfileScope profile(kProfileCompound);
+    std::unordered_map<std::string_view, int> ids;
+    for (const auto *seq : {&a, &b}) {
+      auto &out = seq == &a ? a_ids_ : b_ids_;
+      out.reserve(seq->size());
+      for (const auto &w : *seq)
+        out.push_back(ids.emplace(w, static_cast<int>(ids.size())).first->second);
+    }
+    const size_t limit = max_span < 0 ? SIZE_MAX : static_cast<size_t>(max_span);
+    FindCompounds(a, b, b_ids_, limit, &a_offsets_, &a_candidates_);
+    FindCompounds(b, a, a_ids_, limit, &b_offsets_, &b_candidates_);
+  }
+
+  const std::vector<int> &AIds() const { return a_ids_; }
+  const std::vector<int> &BIds() const { return b_ids_; }
+
+  // Runs a[m-span .. m) matching a word of b, by increasing span.
+  Candidates ACompounds(size_t m) const {
+    return {a_candidates_.data() + a_offsets_[m], a_candidates_.data() + a_offsets_[m + 1]};
+  }
+  // Runs b[n-span .. n) matching a word of a, by increasing span.
+  Candidates BCompounds(size_t n) const {
+    return {b_candidates_.data() + b_offsets_[n], b_candidates_.data() + b_offsets_[n + 1]};
+  }
+
+  // Longest run in ACompounds / BCompounds (at least 1).
+  size_t MaxASpan() const { return MaxSpan(a_candidates_); }
+  size_t MaxBSpan() const { return MaxSpan(b_candidates_); }
+
+ private:
+  static constexpr uint64_t kBase = 0x100000001b3ULL;
+
+  static size_t MaxSpan(const std::vector<Candidate> &candidates) {
+    size_t ans = 1;
+    for (const auto &c : candidates) ans = std::max(ans, c.span);
+    return ans;
+  }
+
+  // Whether the concatenation of seq[begin .. end) equals word.
+  static bool ConcatEquals(const std::vector<std::string> &seq, size_t begin, size_t end,
+                           const std::string &word) {
+    size_t pos = 0;
+    for (size_t i = begin; i < end; i++) {
+      if (word.compare(pos, seq[i].size(), seq[i]) != 0) return false;
+      pos += seq[i].size();
+    }
+    return pos == word.size();
+  }
+
+  // For every position m of seq (1-based end), the runs seq[m-k .. m),
+  // 2 <= k <= max_span, that spell a word of other (whose ids are other_ids).
+  static void FindCompounds(const std::vector<std::string> &seq,
+                            const std::vector<std::string> &other,
+                            const std::vector<int> &other_ids,
+                            const size_t max_span,
+                            std::vector<size_t> *offsets,
+                            std::vector<Candidate> *candidates) {
+    size_t max_len = 0;
+    std::unordered_multimap<uint64_t, size_t> words;  // hash -> position in other.
+    std::vector<char> seen(
+        other_ids.empty() ? 0 : *std::max_element(other_ids.begin(), other_ids.end()) + 1);
+    for (size_t j = 0; j < other.size(); j++) {
+      max_len = std::max(max_len, other[j].size());
+      if (seen[other_ids[j]]) continue;
+      seen[other_ids[j]] = 1;
+      uint64_t h = 0;
+      for (unsigned char c : other[j]) h = h * kBase + c;
+      words.emplace(h, j);
+    }
+    std::vector<uint64_t> pow(max_len + 1, 1);
+    for (size_t l = 1; l <= max_len; l++) pow[l] = pow[l - 1] * kBase;
+
+    // Rolling hashes and lengths of the prefix concatenations seq[0 .. i).
+    std::vector<uint64_t> prefix_hash(seq.size() + 1, 0);
+    std::vector<size_t> prefix_len(seq.size() + 1, 0);
+    for (size_t i = 0; i < seq.size(); i++) {
+      uint64_t h = prefix_hash[i];
+      for (unsigned char c : seq[i]) h = h * kBase + c;
+      prefix_hash[i + 1] = h;
+      prefix_len[i + 1] = prefix_len[i] + seq[i].size();
+    }
+
+    offsets->assign(1, 0);
+    offsets->push_back(0);  // Position 0 (no words) has no runs.
+    int64_t attempts = 0;
+    for (size_t m = 1; m <= seq.size(); m++) {
+      for (size_t k = 2; k <= std::min(m, max_span); k++) {
+        const size_t len = prefix_len[m] - prefix_len[m - k];
+        if (len > max_len) break;
+        attempts++;
+        const uint64_t h = prefix_hash[m] - prefix_hash[m - k] * pow[len];
+        auto range = words.equal_range(h);
+        for (auto it = range.first; it != range.second; ++it) {
+          const std::string &word = other[it->second];
+          if (word.size() == len && ConcatEquals(seq, m - k, m, word)) {
+            candidates->push_back({k, other_ids[it->second]});
+            break;
+          }
+        }
+      }
+      offsets->push_back(candidates->size());
+    }
+    Profiler::Count(kProfileCompoundAttempts, attempts);
+    Profiler::Count(kProfileCompoundHits, candidates->size());
+  }
+
+  std::vector<int> a_ids_, b_ids_;
+  std::vector<size_t> a_offsets_, b_offsets_;
+  std::vector<Candidate> a_candidates_, b_candidates_;
+};
+
+}  // namespace internal
+
 int LevenshteinEditDistanceCompound(
     const std::vector<std::string> &ref,
     const std::vector<std::string> &hyp,
     const bool sclite_mode,
-    int *ins, int *del, int *sub) {
+    int *ins, int *del, int *sub,
+    const int max_compound_words) {
 
   int ins_cost, del_cost, sub_cost;
   if (sclite_mode) {
@@ -174,115 +863,105 @@ int LevenshteinEditDistanceCompound(
     sub_cost = SUB_COST;
   }
 
+  internal::ProfileScope profile(internal::kProfileDp);
   size_t M = ref.size(), N = hyp.size();
+  const internal::CompoundIndex index(ref, hyp, max_compound_words);
+  const std::vector<int> &ref_ids = index.AIds(), &hyp_ids = index.BIds();
 
-  // Full 2D table (compound transitions access arbitrary previous rows).
-  std::vector<std::vector<error_stats>> e(M + 1, std::vector<error_stats>(N + 1));
+  // A compound transition into row i reaches back at most K rows, so only the
+  // last K + 1 rows are kept, in a ring buffer (O(K * N) memory).
+  const size_t K = index.MaxASpan();
+  std::vector<std::vector<error_stats>> rows(std::min(K, M) + 1,
+                                             std::vector<error_stats>(N + 1));
+  internal::Profiler::CountDp(M * N, rows.size() * (N + 1) * sizeof(error_stats));
+  auto row = [&](size_t i) -> std::vector<error_stats> & { return rows[i % rows.size()]; };
 
-  // Initialize first column: deleting ref words.
-  for (size_t i = 0; i <= M; i++) {
-    e[i][0].ins_num = 0;
-    e[i][0].sub_num = 0;
-    e[i][0].del_num = i;
-    e[i][0].total_num = i;
-    e[i][0].total_cost = i * del_cost;
-  }
   // Initialize first row: inserting hyp words.
   for (size_t j = 0; j <= N; j++) {
-    e[0][j].ins_num = j;
-    e[0][j].sub_num = 0;
-    e[0][j].del_num = 0;
-    e[0][j].total_num = j;
-    e[0][j].total_cost = j * ins_cost;
+    row(0)[j].ins_num = j;
+    row(0)[j].sub_num = 0;
+    row(0)[j].del_num = 0;
+    row(0)[j].total_num = j;
+    row(0)[j].total_cost = j * ins_cost;
   }
 
   for (size_t i = 1; i <= M; i++) {
+    std::vector<error_stats> &cur = row(i);
+    const std::vector<error_stats> &prev = row(i - 1);
+    // First column: deleting ref words.
+    cur[0].ins_num = 0;
+    cur[0].sub_num = 0;
+    cur[0].del_num = i;
+    cur[0].total_num = i;
+    cur[0].total_cost = i * del_cost;
+
     for (size_t j = 1; j <= N; j++) {
       // --- Standard transitions ---
-      int sub_err = e[i-1][j-1].total_cost;
-      if (ref[i-1] != hyp[j-1])
+      const bool match = ref_ids[i-1] == hyp_ids[j-1];
+      int sub_err = prev[j-1].total_cost;
+      if (!match)
         sub_err += sub_cost;
-      int del_err = e[i-1][j].total_cost + del_cost;
-      int ins_err = e[i][j-1].total_cost + ins_cost;
+      int del_err = prev[j].total_cost + del_cost;
+      int ins_err = cur[j-1].total_cost + ins_cost;
 
       if (sub_err < ins_err && sub_err < del_err) {
-        e[i][j] = e[i-1][j-1];
-        if (ref[i-1] != hyp[j-1]) {
-          e[i][j].sub_num++;
-          e[i][j].total_num++;
+        cur[j] = prev[j-1];
+        if (!match) {
+          cur[j].sub_num++;
+          cur[j].total_num++;
         }
-        e[i][j].total_cost = sub_err;
+        cur[j].total_cost = sub_err;
       } else if (del_err < ins_err) {
-        e[i][j] = e[i-1][j];
-        e[i][j].del_num++;
-        e[i][j].total_num++;
-        e[i][j].total_cost = del_err;
+        cur[j] = prev[j];
+        cur[j].del_num++;
+        cur[j].total_num++;
+        cur[j].total_cost = del_err;
       } else {
-        e[i][j] = e[i][j-1];
-        e[i][j].ins_num++;
-        e[i][j].total_num++;
-        e[i][j].total_cost = ins_err;
+        cur[j] = cur[j-1];
+        cur[j].ins_num++;
+        cur[j].total_num++;
+        cur[j].total_cost = ins_err;
       }
 
       // --- Compound: k ref words -> 1 hyp word ---
-      {
-        std::string merged = ref[i-1];
-        for (size_t k = 2; k <= i; k++) {
-          merged = ref[i-k] + merged;
-          if (merged.size() > hyp[j-1].size()) break;
-          if (merged == hyp[j-1]) {
-            if (e[i-k][j-1].total_cost < e[i][j].total_cost) {
-              e[i][j] = e[i-k][j-1];  // inherit stats, 0 new errors
-            }
-          }
+      for (const auto &c : index.ACompounds(i)) {
+        const error_stats &from = row(i - c.span)[j-1];
+        if (c.word == hyp_ids[j-1] && from.total_cost < cur[j].total_cost) {
+          cur[j] = from;  // inherit stats, 0 new errors
         }
       }
 
       // --- Compound: k hyp words -> 1 ref word ---
-      {
-        std::string merged = hyp[j-1];
-        for (size_t k = 2; k <= j; k++) {
-          merged = hyp[j-k] + merged;
-          if (merged.size() > ref[i-1].size()) break;
-          if (merged == ref[i-1]) {
-            if (e[i-1][j-k].total_cost < e[i][j].total_cost) {
-              e[i][j] = e[i-1][j-k];  // inherit stats, 0 new errors
-            }
-          }
+      for (const auto &c : index.BCompounds(j)) {
+        if (c.word == ref_ids[i-1] && prev[j-c.span].total_cost < cur[j].total_cost) {
+          cur[j] = prev[j-c.span];  // inherit stats, 0 new errors
         }
       }
     }
   }
 
-  if (ins != nullptr) *ins = e[M][N].ins_num;
-  if (del != nullptr) *del = e[M][N].del_num;
-  if (sub != nullptr) *sub = e[M][N].sub_num;
-  return e[M][N].total_num;
+  const error_stats &last = row(M)[N];
+  if (ins != nullptr) *ins = last.ins_num;
+  if (del != nullptr) *del = last.del_num;
+  if (sub != nullptr) *sub = last.sub_num;
+  return last.total_num;
 }
 
 
-int LevenshteinAlignmentCompound(
-    const std::vector<std::string> &a,
-    const std::vector<std::string> &b,
-    const std::string &eps_symbol,
-    const bool sclite_mode,
-    std::vector<std::pair<std::string, std::string>> *output) {
-
-  assert(output != NULL);
-  output->clear();
+namespace internal {
 
-  int ins_cost, del_cost, sub_cost;
-  if (sclite_mode) {
-    ins_cost = INS_COST_SCLITE;
-    del_cost = DEL_COST_SCLITE;
-    sub_cost = SUB_COST_SCLITE;
-  } else {
-    ins_cost = INS_COST;
-    del_cost = DEL_COST;
-    sub_cost = SUB_COST;
-  }
+typedef std::pair<size_t, size_t> PathCell;
 
+// Traceback path of LevenshteinAlignmentCompound, from (M, N) back to (0, 0).
+static std::vector<PathCell> CompoundAlignmentPath(
+    const std::vector<std::string> &a,
+    const std::vector<std::string> &b,
+    int ins_cost, int del_cost, int sub_cost,
+    const int max_compound_words) {
+  ProfileScope profile(kProfileDp);
   size_t M = a.size(), N = b.size();
+  const internal::CompoundIndex index(a, b, max_compound_words);
+  const std::vector<int> &a_ids = index.AIds(), &b_ids = index.BIds();
 
   // Cost table.
   std::vector<std::vector<int>> e(M + 1, std::vector<int>(N + 1));
@@ -292,6 +971,7 @@ int LevenshteinAlignmentCompound(
     size_t prev_n;
   };
   std::vector<std::vector<BackPointer>> bp(M + 1, std::vector<BackPointer>(N + 1));
+  Profiler::CountDp(M * N, (M + 1) * (N + 1) * (sizeof(int) + sizeof(BackPointer)));
 
   for (size_t n = 0; n <= N; n++)
     e[0][n] = n * ins_cost;
@@ -305,7 +985,7 @@ int LevenshteinAlignmentCompound(
 
   for (size_t m = 1; m <= M; m++) {
     for (size_t n = 1; n <= N; n++) {
-      int sub_or_ok = e[m-1][n-1] + (a[m-1] == b[n-1] ? 0 : sub_cost);
+      int sub_or_ok = e[m-1][n-1] + (a_ids[m-1] == b_ids[n-1] ? 0 : sub_cost);
       int del = e[m-1][n] + del_cost;
       int ins = e[m][n-1] + ins_cost;
 
@@ -322,157 +1002,3226 @@ int LevenshteinAlignmentCompound(
       }
 
       // Compound: k ref words -> 1 hyp word.
-      {
-        std::string merged = a[m-1];
-        for (size_t k = 2; k <= m; k++) {
-          merged = a[m-k] + merged;
-          if (merged.size() > b[n-1].size()) break;
-          if (merged == b[n-1]) {
-            if (e[m-k][n-1] < e[m][n]) {
-              e[m][n] = e[m-k][n-1];
-              bp[m][n] = {m - k, n - 1};
-            }
-          }
+      for (const auto &c : index.ACompounds(m)) {
+        if (c.word == b_ids[n-1] && e[m-c.span][n-1] < e[m][n]) {
+          e[m][n] = e[m-c.span][n-1];
+          bp[m][n] = {m - c.span, n - 1};
         }
       }
 
       // Compound: k hyp words -> 1 ref word.
-      {
-        std::string merged = b[n-1];
-        for (size_t k = 2; k <= n; k++) {
-          merged = b[n-k] + merged;
-          if (merged.size() > a[m-1].size()) break;
-          if (merged == a[m-1]) {
-            if (e[m-1][n-k] < e[m][n]) {
-              e[m][n] = e[m-1][n-k];
-              bp[m][n] = {m - 1, n - k};
-            }
-          }
+      for (const auto &c : index.BCompounds(n)) {
+        if (c.word == a_ids[m-1] && e[m-1][n-c.span] < e[m][n]) {
+          e[m][n] = e[m-1][n-c.span];
+          bp[m][n] = {m - 1, n - c.span};
         }
       }
     }
   }
 
   // Traceback.
+  std::vector<PathCell> path{{M, N}};
   size_t m = M, n = N;
   while (m != 0 || n != 0) {
-    size_t pm = bp[m][n].prev_m;
-    size_t pn = bp[m][n].prev_n;
-    size_t ref_consumed = m - pm;
-    size_t hyp_consumed = n - pn;
-
-    if (ref_consumed > 1 && hyp_consumed == 1) {
-      // Compound: multiple ref words -> 1 hyp word.
-      std::string ref_str;
-      for (size_t idx = pm; idx < m; idx++) {
-        if (!ref_str.empty()) ref_str += " ";
-        ref_str += a[idx];
-      }
-      output->push_back({ref_str, b[pn]});
-    } else if (ref_consumed == 1 && hyp_consumed > 1) {
-      // Compound: 1 ref word -> multiple hyp words.
-      std::string hyp_str;
-      for (size_t idx = pn; idx < n; idx++) {
-        if (!hyp_str.empty()) hyp_str += " ";
-        hyp_str += b[idx];
-      }
-      output->push_back({a[pm], hyp_str});
+    const BackPointer &p = bp[m][n];
+    m = p.prev_m;
+    n = p.prev_n;
+    path.emplace_back(m, n);
+  }
+  return path;
+}
+
+// Converts a compound alignment path (from (M, N) back to (0, 0)) into
+// AlignmentColumns and returns its cost.
+static int CompoundPathToColumns(const std::vector<std::string> &a,
+                                 const std::vector<std::string> &b,
+                                 int ins_cost, int del_cost, int sub_cost,
+                                 const std::vector<PathCell> &path,
+                                 AlignmentColumns *output) {
+  output->Clear();
+  int cost = 0;
+  for (size_t s = path.size(); s-- > 1;) {
+    const size_t pm = path[s].first, pn = path[s].second;
+    const size_t m = path[s-1].first, n = path[s-1].second;
+    int op;
+    if (m - pm > 1 || n - pn > 1) {
+      op = kOpCompound;
+    } else if (pm == m) {
+      op = kOpInsertion;
+      cost += ins_cost;
+    } else if (pn == n) {
+      op = kOpDeletion;
+      cost += del_cost;
+    } else if (a[pm] != b[pn]) {
+      op = kOpSubstitution;
+      cost += sub_cost;
     } else {
-      // Standard transition.
-      std::string a_sym = (pm == m) ? eps_symbol : a[pm];
-      std::string b_sym = (pn == n) ? eps_symbol : b[pn];
-      output->push_back({a_sym, b_sym});
+      op = kOpCorrect;
     }
-    m = pm;
-    n = pn;
+    output->Append(op, static_cast<int>(pm), static_cast<int>(m), static_cast<int>(pn),
+                   static_cast<int>(n));
   }
-  ReverseVector(output);
-  return e[M][N];
+  return cost;
 }
 
+// The string pairs of LevenshteinAlignmentCompound, with the words of a
+// compound joined by spaces.
+static void ColumnsToCompoundPairs(const std::vector<std::string> &a,
+                                   const std::vector<std::string> &b,
+                                   const std::string &eps_symbol,
+                                   const AlignmentColumns &columns,
+                                   std::vector<std::pair<std::string, std::string>> *output) {
+  ProfileScope profile(kProfileResult);
+  auto join = [](const std::vector<std::string> &words, int begin, int end) {
+    std::string ans;
+    for (int k = begin; k < end; k++) {
+      if (k != begin) ans += " ";
+      ans += words[k];
+    }
+    return ans;
+  };
+  output->clear();
+  output->reserve(columns.Size());
+  for (size_t k = 0; k < columns.Size(); k++) {
+    const int rb = columns.ref_begin[k], re = columns.ref_end[k];
+    const int hb = columns.hyp_begin[k], he = columns.hyp_end[k];
+    output->emplace_back(rb == re ? eps_symbol : join(a, rb, re),
+                         hb == he ? eps_symbol : join(b, hb, he));
+  }
+}
 
-namespace internal {
+}  // namespace internal
 
-    std::vector<std::pair<int, int>> GetEdits(
-        const std::vector<std::vector<int>> &refs,
-        const std::vector<std::vector<int>> &hyps
-    ) {
-        std::vector<std::pair<int, int>> ans;
-        for (int i = 0; i != refs.size(); ++i) {
-            const auto &ref = refs[i];
-            const auto dist = LevenshteinEditDistance(ref, hyps[i], false, nullptr, nullptr, nullptr);
-            ans.emplace_back(dist, ref.size());
-        }
-        return ans;
-    }
+int LevenshteinAlignmentCompound(
+    const std::vector<std::string> &a,
+    const std::vector<std::string> &b,
+    const std::string &eps_symbol,
+    const bool sclite_mode,
+    std::vector<std::pair<std::string, std::string>> *output,
+    const int max_compound_words) {
+  assert(output != NULL);
+  const int ins_cost = sclite_mode ? INS_COST_SCLITE : INS_COST;
+  const int del_cost = sclite_mode ? DEL_COST_SCLITE : DEL_COST;
+  const int sub_cost = sclite_mode ? SUB_COST_SCLITE : SUB_COST;
+  AlignmentColumns columns;
+  const int cost = internal::CompoundPathToColumns(
+      a, b, ins_cost, del_cost, sub_cost,
+      internal::CompoundAlignmentPath(a, b, ins_cost, del_cost, sub_cost, max_compound_words),
+      &columns);
+  internal::ColumnsToCompoundPairs(a, b, eps_symbol, columns, output);
+  return cost;
+}
 
-    std::vector<std::pair<int, int>> GetEditsCompound(
-        const std::vector<std::vector<std::string>> &refs,
-        const std::vector<std::vector<std::string>> &hyps
-    ) {
-        std::vector<std::pair<int, int>> ans;
-        for (size_t i = 0; i != refs.size(); ++i) {
-            const auto &ref = refs[i];
-            const auto dist = LevenshteinEditDistanceCompound(
-                ref, hyps[i], false, nullptr, nullptr, nullptr);
-            ans.emplace_back(dist, static_cast<int>(ref.size()));
-        }
-        return ans;
-    }
 
-    std::pair<double, double> GetBootstrapWerInterval(
-        const std::vector<std::pair<int, int>> &edit_sym_per_hyp,
-        const int replications,
-        const unsigned int seed)
-    {
-        std::mt19937 rng{seed};
-        std::uniform_int_distribution<> dist{0, static_cast<int>(edit_sym_per_hyp.size()) - 1};
+namespace internal {
 
-        double wer_accum = 0.0, wer_mult_accum = 0.0;
-        for (int i = 0; i != replications; ++i) {
-            int num_sym = 0, num_errs = 0;
-            for (int j = 0; j != edit_sym_per_hyp.size(); ++j) {
-                const auto selected = dist(rng);
-                const auto &nerr_nsym = edit_sym_per_hyp[selected];
-                num_errs += nerr_nsym.first;
-                num_sym += nerr_nsym.second;
-            }
-            const double wer_rep = static_cast<double>(num_errs) / num_sym;
-            wer_accum += wer_rep;
-            wer_mult_accum += std::pow(wer_rep, 2);
-        }
+// Cost models for the linear-memory aligner below.  Step() returns the cost
+// of cell (m, n) of the DP table and stores the predecessor that the
+// traceback of LevenshteinAlignment / LevenshteinAlignmentCompound would move
+// to, reading previously computed cells through ``get(i, j)``.  A model also
+// reports how many rows / columns back a single transition may reach.
 
-        const double mean = wer_accum / replications;
-        const double _tmp = wer_mult_accum / replications - std::pow(mean, 2);
-        double interval = 0.0;
-        if (_tmp > 0) {
-            interval = 1.96 * std::sqrt(_tmp);
-        }
-        return std::make_pair(mean, interval);
-    }
+struct AlignmentModel {
+  IntSequence a;
+  IntSequence b;
+  int ins_cost, del_cost, sub_cost;
 
-    double GetPImprov(
-        const std::vector<std::pair<int, int>> &edit_sym_per_hyp,
-        const std::vector<std::pair<int, int>> &edit_sym_per_hyp2,
-        const int replications,
-        const unsigned int seed
-    ) {
-        std::mt19937 rng{seed};
-        std::uniform_int_distribution<> dist{0, static_cast<int>(edit_sym_per_hyp.size()) - 1};
-
-        double improv_accum = 0.0;
-        for (int i = 0; i != replications; ++i) {
-            int num_errs = 0;
-            for (int j = 0; j != edit_sym_per_hyp.size(); ++j) {
-                const auto selected = dist(rng);
-                num_errs += edit_sym_per_hyp[selected].first - edit_sym_per_hyp2[selected].first;
-            }
-            if (num_errs > 0) {
-                improv_accum += 1;
-            }
-        }
+  size_t MaxRefSpan() const { return 1; }
+  size_t MaxHypSpan() const { return 1; }
 
-        return improv_accum / replications;
+  template <typename Get>
+  int Step(size_t m, size_t n, const Get &get, size_t *pm, size_t *pn) const {
+    if (m == 0) {
+      *pm = 0;
+      *pn = n - 1;
+      return n * ins_cost;
+    }
+    if (n == 0) {
+      *pm = m - 1;
+      *pn = 0;
+      return m * del_cost;
+    }
+    int sub_or_ok = get(m-1, n-1) + (a[m-1] == b[n-1] ? 0 : sub_cost);
+    int del = get(m-1, n) + del_cost;  // assumes a == ref, b == hyp.
+    int ins = get(m, n-1) + ins_cost;
+    if (sub_or_ok < std::min(del, ins)) {
+      *pm = m - 1;
+      *pn = n - 1;
+      return sub_or_ok;
+    }
+    if (del < ins) {
+      *pm = m - 1;
+      *pn = n;
+      return del;
     }
+    *pm = m;
+    *pn = n - 1;
+    return ins;
+  }
+};
 
-}
+struct CompoundAlignmentModel {
+  const std::vector<std::string> &a;
+  const std::vector<std::string> &b;
+  int ins_cost, del_cost, sub_cost;
+  CompoundIndex index;
+  size_t max_ref_span, max_hyp_span;
+
+  CompoundAlignmentModel(const std::vector<std::string> &a,
+                         const std::vector<std::string> &b,
+                         int ins_cost, int del_cost, int sub_cost,
+                         int max_compound_words)
+      : a(a), b(b), ins_cost(ins_cost), del_cost(del_cost), sub_cost(sub_cost),
+        index(a, b, max_compound_words), max_ref_span(index.MaxASpan()), max_hyp_span(index.MaxBSpan()) {}
+
+  size_t MaxRefSpan() const { return max_ref_span; }
+  size_t MaxHypSpan() const { return max_hyp_span; }
+
+  template <typename Get>
+  int Step(size_t m, size_t n, const Get &get, size_t *pm, size_t *pn) const {
+    if (m == 0) {
+      *pm = 0;
+      *pn = n - 1;
+      return n * ins_cost;
+    }
+    if (n == 0) {
+      *pm = m - 1;
+      *pn = 0;
+      return m * del_cost;
+    }
+    const int a_id = index.AIds()[m-1], b_id = index.BIds()[n-1];
+    int sub_or_ok = get(m-1, n-1) + (a_id == b_id ? 0 : sub_cost);
+    int del = get(m-1, n) + del_cost;
+    int ins = get(m, n-1) + ins_cost;
+    int cost;
+    if (sub_or_ok < std::min(del, ins)) {
+      cost = sub_or_ok;
+      *pm = m - 1;
+      *pn = n - 1;
+    } else if (del < ins) {
+      cost = del;
+      *pm = m - 1;
+      *pn = n;
+    } else {
+      cost = ins;
+      *pm = m;
+      *pn = n - 1;
+    }
+    // Compound: k ref words -> 1 hyp word.
+    for (const auto &c : index.ACompounds(m)) {
+      if (c.word == b_id && get(m-c.span, n-1) < cost) {
+        cost = get(m-c.span, n-1);
+        *pm = m - c.span;
+        *pn = n - 1;
+      }
+    }
+    // Compound: k hyp words -> 1 ref word.
+    for (const auto &c : index.BCompounds(n)) {
+      if (c.word == a_id && get(m-1, n-c.span) < cost) {
+        cost = get(m-1, n-c.span);
+        *pm = m - 1;
+        *pn = n - c.span;
+      }
+    }
+    return cost;
+  }
+};
+
+// Recovers the exact traceback path of the full-table aligners using memory
+// linear in the sequence lengths (times the maximum transition span K).
+//
+// The table is split at a middle row.  A forward pass over the lower half
+// propagates, for every cell, the cell at which its traceback path first
+// reaches a row at or above the split; this pins down where the path of the
+// bottom-right cell crosses it.  Both halves are then solved recursively.
+// A sub-problem only needs the K rows above it and the K columns to its left
+// to recompute its DP values exactly, so the choices made during the
+// traceback -- including all tie-breaking -- are identical to the full table.
+template <typename Model>
+class LinearMemoryAligner {
+ public:
+  typedef std::pair<size_t, size_t> Cell;
+
+  LinearMemoryAligner(const Model &model, size_t M, size_t N)
+      : model_(model), M_(M), N_(N),
+        kr_(model.MaxRefSpan()), kc_(model.MaxHypSpan()) {}
+
+  // Returns the traceback path from (M, N) back to (0, 0), one cell per step.
+  std::vector<Cell> Trace() {
+    std::vector<Cell> path{{M_, N_}};
+    std::vector<int> top(N_ + 1, 0);
+    const int *row = top.data();
+    auto get = [&](size_t, size_t j) { return row[j]; };
+    size_t pm, pn;
+    for (size_t n = 1; n <= N_; n++) top[n] = model_.Step(0, n, get, &pm, &pn);
+    Region r{0, 0, M_, N_, top.data(), N_ + 1, nullptr, 0};
+    Solve(r, &path);
+    return path;
+  }
+
+ private:
+  // The traceback path of the region runs from (r1, c1) back to (r0, c0).
+  // ``top`` holds rows [FirstRow(), r0] and ``left`` holds rows (r0, r1],
+  // both starting at column FirstCol().
+  struct Region {
+    size_t r0, c0, r1, c1;
+    const int *top;
+    size_t top_stride;
+    const int *left;
+    size_t left_stride;
+  };
+
+  static constexpr size_t kDirectCells = 1 << 20;
+  static constexpr uint64_t kNoCell = ~static_cast<uint64_t>(0);
+
+  size_t FirstRow(const Region &r) const { return r.r0 >= kr_ - 1 ? r.r0 - (kr_ - 1) : 0; }
+  size_t FirstCol(const Region &r) const { return r.c0 >= kc_ ? r.c0 - kc_ : 0; }
+  uint64_t Pack(size_t i, size_t j) const { return static_cast<uint64_t>(i) * (N_ + 1) + j; }
+
+  // Computes rows (r0, r1] of the region, keeping the last ``ring`` of them
+  // in ``buf`` (full frame width, starting at FirstCol()).  Calls
+  // on_cell(m, n, pm, pn) for every computed cell and on_row(m, row) after
+  // every row.
+  template <typename OnCell, typename OnRow>
+  void Sweep(const Region &r, size_t ring, std::vector<int> *buf,
+             OnCell on_cell, OnRow on_row) const {
+    const size_t fr0 = FirstRow(r), fc0 = FirstCol(r);
+    const size_t width = r.c1 - fc0 + 1, lead = r.c0 - fc0;
+    buf->resize(ring * width);
+    Profiler::CountDp((r.r1 - r.r0) * (r.c1 - r.c0 + 1), buf->size() * sizeof(int));
+    std::vector<const int *> rows(kr_ + 1);
+    size_t m = r.r0;
+    auto row_ptr = [&](size_t i) -> const int * {
+      if (i <= r.r0) return r.top + (i - fr0) * r.top_stride;
+      return buf->data() + ((i - r.r0 - 1) % ring) * width;
+    };
+    auto get = [&](size_t i, size_t j) { return rows[m - i][j - fc0]; };
+    for (m = r.r0 + 1; m <= r.r1; m++) {
+      int *row = buf->data() + ((m - r.r0 - 1) % ring) * width;
+      std::copy(r.left + (m - r.r0 - 1) * r.left_stride,
+                r.left + (m - r.r0 - 1) * r.left_stride + lead, row);
+      for (size_t d = 0; d <= kr_ && d + fr0 <= m; d++) rows[d] = row_ptr(m - d);
+      for (size_t n = r.c0; n <= r.c1; n++) {
+        size_t pm, pn;
+        row[n - fc0] = model_.Step(m, n, get, &pm, &pn);
+        on_cell(m, n, pm, pn);
+      }
+      on_row(m, row);
+    }
+  }
+
+  // Full traceback of a small region.
+  void SolveDirect(const Region &r, std::vector<Cell> *path) const {
+    const size_t fr0 = FirstRow(r), fc0 = FirstCol(r);
+    const size_t width = r.c1 - fc0 + 1;
+    std::vector<int> buf;
+    Sweep(r, std::max<size_t>(r.r1 - r.r0, 1), &buf,
+          [](size_t, size_t, size_t, size_t) {}, [](size_t, const int *) {});
+    auto get = [&](size_t i, size_t j) {
+      if (i <= r.r0) return r.top[(i - fr0) * r.top_stride + (j - fc0)];
+      return buf[(i - r.r0 - 1) * width + (j - fc0)];
+    };
+    size_t m = r.r1, n = r.c1;
+    while (m != r.r0 || n != r.c0) {
+      assert(m > r.r0 || r.r0 == 0);
+      size_t pm, pn;
+      model_.Step(m, n, get, &pm, &pn);
+      m = pm;
+      n = pn;
+      path->emplace_back(m, n);
+    }
+  }
+
+  // Appends the cells of the region's path after (r1, c1), up to (r0, c0).
+  void Solve(const Region &r, std::vector<Cell> *path) const {
+    const size_t rows = r.r1 - r.r0;
+    const size_t fc0 = FirstCol(r), width = r.c1 - fc0 + 1;
+    if (rows <= 2 * kr_ + 1 || (rows + kr_) * width <= kDirectCells) {
+      SolveDirect(r, path);
+      return;
+    }
+    const size_t mid = r.r0 + rows / 2;
+    const size_t ring = kr_ + 1;
+
+    // Pass 1: find where the path of (r1, c1) first reaches a row <= mid.
+    std::vector<int> buf;
+    std::vector<uint64_t> land(ring * width, kNoCell);
+    auto land_of = [&](size_t i, size_t j) -> uint64_t {
+      if (i <= mid) return Pack(i, j);
+      if (j < r.c0) return kNoCell;
+      return land[((i - r.r0 - 1) % ring) * width + (j - fc0)];
+    };
+    Sweep(r, ring, &buf,
+          [&](size_t m, size_t n, size_t pm, size_t pn) {
+            if (m > mid)
+              land[((m - r.r0 - 1) % ring) * width + (n - fc0)] = land_of(pm, pn);
+          },
+          [](size_t, const int *) {});
+    const uint64_t cross = land_of(r.r1, r.c1);
+    assert(cross != kNoCell);
+    const size_t rc = cross / (N_ + 1), cc = cross % (N_ + 1);
+
+    // Pass 2: collect the boundary rows and columns of the lower part.
+    Region lower{rc, cc, r.r1, r.c1, nullptr, 0, nullptr, 0};
+    const size_t lfr0 = FirstRow(lower), lfc0 = FirstCol(lower);
+    lower.top_stride = r.c1 - lfc0 + 1;
+    lower.left_stride = cc - lfc0;
+    std::vector<int> top((rc - lfr0 + 1) * lower.top_stride);
+    std::vector<int> left((r.r1 - rc) * lower.left_stride);
+    for (size_t i = lfr0; i <= std::min(rc, r.r0); i++) {
+      const int *src = r.top + (i - FirstRow(r)) * r.top_stride + (lfc0 - fc0);
+      std::copy(src, src + lower.top_stride, top.begin() + (i - lfr0) * lower.top_stride);
+    }
+    Sweep(r, ring, &buf, [](size_t, size_t, size_t, size_t) {},
+          [&](size_t m, const int *row) {
+            if (m >= lfr0 && m <= rc)
+              std::copy(row + (lfc0 - fc0), row + (lfc0 - fc0) + lower.top_stride,
+                        top.begin() + (m - lfr0) * lower.top_stride);
+            if (m > rc)
+              std::copy(row + (lfc0 - fc0), row + (lfc0 - fc0) + lower.left_stride,
+                        left.begin() + (m - rc - 1) * lower.left_stride);
+          });
+    std::vector<int>().swap(buf);
+    std::vector<uint64_t>().swap(land);
+    lower.top = top.data();
+    lower.left = left.data();
+    Solve(lower, path);
+    std::vector<int>().swap(top);
+    std::vector<int>().swap(left);
+
+    Region upper = r;
+    upper.r1 = rc;
+    upper.c1 = cc;
+    Solve(upper, path);
+  }
+
+  const Model &model_;
+  const size_t M_, N_;
+  const size_t kr_, kc_;
+};
+
+}  // namespace internal
+
+int LevenshteinAlignmentLinearMemory(IntSequence a,
+                                     IntSequence b,
+                                     int eps_symbol,
+                                     const bool sclite_mode,
+                                     std::vector<std::pair<int, int> > *output) {
+  assert(output != NULL);
+  output->clear();
+  internal::ProfileScope profile(internal::kProfileDp);
+  internal::AlignmentModel model{
+      a, b,
+      sclite_mode ? INS_COST_SCLITE : INS_COST,
+      sclite_mode ? DEL_COST_SCLITE : DEL_COST,
+      sclite_mode ? SUB_COST_SCLITE : SUB_COST};
+  internal::LinearMemoryAligner<internal::AlignmentModel> aligner(model, a.size(), b.size());
+  const auto path = aligner.Trace();
+
+  int cost = 0;
+  for (size_t s = 0; s + 1 < path.size(); s++) {
+    const size_t m = path[s].first, n = path[s].second;
+    const size_t last_m = path[s+1].first, last_n = path[s+1].second;
+    int a_sym = (last_m == m ? eps_symbol : a[last_m]);
+    int b_sym = (last_n == n ? eps_symbol : b[last_n]);
+    if (last_m == m) cost += model.ins_cost;
+    else if (last_n == n) cost += model.del_cost;
+    else if (a_sym != b_sym) cost += model.sub_cost;
+    output->push_back(std::make_pair(a_sym, b_sym));
+  }
+  ReverseVector(output);
+  return cost;
+}
+
+namespace internal {
+
+// Traceback path of LevenshteinAlignmentCompoundLinearMemory, from (M, N)
+// back to (0, 0).
+static std::vector<PathCell> CompoundAlignmentPathLinearMemory(
+    const std::vector<std::string> &a,
+    const std::vector<std::string> &b,
+    int ins_cost, int del_cost, int sub_cost,
+    const int max_compound_words) {
+  ProfileScope profile(kProfileDp);
+  CompoundAlignmentModel model(a, b, ins_cost, del_cost, sub_cost, max_compound_words);
+  LinearMemoryAligner<CompoundAlignmentModel> aligner(model, a.size(), b.size());
+  return aligner.Trace();
+}
+
+}  // namespace internal
+
+int LevenshteinAlignmentCompoundLinearMemory(
+    const std::vector<std::string> &a,
+    const std::vector<std::string> &b,
+    const std::string &eps_symbol,
+    const bool sclite_mode,
+    std::vector<std::pair<std::string, std::string>> *output,
+    const int max_compound_words) {
+  assert(output != NULL);
+  AlignmentColumns columns;
+  const int cost = LevenshteinAlignmentCompoundColumns(a, b, sclite_mode, true, &columns,
+                                                       max_compound_words);
+  internal::ColumnsToCompoundPairs(a, b, eps_symbol, columns, output);
+  return cost;
+}
+
+int LevenshteinAlignmentCompoundColumns(
+    const std::vector<std::string> &a,
+    const std::vector<std::string> &b,
+    const bool sclite_mode,
+    const bool linear_memory,
+    AlignmentColumns *output,
+    const int max_compound_words) {
+  assert(output != NULL);
+  const int ins_cost = sclite_mode ? INS_COST_SCLITE : INS_COST;
+  const int del_cost = sclite_mode ? DEL_COST_SCLITE : DEL_COST;
+  const int sub_cost = sclite_mode ? SUB_COST_SCLITE : SUB_COST;
+  const auto path = linear_memory
+      ? internal::CompoundAlignmentPathLinearMemory(a, b, ins_cost, del_cost, sub_cost,
+                                                    max_compound_words)
+      : internal::CompoundAlignmentPath(a, b, ins_cost, del_cost, sub_cost,
+                                        max_compound_words);
+  return internal::CompoundPathToColumns(a, b, ins_cost, del_cost, sub_cost, path, output);
+}
+
+
+namespace internal {
+
+typedef uint64_t Word;
+static const size_t kWordBits = 64;
+
+// Up to this many words per vertical-difference array, the bit-parallel
+// engine stores every column right away; above it, it first computes the
+// distance and then stores only the band optimal paths can pass through,
+// falling back to the linear-memory traceback when even that is too big.
+static const size_t kBitParallelFullStoreWords = 1 << 18;
+static const size_t kBitParallelMaxBandWords = 1 << 23;
+
+// Equality masks of the reference for the bit-parallel engine: in the mask
+// of a hyp token, bit (i % 64) of word (i / 64) is set iff ref[i] equals the
+// token.  Only symbols occurring in both sequences get a mask.  When dense
+// masks would take too much memory (huge vocabularies), the mask of each
+// token is instead assembled on demand from the token's reference positions.
+class RefMasks {
+ public:
+  RefMasks(IntSequence ref, IntSequence hyp)
+      : num_words_((ref.size() + kWordBits - 1) / kWordBits),
+        hyp_ids_(hyp.size(), -1) {
+    std::vector<std::pair<int, size_t> > by_symbol(ref.size());
+    for (size_t i = 0; i < ref.size(); i++) by_symbol[i] = std::make_pair(ref[i], i);
+    std::sort(by_symbol.begin(), by_symbol.end());
+
+    // Give every symbol shared with the hyp an id and collect its positions.
+    std::vector<int> id_of_run(by_symbol.size(), -1);
+    offsets_.push_back(0);
+    for (size_t j = 0; j < hyp.size(); j++) {
+      auto it = std::lower_bound(by_symbol.begin(), by_symbol.end(),
+                                 std::make_pair(hyp[j], size_t(0)));
+      if (it == by_symbol.end() || it->first != hyp[j]) continue;
+      const size_t begin = it - by_symbol.begin();
+      if (id_of_run[begin] < 0) {
+        id_of_run[begin] = static_cast<int>(offsets_.size()) - 1;
+        for (size_t k = begin; k < by_symbol.size() && by_symbol[k].first == hyp[j]; k++)
+          positions_.push_back(by_symbol[k].second);
+        offsets_.push_back(positions_.size());
+      }
+      hyp_ids_[j] = id_of_run[begin];
+    }
+
+    const size_t num_ids = offsets_.size() - 1;
+    dense_ = (num_ids + 1) * num_words_ <= kMaxDenseWords;
+    if (dense_) {
+      // The extra last mask is all zeros, for tokens absent from the ref.
+      masks_.assign((num_ids + 1) * num_words_, 0);
+      for (size_t u = 0; u < num_ids; u++) {
+        Word *mask = &masks_[u * num_words_];
+        for (size_t k = offsets_[u]; k < offsets_[u + 1]; k++)
+          mask[positions_[k] / kWordBits] |= Word(1) << (positions_[k] % kWordBits);
+      }
+      for (auto &id : hyp_ids_)
+        if (id < 0) id = static_cast<int>(num_ids);
+    } else {
+      scratch_.assign(num_words_, 0);
+    }
+  }
+
+  size_t NumWords() const { return num_words_; }
+
+  // Returns the masks of hyp[j]; valid until the next call.
+  const Word *Get(size_t j) {
+    const int id = hyp_ids_[j];
+    if (dense_) return &masks_[id * num_words_];
+    if (last_ >= 0) {
+      for (size_t k = offsets_[last_]; k < offsets_[last_ + 1]; k++)
+        scratch_[positions_[k] / kWordBits] = 0;
+    }
+    if (id >= 0) {
+      for (size_t k = offsets_[id]; k < offsets_[id + 1]; k++)
+        scratch_[positions_[k] / kWordBits] |= Word(1) << (positions_[k] % kWordBits);
+    }
+    last_ = id;
+    return scratch_.data();
+  }
+
+ private:
+  static const size_t kMaxDenseWords = 1 << 22;
+
+  size_t num_words_;
+  std::vector<int> hyp_ids_;
+  std::vector<size_t> positions_;
+  std::vector<size_t> offsets_;
+  bool dense_ = true;
+  std::vector<Word> masks_;
+  std::vector<Word> scratch_;
+  int last_ = -1;
+};
+
+// Advances one 64-row block of the bit-parallel DP by one hyp token, where
+// Pv / Mv encode the +1 / -1 vertical differences of the block's column.
+// hin is the horizontal difference entering at the top of the block; the
+// one leaving at its bottom is returned (Hyyro's blocked formulation).
+static inline int AdvanceBlock(Word eq, int hin, Word *pv, Word *mv) {
+  const Word hin_neg = hin < 0 ? 1 : 0;
+  const Word xv = eq | *mv;
+  eq |= hin_neg;
+  const Word xh = (((eq & *pv) + *pv) ^ *pv) | eq;
+  Word ph = *mv | ~(xh | *pv);
+  Word mh = *pv & xh;
+  const int hout = static_cast<int>(ph >> (kWordBits - 1)) -
+                   static_cast<int>(mh >> (kWordBits - 1));
+  ph = (ph << 1) | (hin > 0 ? 1 : 0);
+  mh = (mh << 1) | hin_neg;
+  *pv = mh | ~(xv | ph);
+  *mv = ph & xv;
+  return hout;
+}
+
+static inline int Popcount(Word w) {
+#if defined(__GNUC__) || defined(__clang__)
+  return __builtin_popcountll(w);
+#else
+  w = w - ((w >> 1) & 0x5555555555555555ULL);
+  w = (w & 0x3333333333333333ULL) + ((w >> 2) & 0x3333333333333333ULL);
+  w = (w + (w >> 4)) & 0x0F0F0F0F0F0F0F0FULL;
+  return static_cast<int>((w * 0x0101010101010101ULL) >> 56);
+#endif
+}
+
+// Sum of the vertical differences of rows [64 * b + 1, 64 * b + bits].
+static inline int BlockDelta(Word pv, Word mv, size_t bits) {
+  const Word mask = bits >= kWordBits ? ~Word(0) : (Word(1) << bits) - 1;
+  return Popcount(pv & mask) - Popcount(mv & mask);
+}
+
+// Runs the blocked bit-parallel DP (ref along the rows, hyp along the
+// columns) and calls on_column(j, pv, mv, scores) after every hyp token,
+// where scores[b] is D[64 * (b + 1)][j].  Returns D[M][N].
+template <typename OnColumn>
+int BitParallelSweep(size_t M, size_t N, RefMasks *masks, OnColumn on_column) {
+  const size_t W = masks->NumWords();
+  std::vector<Word> pv(W, ~Word(0)), mv(W, 0);
+  std::vector<int> scores(W);
+  Profiler::CountDp(M * N, W * (2 * sizeof(Word) + sizeof(int)));
+  for (size_t b = 0; b < W; b++) scores[b] = static_cast<int>(kWordBits * (b + 1));
+  for (size_t j = 1; j <= N; j++) {
+    const Word *eq = masks->Get(j - 1);
+    int h = 1;  // D[0][j] - D[0][j-1]
+    for (size_t b = 0; b < W; b++) {
+      h = AdvanceBlock(eq[b], h, &pv[b], &mv[b]);
+      scores[b] += h;
+    }
+    on_column(j, pv.data(), mv.data(), scores.data());
+  }
+  if (W == 0) return static_cast<int>(N);
+  const int base = W > 1 ? scores[W - 2] : static_cast<int>(N);
+  return base + BlockDelta(pv[W - 1], mv[W - 1], M - kWordBits * (W - 1));
+}
+
+// Vertical-difference words of the bit-parallel DP for a diagonal band of
+// every column, from which single DP values can be recovered cheaply.
+class BandStore {
+ public:
+  // Column j keeps the blocks covering rows [j + lo, j + hi] (clamped).
+  BandStore(size_t M, size_t N, long long lo, long long hi) {
+    first_.resize(N + 1);
+    offsets_.resize(N + 2, 0);
+    for (size_t j = 1; j <= N; j++) {
+      const long long r0 = std::max<long long>(1, static_cast<long long>(j) + lo);
+      const long long r1 = std::min<long long>(M, static_cast<long long>(j) + hi);
+      size_t fb = 0, nb = 0;
+      if (r0 <= r1) {
+        fb = (r0 - 1) / kWordBits;
+        nb = (r1 - 1) / kWordBits - fb + 1;
+      }
+      first_[j] = fb;
+      offsets_[j + 1] = offsets_[j] + nb;
+    }
+  }
+
+  size_t NumWords() const { return offsets_.back(); }
+
+  void Allocate() {
+    pv_.resize(NumWords());
+    mv_.resize(NumWords());
+    base_.resize(first_.size());
+    Profiler::CountDp(0, NumWords() * 2 * sizeof(Word) + base_.size() * sizeof(int));
+  }
+
+  void Store(size_t j, const Word *pv, const Word *mv, const int *scores) {
+    const size_t fb = first_[j];
+    base_[j] = fb == 0 ? static_cast<int>(j) : scores[fb - 1];
+    std::copy(pv + fb, pv + fb + (offsets_[j + 1] - offsets_[j]), pv_.begin() + offsets_[j]);
+    std::copy(mv + fb, mv + fb + (offsets_[j + 1] - offsets_[j]), mv_.begin() + offsets_[j]);
+  }
+
+  // D[i][j], for a cell inside the band of column j.
+  int Get(size_t i, size_t j) const {
+    if (j == 0) return static_cast<int>(i);
+    if (i == 0) return static_cast<int>(j);
+    const size_t b = (i - 1) / kWordBits, fb = first_[j];
+    assert(b >= fb && offsets_[j] + (b - fb) < offsets_[j + 1]);
+    int value = base_[j];
+    const size_t off = offsets_[j] - fb;
+    for (size_t k = fb; k < b; k++) value += BlockDelta(pv_[off + k], mv_[off + k], kWordBits);
+    return value + BlockDelta(pv_[off + b], mv_[off + b], i - kWordBits * b);
+  }
+
+ private:
+  std::vector<size_t> first_;
+  std::vector<size_t> offsets_;
+  std::vector<int> base_;
+  std::vector<Word> pv_, mv_;
+};
+
+}  // namespace internal
+
+namespace internal {
+
+// Traces the alignment back from D[M][N] with the tie-breaking rule of
+// LevenshteinEditDistance, where d(i, j) returns D[i][j] for any cell the
+// traceback visits, calling visit(op, i, j) for every step (last step
+// first) with the AlignmentOp and the 0-based positions it consumes
+// (-1 for none).
+template <typename Cost, typename Visit>
+static void Traceback(IntSequence ref, IntSequence hyp, int ins_cost, int del_cost,
+                      int sub_cost, Cost d, Visit visit) {
+  size_t i = ref.size(), j = hyp.size();
+  while (i != 0 || j != 0) {
+    if (i == 0) {
+      j--;
+      visit(kOpInsertion, -1, static_cast<int>(j));
+    } else if (j == 0) {
+      i--;
+      visit(kOpDeletion, static_cast<int>(i), -1);
+    } else {
+      const bool same = ref[i-1] == hyp[j-1];
+      const int sub_err = d(i-1, j-1) + (same ? 0 : sub_cost);
+      const int del_err = d(i-1, j) + del_cost;
+      const int ins_err = d(i, j-1) + ins_cost;
+      if (sub_err < ins_err && sub_err < del_err) {
+        i--;
+        j--;
+        visit(same ? kOpCorrect : kOpSubstitution, static_cast<int>(i), static_cast<int>(j));
+      } else if (del_err < ins_err) {
+        i--;
+        visit(kOpDeletion, static_cast<int>(i), -1);
+      } else {
+        j--;
+        visit(kOpInsertion, -1, static_cast<int>(j));
+      }
+    }
+  }
+}
+
+// The ins / del / sub counts of the Traceback.
+template <typename Cost>
+static void TracebackCounts(IntSequence ref, IntSequence hyp, int ins_cost, int del_cost,
+                            int sub_cost, Cost d, int *n_ins, int *n_del, int *n_sub) {
+  *n_ins = *n_del = *n_sub = 0;
+  Traceback(ref, hyp, ins_cost, del_cost, sub_cost, d, [&](AlignmentOp op, int, int) {
+    if (op == kOpInsertion) ++*n_ins;
+    else if (op == kOpDeletion) ++*n_del;
+    else if (op == kOpSubstitution) ++*n_sub;
+  });
+}
+
+// LevenshteinEditDistanceBitParallel for references of at most 64 symbols
+// (most utterances): a whole column fits in one word, so every column is
+// kept without any mask or band bookkeeping, which dominates the cost of
+// such short inputs.
+static int SingleWordEditDistance(IntSequence ref, IntSequence hyp,
+                                  int *ins, int *del, int *sub) {
+  const size_t M = ref.size(), N = hyp.size();
+  thread_local std::vector<Word> pv_cols, mv_cols;
+  pv_cols.resize(N + 1);
+  mv_cols.resize(N + 1);
+  Profiler::CountDp(M * N, 2 * (N + 1) * sizeof(Word));
+  Word pv = ~Word(0), mv = 0;  // D[i][0] = i
+  pv_cols[0] = pv;
+  mv_cols[0] = mv;
+  for (size_t j = 1; j <= N; j++) {
+    Word eq = 0;
+    for (size_t i = 0; i < M; i++) eq |= Word(ref[i] == hyp[j-1]) << i;
+    AdvanceBlock(eq, 1, &pv, &mv);
+    pv_cols[j] = pv;
+    mv_cols[j] = mv;
+  }
+  auto d = [&](size_t i, size_t j) {
+    return static_cast<int>(j) + BlockDelta(pv_cols[j], mv_cols[j], i);
+  };
+  int n_ins, n_del, n_sub;
+  TracebackCounts(ref, hyp, INS_COST, DEL_COST, SUB_COST, d, &n_ins, &n_del, &n_sub);
+  if (ins != nullptr) *ins = n_ins;
+  if (del != nullptr) *del = n_del;
+  if (sub != nullptr) *sub = n_sub;
+  return n_ins + n_del + n_sub;
+}
+
+}  // namespace internal
+
+int LevenshteinEditDistanceBitParallel(IntSequence ref,
+                                       IntSequence hyp,
+                                       int *ins, int *del, int *sub) {
+  internal::ProfileScope profile(internal::kProfileDp);
+  const size_t M = ref.size(), N = hyp.size();
+  if (M > 0 && M <= internal::kWordBits)
+    return internal::SingleWordEditDistance(ref, hyp, ins, del, sub);
+  int n_ins = 0, n_del = 0, n_sub = 0;
+  if (M == 0 || N == 0) {
+    n_ins = static_cast<int>(N);
+    n_del = static_cast<int>(M);
+  } else {
+    // Store every column if that is cheap, otherwise find the distance first
+    // and only keep the diagonal band that optimal paths can pass through.
+    const long long delta = static_cast<long long>(M) - static_cast<long long>(N);
+    long long lo = -static_cast<long long>(N), hi = static_cast<long long>(M);
+    internal::RefMasks masks(ref, hyp);
+    std::unique_ptr<internal::BandStore> store(new internal::BandStore(M, N, lo, hi));
+    int dist = -1;
+    if (store->NumWords() > internal::kBitParallelFullStoreWords) {
+      dist = internal::BitParallelSweep(M, N, &masks, [](size_t, const internal::Word *,
+                                                         const internal::Word *, const int *) {});
+      // A cell (i, j) on an optimal path satisfies |i - j| + |delta - (i - j)| <= dist;
+      // one extra diagonal on each side covers the neighbours the traceback inspects.
+      const long long slack = (dist - std::abs(delta)) / 2;
+      lo = std::min<long long>(0, delta) - slack - 1;
+      hi = std::max<long long>(0, delta) + slack + 1;
+      store.reset(new internal::BandStore(M, N, lo, hi));
+    }
+    if (dist == 0) {
+      // Identical sequences.
+    } else if (store->NumWords() > internal::kBitParallelMaxBandWords) {
+      // Too many errors on too long sequences to keep even the band: count
+      // the ops of the (identical) linear-memory traceback instead.
+      internal::AlignmentModel model{ref, hyp, INS_COST, DEL_COST, SUB_COST};
+      internal::LinearMemoryAligner<internal::AlignmentModel> aligner(model, M, N);
+      const auto path = aligner.Trace();
+      for (size_t s = 0; s + 1 < path.size(); s++) {
+        const size_t m = path[s].first, n = path[s].second;
+        const size_t pm = path[s + 1].first, pn = path[s + 1].second;
+        if (pm == m) n_ins++;
+        else if (pn == n) n_del++;
+        else if (ref[pm] != hyp[pn]) n_sub++;
+      }
+    } else {
+      store->Allocate();
+      internal::BitParallelSweep(
+          M, N, &masks,
+          [&](size_t j, const internal::Word *pv, const internal::Word *mv, const int *scores) {
+            store->Store(j, pv, mv, scores);
+          });
+      // Same traceback rule as LevenshteinEditDistance / LevenshteinAlignment.
+      internal::TracebackCounts(
+          ref, hyp, INS_COST, DEL_COST, SUB_COST,
+          [&](size_t i, size_t j) { return store->Get(i, j); }, &n_ins, &n_del, &n_sub);
+    }
+  }
+  if (ins != nullptr) *ins = n_ins;
+  if (del != nullptr) *del = n_del;
+  if (sub != nullptr) *sub = n_sub;
+  return n_ins + n_del + n_sub;
+}
+
+
+int LevenshteinEditDistanceNBest(IntSequence ref,
+                                 const std::vector<IntSequence> &hyps,
+                                 const bool sclite_mode,
+                                 std::vector<error_stats> *stats) {
+  using internal::Word;
+  using internal::kWordBits;
+  internal::ProfileScope profile(internal::kProfileDp);
+  const size_t M = ref.size(), K = hyps.size();
+  stats->assign(K, error_stats{0, 0, 0, 0, 0});
+  if (K == 0) return -1;
+
+  // Visiting the hyps in lexicographic order walks their prefix trie depth
+  // first: the DP columns of the common prefix with the previous hyp are
+  // still on the stack and only the rest has to be computed.
+  std::vector<size_t> order(K);
+  for (size_t k = 0; k < K; k++) order[k] = k;
+  std::sort(order.begin(), order.end(), [&](size_t x, size_t y) {
+    return std::lexicographical_compare(hyps[x].begin(), hyps[x].end(),
+                                        hyps[y].begin(), hyps[y].end());
+  });
+  size_t max_len = 0;
+  for (const auto &hyp : hyps) max_len = std::max(max_len, hyp.size());
+
+  const int ins_cost = sclite_mode ? INS_COST_SCLITE : INS_COST;
+  const int del_cost = sclite_mode ? DEL_COST_SCLITE : DEL_COST;
+  const int sub_cost = sclite_mode ? SUB_COST_SCLITE : SUB_COST;
+
+  // Unit costs: bit-parallel columns (see BitParallelSweep) with the ref
+  // masks built once for the tokens of all hyps.  Sclite costs: plain
+  // columns of DP values.
+  const size_t W = (M + kWordBits - 1) / kWordBits;
+  std::vector<Word> pv, mv;
+  std::vector<int> scores, cols;
+  std::vector<int> all_tokens;
+  std::vector<size_t> token_offset(K);
+  std::unique_ptr<internal::RefMasks> masks;
+  if (!sclite_mode) {
+    for (size_t k = 0; k < K; k++) {
+      token_offset[k] = all_tokens.size();
+      all_tokens.insert(all_tokens.end(), hyps[k].begin(), hyps[k].end());
+    }
+    masks.reset(new internal::RefMasks(ref, all_tokens));
+    pv.assign((max_len + 1) * W, ~Word(0));
+    mv.assign((max_len + 1) * W, 0);
+    scores.resize((max_len + 1) * W);
+    for (size_t b = 0; b < W; b++) scores[b] = static_cast<int>(kWordBits * (b + 1));
+  } else {
+    cols.resize((max_len + 1) * (M + 1));
+    for (size_t i = 0; i <= M; i++) cols[i] = static_cast<int>(i) * del_cost;
+  }
+  internal::Profiler::CountDp(0, pv.size() * 2 * sizeof(Word) + scores.size() * sizeof(int) +
+                                     cols.size() * sizeof(int));
+
+  const IntSequence *prev = nullptr;
+  for (const size_t k : order) {
+    const IntSequence hyp = hyps[k];
+    const size_t N = hyp.size();
+    size_t lcp = 0;
+    if (prev != nullptr)
+      while (lcp < N && lcp < prev->size() && hyp[lcp] == (*prev)[lcp]) lcp++;
+    internal::Profiler::CountDp(M * (N - lcp), 0);
+    for (size_t j = lcp + 1; j <= N; j++) {
+      if (!sclite_mode) {
+        const Word *eq = masks->Get(token_offset[k] + j - 1);
+        const size_t from = (j - 1) * W, to = j * W;
+        int h = 1;  // D[0][j] - D[0][j-1]
+        for (size_t b = 0; b < W; b++) {
+          pv[to + b] = pv[from + b];
+          mv[to + b] = mv[from + b];
+          h = internal::AdvanceBlock(eq[b], h, &pv[to + b], &mv[to + b]);
+          scores[to + b] = scores[from + b] + h;
+        }
+      } else {
+        const int *e = &cols[(j - 1) * (M + 1)];
+        int *cur = &cols[j * (M + 1)];
+        cur[0] = e[0] + ins_cost;
+        for (size_t i = 1; i <= M; i++) {
+          const int sub_err = e[i-1] + (hyp[j-1] == ref[i-1] ? 0 : sub_cost);
+          cur[i] = std::min(sub_err, std::min(e[i] + ins_cost, cur[i-1] + del_cost));
+        }
+      }
+    }
+    prev = &hyps[k];
+
+    auto &s = (*stats)[k];
+    if (!sclite_mode) {
+      internal::TracebackCounts(
+          ref, hyp, ins_cost, del_cost, sub_cost,
+          [&](size_t i, size_t j) {
+            if (i == 0) return static_cast<int>(j);
+            const size_t b = (i - 1) / kWordBits;
+            const int base = b == 0 ? static_cast<int>(j) : scores[j * W + b - 1];
+            return base + internal::BlockDelta(pv[j * W + b], mv[j * W + b], i - kWordBits * b);
+          },
+          &s.ins_num, &s.del_num, &s.sub_num);
+    } else {
+      internal::TracebackCounts(
+          ref, hyp, ins_cost, del_cost, sub_cost,
+          [&](size_t i, size_t j) { return cols[j * (M + 1) + i]; },
+          &s.ins_num, &s.del_num, &s.sub_num);
+    }
+    s.total_num = s.ins_num + s.del_num + s.sub_num;
+    s.total_cost = s.ins_num * ins_cost + s.del_num * del_cost + s.sub_num * sub_cost;
+  }
+
+  int oracle = 0;
+  for (size_t k = 1; k < K; k++)
+    if ((*stats)[k].total_num < (*stats)[oracle].total_num) oracle = static_cast<int>(k);
+  return oracle;
+}
+
+
+IncrementalAligner::IncrementalAligner(const std::vector<int> &ref, const bool sclite_mode)
+    : ref_(ref), sclite_mode_(sclite_mode),
+      num_words_((ref.size() + internal::kWordBits - 1) / internal::kWordBits) {
+  const size_t M = ref_.size();
+  if (!sclite_mode_) {
+    by_symbol_.resize(M);
+    for (size_t i = 0; i < M; i++) by_symbol_[i] = std::make_pair(ref_[i], static_cast<int>(i));
+    std::sort(by_symbol_.begin(), by_symbol_.end());
+    eq_.assign(num_words_, 0);
+    pv_.assign(num_words_, ~internal::Word(0));
+    mv_.assign(num_words_, 0);
+    scores_.resize(num_words_);
+    for (size_t b = 0; b < num_words_; b++)
+      scores_[b] = static_cast<int>(internal::kWordBits * (b + 1));
+  } else {
+    cols_.resize(M + 1);
+    for (size_t i = 0; i <= M; i++) cols_[i] = static_cast<int>(i) * DEL_COST_SCLITE;
+  }
+}
+
+size_t IncrementalAligner::HypSize() const {
+  std::lock_guard<std::mutex> lock(mutex_);
+  return hyp_.size();
+}
+
+void IncrementalAligner::Extend(IntSequence symbols) {
+  using internal::Word;
+  using internal::kWordBits;
+  std::lock_guard<std::mutex> lock(mutex_);
+  internal::ProfileScope profile(internal::kProfileDp);
+  const size_t M = ref_.size(), W = num_words_;
+  internal::Profiler::CountDp(
+      M * symbols.size(),
+      symbols.size() * (sclite_mode_ ? (M + 1) * sizeof(int)
+                                     : W * (2 * sizeof(Word) + sizeof(int))));
+  for (const int symbol : symbols) {
+    hyp_.push_back(symbol);
+    const size_t j = hyp_.size();
+    if (!sclite_mode_) {
+      auto first = std::lower_bound(by_symbol_.begin(), by_symbol_.end(),
+                                    std::make_pair(symbol, 0));
+      auto last = first;
+      for (; last != by_symbol_.end() && last->first == symbol; ++last)
+        eq_[last->second / kWordBits] |= Word(1) << (last->second % kWordBits);
+      pv_.resize((j + 1) * W);
+      mv_.resize((j + 1) * W);
+      scores_.resize((j + 1) * W);
+      const size_t from = (j - 1) * W, to = j * W;
+      int h = 1;  // D[0][j] - D[0][j-1]
+      for (size_t b = 0; b < W; b++) {
+        pv_[to + b] = pv_[from + b];
+        mv_[to + b] = mv_[from + b];
+        h = internal::AdvanceBlock(eq_[b], h, &pv_[to + b], &mv_[to + b]);
+        scores_[to + b] = scores_[from + b] + h;
+      }
+      for (; first != last; ++first) eq_[first->second / kWordBits] = 0;
+    } else {
+      cols_.resize((j + 1) * (M + 1));
+      const int *e = &cols_[(j - 1) * (M + 1)];
+      int *cur = &cols_[j * (M + 1)];
+      cur[0] = e[0] + INS_COST_SCLITE;
+      for (size_t i = 1; i <= M; i++) {
+        const int sub_err = e[i-1] + (symbol == ref_[i-1] ? 0 : SUB_COST_SCLITE);
+        cur[i] = std::min(sub_err, std::min(e[i] + INS_COST_SCLITE, cur[i-1] + DEL_COST_SCLITE));
+      }
+    }
+  }
+}
+
+void IncrementalAligner::Retract(size_t n) {
+  std::lock_guard<std::mutex> lock(mutex_);
+  const size_t N = hyp_.size() - std::min(n, hyp_.size());
+  hyp_.resize(N);
+  if (!sclite_mode_) {
+    pv_.resize((N + 1) * num_words_);
+    mv_.resize((N + 1) * num_words_);
+    scores_.resize((N + 1) * num_words_);
+  } else {
+    cols_.resize((N + 1) * (ref_.size() + 1));
+  }
+}
+
+int IncrementalAligner::Cost(size_t i, size_t j) const {
+  using internal::kWordBits;
+  if (sclite_mode_) return cols_[j * (ref_.size() + 1) + i];
+  if (i == 0) return static_cast<int>(j);
+  const size_t b = (i - 1) / kWordBits, W = num_words_;
+  const int base = b == 0 ? static_cast<int>(j) : scores_[j * W + b - 1];
+  return base + internal::BlockDelta(pv_[j * W + b], mv_[j * W + b], i - kWordBits * b);
+}
+
+size_t IncrementalAligner::RefPrefix(const bool partial) const {
+  const size_t M = ref_.size(), N = hyp_.size();
+  if (!partial) return M;
+  size_t best = 0;
+  int best_cost = Cost(0, N);
+  for (size_t i = 1; i <= M; i++) {
+    const int cost = Cost(i, N);
+    if (cost <= best_cost) {
+      best = i;
+      best_cost = cost;
+    }
+  }
+  return best;
+}
+
+template <typename Visit>
+void IncrementalAligner::Traceback(const size_t ref_len, Visit visit) const {
+  const int ins_cost = sclite_mode_ ? INS_COST_SCLITE : INS_COST;
+  const int del_cost = sclite_mode_ ? DEL_COST_SCLITE : DEL_COST;
+  const int sub_cost = sclite_mode_ ? SUB_COST_SCLITE : SUB_COST;
+  internal::Traceback(IntSequence(ref_.data(), ref_len), IntSequence(hyp_),
+                      ins_cost, del_cost, sub_cost,
+                      [this](size_t i, size_t j) { return Cost(i, j); }, visit);
+}
+
+error_stats IncrementalAligner::Stats(const bool partial, int *ref_len) const {
+  std::lock_guard<std::mutex> lock(mutex_);
+  error_stats stats{0, 0, 0, 0, 0};
+  *ref_len = static_cast<int>(RefPrefix(partial));
+  Traceback(*ref_len, [&](AlignmentOp op, int, int) {
+    if (op == kOpInsertion) stats.ins_num++;
+    else if (op == kOpDeletion) stats.del_num++;
+    else if (op == kOpSubstitution) stats.sub_num++;
+  });
+  stats.total_num = stats.ins_num + stats.del_num + stats.sub_num;
+  stats.total_cost = sclite_mode_
+      ? stats.ins_num * INS_COST_SCLITE + stats.del_num * DEL_COST_SCLITE +
+            stats.sub_num * SUB_COST_SCLITE
+      : stats.total_num;
+  return stats;
+}
+
+void IncrementalAligner::Alignment(const bool partial,
+                                   std::vector<int> *ref_idx,
+                                   std::vector<int> *hyp_idx,
+                                   std::vector<int> *ops) const {
+  std::lock_guard<std::mutex> lock(mutex_);
+  ref_idx->clear();
+  hyp_idx->clear();
+  ops->clear();
+  Traceback(RefPrefix(partial), [&](AlignmentOp op, int i, int j) {
+    ref_idx->push_back(i);
+    hyp_idx->push_back(j);
+    ops->push_back(op);
+  });
+  std::reverse(ref_idx->begin(), ref_idx->end());
+  std::reverse(hyp_idx->begin(), hyp_idx->end());
+  std::reverse(ops->begin(), ops->end());
+}
+
+
+namespace internal {
+
+static const int kInfCost = std::numeric_limits<int>::max() / 2;
+
+// Diagonal band [xlo, xhi] of ref_index - hyp_index that contains every
+// alignment of cost <= max_cost (see LevenshteinEditDistanceBounded).
+static void ErrorBand(long long M, long long N, long long max_cost, int indel_cost,
+                      long long *xlo, long long *xhi) {
+  const long long delta = M - N;
+  const long long slack = std::max<long long>(0, (max_cost / indel_cost - std::llabs(delta)) / 2);
+  *xlo = std::min<long long>(0, delta) - slack;
+  *xhi = std::max<long long>(0, delta) + slack;
+}
+
+// LevenshteinEditDistance restricted to the cells with
+// xlo <= ref_index - hyp_index <= xhi.  Returns -1 as soon as no cell of a
+// row can still lead to a total cost of at most max_cost.
+static int BandedEditDistance(IntSequence ref,
+                              IntSequence hyp,
+                              int ins_cost, int del_cost, int sub_cost,
+                              long long xlo, long long xhi, long long max_cost,
+                              int *ins, int *del, int *sub) {
+  const long long M = ref.size(), N = hyp.size();
+  const int indel_cost = std::min(ins_cost, del_cost);
+  const error_stats inf = {0, 0, 0, 0, kInfCost};
+  std::vector<error_stats> e(M + 1, inf), cur_e(M + 1, inf);
+  Profiler::CountDp(0, 2 * e.size() * sizeof(error_stats));
+  for (long long r = 0; r <= std::min(M, xhi); r++) {
+    e[r].del_num = r;
+    e[r].total_num = r;
+    e[r].total_cost = r * del_cost;
+  }
+  for (long long h = 1; h <= N; h++) {
+    const long long lo = std::max<long long>(0, h + xlo), hi = std::min(M, h + xhi);
+    if (lo > hi) return -1;
+    Profiler::CountDp(hi - lo + 1, 0);
+    if (lo > 0) cur_e[lo-1] = inf;
+    if (hi < M) cur_e[hi+1] = inf;
+    long long best = kInfCost;
+    for (long long r = lo; r <= hi; r++) {
+      if (r == 0) {
+        cur_e[0] = e[0];
+        cur_e[0].ins_num++;
+        cur_e[0].total_num++;
+        cur_e[0].total_cost += ins_cost;
+      } else {
+        int ins_err = e[r].total_cost + ins_cost;
+        int del_err = cur_e[r-1].total_cost + del_cost;
+        int sub_err = e[r-1].total_cost;
+        if (hyp[h-1] != ref[r-1])
+          sub_err += sub_cost;
+        if (sub_err < ins_err && sub_err < del_err) {
+          cur_e[r] = e[r-1];
+          if (hyp[h-1] != ref[r-1]) {
+            cur_e[r].sub_num++;
+            cur_e[r].total_num++;
+          }
+          cur_e[r].total_cost = sub_err;
+        } else if (del_err < ins_err) {
+          cur_e[r] = cur_e[r-1];
+          cur_e[r].total_cost = del_err;
+          cur_e[r].del_num++;
+          cur_e[r].total_num++;
+        } else {
+          cur_e[r] = e[r];
+          cur_e[r].total_cost = ins_err;
+          cur_e[r].ins_num++;
+          cur_e[r].total_num++;
+        }
+      }
+      // Every remaining length difference costs at least one ins/del.
+      const long long remaining = std::llabs((M - r) - (N - h)) * indel_cost;
+      best = std::min(best, cur_e[r].total_cost + remaining);
+    }
+    if (best > max_cost) return -1;
+    std::swap(e, cur_e);
+  }
+  if (e[M].total_cost > max_cost) return -1;
+  if (ins != nullptr) *ins = e[M].ins_num;
+  if (del != nullptr) *del = e[M].del_num;
+  if (sub != nullptr) *sub = e[M].sub_num;
+  return e[M].total_num;
+}
+
+// LevenshteinAlignment restricted to the cells with
+// xlo <= m - n <= xhi; see BandedEditDistance.
+static int BandedAlignment(IntSequence a,
+                           IntSequence b,
+                           int eps_symbol,
+                           int ins_cost, int del_cost, int sub_cost,
+                           long long xlo, long long xhi, long long max_cost,
+                           std::vector<std::pair<int, int> > *output) {
+  const long long M = a.size(), N = b.size();
+  const long long width = xhi - xlo + 1;
+  const int indel_cost = std::min(ins_cost, del_cost);
+  // Row m stores columns [m - xhi, m - xlo].
+  std::vector<int> table((M + 1) * width, kInfCost);
+  Profiler::CountDp(0, table.size() * sizeof(int));
+  auto at = [&](long long m, long long n) -> int {
+    const long long k = n - (m - xhi);
+    if (n < 0 || n > N || k < 0 || k >= width) return kInfCost;
+    return table[m * width + k];
+  };
+  for (long long m = 0; m <= M; m++) {
+    const long long lo = std::max<long long>(0, m - xhi), hi = std::min(N, m - xlo);
+    if (lo > hi) return -1;
+    Profiler::CountDp(hi - lo + 1, 0);
+    long long best = kInfCost;
+    for (long long n = lo; n <= hi; n++) {
+      int cost;
+      if (m == 0) {
+        cost = n * ins_cost;
+      } else if (n == 0) {
+        cost = at(m-1, 0) + del_cost;
+      } else {
+        int sub_or_ok = at(m-1, n-1) + (a[m-1] == b[n-1] ? 0 : sub_cost);
+        int del = at(m-1, n) + del_cost;
+        int ins = at(m, n-1) + ins_cost;
+        cost = std::min(sub_or_ok, std::min(del, ins));
+      }
+      table[m * width + (n - (m - xhi))] = cost;
+      best = std::min(best, cost + std::llabs((M - m) - (N - n)) * indel_cost);
+    }
+    if (best > max_cost) return -1;
+  }
+  if (at(M, N) > max_cost) return -1;
+
+  long long m = M, n = N;
+  while (m != 0 || n != 0) {
+    long long last_m, last_n;
+    if (m == 0) {
+      last_m = m;
+      last_n = n-1;
+    } else if (n == 0) {
+      last_m = m-1;
+      last_n = n;
+    } else {
+      int sub_or_ok = at(m-1, n-1) + (a[m-1] == b[n-1] ? 0 : sub_cost);
+      int del = at(m-1, n) + del_cost;
+      int ins = at(m, n-1) + ins_cost;
+      if (sub_or_ok < std::min(del, ins)) {
+        last_m = m-1;
+        last_n = n-1;
+      } else if (del < ins) {
+        last_m = m-1;
+        last_n = n;
+      } else {
+        last_m = m;
+        last_n = n-1;
+      }
+    }
+    int a_sym = (last_m == m ? eps_symbol : a[last_m]);
+    int b_sym = (last_n == n ? eps_symbol : b[last_n]);
+    output->push_back(std::make_pair(a_sym, b_sym));
+    m = last_m;
+    n = last_n;
+  }
+  ReverseVector(output);
+  return at(M, N);
+}
+
+}  // namespace internal
+
+int LevenshteinEditDistanceBounded(IntSequence ref,
+                                   IntSequence hyp,
+                                   const bool sclite_mode,
+                                   const int max_errors,
+                                   int *ins, int *del, int *sub) {
+  if (max_errors < 0)
+    return LevenshteinEditDistance(ref, hyp, sclite_mode, ins, del, sub);
+  internal::ProfileScope profile(internal::kProfileDp);
+  const long long M = ref.size(), N = hyp.size();
+  // Every alignment needs at least |M - N| insertions or deletions.
+  if (std::llabs(M - N) > max_errors) return -1;
+
+  const int ins_cost = sclite_mode ? INS_COST_SCLITE : INS_COST;
+  const int del_cost = sclite_mode ? DEL_COST_SCLITE : DEL_COST;
+  const int sub_cost = sclite_mode ? SUB_COST_SCLITE : SUB_COST;
+  // An alignment with at most max_errors errors costs at most this much.
+  const long long max_cost =
+      static_cast<long long>(max_errors) * std::max(sub_cost, std::max(ins_cost, del_cost));
+  long long xlo, xhi;
+  internal::ErrorBand(M, N, max_cost, std::min(ins_cost, del_cost), &xlo, &xhi);
+
+  int total;
+  if (!sclite_mode && (xhi - xlo + 1) * 32 >= M) {
+    // Wide band: the bit-parallel engine over the full table is faster.
+    total = LevenshteinEditDistanceBitParallel(ref, hyp, ins, del, sub);
+  } else {
+    total = internal::BandedEditDistance(ref, hyp, ins_cost, del_cost, sub_cost,
+                                         xlo, xhi, max_cost, ins, del, sub);
+  }
+  return total > max_errors ? -1 : total;
+}
+
+int LevenshteinAlignmentBounded(IntSequence a,
+                                IntSequence b,
+                                int eps_symbol,
+                                const bool sclite_mode,
+                                const int max_errors,
+                                std::vector<std::pair<int, int> > *output) {
+  assert(output != NULL);
+  output->clear();
+  if (max_errors < 0) {
+    if (UseLinearMemoryAlignment(a.size(), b.size()))
+      return LevenshteinAlignmentLinearMemory(a, b, eps_symbol, sclite_mode, output);
+    return LevenshteinAlignment(a, b, eps_symbol, sclite_mode, output);
+  }
+  internal::ProfileScope profile(internal::kProfileDp);
+  const long long M = a.size(), N = b.size();
+  if (std::llabs(M - N) > max_errors) return -1;
+
+  const int ins_cost = sclite_mode ? INS_COST_SCLITE : INS_COST;
+  const int del_cost = sclite_mode ? DEL_COST_SCLITE : DEL_COST;
+  const int sub_cost = sclite_mode ? SUB_COST_SCLITE : SUB_COST;
+  const long long max_cost =
+      static_cast<long long>(max_errors) * std::max(sub_cost, std::max(ins_cost, del_cost));
+  long long xlo, xhi;
+  internal::ErrorBand(M, N, max_cost, std::min(ins_cost, del_cost), &xlo, &xhi);
+
+  int cost;
+  if (UseLinearMemoryAlignment(a.size(), static_cast<size_t>(xhi - xlo))) {
+    cost = LevenshteinAlignmentLinearMemory(a, b, eps_symbol, sclite_mode, output);
+  } else {
+    cost = internal::BandedAlignment(a, b, eps_symbol, ins_cost, del_cost, sub_cost,
+                                     xlo, xhi, max_cost, output);
+  }
+  int errors = 0;
+  for (const auto &p : *output)
+    if (p.first != p.second) errors++;
+  if (cost < 0 || errors > max_errors) {
+    output->clear();
+    return -1;
+  }
+  return cost;
+}
+
+namespace internal {
+
+// A symbol occurring in neither a nor b, used as the epsilon when the caller
+// has not reserved one.
+static int UnusedSymbol(IntSequence a, IntSequence b) {
+  int lo = INT_MAX, hi = INT_MIN;
+  for (int s : a) { lo = std::min(lo, s); hi = std::max(hi, s); }
+  for (int s : b) { lo = std::min(lo, s); hi = std::max(hi, s); }
+  if (lo > INT_MIN) return lo - 1;
+  if (hi < INT_MAX) return hi + 1;
+  // Both extremes are in use: the sequences have far fewer than 2^32
+  // distinct symbols, so there is a gap between two consecutive ones.
+  std::vector<int> symbols(a.begin(), a.end());
+  symbols.insert(symbols.end(), b.begin(), b.end());
+  std::sort(symbols.begin(), symbols.end());
+  for (size_t i = 1; i < symbols.size(); i++)
+    if (symbols[i] - 1 > symbols[i - 1]) return symbols[i] - 1;
+  return 0;  // Unreachable.
+}
+
+}  // namespace internal
+
+int LevenshteinAlignmentColumns(IntSequence a,
+                                IntSequence b,
+                                const bool sclite_mode,
+                                const int max_errors,
+                                const bool linear_memory,
+                                AlignmentColumns *output) {
+  const int eps = internal::UnusedSymbol(a, b);
+  std::vector<std::pair<int, int> > alignment;
+  int cost;
+  if (max_errors >= 0)
+    cost = LevenshteinAlignmentBounded(a, b, eps, sclite_mode, max_errors, &alignment);
+  else if (linear_memory)
+    cost = LevenshteinAlignmentLinearMemory(a, b, eps, sclite_mode, &alignment);
+  else
+    cost = LevenshteinAlignment(a, b, eps, sclite_mode, &alignment);
+
+  output->Clear();
+  if (cost < 0) return cost;
+  int i = 0, j = 0;
+  for (const auto &p : alignment) {
+    if (p.first == eps) {
+      output->Append(kOpInsertion, i, i, j, j + 1);
+      j++;
+    } else if (p.second == eps) {
+      output->Append(kOpDeletion, i, i + 1, j, j);
+      i++;
+    } else {
+      output->Append(p.first == p.second ? kOpCorrect : kOpSubstitution, i, i + 1, j, j + 1);
+      i++;
+      j++;
+    }
+  }
+  return cost;
+}
+
+int LevenshteinAlignmentIndices(IntSequence a,
+                                IntSequence b,
+                                const bool sclite_mode,
+                                const int max_errors,
+                                std::vector<int> *ref_idx,
+                                std::vector<int> *hyp_idx,
+                                std::vector<int> *ops) {
+  AlignmentColumns columns;
+  const int cost = LevenshteinAlignmentColumns(
+      a, b, sclite_mode, max_errors, UseLinearMemoryAlignment(a.size(), b.size()), &columns);
+  ref_idx->clear();
+  hyp_idx->clear();
+  ref_idx->reserve(columns.Size());
+  hyp_idx->reserve(columns.Size());
+  for (size_t k = 0; k < columns.Size(); k++) {
+    ref_idx->push_back(columns.ops[k] == kOpInsertion ? -1 : columns.ref_begin[k]);
+    hyp_idx->push_back(columns.ops[k] == kOpDeletion ? -1 : columns.hyp_begin[k]);
+  }
+  ops->swap(columns.ops);
+  return cost;
+}
+
+
+namespace internal {
+
+// A run of matching symbols a[i, i + len) == b[j, j + len).
+struct AnchorRun {
+  size_t i;
+  size_t j;
+  size_t len;
+};
+
+static uint64_t NgramHash(const int *symbols, size_t n) {
+  uint64_t h = 0;
+  for (size_t k = 0; k < n; k++)
+    h = (h ^ static_cast<uint32_t>(symbols[k])) * 0x9E3779B97F4A7C15ULL;
+  return h ^ (h >> 29);
+}
+
+// Appends to *runs, in order, the anchors of a[a_begin, a_end) and
+// b[b_begin, b_end) (see LevenshteinAlignmentAnchored), recursing into the
+// gaps that are still too large.
+static void FindAnchors(IntSequence a, IntSequence b, size_t a_begin, size_t a_end,
+                        size_t b_begin, size_t b_end, size_t n, long long max_exact_cells,
+                        std::vector<AnchorRun> *runs) {
+  const size_t M = a_end - a_begin, N = b_end - b_begin;
+  if (M < n || N < n ||
+      static_cast<double>(M + 1) * (N + 1) <= static_cast<double>(max_exact_cells))
+    return;
+
+  // Positions of the n-grams occurring once in a (by hash; a collision just
+  // loses an anchor), then of those also occurring once in b.
+  std::unordered_map<uint64_t, std::pair<size_t, size_t> > in_a;  // hash -> (count, pos)
+  in_a.reserve(M);
+  for (size_t i = a_begin; i + n <= a_end; i++) {
+    auto &e = in_a.emplace(NgramHash(a.data() + i, n), std::make_pair(0, i)).first->second;
+    e.first++;
+  }
+  std::unordered_map<uint64_t, std::pair<size_t, size_t> > in_b;
+  in_b.reserve(N);
+  for (size_t j = b_begin; j + n <= b_end; j++) {
+    const uint64_t h = NgramHash(b.data() + j, n);
+    auto it = in_a.find(h);
+    if (it == in_a.end() || it->second.first != 1) continue;
+    auto &e = in_b.emplace(h, std::make_pair(0, j)).first->second;
+    e.first++;
+  }
+  std::vector<std::pair<size_t, size_t> > matches;  // (i, j)
+  for (const auto &kv : in_b) {
+    if (kv.second.first != 1) continue;
+    const size_t i = in_a[kv.first].second, j = kv.second.second;
+    if (std::equal(a.data() + i, a.data() + i + n, b.data() + j))
+      matches.emplace_back(i, j);
+  }
+  std::sort(matches.begin(), matches.end());
+
+  // Longest chain with increasing j (patience sorting).
+  std::vector<size_t> tails, prev(matches.size());
+  for (size_t k = 0; k < matches.size(); k++) {
+    auto it = std::lower_bound(tails.begin(), tails.end(), matches[k].second,
+                               [&](size_t t, size_t j) { return matches[t].second < j; });
+    prev[k] = it == tails.begin() ? SIZE_MAX : *(it - 1);
+    if (it == tails.end()) tails.push_back(k);
+    else *it = k;
+  }
+  std::vector<size_t> chain;
+  for (size_t k = tails.empty() ? SIZE_MAX : tails.back(); k != SIZE_MAX; k = prev[k])
+    chain.push_back(k);
+  std::reverse(chain.begin(), chain.end());
+
+  // Merge overlapping n-grams on the same diagonal into runs and drop the
+  // ones overlapping a run on another diagonal.
+  std::vector<AnchorRun> level;
+  for (const size_t k : chain) {
+    const size_t i = matches[k].first, j = matches[k].second;
+    if (!level.empty()) {
+      AnchorRun &last = level.back();
+      if (i - last.i == j - last.j && i <= last.i + last.len) {
+        last.len = i + n - last.i;
+        continue;
+      }
+      if (i < last.i + last.len || j < last.j + last.len) continue;
+    }
+    level.push_back({i, j, n});
+  }
+
+  size_t i = a_begin, j = b_begin;
+  for (const auto &run : level) {
+    FindAnchors(a, b, i, run.i, j, run.j, n, max_exact_cells, runs);
+    runs->push_back(run);
+    i = run.i + run.len;
+    j = run.j + run.len;
+  }
+  if (!level.empty()) FindAnchors(a, b, i, a_end, j, b_end, n, max_exact_cells, runs);
+}
+
+// Number of q-grams (by hash) of a and of b without a counterpart in the
+// other sequence.  Hash collisions can only lower the counts.
+static std::pair<size_t, size_t> UnmatchedQgrams(IntSequence a, IntSequence b, size_t q) {
+  std::vector<uint64_t> qa, qb;
+  for (size_t i = 0; i + q <= a.size(); i++) qa.push_back(NgramHash(a.data() + i, q));
+  for (size_t j = 0; j + q <= b.size(); j++) qb.push_back(NgramHash(b.data() + j, q));
+  std::sort(qa.begin(), qa.end());
+  std::sort(qb.begin(), qb.end());
+  size_t common = 0;
+  for (size_t p = 0, r = 0; p < qa.size() && r < qb.size();) {
+    if (qa[p] < qb[r]) p++;
+    else if (qb[r] < qa[p]) r++;
+    else { common++; p++; r++; }
+  }
+  return std::make_pair(qa.size() - common, qb.size() - common);
+}
+
+// Lower bound on the cost of any alignment of a and b.  With single
+// symbols, the x symbols of a and y symbols of b left over by the best
+// matching need min(x, y) substitutions and |x - y| insertions / deletions;
+// more generally, every edit changes at most q of the q-grams of a sequence
+// (the q-gram lemma).
+static int AlignmentLowerBound(IntSequence a, IntSequence b, int indel_cost, int sub_cost) {
+  const auto unigrams = UnmatchedQgrams(a, b, 1);
+  const size_t lo = std::min(unigrams.first, unigrams.second);
+  const size_t hi = std::max(unigrams.first, unigrams.second);
+  long long bound = static_cast<long long>(lo) * std::min(sub_cost, 2 * indel_cost) +
+                    static_cast<long long>(hi - lo) * indel_cost;
+  for (size_t q = 2; q <= 4; q++) {
+    const auto qgrams = UnmatchedQgrams(a, b, q);
+    const size_t edits = (std::max(qgrams.first, qgrams.second) + q - 1) / q;
+    bound = std::max(bound, static_cast<long long>(edits) * std::min(sub_cost, indel_cost));
+  }
+  return static_cast<int>(std::min<long long>(bound, INT_MAX));
+}
+
+}  // namespace internal
+
+int LevenshteinAlignmentAnchored(IntSequence a,
+                                 IntSequence b,
+                                 const bool sclite_mode,
+                                 const int ngram,
+                                 const long long max_exact_cells,
+                                 const int num_threads,
+                                 std::vector<int> *ref_idx,
+                                 std::vector<int> *hyp_idx,
+                                 std::vector<int> *ops,
+                                 AnchoredAlignmentInfo *info) {
+  const size_t M = a.size(), N = b.size();
+  std::vector<internal::AnchorRun> runs;
+  internal::FindAnchors(a, b, 0, M, 0, N, std::max(ngram, 1), max_exact_cells, &runs);
+
+  // Segment s lies between runs[s - 1] and runs[s], the last one after all runs.
+  struct Segment {
+    size_t i, j, m, n;
+    int cost;
+    std::vector<int> ref_idx, hyp_idx, ops;
+  };
+  std::vector<Segment> segments(runs.size() + 1);
+  size_t i = 0, j = 0;
+  for (size_t s = 0; s <= runs.size(); s++) {
+    const size_t i_end = s < runs.size() ? runs[s].i : M;
+    const size_t j_end = s < runs.size() ? runs[s].j : N;
+    segments[s].i = i;
+    segments[s].j = j;
+    segments[s].m = i_end - i;
+    segments[s].n = j_end - j;
+    if (s < runs.size()) {
+      i = i_end + runs[s].len;
+      j = j_end + runs[s].len;
+    }
+  }
+  internal::ParallelFor(segments.size(), num_threads, [&](size_t s) {
+    Segment &seg = segments[s];
+    seg.cost = LevenshteinAlignmentIndices(IntSequence(a.data() + seg.i, seg.m),
+                                           IntSequence(b.data() + seg.j, seg.n),
+                                           sclite_mode, -1, &seg.ref_idx, &seg.hyp_idx,
+                                           &seg.ops);
+  });
+
+  ref_idx->clear();
+  hyp_idx->clear();
+  ops->clear();
+  int cost = 0;
+  for (size_t s = 0; s < segments.size(); s++) {
+    const Segment &seg = segments[s];
+    cost += seg.cost;
+    for (size_t k = 0; k < seg.ops.size(); k++) {
+      ref_idx->push_back(seg.ref_idx[k] < 0 ? -1 : static_cast<int>(seg.i) + seg.ref_idx[k]);
+      hyp_idx->push_back(seg.hyp_idx[k] < 0 ? -1 : static_cast<int>(seg.j) + seg.hyp_idx[k]);
+      ops->push_back(seg.ops[k]);
+    }
+    if (s < runs.size()) {
+      for (size_t k = 0; k < runs[s].len; k++) {
+        ref_idx->push_back(static_cast<int>(runs[s].i + k));
+        hyp_idx->push_back(static_cast<int>(runs[s].j + k));
+        ops->push_back(kOpCorrect);
+      }
+    }
+  }
+
+  info->num_anchors = static_cast<int>(runs.size());
+  if (runs.empty()) {
+    info->lower_bound = cost;
+  } else {
+    info->lower_bound = sclite_mode
+        ? internal::AlignmentLowerBound(a, b, INS_COST_SCLITE, SUB_COST_SCLITE)
+        : internal::AlignmentLowerBound(a, b, INS_COST, SUB_COST);
+  }
+  return cost;
+}
+
+
+int LevenshteinAlignmentTimed(IntSequence a,
+                              IntSequence b,
+                              const std::vector<std::pair<double, double> > &a_times,
+                              const std::vector<std::pair<double, double> > &b_times,
+                              const double collar,
+                              const bool sclite_mode,
+                              std::vector<int> *ref_idx,
+                              std::vector<int> *hyp_idx,
+                              std::vector<int> *ops) {
+  internal::ProfileScope profile(internal::kProfileDp);
+  const size_t M = a.size(), N = b.size();
+  if (a_times.size() != M || b_times.size() != N)
+    throw std::invalid_argument("Expected one (start, end) time per word.");
+  for (const auto *times : {&a_times, &b_times})
+    for (size_t k = 1; k < times->size(); k++)
+      if ((*times)[k].first < (*times)[k - 1].first)
+        throw std::invalid_argument("Word times must be sorted by start time.");
+
+  const int ins_cost = sclite_mode ? INS_COST_SCLITE : INS_COST;
+  const int del_cost = sclite_mode ? DEL_COST_SCLITE : DEL_COST;
+  const int sub_cost = sclite_mode ? SUB_COST_SCLITE : SUB_COST;
+  auto allowed = [&](size_t i, size_t j) {
+    return b_times[j].first <= a_times[i].second + collar &&
+           b_times[j].second >= a_times[i].first - collar;
+  };
+
+  // The words of b that a[i] may be matched with lie in [lo, hi): hi by
+  // start time, lo by the running maximum of the end times.
+  std::vector<double> b_starts(N), b_max_ends(N);
+  for (size_t j = 0; j < N; j++) {
+    b_starts[j] = b_times[j].first;
+    b_max_ends[j] = j == 0 ? b_times[j].second : std::max(b_max_ends[j - 1], b_times[j].second);
+  }
+  // Columns [first[i], last[i]] of DP row i are computed: those of the
+  // matches into and out of the row, widened into a staircase so that any
+  // insertion / deletion path between two computed cells can be rerouted
+  // through computed cells at the same cost.
+  const long long kNone = -1;
+  std::vector<long long> first(M + 1, static_cast<long long>(N) + 1), last(M + 1, kNone);
+  first[0] = last[0] = 0;
+  first[M] = std::min<long long>(first[M], N);
+  last[M] = N;
+  for (size_t i = 0; i < M; i++) {
+    const long long lo = std::lower_bound(b_max_ends.begin(), b_max_ends.end(),
+                                          a_times[i].first - collar) - b_max_ends.begin();
+    const long long hi = std::upper_bound(b_starts.begin(), b_starts.end(),
+                                          a_times[i].second + collar) - b_starts.begin();
+    if (lo >= hi) continue;
+    first[i] = std::min(first[i], lo);
+    last[i] = std::max(last[i], hi - 1);
+    first[i + 1] = std::min(first[i + 1], lo + 1);
+    last[i + 1] = std::max(last[i + 1], hi);
+  }
+  for (size_t i = M; i-- > 0;) first[i] = std::min(first[i], first[i + 1]);
+  for (size_t i = 1; i <= M; i++) last[i] = std::max(last[i], last[i - 1]);
+  for (size_t i = 0; i < M; i++) last[i] = std::max(last[i], first[i + 1]);
+
+  std::vector<size_t> offset(M + 2, 0);
+  for (size_t i = 0; i <= M; i++) offset[i + 1] = offset[i] + (last[i] - first[i] + 1);
+  std::vector<int> e(offset[M + 1]);
+  internal::Profiler::CountDp(e.size(), e.size() * sizeof(int));
+  auto cost = [&](size_t i, long long j) {
+    if (j < first[i] || j > last[i]) return internal::kInfCost;
+    return e[offset[i] + (j - first[i])];
+  };
+  for (size_t i = 0; i <= M; i++) {
+    for (long long j = first[i]; j <= last[i]; j++) {
+      int best = i == 0 && j == 0 ? 0 : internal::kInfCost;
+      if (i > 0) best = std::min(best, cost(i - 1, j) + del_cost);
+      if (j > first[i]) best = std::min(best, e[offset[i] + (j - 1 - first[i])] + ins_cost);
+      if (i > 0 && j > 0 && allowed(i - 1, j - 1))
+        best = std::min(best, cost(i - 1, j - 1) + (a[i-1] == b[j-1] ? 0 : sub_cost));
+      e[offset[i] + (j - first[i])] = best;
+    }
+  }
+
+  // Trace back with the tie-breaking of LevenshteinAlignment.
+  ref_idx->clear();
+  hyp_idx->clear();
+  ops->clear();
+  size_t i = M, j = N;
+  while (i != 0 || j != 0) {
+    const int sub_err = i > 0 && j > 0 && allowed(i - 1, j - 1)
+        ? cost(i - 1, j - 1) + (a[i-1] == b[j-1] ? 0 : sub_cost)
+        : internal::kInfCost;
+    const int del_err = i > 0 ? cost(i - 1, j) + del_cost : internal::kInfCost;
+    const int ins_err = j > 0 ? cost(i, j - 1) + ins_cost : internal::kInfCost;
+    if (sub_err < ins_err && sub_err < del_err) {
+      i--;
+      j--;
+      ref_idx->push_back(static_cast<int>(i));
+      hyp_idx->push_back(static_cast<int>(j));
+      ops->push_back(a[i] == b[j] ? kOpCorrect : kOpSubstitution);
+    } else if (del_err < ins_err) {
+      i--;
+      ref_idx->push_back(static_cast<int>(i));
+      hyp_idx->push_back(-1);
+      ops->push_back(kOpDeletion);
+    } else {
+      j--;
+      ref_idx->push_back(-1);
+      hyp_idx->push_back(static_cast<int>(j));
+      ops->push_back(kOpInsertion);
+    }
+  }
+  ReverseVector(ref_idx);
+  ReverseVector(hyp_idx);
+  ReverseVector(ops);
+  return cost(M, N);
+}
+
+
+int LevenshteinAlignmentLattice(IntSequence ref,
+                                const std::vector<LatticeArc> &arcs,
+                                const int start,
+                                const std::vector<int> &finals,
+                                const int eps_label,
+                                const bool sclite_mode,
+                                std::vector<int> *ref_idx,
+                                std::vector<int> *arc_idx,
+                                std::vector<int> *ops,
+                                std::vector<int> *path) {
+  internal::ProfileScope profile(internal::kProfileDp);
+  ref_idx->clear();
+  arc_idx->clear();
+  ops->clear();
+  path->clear();
+
+  int num_states = start + 1;
+  for (const auto &arc : arcs) {
+    if (arc.src < 0 || arc.dst < 0)
+      throw std::invalid_argument("Lattice states must be non-negative.");
+    num_states = std::max(num_states, std::max(arc.src, arc.dst) + 1);
+  }
+  for (const int f : finals) {
+    if (f < 0) throw std::invalid_argument("Lattice states must be non-negative.");
+    num_states = std::max(num_states, f + 1);
+  }
+  if (start < 0) throw std::invalid_argument("Lattice states must be non-negative.");
+  const size_t S = num_states;
+
+  // Incoming arcs of every state (in CSR form) and a topological order.
+  std::vector<size_t> in_offsets(S + 1, 0);
+  std::vector<int> out_degree(S, 0);
+  for (const auto &arc : arcs) {
+    in_offsets[arc.dst + 1]++;
+    out_degree[arc.src]++;
+  }
+  for (size_t t = 0; t < S; t++) in_offsets[t + 1] += in_offsets[t];
+  std::vector<int> in_arcs(arcs.size());
+  {
+    std::vector<size_t> fill(in_offsets.begin(), in_offsets.end() - 1);
+    for (size_t a = 0; a < arcs.size(); a++) in_arcs[fill[arcs[a].dst]++] = static_cast<int>(a);
+  }
+  std::vector<std::vector<int>> out_arcs(S);
+  std::vector<int> in_degree(S, 0);
+  for (size_t a = 0; a < arcs.size(); a++) {
+    out_arcs[arcs[a].src].push_back(static_cast<int>(a));
+    in_degree[arcs[a].dst]++;
+  }
+  std::vector<int> order;
+  order.reserve(S);
+  for (size_t t = 0; t < S; t++)
+    if (in_degree[t] == 0) order.push_back(static_cast<int>(t));
+  for (size_t k = 0; k < order.size(); k++) {
+    for (const int a : out_arcs[order[k]])
+      if (--in_degree[arcs[a].dst] == 0) order.push_back(arcs[a].dst);
+  }
+  if (order.size() != S) throw std::invalid_argument("The lattice has a cycle.");
+
+  const int ins_cost = sclite_mode ? INS_COST_SCLITE : INS_COST;
+  const int del_cost = sclite_mode ? DEL_COST_SCLITE : DEL_COST;
+  const int sub_cost = sclite_mode ? SUB_COST_SCLITE : SUB_COST;
+  const int inf = internal::kInfCost;
+
+  // cost[t * R + i]: the cheapest alignment of ref[0, i) with a path from
+  // start to t, reached by op[t * R + i] over arc from[t * R + i].
+  enum : unsigned char { kNone, kStart, kSub, kIns, kDel, kEps };
+  const size_t M = ref.size(), R = M + 1;
+  std::vector<int> cost(S * R, inf), from(S * R, -1);
+  std::vector<unsigned char> op(S * R, kNone);
+  internal::Profiler::CountDp(arcs.size() * R, S * R * (2 * sizeof(int) + 1));
+  for (const int t : order) {
+    for (size_t i = 0; i <= M; i++) {
+      const size_t cell = t * R + i;
+      if (t == start && i == 0) {
+        cost[cell] = 0;
+        op[cell] = kStart;
+        continue;
+      }
+      int sub_err = inf, ins_err = inf, eps_err = inf;
+      int sub_arc = -1, ins_arc = -1, eps_arc = -1;
+      for (size_t k = in_offsets[t]; k < in_offsets[t + 1]; k++) {
+        const int a = in_arcs[k];
+        const LatticeArc &arc = arcs[a];
+        const int here = cost[arc.src * R + i];
+        if (arc.label == eps_label) {
+          if (here < eps_err) eps_err = here, eps_arc = a;
+          continue;
+        }
+        if (here + ins_cost < ins_err) ins_err = here + ins_cost, ins_arc = a;
+        if (i > 0) {
+          const int diag = cost[arc.src * R + i - 1] +
+                           (arc.label == ref[i-1] ? 0 : sub_cost);
+          if (diag < sub_err) sub_err = diag, sub_arc = a;
+        }
+      }
+      const int del_err = i > 0 ? cost[cell - 1] + del_cost : inf;
+
+      // Same preference as LevenshteinAlignment; an epsilon arc is only
+      // taken when it is strictly cheaper.
+      int best = ins_err, best_op = kIns, best_arc = ins_arc;
+      if (sub_err < ins_err && sub_err < del_err)
+        best = sub_err, best_op = kSub, best_arc = sub_arc;
+      else if (del_err < ins_err)
+        best = del_err, best_op = kDel, best_arc = -1;
+      if (eps_err < best) best = eps_err, best_op = kEps, best_arc = eps_arc;
+      if (best >= inf) continue;
+      cost[cell] = best;
+      op[cell] = best_op;
+      from[cell] = best_arc;
+    }
+  }
+
+  int best_final = -1;
+  auto consider = [&](const int f) {
+    if (cost[f * R + M] < inf && (best_final < 0 || cost[f * R + M] < cost[best_final * R + M]))
+      best_final = f;
+  };
+  if (finals.empty()) {
+    for (size_t t = 0; t < S; t++)
+      if (out_degree[t] == 0) consider(static_cast<int>(t));
+  } else {
+    for (const int f : finals) consider(f);
+  }
+  if (best_final < 0) return -1;
+
+  size_t t = best_final, i = M;
+  while (op[t * R + i] != kStart) {
+    const size_t cell = t * R + i;
+    const int a = from[cell];
+    switch (op[cell]) {
+      case kSub:
+        ref_idx->push_back(static_cast<int>(i) - 1);
+        arc_idx->push_back(a);
+        ops->push_back(arcs[a].label == ref[i-1] ? kOpCorrect : kOpSubstitution);
+        path->push_back(a);
+        t = arcs[a].src;
+        i--;
+        break;
+      case kIns:
+        ref_idx->push_back(-1);
+        arc_idx->push_back(a);
+        ops->push_back(kOpInsertion);
+        path->push_back(a);
+        t = arcs[a].src;
+        break;
+      case kDel:
+        ref_idx->push_back(static_cast<int>(i) - 1);
+        arc_idx->push_back(-1);
+        ops->push_back(kOpDeletion);
+        i--;
+        break;
+      case kEps:
+        path->push_back(a);
+        t = arcs[a].src;
+        break;
+    }
+  }
+  ReverseVector(ref_idx);
+  ReverseVector(arc_idx);
+  ReverseVector(ops);
+  ReverseVector(path);
+  return cost[best_final * R + M];
+}
+
+
+void CostTable::SetInsCost(int symbol, int cost) {
+  assert(symbol >= 0 && cost >= 0);
+  if (static_cast<size_t>(symbol) >= ins_.size()) ins_.resize(symbol + 1, -1);
+  ins_[symbol] = cost;
+}
+
+void CostTable::SetDelCost(int symbol, int cost) {
+  assert(symbol >= 0 && cost >= 0);
+  if (static_cast<size_t>(symbol) >= del_.size()) del_.resize(symbol + 1, -1);
+  del_[symbol] = cost;
+}
+
+void CostTable::SetSubCost(int ref, int hyp, int cost) {
+  assert(cost >= 0);
+  auto &row = overrides_[ref];
+  auto it = std::lower_bound(row.begin(), row.end(), std::make_pair(hyp, INT_MIN));
+  if (it != row.end() && it->first == hyp) it->second = cost;
+  else row.insert(it, std::make_pair(hyp, cost));
+}
+
+void CostTable::SetSubMatrix(const int *costs, size_t num_symbols) {
+  matrix_size_ = num_symbols;
+  matrix_.assign(costs, costs + num_symbols * num_symbols);
+}
+
+const std::vector<std::pair<int, int>> *CostTable::SubOverrides(int ref) const {
+  auto it = overrides_.find(ref);
+  return it == overrides_.end() ? nullptr : &it->second;
+}
+
+int CostTable::SubCost(int ref, int hyp) const {
+  if (ref == hyp) return 0;
+  if (const auto *row = SubOverrides(ref)) {
+    auto it = std::lower_bound(row->begin(), row->end(), std::make_pair(hyp, INT_MIN));
+    if (it != row->end() && it->first == hyp) return it->second;
+  }
+  if (ref >= 0 && hyp >= 0 && static_cast<size_t>(ref) < matrix_size_ &&
+      static_cast<size_t>(hyp) < matrix_size_)
+    return MatrixRow(ref)[hyp];
+  return sub_cost_;
+}
+
+namespace internal {
+
+// The costs of a CostTable looked up once for a pair of sequences: the
+// insertion / deletion cost of every position and, unless that would take
+// too much memory, a row of substitution costs against the whole hyp for
+// every distinct ref symbol, so that the DP reads them sequentially.
+class PairCosts {
+ public:
+  static const size_t kMaxCachedCosts = 1 << 22;
+
+  PairCosts(const CostTable &table, IntSequence ref, IntSequence hyp)
+      : table_(table), ref_(ref), hyp_(hyp), ins_(hyp.size()), del_(ref.size()),
+        hyp_by_symbol_(hyp.size()) {
+    for (size_t j = 0; j < hyp.size(); j++) {
+      ins_[j] = table.InsCost(hyp[j]);
+      hyp_by_symbol_[j] = std::make_pair(hyp[j], j);
+    }
+    for (size_t i = 0; i < ref.size(); i++) del_[i] = table.DelCost(ref[i]);
+    std::sort(hyp_by_symbol_.begin(), hyp_by_symbol_.end());
+
+    std::unordered_map<int, size_t> row_of_symbol;
+    row_index_.resize(ref.size());
+    for (size_t i = 0; i < ref.size(); i++)
+      row_index_[i] = row_of_symbol.emplace(ref[i], row_of_symbol.size()).first->second;
+    cached_ = row_of_symbol.size() * hyp.size() <= kMaxCachedCosts;
+    if (cached_) {
+      rows_.resize(row_of_symbol.size() * hyp.size());
+      for (const auto &p : row_of_symbol) FillRow(p.first, rows_.data() + p.second * hyp.size());
+    } else {
+      scratch_.resize(hyp.size());
+    }
+    Profiler::CountDp(0, (ins_.size() + del_.size() + rows_.size() + scratch_.size()) * sizeof(int));
+  }
+
+  int Ins(size_t j) const { return ins_[j]; }  // inserting hyp[j]
+  int Del(size_t i) const { return del_[i]; }  // deleting ref[i]
+
+  // Cost of substituting hyp[j] for ref[i].
+  int Sub(size_t i, size_t j) const {
+    if (cached_) return rows_[row_index_[i] * hyp_.size() + j];
+    return table_.SubCost(ref_[i], hyp_[j]);
+  }
+
+  // The costs of substituting every hyp[j] for ref[i], valid until the next call.
+  const int *SubRow(size_t i) {
+    if (cached_) return rows_.data() + row_index_[i] * hyp_.size();
+    FillRow(ref_[i], scratch_.data());
+    return scratch_.data();
+  }
+
+ private:
+  void FillRow(int symbol, int *row) const {
+    const size_t N = hyp_.size();
+    if (symbol >= 0 && static_cast<size_t>(symbol) < table_.MatrixSize()) {
+      const int *costs = table_.MatrixRow(symbol);
+      const size_t V = table_.MatrixSize();
+      for (size_t j = 0; j < N; j++)
+        row[j] = hyp_[j] >= 0 && static_cast<size_t>(hyp_[j]) < V ? costs[hyp_[j]]
+                                                                  : table_.DefaultSubCost();
+    } else {
+      std::fill(row, row + N, table_.DefaultSubCost());
+    }
+    auto set = [&](int hyp_symbol, int cost) {
+      auto it = std::lower_bound(hyp_by_symbol_.begin(), hyp_by_symbol_.end(),
+                                 std::make_pair(hyp_symbol, size_t(0)));
+      for (; it != hyp_by_symbol_.end() && it->first == hyp_symbol; ++it) row[it->second] = cost;
+    };
+    if (const auto *overrides = table_.SubOverrides(symbol))
+      for (const auto &o : *overrides) set(o.first, o.second);
+    set(symbol, 0);
+  }
+
+  const CostTable &table_;
+  const IntSequence ref_, hyp_;
+  std::vector<int> ins_, del_;
+  std::vector<std::pair<int, size_t>> hyp_by_symbol_;
+  std::vector<size_t> row_index_;
+  bool cached_;
+  std::vector<int> rows_, scratch_;
+};
+
+// Cost model of LevenshteinAlignmentWeighted for the linear-memory aligner.
+struct WeightedAlignmentModel {
+  const PairCosts &costs;
+
+  size_t MaxRefSpan() const { return 1; }
+  size_t MaxHypSpan() const { return 1; }
+
+  template <typename Get>
+  int Step(size_t m, size_t n, const Get &get, size_t *pm, size_t *pn) const {
+    if (m == 0) {
+      *pm = 0;
+      *pn = n - 1;
+      return n == 1 ? costs.Ins(0) : get(0, n - 1) + costs.Ins(n - 1);
+    }
+    if (n == 0) {
+      *pm = m - 1;
+      *pn = 0;
+      return m == 1 ? costs.Del(0) : get(m - 1, 0) + costs.Del(m - 1);
+    }
+    int sub_or_ok = get(m-1, n-1) + costs.Sub(m - 1, n - 1);
+    int del = get(m-1, n) + costs.Del(m - 1);
+    int ins = get(m, n-1) + costs.Ins(n - 1);
+    if (sub_or_ok < std::min(del, ins)) {
+      *pm = m - 1;
+      *pn = n - 1;
+      return sub_or_ok;
+    }
+    if (del < ins) {
+      *pm = m - 1;
+      *pn = n;
+      return del;
+    }
+    *pm = m;
+    *pn = n - 1;
+    return ins;
+  }
+};
+
+}  // namespace internal
+
+int LevenshteinEditDistanceWeighted(IntSequence ref,
+                                    IntSequence hyp,
+                                    const CostTable &costs,
+                                    error_stats *stats) {
+  internal::ProfileScope profile(internal::kProfileDp);
+  const size_t M = ref.size(), N = hyp.size();
+  internal::PairCosts pair(costs, ref, hyp);
+  // Rows over the hyp positions, one ref symbol at a time.
+  std::vector<error_stats> e(N + 1), cur_e(N + 1);
+  internal::Profiler::CountDp(M * N, 2 * e.size() * sizeof(error_stats));
+  e[0] = error_stats{0, 0, 0, 0, 0};
+  for (size_t j = 1; j <= N; j++) {
+    e[j] = e[j-1];
+    e[j].ins_num++;
+    e[j].total_num++;
+    e[j].total_cost += pair.Ins(j - 1);
+  }
+  for (size_t i = 1; i <= M; i++) {
+    const int *sub_row = pair.SubRow(i - 1);
+    const int del_cost = pair.Del(i - 1);
+    cur_e[0] = e[0];
+    cur_e[0].del_num++;
+    cur_e[0].total_num++;
+    cur_e[0].total_cost += del_cost;
+    for (size_t j = 1; j <= N; j++) {
+      const int ins_err = cur_e[j-1].total_cost + pair.Ins(j - 1);
+      const int del_err = e[j].total_cost + del_cost;
+      const int sub_err = e[j-1].total_cost + sub_row[j-1];
+      if (sub_err < ins_err && sub_err < del_err) {
+        cur_e[j] = e[j-1];
+        if (ref[i-1] != hyp[j-1]) {
+          cur_e[j].sub_num++;
+          cur_e[j].total_num++;
+        }
+        cur_e[j].total_cost = sub_err;
+      } else if (del_err < ins_err) {
+        cur_e[j] = e[j];
+        cur_e[j].del_num++;
+        cur_e[j].total_num++;
+        cur_e[j].total_cost = del_err;
+      } else {
+        cur_e[j] = cur_e[j-1];
+        cur_e[j].ins_num++;
+        cur_e[j].total_num++;
+        cur_e[j].total_cost = ins_err;
+      }
+    }
+    std::swap(e, cur_e);
+  }
+  *stats = e[N];
+  return e[N].total_num;
+}
+
+int LevenshteinAlignmentWeighted(IntSequence a,
+                                 IntSequence b,
+                                 int eps_symbol,
+                                 const CostTable &costs,
+                                 const bool linear_memory,
+                                 std::vector<std::pair<int, int> > *output) {
+  assert(output != NULL);
+  internal::ProfileScope profile(internal::kProfileDp);
+  output->clear();
+  const size_t M = a.size(), N = b.size();
+  internal::PairCosts pair(costs, a, b);
+  std::vector<std::pair<size_t, size_t>> path;
+  if (linear_memory) {
+    internal::WeightedAlignmentModel model{pair};
+    path = internal::LinearMemoryAligner<internal::WeightedAlignmentModel>(model, M, N).Trace();
+  } else {
+    std::vector<int> e((M + 1) * (N + 1));
+    internal::Profiler::CountDp(M * N, e.size() * sizeof(int));
+    auto at = [&](size_t m, size_t n) -> int & { return e[m * (N + 1) + n]; };
+    for (size_t n = 1; n <= N; n++) at(0, n) = at(0, n - 1) + pair.Ins(n - 1);
+    for (size_t m = 1; m <= M; m++) {
+      const int *sub_row = pair.SubRow(m - 1);
+      const int del_cost = pair.Del(m - 1);
+      at(m, 0) = at(m - 1, 0) + del_cost;
+      for (size_t n = 1; n <= N; n++) {
+        int sub_or_ok = at(m-1, n-1) + sub_row[n-1];
+        int del = at(m-1, n) + del_cost;
+        int ins = at(m, n-1) + pair.Ins(n - 1);
+        at(m, n) = std::min(sub_or_ok, std::min(del, ins));
+      }
+    }
+    // Same traceback rule as LevenshteinAlignment.
+    internal::WeightedAlignmentModel model{pair};
+    auto get = [&](size_t m, size_t n) { return at(m, n); };
+    size_t m = M, n = N;
+    path.emplace_back(m, n);
+    while (m != 0 || n != 0) {
+      model.Step(m, n, get, &m, &n);
+      path.emplace_back(m, n);
+    }
+  }
+
+  int cost = 0;
+  for (size_t s = 0; s + 1 < path.size(); s++) {
+    const size_t m = path[s].first, n = path[s].second;
+    const size_t last_m = path[s+1].first, last_n = path[s+1].second;
+    if (last_m == m) cost += pair.Ins(last_n);
+    else if (last_n == n) cost += pair.Del(last_m);
+    else cost += pair.Sub(last_m, last_n);
+    output->push_back(std::make_pair(last_m == m ? eps_symbol : a[last_m],
+                                     last_n == n ? eps_symbol : b[last_n]));
+  }
+  ReverseVector(output);
+  return cost;
+}
+
+
+namespace internal {
+
+    void ParallelFor(
+        size_t n,
+        int num_threads,
+        const std::function<void(size_t)> &fn
+    ) {
+        if (num_threads <= 0) {
+            num_threads = static_cast<int>(std::thread::hardware_concurrency());
+        }
+        if (num_threads <= 0) num_threads = 1;
+        if (static_cast<size_t>(num_threads) > n) num_threads = static_cast<int>(n);
+        if (num_threads <= 1) {
+            for (size_t i = 0; i != n; ++i) fn(i);
+            return;
+        }
+
+        // Work items are handed out in small chunks from a shared counter so
+        // that a few very long pairs don't leave the other workers idle.
+        const size_t chunk = std::max<size_t>(1, n / (static_cast<size_t>(num_threads) * 16));
+        std::atomic<size_t> next{0};
+        std::exception_ptr error;
+        std::mutex error_mutex;
+
+        auto worker = [&]() {
+            try {
+                for (;;) {
+                    const size_t begin = next.fetch_add(chunk);
+                    if (begin >= n) break;
+                    const size_t end = std::min(n, begin + chunk);
+                    for (size_t i = begin; i != end; ++i) fn(i);
+                }
+            } catch (...) {
+                std::lock_guard<std::mutex> lock(error_mutex);
+                if (!error) error = std::current_exception();
+                next.store(n);
+            }
+        };
+
+        std::vector<std::thread> threads;
+        threads.reserve(num_threads - 1);
+        for (int t = 1; t < num_threads; ++t) threads.emplace_back(worker);
+        worker();
+        for (auto &t : threads) t.join();
+        if (error) std::rethrow_exception(error);
+    }
+
+    std::vector<std::pair<int, int>> GetEdits(
+        const std::vector<std::vector<int>> &refs,
+        const std::vector<std::vector<int>> &hyps,
+        const int max_errors
+    ) {
+        std::vector<std::pair<int, int>> ans;
+        for (int i = 0; i != refs.size(); ++i) {
+            const auto &ref = refs[i];
+            const auto dist = LevenshteinEditDistanceBounded(
+                ref, hyps[i], false, max_errors, nullptr, nullptr, nullptr);
+            ans.emplace_back(dist, ref.size());
+        }
+        return ans;
+    }
+
+    std::vector<std::pair<int, int>> GetEditsCompound(
+        const std::vector<std::vector<std::string>> &refs,
+        const std::vector<std::vector<std::string>> &hyps,
+        const int max_compound_words
+    ) {
+        std::vector<std::pair<int, int>> ans;
+        for (size_t i = 0; i != refs.size(); ++i) {
+            const auto &ref = refs[i];
+            const auto dist = LevenshteinEditDistanceCompound(
+                ref, hyps[i], false, nullptr, nullptr, nullptr, max_compound_words);
+            ans.emplace_back(dist, static_cast<int>(ref.size()));
+        }
+        return ans;
+    }
+
+    std::vector<error_stats> GetEditStats(
+        const std::vector<IntSequence> &refs,
+        const std::vector<IntSequence> &hyps,
+        const bool sclite_mode,
+        const int num_threads,
+        const int max_errors,
+        const double max_err_rate
+    ) {
+        assert(refs.size() == hyps.size());
+        std::vector<error_stats> ans(refs.size());
+        if (sclite_mode && max_errors < 0 && max_err_rate < 0) {
+            // Chunks of pairs for LevenshteinEditDistanceMany, which packs
+            // the short ones into SIMD lanes.
+            const size_t threads = num_threads > 0 ? num_threads
+                                                   : std::max(1u, std::thread::hardware_concurrency());
+            const size_t chunk = std::min<size_t>(
+                1024, std::max<size_t>(64, refs.size() / (threads * 4)));
+            ParallelFor((refs.size() + chunk - 1) / chunk, num_threads, [&](size_t c) {
+                const size_t begin = c * chunk, end = std::min(refs.size(), begin + chunk);
+                const std::vector<IntSequence> chunk_refs(refs.begin() + begin, refs.begin() + end);
+                const std::vector<IntSequence> chunk_hyps(hyps.begin() + begin, hyps.begin() + end);
+                std::vector<error_stats> stats;
+                LevenshteinEditDistanceMany(chunk_refs, chunk_hyps, true, &stats);
+                for (size_t i = begin; i < end; i++) {
+                    ans[i] = stats[i - begin];
+                    ans[i].total_cost = 0;
+                }
+            });
+            return ans;
+        }
+        ParallelFor(refs.size(), num_threads, [&](size_t i) {
+            auto &st = ans[i];
+            st.total_num = LevenshteinEditDistanceBounded(
+                refs[i], hyps[i], sclite_mode,
+                MaxErrorsFor(refs[i].size(), max_errors, max_err_rate),
+                &st.ins_num, &st.del_num, &st.sub_num);
+            if (st.total_num < 0) st = {-1, -1, -1, -1, 0};
+            st.total_cost = 0;
+        });
+        return ans;
+    }
+
+    std::vector<error_stats> GetEditStatsWeighted(
+        const std::vector<IntSequence> &refs,
+        const std::vector<IntSequence> &hyps,
+        const CostTable &costs,
+        const int num_threads,
+        const int max_errors,
+        const double max_err_rate
+    ) {
+        assert(refs.size() == hyps.size());
+        std::vector<error_stats> ans(refs.size());
+        ParallelFor(refs.size(), num_threads, [&](size_t i) {
+            auto &st = ans[i];
+            const int limit = MaxErrorsFor(refs[i].size(), max_errors, max_err_rate);
+            if (LevenshteinEditDistanceWeighted(refs[i], hyps[i], costs, &st) > limit &&
+                limit >= 0)
+                st = {-1, -1, -1, -1, -1};
+        });
+        return ans;
+    }
+
+    std::vector<error_stats> GetEditStatsCompound(
+        const std::vector<std::vector<std::string>> &refs,
+        const std::vector<std::vector<std::string>> &hyps,
+        const bool sclite_mode,
+        const int num_threads,
+        const int max_errors,
+        const double max_err_rate,
+        const int max_compound_words
+    ) {
+        assert(refs.size() == hyps.size());
+        std::vector<error_stats> ans(refs.size());
+        ParallelFor(refs.size(), num_threads, [&](size_t i) {
+            auto &st = ans[i];
+            st.total_num = LevenshteinEditDistanceCompound(
+                refs[i], hyps[i], sclite_mode, &st.ins_num, &st.del_num, &st.sub_num,
+                max_compound_words);
+            const int limit = MaxErrorsFor(refs[i].size(), max_errors, max_err_rate);
+            if (limit >= 0 && st.total_num > limit) st = {-1, -1, -1, -1, 0};
+            st.total_cost = 0;
+        });
+        return ans;
+    }
+
+    std::vector<std::vector<std::pair<int, int>>> GetAlignments(
+        const std::vector<IntSequence> &refs,
+        const std::vector<IntSequence> &hyps,
+        const int eps_symbol,
+        const bool sclite_mode,
+        const int num_threads,
+        const int max_errors,
+        const double max_err_rate,
+        std::vector<char> *within_limit
+    ) {
+        assert(refs.size() == hyps.size());
+        std::vector<std::vector<std::pair<int, int>>> ans(refs.size());
+        if (within_limit != nullptr) within_limit->assign(refs.size(), 1);
+        ParallelFor(refs.size(), num_threads, [&](size_t i) {
+            const int limit = MaxErrorsFor(refs[i].size(), max_errors, max_err_rate);
+            const int cost = LevenshteinAlignmentBounded(
+                refs[i], hyps[i], eps_symbol, sclite_mode, limit, &ans[i]);
+            if (cost < 0 && within_limit != nullptr) (*within_limit)[i] = 0;
+        });
+        return ans;
+    }
+
+    std::vector<std::vector<std::pair<int, int>>> GetAlignmentsWeighted(
+        const std::vector<IntSequence> &refs,
+        const std::vector<IntSequence> &hyps,
+        const int eps_symbol,
+        const CostTable &costs,
+        const int num_threads,
+        const int max_errors,
+        const double max_err_rate,
+        std::vector<char> *within_limit
+    ) {
+        assert(refs.size() == hyps.size());
+        std::vector<std::vector<std::pair<int, int>>> ans(refs.size());
+        if (within_limit != nullptr) within_limit->assign(refs.size(), 1);
+        ParallelFor(refs.size(), num_threads, [&](size_t i) {
+            LevenshteinAlignmentWeighted(refs[i], hyps[i], eps_symbol, costs,
+                                         UseLinearMemoryAlignment(refs[i].size(), hyps[i].size()),
+                                         &ans[i]);
+            const int limit = MaxErrorsFor(refs[i].size(), max_errors, max_err_rate);
+            if (limit < 0) return;
+            int errors = 0;
+            for (const auto &p : ans[i])
+                if (p.first != p.second) errors++;
+            if (errors > limit) {
+                ans[i].clear();
+                if (within_limit != nullptr) (*within_limit)[i] = 0;
+            }
+        });
+        return ans;
+    }
+
+    std::vector<std::vector<std::pair<std::string, std::string>>> GetAlignmentsCompound(
+        const std::vector<std::vector<std::string>> &refs,
+        const std::vector<std::vector<std::string>> &hyps,
+        const std::string &eps_symbol,
+        const bool sclite_mode,
+        const int num_threads,
+        const int max_errors,
+        const double max_err_rate,
+        std::vector<char> *within_limit,
+        const int max_compound_words
+    ) {
+        assert(refs.size() == hyps.size());
+        std::vector<std::vector<std::pair<std::string, std::string>>> ans(refs.size());
+        if (within_limit != nullptr) within_limit->assign(refs.size(), 1);
+        ParallelFor(refs.size(), num_threads, [&](size_t i) {
+            const int limit = MaxErrorsFor(refs[i].size(), max_errors, max_err_rate);
+            if (limit >= 0 && LevenshteinEditDistanceCompound(
+                    refs[i], hyps[i], sclite_mode, nullptr, nullptr, nullptr,
+                    max_compound_words) > limit) {
+                if (within_limit != nullptr) (*within_limit)[i] = 0;
+                return;
+            }
+            if (UseLinearMemoryAlignment(refs[i].size(), hyps[i].size()))
+                LevenshteinAlignmentCompoundLinearMemory(
+                    refs[i], hyps[i], eps_symbol, sclite_mode, &ans[i], max_compound_words);
+            else
+                LevenshteinAlignmentCompound(refs[i], hyps[i], eps_symbol, sclite_mode, &ans[i],
+                                             max_compound_words);
+        });
+        return ans;
+    }
+
+    // Copies the top_k entries of counts (all if top_k < 0) in the order of
+    // ErrorReport, calling out(key, count) for each.
+    template <typename Key, typename Out>
+    static void TopCounts(const std::unordered_map<Key, int64_t> &counts, const int top_k,
+                          Out out) {
+        std::vector<std::pair<Key, int64_t>> entries(counts.begin(), counts.end());
+        auto before = [](const std::pair<Key, int64_t> &x, const std::pair<Key, int64_t> &y) {
+            return x.second != y.second ? x.second > y.second : x.first < y.first;
+        };
+        const size_t k = top_k < 0 ? entries.size()
+                                   : std::min(entries.size(), static_cast<size_t>(top_k));
+        std::partial_sort(entries.begin(), entries.begin() + k, entries.end(), before);
+        for (size_t i = 0; i != k; ++i) out(entries[i].first, entries[i].second);
+    }
+
+    ErrorReport GetErrorReport(
+        const std::vector<IntSequence> &refs,
+        const std::vector<IntSequence> &hyps,
+        const std::vector<int> &groups,
+        const int num_groups,
+        const bool sclite_mode,
+        const int num_threads,
+        const int top_k
+    ) {
+        assert(refs.size() == hyps.size());
+        assert(groups.empty() || groups.size() == refs.size());
+        // Every shard of consecutive pairs fills its own maps, merged at the end.
+        struct Shard {
+            std::unordered_map<uint64_t, int64_t> sub;  // (ref << 32) | hyp
+            std::unordered_map<int, int64_t> ins, del;
+            std::vector<ErrorReport::GroupTotals> groups;
+        };
+        const size_t n = refs.size();
+        size_t threads = num_threads > 0 ? num_threads : std::thread::hardware_concurrency();
+        const size_t num_shards = std::min(n, std::max<size_t>(threads, 1) * 4);
+        std::vector<Shard> shards(num_shards);
+        ParallelFor(num_shards, num_threads, [&](size_t s) {
+            Shard &shard = shards[s];
+            shard.groups.resize(std::max(num_groups, 1));
+            AlignmentColumns columns;
+            for (size_t i = n * s / num_shards; i != n * (s + 1) / num_shards; ++i) {
+                LevenshteinAlignmentColumns(
+                    refs[i], hyps[i], sclite_mode, -1,
+                    UseLinearMemoryAlignment(refs[i].size(), hyps[i].size()), &columns);
+                auto &totals = shard.groups[groups.empty() ? 0 : groups[i]];
+                int64_t errors = 0;
+                for (size_t k = 0; k != columns.Size(); ++k) {
+                    const int r = columns.ref_begin[k];
+                    const int h = columns.hyp_begin[k];
+                    switch (columns.ops[k]) {
+                        case kOpSubstitution:
+                            shard.sub[static_cast<uint64_t>(static_cast<uint32_t>(refs[i][r])) << 32 |
+                                      static_cast<uint32_t>(hyps[i][h])]++;
+                            totals.sub++;
+                            break;
+                        case kOpInsertion:
+                            shard.ins[hyps[i][h]]++;
+                            totals.ins++;
+                            break;
+                        case kOpDeletion:
+                            shard.del[refs[i][r]]++;
+                            totals.del++;
+                            break;
+                        default:
+                            continue;
+                    }
+                    errors++;
+                }
+                totals.ref_len += refs[i].size();
+                totals.num_utts++;
+                if (errors != 0) totals.num_sent_err++;
+            }
+        });
+
+        Shard all;
+        all.groups.resize(std::max(num_groups, 1));
+        for (const auto &shard : shards) {
+            for (const auto &kv : shard.sub) all.sub[kv.first] += kv.second;
+            for (const auto &kv : shard.ins) all.ins[kv.first] += kv.second;
+            for (const auto &kv : shard.del) all.del[kv.first] += kv.second;
+            for (size_t g = 0; g != all.groups.size(); ++g) {
+                auto &to = all.groups[g];
+                const auto &from = shard.groups[g];
+                to.ins += from.ins;
+                to.del += from.del;
+                to.sub += from.sub;
+                to.ref_len += from.ref_len;
+                to.num_utts += from.num_utts;
+                to.num_sent_err += from.num_sent_err;
+            }
+        }
+
+        ErrorReport ans;
+        ans.groups.swap(all.groups);
+        TopCounts(all.sub, top_k, [&](uint64_t key, int64_t count) {
+            ans.sub_ref.push_back(static_cast<int>(static_cast<uint32_t>(key >> 32)));
+            ans.sub_hyp.push_back(static_cast<int>(static_cast<uint32_t>(key)));
+            ans.sub_count.push_back(count);
+        });
+        TopCounts(all.ins, top_k, [&](int symbol, int64_t count) {
+            ans.ins_symbol.push_back(symbol);
+            ans.ins_count.push_back(count);
+        });
+        TopCounts(all.del, top_k, [&](int symbol, int64_t count) {
+            ans.del_symbol.push_back(symbol);
+            ans.del_count.push_back(count);
+        });
+        return ans;
+    }
+
+    // SplitMix64 (Steele, Lea & Flood, 2014): a small, fast generator whose
+    // independent streams are cheap to derive, one per replication.
+    class SplitMix64 {
+     public:
+        explicit SplitMix64(uint64_t state) : state_(state) {}
+
+        uint64_t operator()() {
+            uint64_t z = (state_ += 0x9e3779b97f4a7c15ULL);
+            z = (z ^ (z >> 30)) * 0xbf58476d1ce4e5b9ULL;
+            z = (z ^ (z >> 27)) * 0x94d049bb133111ebULL;
+            return z ^ (z >> 31);
+        }
+
+        // Unbiased draw from [0, n) using Lemire's multiply-shift method.
+        uint32_t Below(const uint32_t n) {
+            uint64_t m = static_cast<uint64_t>((*this)() >> 32) * n;
+            if (static_cast<uint32_t>(m) < n) {
+                const uint32_t threshold = static_cast<uint32_t>(-n) % n;
+                while (static_cast<uint32_t>(m) < threshold)
+                    m = static_cast<uint64_t>((*this)() >> 32) * n;
+            }
+            return static_cast<uint32_t>(m >> 32);
+        }
+
+     private:
+        uint64_t state_;
+    };
+
+    BootstrapResult Bootstrap(
+        const std::vector<std::pair<int, int>> &edit_sym_per_hyp,
+        const std::vector<std::pair<int, int>> *edit_sym_per_hyp2,
+        const int replications,
+        const uint64_t seed,
+        const int num_threads
+    ) {
+        const size_t n = edit_sym_per_hyp.size();
+        const bool two_systems = edit_sym_per_hyp2 != nullptr;
+        if (two_systems && edit_sym_per_hyp2->size() != n)
+            throw std::invalid_argument("Both systems must have the same number of utterances.");
+
+        // Structure-of-arrays copy so the resampling loop reads packed ints.
+        std::vector<int> errs(n), syms(n), errs2(two_systems ? n : 0), syms2(two_systems ? n : 0);
+        for (size_t j = 0; j != n; ++j) {
+            errs[j] = edit_sym_per_hyp[j].first;
+            syms[j] = edit_sym_per_hyp[j].second;
+            if (two_systems) {
+                errs2[j] = (*edit_sym_per_hyp2)[j].first;
+                syms2[j] = (*edit_sym_per_hyp2)[j].second;
+            }
+        }
+
+        BootstrapResult ans;
+        const size_t reps = static_cast<size_t>(std::max(replications, 0));
+        ans.wer.resize(reps);
+        if (two_systems) ans.wer2.resize(reps);
+        std::vector<char> improved(two_systems ? reps : 0);
+        SplitMix64 seeder{seed};
+        const uint64_t base = seeder();
+
+        ParallelFor(reps, num_threads, [&](size_t r) {
+            SplitMix64 rng{SplitMix64{base ^ static_cast<uint64_t>(r)}()};
+            const uint32_t count = static_cast<uint32_t>(n);
+            int64_t num_errs = 0, num_sym = 0, num_errs2 = 0, num_sym2 = 0;
+            if (two_systems) {
+                for (size_t j = 0; j != n; ++j) {
+                    const uint32_t k = rng.Below(count);
+                    num_errs += errs[k];
+                    num_sym += syms[k];
+                    num_errs2 += errs2[k];
+                    num_sym2 += syms2[k];
+                }
+                ans.wer2[r] = static_cast<double>(num_errs2) / num_sym2;
+                improved[r] = num_errs > num_errs2;
+            } else {
+                for (size_t j = 0; j != n; ++j) {
+                    const uint32_t k = rng.Below(count);
+                    num_errs += errs[k];
+                    num_sym += syms[k];
+                }
+            }
+            ans.wer[r] = static_cast<double>(num_errs) / num_sym;
+        });
+
+        if (two_systems && reps > 0) {
+            size_t num_improved = 0;
+            for (char c : improved) num_improved += c;
+            ans.p_improv = static_cast<double>(num_improved) / reps;
+        }
+        return ans;
+    }
+
+    MultiBootstrapResult BootstrapMulti(
+        const std::vector<std::vector<std::pair<int, int>>> &systems,
+        const int replications,
+        const uint64_t seed,
+        const int num_threads
+    ) {
+        const size_t S = systems.size();
+        const size_t n = S == 0 ? 0 : systems[0].size();
+        for (const auto &edits : systems)
+            if (edits.size() != n)
+                throw std::invalid_argument("All systems must have the same number of utterances.");
+
+        // System-major copy; the reference lengths are stored once when all
+        // systems share them (as they do when scored against the same refs).
+        bool shared_syms = true;
+        for (size_t s = 1; s != S && shared_syms; ++s)
+            for (size_t j = 0; j != n && shared_syms; ++j)
+                shared_syms = systems[s][j].second == systems[0][j].second;
+        std::vector<int> errs(n * S), syms(n * (shared_syms ? std::min<size_t>(S, 1) : S));
+        for (size_t s = 0; s != S; ++s) {
+            for (size_t j = 0; j != n; ++j) {
+                errs[s * n + j] = systems[s][j].first;
+                if (s == 0 || !shared_syms) syms[s * n + j] = systems[s][j].second;
+            }
+        }
+
+        MultiBootstrapResult ans;
+        const size_t reps = static_cast<size_t>(std::max(replications, 0));
+        ans.wer.assign(S, std::vector<double>(reps));
+        // The number of errors of every system in every replication.
+        std::vector<int64_t> totals(reps * S);
+        SplitMix64 seeder{seed};
+        const uint64_t base = seeder();
+
+        ParallelFor(reps, num_threads, [&](size_t r) {
+            SplitMix64 rng{SplitMix64{base ^ static_cast<uint64_t>(r)}()};
+            const uint32_t count = static_cast<uint32_t>(n);
+            // How many times every utterance was drawn; the totals are then
+            // sequential dot products instead of S random reads per draw.
+            std::vector<uint32_t> draws(n, 0);
+            for (size_t j = 0; j != n; ++j) draws[rng.Below(count)]++;
+            auto dot = [&](const int *values) {
+                int64_t sum = 0;
+                for (size_t k = 0; k != n; ++k) sum += static_cast<int64_t>(draws[k]) * values[k];
+                return sum;
+            };
+            const int64_t shared_num_sym = shared_syms && S > 0 ? dot(syms.data()) : 0;
+            for (size_t s = 0; s != S; ++s) {
+                const int64_t num_errs = dot(errs.data() + s * n);
+                const int64_t num_sym = shared_syms ? shared_num_sym : dot(syms.data() + s * n);
+                totals[r * S + s] = num_errs;
+                ans.wer[s][r] = static_cast<double>(num_errs) / num_sym;
+            }
+        });
+
+        ans.p_improv.assign(S * S, 0.0);
+        if (reps > 0) {
+            std::vector<size_t> num_improved(S * S, 0);
+            for (size_t r = 0; r != reps; ++r) {
+                const int64_t *t = totals.data() + r * S;
+                for (size_t a = 0; a != S; ++a)
+                    for (size_t b = 0; b != S; ++b) num_improved[a * S + b] += t[a] > t[b];
+            }
+            for (size_t i = 0; i != S * S; ++i)
+                ans.p_improv[i] = static_cast<double>(num_improved[i]) / reps;
+        }
+        return ans;
+    }
+
+    WerInterval GetWerInterval(std::vector<double> wer, const bool percentile) {
+        WerInterval ans{0.0, 0.0, 0.0, 0.0};
+        if (wer.empty()) return ans;
+
+        double wer_accum = 0.0, wer_mult_accum = 0.0;
+        for (double w : wer) {
+            wer_accum += w;
+            wer_mult_accum += w * w;
+        }
+        const size_t reps = wer.size();
+        ans.mean = wer_accum / reps;
+
+        if (!percentile) {
+            const double _tmp = wer_mult_accum / reps - ans.mean * ans.mean;
+            if (_tmp > 0) {
+                ans.interval = 1.96 * std::sqrt(_tmp);
+            }
+            ans.lower = ans.mean - ans.interval;
+            ans.upper = ans.mean + ans.interval;
+            return ans;
+        }
+
+        // Linearly interpolated percentiles (as numpy.percentile).
+        std::sort(wer.begin(), wer.end());
+        auto quantile = [&](const double q) {
+            const double pos = q * (reps - 1);
+            const size_t lo = static_cast<size_t>(pos);
+            const size_t hi = std::min(lo + 1, reps - 1);
+            return wer[lo] + (pos - lo) * (wer[hi] - wer[lo]);
+        };
+        ans.lower = quantile(0.025);
+        ans.upper = quantile(0.975);
+        ans.interval = (ans.upper - ans.lower) / 2;
+        return ans;
+    }
+
+    std::pair<double, double> GetBootstrapWerInterval(
+        const std::vector<std::pair<int, int>> &edit_sym_per_hyp,
+        const int replications,
+        const unsigned int seed)
+    {
+        const auto boot = Bootstrap(edit_sym_per_hyp, nullptr, replications, seed, 1);
+        const auto ci = GetWerInterval(boot.wer, false);
+        return std::make_pair(ci.mean, ci.interval);
+    }
+
+    double GetPImprov(
+        const std::vector<std::pair<int, int>> &edit_sym_per_hyp,
+        const std::vector<std::pair<int, int>> &edit_sym_per_hyp2,
+        const int replications,
+        const unsigned int seed
+    ) {
+        return Bootstrap(edit_sym_per_hyp, &edit_sym_per_hyp2, replications, seed, 1).p_improv;
+    }
+
+    // Calls per entry point; only touched while profiling.
+    static std::mutex &ProfileCallsMutex() {
+        static std::mutex mutex;
+        return mutex;
+    }
+
+    static std::unordered_map<std::string, int64_t> &ProfileCalls() {
+        static std::unordered_map<std::string, int64_t> calls;
+        return calls;
+    }
+
+    void Profiler::AddCall(const std::string &name, int64_t ns) {
+        if (!Enabled()) return;
+        AddTime(kProfileNative, ns);
+        std::lock_guard<std::mutex> lock(ProfileCallsMutex());
+        ProfileCalls()[name]++;
+    }
+
+    std::vector<std::pair<std::string, int64_t>> Profiler::Calls() {
+        std::lock_guard<std::mutex> lock(ProfileCallsMutex());
+        std::vector<std::pair<std::string, int64_t>> ans(ProfileCalls().begin(),
+                                                         ProfileCalls().end());
+        std::sort(ans.begin(), ans.end());
+        return ans;
+    }
+
+    void Profiler::Reset() {
+        for (auto &counter : counters_) counter.store(0, std::memory_order_relaxed);
+        for (auto &ns : ns_) ns.store(0, std::memory_order_relaxed);
+        std::lock_guard<std::mutex> lock(ProfileCallsMutex());
+        ProfileCalls().clear();
+    }
+
+}
+
+
+int SymbolTable::InternLocked(const std::string &symbol) {
+  auto it = ids_.find(symbol);
+  if (it != ids_.end()) return it->second;
+  const int id = static_cast<int>(symbols_.size());
+  ids_.emplace(symbol, id);
+  symbols_.push_back(symbol);
+  return id;
+}
+
+int SymbolTable::Intern(const std::string &symbol) {
+  std::lock_guard<std::mutex> lock(mutex_);
+  return InternLocked(symbol);
+}
+
+int SymbolTable::Find(const std::string &symbol) const {
+  std::lock_guard<std::mutex> lock(mutex_);
+  auto it = ids_.find(symbol);
+  return it == ids_.end() ? -1 : it->second;
+}
+
+std::pair<int, int> SymbolTable::Encode(const std::vector<std::vector<std::string>> &seqs,
+                                        const bool add,
+                                        std::vector<std::vector<int>> *ids) {
+  internal::ProfileScope profile(internal::kProfileSymbols);
+  std::lock_guard<std::mutex> lock(mutex_);
+  ids->resize(seqs.size());
+  for (size_t i = 0; i < seqs.size(); i++) {
+    const auto &seq = seqs[i];
+    auto &out = (*ids)[i];
+    out.resize(seq.size());
+    for (size_t j = 0; j < seq.size(); j++) {
+      if (add) {
+        out[j] = InternLocked(seq[j]);
+        continue;
+      }
+      auto it = ids_.find(seq[j]);
+      if (it == ids_.end()) return std::make_pair(static_cast<int>(i), static_cast<int>(j));
+      out[j] = it->second;
+    }
+  }
+  return std::make_pair(-1, -1);
+}
+
+std::string SymbolTable::Symbol(int id) const {
+  std::lock_guard<std::mutex> lock(mutex_);
+  return symbols_[id];
+}
+
+bool SymbolTable::Decode(const std::vector<int> &ids,
+                         std::vector<std::string> *symbols) const {
+  internal::ProfileScope profile(internal::kProfileSymbols);
+  std::lock_guard<std::mutex> lock(mutex_);
+  symbols->resize(ids.size());
+  for (size_t i = 0; i < ids.size(); i++) {
+    if (ids[i] < 0 || static_cast<size_t>(ids[i]) >= symbols_.size()) return false;
+    (*symbols)[i] = symbols_[ids[i]];
+  }
+  return true;
+}
+
+size_t SymbolTable::Size() const {
+  std::lock_guard<std::mutex> lock(mutex_);
+  return symbols_.size();
+}
+
+
+// Blob layout: the magic "KWA", a version byte, a flags byte (bit 0 sclite
+// mode, bit 1 merge compounds), then LEB128 varints: the number of
+// utterances, the ins / del / sub / ref_len totals and (errors, ref_len) of
+// every utterance.
+static const char kWerAccumulatorMagic[] = "KWA";
+static const char kWerAccumulatorVersion = 1;
+
+static void PutVarint(uint64_t value, std::string *out) {
+  while (value >= 0x80) {
+    out->push_back(static_cast<char>((value & 0x7f) | 0x80));
+    value >>= 7;
+  }
+  out->push_back(static_cast<char>(value));
+}
+
+static bool GetVarint(const std::string &data, size_t *pos, uint64_t *value) {
+  *value = 0;
+  for (int shift = 0; shift < 64 && *pos < data.size(); shift += 7) {
+    const auto byte = static_cast<unsigned char>(data[(*pos)++]);
+    *value |= static_cast<uint64_t>(byte & 0x7f) << shift;
+    if (!(byte & 0x80)) return true;
+  }
+  return false;
+}
+
+void WerAccumulator::Add(const std::vector<error_stats> &stats,
+                         const std::vector<int> &ref_len) {
+  assert(stats.size() == ref_len.size());
+  std::lock_guard<std::mutex> lock(mutex_);
+  edits_.reserve(edits_.size() + stats.size());
+  for (size_t i = 0; i != stats.size(); ++i) {
+    const auto &s = stats[i];
+    totals_.ins += s.ins_num;
+    totals_.del += s.del_num;
+    totals_.sub += s.sub_num;
+    totals_.ref_len += ref_len[i];
+    edits_.emplace_back(s.ins_num + s.del_num + s.sub_num, ref_len[i]);
+  }
+}
+
+bool WerAccumulator::Merge(const WerAccumulator &other) {
+  if (other.sclite_mode_ != sclite_mode_ || other.merge_compounds_ != merge_compounds_)
+    return false;
+  // Copy first, so that merging an accumulator into itself doesn't deadlock.
+  Totals totals;
+  std::vector<std::pair<int, int>> edits;
+  {
+    std::lock_guard<std::mutex> lock(other.mutex_);
+    totals = other.totals_;
+    edits = other.edits_;
+  }
+  std::lock_guard<std::mutex> lock(mutex_);
+  totals_.ins += totals.ins;
+  totals_.del += totals.del;
+  totals_.sub += totals.sub;
+  totals_.ref_len += totals.ref_len;
+  edits_.insert(edits_.end(), edits.begin(), edits.end());
+  return true;
+}
+
+std::string WerAccumulator::Serialize() const {
+  std::lock_guard<std::mutex> lock(mutex_);
+  std::string out(kWerAccumulatorMagic);
+  out.push_back(kWerAccumulatorVersion);
+  out.push_back(static_cast<char>((sclite_mode_ ? 1 : 0) | (merge_compounds_ ? 2 : 0)));
+  PutVarint(edits_.size(), &out);
+  for (int64_t total : {totals_.ins, totals_.del, totals_.sub, totals_.ref_len})
+    PutVarint(static_cast<uint64_t>(total), &out);
+  for (const auto &e : edits_) {
+    PutVarint(static_cast<uint32_t>(e.first), &out);
+    PutVarint(static_cast<uint32_t>(e.second), &out);
+  }
+  return out;
+}
+
+bool WerAccumulator::Deserialize(const std::string &data) {
+  const size_t header = sizeof(kWerAccumulatorMagic) + 1;
+  if (data.size() < header || data.compare(0, 3, kWerAccumulatorMagic) != 0 ||
+      data[3] != kWerAccumulatorVersion || (data[4] & ~3) != 0)
+    return false;
+  size_t pos = header;
+  uint64_t num_utts;
+  uint64_t values[4];
+  if (!GetVarint(data, &pos, &num_utts)) return false;
+  for (auto &value : values)
+    if (!GetVarint(data, &pos, &value)) return false;
+  // Every utterance takes at least two bytes.
+  if (num_utts > (data.size() - pos) / 2) return false;
+
+  std::vector<std::pair<int, int>> edits(num_utts);
+  uint64_t errors_sum = 0, ref_len_sum = 0;
+  for (auto &e : edits) {
+    uint64_t errors, ref_len;
+    if (!GetVarint(data, &pos, &errors) || !GetVarint(data, &pos, &ref_len) ||
+        errors > INT_MAX || ref_len > INT_MAX)
+      return false;
+    e = {static_cast<int>(errors), static_cast<int>(ref_len)};
+    errors_sum += errors;
+    ref_len_sum += ref_len;
+  }
+  if (pos != data.size() || errors_sum != values[0] + values[1] + values[2] ||
+      ref_len_sum != values[3])
+    return false;
+
+  std::lock_guard<std::mutex> lock(mutex_);
+  sclite_mode_ = data[4] & 1;
+  merge_compounds_ = data[4] & 2;
+  totals_.ins = static_cast<int64_t>(values[0]);
+  totals_.del = static_cast<int64_t>(values[1]);
+  totals_.sub = static_cast<int64_t>(values[2]);
+  totals_.ref_len = static_cast<int64_t>(values[3]);
+  edits_.swap(edits);
+  return true;
+}
+
+WerAccumulator::Totals WerAccumulator::GetTotals() const {
+  std::lock_guard<std::mutex> lock(mutex_);
+  return totals_;
+}
+
+size_t WerAccumulator::NumUtterances() const {
+  std::lock_guard<std::mutex> lock(mutex_);
+  return edits_.size();
+}
+
+std::vector<std::pair<int, int>> WerAccumulator::Edits() const {
+  std::lock_guard<std::mutex> lock(mutex_);
+  return edits_;
+}
+
+
+namespace internal {
+
+// Read-only view of a whole file: memory-mapped where available, read into
+// memory otherwise.
+class MappedFile {
+ public:
+  explicit MappedFile(const std::string &path) {
+#if defined(_WIN32)
+    std::ifstream in(path, std::ios::binary);
+    if (!in) throw std::runtime_error("Cannot open " + path);
+    contents_.assign(std::istreambuf_iterator<char>(in), std::istreambuf_iterator<char>());
+    view_ = contents_;
+#else
+    const int fd = ::open(path.c_str(), O_RDONLY);
+    if (fd < 0) throw std::runtime_error("Cannot open " + path + ": " + std::strerror(errno));
+    struct stat st;
+    if (::fstat(fd, &st) != 0) {
+      const int err = errno;
+      ::close(fd);
+      throw std::runtime_error("Cannot stat " + path + ": " + std::strerror(err));
+    }
+    size_ = static_cast<size_t>(st.st_size);
+    if (size_ > 0) {
+      void *data = ::mmap(nullptr, size_, PROT_READ, MAP_PRIVATE, fd, 0);
+      if (data == MAP_FAILED) {
+        const int err = errno;
+        ::close(fd);
+        throw std::runtime_error("Cannot map " + path + ": " + std::strerror(err));
+      }
+      ::madvise(data, size_, MADV_SEQUENTIAL);
+      data_ = data;
+      view_ = std::string_view(static_cast<const char *>(data), size_);
+    }
+    ::close(fd);
+#endif
+  }
+
+  MappedFile(const MappedFile &) = delete;
+  MappedFile &operator=(const MappedFile &) = delete;
+
+  ~MappedFile() {
+#if !defined(_WIN32)
+    if (data_) ::munmap(data_, size_);
+#endif
+  }
+
+  std::string_view View() const { return view_; }
+
+ private:
+#if defined(_WIN32)
+  std::string contents_;
+#else
+  void *data_ = nullptr;
+  size_t size_ = 0;
+#endif
+  std::string_view view_;
+};
+
+static inline bool IsSpace(const char c) {
+  return c == ' ' || c == '\t' || c == '\r' || c == '\v' || c == '\f';
+}
+
+// Calls fn(token) for every whitespace-separated token of text.
+template <typename Fn>
+static void ForEachToken(std::string_view text, Fn fn) {
+  size_t i = 0;
+  const size_t n = text.size();
+  while (true) {
+    while (i < n && IsSpace(text[i])) ++i;
+    if (i == n) return;
+    const size_t begin = i;
+    while (i < n && !IsSpace(text[i])) ++i;
+    fn(text.substr(begin, i - begin));
+  }
+}
+
+// (utt-id, transcript) of every non-blank line, in file order.
+static std::vector<std::pair<std::string_view, std::string_view>> SplitKaldiText(
+    std::string_view text) {
+  std::vector<std::pair<std::string_view, std::string_view>> lines;
+  while (!text.empty()) {
+    const size_t eol = std::min(text.find('\n'), text.size());
+    std::string_view line = text.substr(0, eol);
+    text.remove_prefix(std::min(eol + 1, text.size()));
+
+    size_t begin = 0;
+    while (begin < line.size() && IsSpace(line[begin])) ++begin;
+    if (begin == line.size()) continue;
+    size_t end = begin;
+    while (end < line.size() && !IsSpace(line[end])) ++end;
+    lines.emplace_back(line.substr(begin, end - begin), line.substr(end));
+  }
+  return lines;
+}
+
+// Open-addressing map from strings to consecutive ids.  Unlike
+// std::unordered_map it doesn't allocate per entry and can be cleared in
+// time proportional to its size, so one instance can be reused cheaply for
+// many small inputs.  The strings are not copied.
+class StringInterner {
+ public:
+  void Clear() {
+    for (size_t slot : used_) slots_[slot].second = -1;
+    used_.clear();
+  }
+
+  size_t Size() const { return used_.size(); }
+
+  // Id of s, giving it the next id if it is new.
+  int Intern(std::string_view s) {
+    if (2 * (used_.size() + 1) > slots_.size()) Grow();
+    size_t slot = Slot(s);
+    if (slots_[slot].second < 0) {
+      slots_[slot] = {s, static_cast<int>(used_.size())};
+      used_.push_back(slot);
+    }
+    return slots_[slot].second;
+  }
+
+  // Id of s, or -1 if it was never interned.
+  int Find(std::string_view s) const {
+    return slots_.empty() ? -1 : slots_[Slot(s)].second;
+  }
+
+ private:
+  size_t Slot(std::string_view s) const {
+    const size_t mask = slots_.size() - 1;
+    size_t slot = std::hash<std::string_view>()(s) & mask;
+    while (slots_[slot].second >= 0 && slots_[slot].first != s) slot = (slot + 1) & mask;
+    return slot;
+  }
+
+  void Grow() {
+    std::vector<std::pair<std::string_view, int>> old(std::max<size_t>(64, 2 * slots_.size()),
+                                                      {std::string_view(), -1});
+    old.swap(slots_);
+    for (size_t &slot : used_) {
+      const auto entry = old[slot];
+      slot = Slot(entry.first);
+      slots_[slot] = entry;
+    }
+  }
+
+  std::vector<std::pair<std::string_view, int>> slots_;
+  std::vector<size_t> used_;  // occupied slots, in id order
+};
+
+TextScoreSummary ScoreTextFiles(
+    const std::string &ref_path,
+    const std::string &hyp_path,
+    const std::string &missing_hyp,
+    const int num_threads,
+    const std::string &per_utt_path,
+    WerAccumulator *acc
+) {
+  if (missing_hyp != "strict" && missing_hyp != "present" && missing_hyp != "all")
+    throw std::invalid_argument("missing_hyp must be 'strict', 'present' or 'all', got '" +
+                                missing_hyp + "'");
+  const MappedFile ref_file(ref_path), hyp_file(hyp_path);
+  const auto refs = SplitKaldiText(ref_file.View());
+  const auto hyps = SplitKaldiText(hyp_file.View());
+
+  // The id of a hyp key is its line number.
+  StringInterner hyp_keys;
+  for (size_t i = 0; i != hyps.size(); ++i) {
+    if (hyp_keys.Intern(hyps[i].first) != static_cast<int>(i))
+      throw std::invalid_argument("Duplicate utterance id '" + std::string(hyps[i].first) +
+                                  "' in " + hyp_path);
+  }
+
+  // Join by key in ref order.
+  StringInterner ref_keys;
+  std::vector<size_t> ref_index;
+  std::vector<std::string_view> hyp_text;
+  TextScoreSummary summary;
+  for (size_t i = 0; i != refs.size(); ++i) {
+    if (ref_keys.Intern(refs[i].first) != static_cast<int>(i))
+      throw std::invalid_argument("Duplicate utterance id '" + std::string(refs[i].first) +
+                                  "' in " + ref_path);
+    const int h = hyp_keys.Find(refs[i].first);
+    if (h < 0) {
+      if (missing_hyp == "strict")
+        throw std::invalid_argument("Utterance '" + std::string(refs[i].first) +
+                                    "' is missing from " + hyp_path);
+      ++summary.num_missing;
+      if (missing_hyp == "present") continue;
+    }
+    ref_index.push_back(i);
+    hyp_text.push_back(h < 0 ? std::string_view() : hyps[h].second);
+  }
+
+  // Words only need to compare equal within a pair, so every pair is
+  // tokenized and interned on its own by the worker that scores it.
+  const bool sclite_mode = acc->ScliteMode();
+  std::vector<error_stats> stats(ref_index.size());
+  std::vector<int> ref_len(ref_index.size());
+  ParallelFor(ref_index.size(), num_threads, [&](size_t i) {
+    thread_local StringInterner vocab;
+    thread_local std::vector<int> ref_ids, hyp_ids;
+    vocab.Clear();
+    ref_ids.clear();
+    hyp_ids.clear();
+    auto intern = [&](std::vector<int> *ids) {
+      return [ids](std::string_view word) { ids->push_back(vocab.Intern(word)); };
+    };
+    ForEachToken(refs[ref_index[i]].second, intern(&ref_ids));
+    ForEachToken(hyp_text[i], intern(&hyp_ids));
+
+    auto &s = stats[i];
+    LevenshteinEditDistance(ref_ids, hyp_ids, sclite_mode, &s.ins_num, &s.del_num,
+                            &s.sub_num);
+    s.total_num = s.ins_num + s.del_num + s.sub_num;
+    ref_len[i] = static_cast<int>(ref_ids.size());
+  });
+
+  if (!per_utt_path.empty()) {
+    std::ofstream out(per_utt_path, std::ios::binary);
+    if (!out) throw std::runtime_error("Cannot open " + per_utt_path + " for writing");
+    std::string buffer;
+    for (size_t i = 0; i != stats.size(); ++i) {
+      const auto &s = stats[i];
+      buffer.append(refs[ref_index[i]].first);
+      buffer += " #csid " + std::to_string(ref_len[i] - s.sub_num - s.del_num) + " " +
+                std::to_string(s.sub_num) + " " + std::to_string(s.ins_num) + " " +
+                std::to_string(s.del_num) + "\n";
+      if (buffer.size() >= (1 << 20)) {
+        out.write(buffer.data(), buffer.size());
+        buffer.clear();
+      }
+    }
+    out.write(buffer.data(), buffer.size());
+    if (!out) throw std::runtime_error("Cannot write " + per_utt_path);
+  }
+
+  summary.num_scored = stats.size();
+  for (const auto &s : stats) summary.num_sentence_errors += s.total_num > 0;
+  acc->Add(stats, ref_len);
+  return summary;
+}
+
+}  // namespace internal
@@ -1,5 +1,13 @@
 #include <algorithm>
+#include <atomic>
+#include <chrono>
+#include <climits>
+#include <cmath>
+#include <cstdint>
+#include <functional>
+#include <mutex>
 #include <string>
+#include <unordered_map>
 #include <utility>
 #include <vector>
 #include <cassert>
@@ -12,6 +20,30 @@
 #define DEL_COST_SCLITE 3
 #define SUB_COST_SCLITE 4
 
+// Alignments whose DP table has more cells than this switch to the
+// linear-memory variants when the engine is chosen automatically.
+#define LINEAR_MEMORY_MIN_CELLS (1 << 24)
+
+// Read-only view of a contiguous sequence of int symbols.  It is implicitly
+// constructed from a std::vector<int>, and can also wrap memory owned by the
+// caller (e.g. a NumPy array) so that it does not need to be copied.
+class IntSequence {
+ public:
+  IntSequence(const std::vector<int> &v) : data_(v.data()), size_(v.size()) {}
+  IntSequence(const int *data, size_t size) : data_(data), size_(size) {}
+
+  size_t size() const { return size_; }
+  bool empty() const { return size_ == 0; }
+  const int *data() const { return data_; }
+  const int &operator[](size_t i) const { return data_[i]; }
+  const int *begin() const { return data_; }
+  const int *end() const { return data_ + size_; }
+
+ private:
+  const int *data_;
+  size_t size_;
+};
+
 /// Reverses the contents of a vector.
 template <typename T>
 inline void ReverseVector(std::vector<T> *vec) {
@@ -32,48 +64,707 @@ struct error_stats {
 // the following implementation.
 
 
-int LevenshteinEditDistance(const std::vector<int> &ref,
-                            const std::vector<int> &hyp,
+int LevenshteinEditDistance(IntSequence ref,
+                            IntSequence hyp,
                             const bool sclite_mode,
                             int *ins, int *del, int *sub);
 
 
-int LevenshteinAlignment(const std::vector<int> &a,
-                         const std::vector<int> &b,
+// Unit-cost edit distance computed with the bit-parallel algorithm of Myers
+// (in Hyyro's blocked form for references longer than 64 symbols), which
+// processes 64 reference symbols per machine word.  The ins/del/sub
+// breakdown is recovered by a traceback over the stored bit vectors and is
+// identical to LevenshteinEditDistance(..., sclite_mode=false, ...).
+int LevenshteinEditDistanceBitParallel(IntSequence ref,
+                                       IntSequence hyp,
+                                       int *ins, int *del, int *sub);
+
+
+// LevenshteinEditDistance of many pairs, with (*stats)[k] set for
+// (refs[k], hyps[k]) (total_cost is unspecified).  With sclite costs the
+// pairs of up to 256 symbols are grouped by length and packed into the
+// lanes of SIMD registers, several pairs being scored per instruction.
+void LevenshteinEditDistanceMany(const std::vector<IntSequence> &refs,
+                                 const std::vector<IntSequence> &hyps,
+                                 const bool sclite_mode,
+                                 std::vector<error_stats> *stats);
+
+
+// Instruction set of the vectorized DP used for sclite costs (and by
+// LevenshteinAlignment): "avx2", "sse2", "neon", "simd128" (other 128-bit
+// targets) or "scalar".  The best one the CPU supports is chosen at startup.
+const char *SimdBackend();
+
+// Selects the instruction set by name, or the best supported one for
+// "auto".  Returns false (keeping the current one) if the name is unknown or
+// not supported by the CPU.  Meant for tests and benchmarks.
+bool SetSimdBackend(const std::string &name);
+
+
+// LevenshteinEditDistance of one reference against many hypotheses, with
+// (*stats)[k] set for hyps[k].  The reference is prepared once and DP
+// columns are shared between hypotheses with a common prefix (walking the
+// hypotheses in sorted order visits an implicit prefix trie), so n-best
+// lists cost about as much as their distinct prefixes.  Returns the index
+// of the hypothesis with the fewest errors (the first one on ties), or -1
+// if there are none.
+int LevenshteinEditDistanceNBest(IntSequence ref,
+                                 const std::vector<IntSequence> &hyps,
+                                 const bool sclite_mode,
+                                 std::vector<error_stats> *stats);
+
+
+// Number of errors allowed for a reference of ref_len symbols, given an
+// absolute limit and/or a limit relative to ref_len (negative = not set).
+// Returns -1 if neither limit is set.
+inline int MaxErrorsFor(size_t ref_len, int max_errors, double max_err_rate) {
+  int ans = max_errors;
+  if (max_err_rate >= 0) {
+    const double limit = std::floor(max_err_rate * ref_len + 1e-9);
+    const int from_rate = limit >= INT_MAX ? INT_MAX : static_cast<int>(limit);
+    ans = ans < 0 ? from_rate : std::min(ans, from_rate);
+  }
+  return ans;
+}
+
+// LevenshteinEditDistance for callers that only care about distances up to
+// max_errors.  The DP is restricted to the diagonal band that any alignment
+// with at most max_errors errors stays in, and stops as soon as the bound is
+// provably exceeded, so near-matches take O(max_errors * min(M, N)) time.
+// Returns -1 (leaving ins/del/sub unspecified) if the distance exceeds
+// max_errors; otherwise the same result as LevenshteinEditDistance.
+// A negative max_errors means no bound.
+int LevenshteinEditDistanceBounded(IntSequence ref,
+                                   IntSequence hyp,
+                                   const bool sclite_mode,
+                                   const int max_errors,
+                                   int *ins, int *del, int *sub);
+
+
+int LevenshteinAlignment(IntSequence a,
+                         IntSequence b,
                          int eps_symbol,
                          const bool sclite_mode,
                          std::vector<std::pair<int, int> > *output);
 
 
+// Same output as LevenshteinAlignment, but the traceback is recovered by
+// divide and conquer, so memory grows linearly with the sequence lengths
+// instead of with their product (at roughly 2-4x the running time).
+int LevenshteinAlignmentLinearMemory(IntSequence a,
+                                     IntSequence b,
+                                     int eps_symbol,
+                                     const bool sclite_mode,
+                                     std::vector<std::pair<int, int> > *output);
+
+
+// Alignment counterpart of LevenshteinEditDistanceBounded: returns -1 and
+// an empty output if the alignment has more than max_errors errors,
+// otherwise the same result as LevenshteinAlignment.
+int LevenshteinAlignmentBounded(IntSequence a,
+                                IntSequence b,
+                                int eps_symbol,
+                                const bool sclite_mode,
+                                const int max_errors,
+                                std::vector<std::pair<int, int> > *output);
+
+
+// Edit operation codes reported by LevenshteinAlignmentIndices.
+enum AlignmentOp {
+  kOpCorrect = 0,
+  kOpSubstitution = 1,
+  kOpInsertion = 2,
+  kOpDeletion = 3,
+  kOpCompound = 4,  // several words of one sequence matching one word of the other
+};
+
+// Alignment as parallel arrays with one entry per alignment step: its
+// AlignmentOp and the spans [ref_begin, ref_end) of a and [hyp_begin,
+// hyp_end) of b it covers.  Insertions have an empty span of a (and
+// deletions an empty span of b) at the position where they occur, so the
+// spans of consecutive steps are adjacent.
+struct AlignmentColumns {
+  std::vector<int> ops, ref_begin, ref_end, hyp_begin, hyp_end;
+
+  size_t Size() const { return ops.size(); }
+  void Clear() {
+    for (auto *v : {&ops, &ref_begin, &ref_end, &hyp_begin, &hyp_end}) v->clear();
+  }
+  void Append(int op, int rb, int re, int hb, int he) {
+    ops.push_back(op);
+    ref_begin.push_back(rb);
+    ref_end.push_back(re);
+    hyp_begin.push_back(hb);
+    hyp_end.push_back(he);
+  }
+};
+
+// Alignment of a and b as three parallel arrays: the position in a (-1 for
+// insertions), the position in b (-1 for deletions) and the AlignmentOp of
+// every alignment step.  No epsilon symbol needs to be reserved.  A
+// non-negative max_errors bounds the alignment as in
+// LevenshteinAlignmentBounded; -1 and empty outputs are returned when it is
+// exceeded.
+int LevenshteinAlignmentIndices(IntSequence a,
+                                IntSequence b,
+                                const bool sclite_mode,
+                                const int max_errors,
+                                std::vector<int> *ref_idx,
+                                std::vector<int> *hyp_idx,
+                                std::vector<int> *ops);
+
+
+// LevenshteinAlignmentIndices as AlignmentColumns, with the linear-memory
+// engine used if linear_memory is set (and max_errors is negative).
+int LevenshteinAlignmentColumns(IntSequence a,
+                                IntSequence b,
+                                const bool sclite_mode,
+                                const int max_errors,
+                                const bool linear_memory,
+                                AlignmentColumns *output);
+
+
+// Arc of a hypothesis lattice: an acyclic graph with states numbered from 0.
+// Arcs whose label is the epsilon label consume no hypothesis symbol.
+struct LatticeArc {
+  int src;
+  int dst;
+  int label;
+};
+
+// Minimum-cost alignment of ref against any path of the lattice from start
+// to one of finals (all states without outgoing arcs if finals is empty).
+// Costs and tie-breaking are those of LevenshteinAlignment, so a linear
+// lattice gives the same alignment.  The alignment is reported as in
+// LevenshteinAlignmentIndices, with the index of the arc instead of a hyp
+// position; *path receives the arcs of the best path in order, including
+// epsilon arcs.  Time and memory are O((num_arcs + num_states) * ref.size()).
+// Returns the cost, or -1 (and empty outputs) if no final state is
+// reachable.  Throws std::invalid_argument for negative state ids or a
+// lattice with a cycle.
+int LevenshteinAlignmentLattice(IntSequence ref,
+                                const std::vector<LatticeArc> &arcs,
+                                const int start,
+                                const std::vector<int> &finals,
+                                const int eps_label,
+                                const bool sclite_mode,
+                                std::vector<int> *ref_idx,
+                                std::vector<int> *arc_idx,
+                                std::vector<int> *ops,
+                                std::vector<int> *path);
+
+
+// Alignment of a and b given the (start, end) time of every word, where a
+// word of a can only be matched with or substituted by a word of b if the
+// gap between their time spans is at most collar (insertions and deletions
+// are always allowed).  Only a band of the DP matrix following the time
+// diagonal is computed, so the time and memory are about linear in the
+// sequence lengths for short collars.  With an infinite collar the result is
+// that of LevenshteinAlignment.  The alignment is reported as in
+// LevenshteinAlignmentIndices and its cost is returned.  Throws
+// std::invalid_argument if the times don't match the sequences or are not
+// sorted by start time.
+int LevenshteinAlignmentTimed(IntSequence a,
+                              IntSequence b,
+                              const std::vector<std::pair<double, double> > &a_times,
+                              const std::vector<std::pair<double, double> > &b_times,
+                              const double collar,
+                              const bool sclite_mode,
+                              std::vector<int> *ref_idx,
+                              std::vector<int> *hyp_idx,
+                              std::vector<int> *ops);
+
+
+// Summary of a LevenshteinAlignmentAnchored call.
+struct AnchoredAlignmentInfo {
+  int num_anchors;   // runs of matching symbols fixed without a DP
+  int lower_bound;   // lower bound on the cost of the exact alignment
+};
+
+// Approximate alignment of long sequences (e.g. hour-long transcripts).
+// N-grams of ngram symbols that occur exactly once in both a and b are
+// matched, the longest chain of them in monotone order is kept as anchors,
+// and only the segments between anchors are aligned with
+// LevenshteinAlignment, in parallel on up to num_threads threads (<= 0 for
+// all cores).  Segments with more than max_exact_cells DP cells are anchored
+// again, with uniqueness now relative to the segment; inputs (or segments
+// without anchors) within the limit are aligned exactly.  The alignment is
+// reported as in LevenshteinAlignmentIndices and its cost is returned.  The
+// exact cost is at least info->lower_bound (equal to the returned cost when
+// no anchors were used), which bounds how suboptimal the result can be.
+int LevenshteinAlignmentAnchored(IntSequence a,
+                                 IntSequence b,
+                                 const bool sclite_mode,
+                                 const int ngram,
+                                 const long long max_exact_cells,
+                                 const int num_threads,
+                                 std::vector<int> *ref_idx,
+                                 std::vector<int> *hyp_idx,
+                                 std::vector<int> *ops,
+                                 AnchoredAlignmentInfo *info);
+
+
 // Compound-aware variants (string-based).
 // Adjacent words in either sequence can be concatenated to match a single
-// word in the other sequence at zero cost.
+// word in the other sequence at zero cost.  Concatenations of more than
+// max_compound_words words are not considered (negative: no limit).
 
+// Keeps only as many DP rows as the longest compound that actually occurs in
+// the pair spans (at most max_compound_words), so memory is O(K * N).
 int LevenshteinEditDistanceCompound(
     const std::vector<std::string> &ref,
     const std::vector<std::string> &hyp,
     const bool sclite_mode,
-    int *ins, int *del, int *sub);
+    int *ins, int *del, int *sub,
+    const int max_compound_words = -1);
 
 int LevenshteinAlignmentCompound(
     const std::vector<std::string> &a,
     const std::vector<std::string> &b,
     const std::string &eps_symbol,
     const bool sclite_mode,
-    std::vector<std::pair<std::string, std::string>> *output);
+    std::vector<std::pair<std::string, std::string>> *output,
+    const int max_compound_words = -1);
+
+// Linear-memory counterpart of LevenshteinAlignmentCompound (see
+// LevenshteinAlignmentLinearMemory).  Memory is additionally proportional to
+// the longest run of words a compound match can span.
+int LevenshteinAlignmentCompoundLinearMemory(
+    const std::vector<std::string> &a,
+    const std::vector<std::string> &b,
+    const std::string &eps_symbol,
+    const bool sclite_mode,
+    std::vector<std::pair<std::string, std::string>> *output,
+    const int max_compound_words = -1);
+
+// LevenshteinAlignmentCompound (or its linear-memory counterpart) as
+// AlignmentColumns, where compound matches are kOpCompound steps.  No
+// strings are built.
+int LevenshteinAlignmentCompoundColumns(
+    const std::vector<std::string> &a,
+    const std::vector<std::string> &b,
+    const bool sclite_mode,
+    const bool linear_memory,
+    AlignmentColumns *output,
+    const int max_compound_words = -1);
+
+// Whether an alignment of sequences of these lengths should use the
+// linear-memory variant when not requested explicitly.
+inline bool UseLinearMemoryAlignment(size_t ref_len, size_t hyp_len) {
+  return static_cast<double>(ref_len + 1) * (hyp_len + 1) > LINEAR_MEMORY_MIN_CELLS;
+}
+
+
+// Edit costs of the weighted DP: default insertion / deletion / substitution
+// costs, per-symbol insertion and deletion costs, and substitution costs from
+// a dense matrix over the symbols [0, V) and / or sparse (ref, hyp) overrides,
+// which take precedence over the matrix.  Symbols without a cost of their own
+// (including negative ones) get the defaults, and a symbol always matches
+// itself at cost 0.  All costs must be non-negative.  A table must not be
+// modified while it is used for scoring, so the Python bindings fill it in
+// at construction and expose no setters.
+class CostTable {
+ public:
+  CostTable(int ins_cost, int del_cost, int sub_cost)
+      : ins_cost_(ins_cost), del_cost_(del_cost), sub_cost_(sub_cost) {}
+
+  void SetInsCost(int symbol, int cost);
+  void SetDelCost(int symbol, int cost);
+  void SetSubCost(int ref, int hyp, int cost);
+  // costs[ref * num_symbols + hyp] is the cost of substituting hyp for ref.
+  void SetSubMatrix(const int *costs, size_t num_symbols);
+
+  int InsCost(int symbol) const { return PerSymbol(ins_, symbol, ins_cost_); }
+  int DelCost(int symbol) const { return PerSymbol(del_, symbol, del_cost_); }
+  int SubCost(int ref, int hyp) const;
+
+  int DefaultSubCost() const { return sub_cost_; }
+  size_t MatrixSize() const { return matrix_size_; }
+  // Row ref of the substitution matrix; ref must be in [0, MatrixSize()).
+  const int *MatrixRow(int ref) const { return matrix_.data() + ref * matrix_size_; }
+  // The sparse overrides for ref as (hyp, cost) pairs sorted by hyp, or null.
+  const std::vector<std::pair<int, int>> *SubOverrides(int ref) const;
+
+ private:
+  static int PerSymbol(const std::vector<int> &costs, int symbol, int fallback) {
+    if (symbol < 0 || static_cast<size_t>(symbol) >= costs.size() || costs[symbol] < 0)
+      return fallback;
+    return costs[symbol];
+  }
+
+  int ins_cost_, del_cost_, sub_cost_;
+  std::vector<int> ins_, del_;  // -1: the default cost
+  size_t matrix_size_ = 0;
+  std::vector<int> matrix_;
+  std::unordered_map<int, std::vector<std::pair<int, int>>> overrides_;
+};
+
+// LevenshteinEditDistance with the costs of a CostTable: *stats receives
+// the ins / del / sub counts of the cheapest alignment (with the tie-breaking
+// of LevenshteinEditDistance) and its total_cost.  Returns the number of
+// errors.
+int LevenshteinEditDistanceWeighted(IntSequence ref,
+                                    IntSequence hyp,
+                                    const CostTable &costs,
+                                    error_stats *stats);
+
+// LevenshteinAlignment (LevenshteinAlignmentLinearMemory if linear_memory)
+// with the costs of a CostTable.  Returns the cost of the alignment.
+int LevenshteinAlignmentWeighted(IntSequence a,
+                                 IntSequence b,
+                                 int eps_symbol,
+                                 const CostTable &costs,
+                                 const bool linear_memory,
+                                 std::vector<std::pair<int, int> > *output);
+
+
+// Interns string symbols as consecutive ints starting from 0, so that a
+// vocabulary can be built once and reused to encode many sequences.  All
+// methods are safe to call from several threads.
+class SymbolTable {
+ public:
+  SymbolTable() = default;
+  SymbolTable(const SymbolTable &) = delete;
+  SymbolTable &operator=(const SymbolTable &) = delete;
+
+  // Id of symbol, adding it to the table if it is not there yet.
+  int Intern(const std::string &symbol);
+
+  // Id of symbol, or -1 if it is not in the table.
+  int Find(const std::string &symbol) const;
+
+  // Encodes every symbol of seqs into *ids (which is resized to match).
+  // With add == false, unknown symbols are not added; the index of the
+  // first one is returned as {sequence, position}, or {-1, -1} if all were
+  // known.
+  std::pair<int, int> Encode(const std::vector<std::vector<std::string>> &seqs,
+                             const bool add,
+                             std::vector<std::vector<int>> *ids);
+
+  // Symbol with the given id; id must be in [0, Size()).
+  std::string Symbol(int id) const;
+
+  // Symbols with the given ids; returns false if any id is out of range.
+  bool Decode(const std::vector<int> &ids, std::vector<std::string> *symbols) const;
+
+  size_t Size() const;
+
+ private:
+  int InternLocked(const std::string &symbol);
+
+  mutable std::mutex mutex_;
+  std::unordered_map<std::string, int> ids_;
+  std::vector<std::string> symbols_;
+};
+
+
+// Corpus-level error counts gathered incrementally: running ins / del / sub /
+// ref_len totals plus the per-utterance (errors, ref_len) pairs needed for
+// bootstrapping.  Accumulators built on different shards can be merged and
+// serialized to a compact binary blob.  All methods are safe to call from
+// several threads.
+class WerAccumulator {
+ public:
+  struct Totals {
+    int64_t ins = 0;
+    int64_t del = 0;
+    int64_t sub = 0;
+    int64_t ref_len = 0;
+  };
+
+  explicit WerAccumulator(bool sclite_mode = false, bool merge_compounds = false)
+      : sclite_mode_(sclite_mode), merge_compounds_(merge_compounds) {}
+  WerAccumulator(const WerAccumulator &) = delete;
+  WerAccumulator &operator=(const WerAccumulator &) = delete;
+
+  bool ScliteMode() const { return sclite_mode_; }
+  bool MergeCompounds() const { return merge_compounds_; }
+
+  // Appends one utterance per entry of stats, with the given reference lengths.
+  void Add(const std::vector<error_stats> &stats, const std::vector<int> &ref_len);
+
+  // Appends the utterances of other after the ones already here.  Returns
+  // false (and changes nothing) if other was built with different settings.
+  bool Merge(const WerAccumulator &other);
+
+  std::string Serialize() const;
+
+  // Replaces the contents with a blob written by Serialize(), including the
+  // settings.  Returns false (and changes nothing) if the blob is malformed.
+  bool Deserialize(const std::string &data);
+
+  Totals GetTotals() const;
+
+  size_t NumUtterances() const;
+
+  // Per-utterance (errors, ref_len) pairs in the order they were added.
+  std::vector<std::pair<int, int>> Edits() const;
+
+ private:
+  mutable std::mutex mutex_;
+  bool sclite_mode_;
+  bool merge_compounds_;
+  Totals totals_;
+  std::vector<std::pair<int, int>> edits_;
+};
+
+// Alignment of a fixed reference against a hypothesis that grows and shrinks
+// at its end, like the partial results of a streaming recognizer.  One DP
+// column is kept per hyp symbol, so extending the hyp costs O(ref.size())
+// per symbol (O(ref.size() / 64) with unit costs) and retracting is O(1).
+// Costs and tie-breaking are those of LevenshteinAlignment.
+//
+// With partial = true, the hyp is aligned against the prefix of the
+// reference it covers so far: the one with the cheapest alignment (the
+// longest one on ties), so that the rest of the reference is not counted as
+// deleted.  Otherwise it is aligned against the whole reference.
+class IncrementalAligner {
+ public:
+  explicit IncrementalAligner(const std::vector<int> &ref, bool sclite_mode = false);
+  IncrementalAligner(const IncrementalAligner &) = delete;
+  IncrementalAligner &operator=(const IncrementalAligner &) = delete;
+
+  bool ScliteMode() const { return sclite_mode_; }
+  size_t RefSize() const { return ref_.size(); }
+  size_t HypSize() const;
+
+  // Appends symbols to the hyp.
+  void Extend(IntSequence symbols);
+
+  // Removes the last n symbols of the hyp (all of them if there are fewer).
+  void Retract(size_t n);
 
+  // Errors of the alignment; *ref_len receives the length of the reference
+  // (prefix) the hyp is aligned against.
+  error_stats Stats(bool partial, int *ref_len) const;
+
+  // The alignment, reported as in LevenshteinAlignmentIndices.
+  void Alignment(bool partial,
+                 std::vector<int> *ref_idx,
+                 std::vector<int> *hyp_idx,
+                 std::vector<int> *ops) const;
+
+ private:
+  int Cost(size_t i, size_t j) const;  // D[i][j]
+  size_t RefPrefix(bool partial) const;
+  template <typename Visit>
+  void Traceback(size_t ref_len, Visit visit) const;
+
+  mutable std::mutex mutex_;
+  const std::vector<int> ref_;
+  const bool sclite_mode_;
+  std::vector<int> hyp_;
+  // Unit costs: the bit-parallel columns (see LevenshteinEditDistanceBitParallel)
+  // with the reference positions sorted by symbol to build the equality
+  // masks.  Sclite costs: plain columns of DP values.
+  size_t num_words_;
+  std::vector<std::pair<int, int>> by_symbol_;
+  std::vector<uint64_t> eq_;
+  std::vector<uint64_t> pv_, mv_;
+  std::vector<int> scores_;
+  std::vector<int> cols_;
+};
 
 namespace internal{
+    // Calls fn(i) for every i in [0, n), spreading the work over up to
+    // num_threads worker threads (num_threads <= 0 uses all available cores).
+    void ParallelFor(
+        size_t n,
+        int num_threads,
+        const std::function<void(size_t)> &fn
+    );
+
+    // Pairs whose distance exceeds max_errors (if non-negative) get -1 errors.
     std::vector<std::pair<int, int>> GetEdits(
         const std::vector<std::vector<int>> &refs,
-        const std::vector<std::vector<int>> &hyps
+        const std::vector<std::vector<int>> &hyps,
+        const int max_errors = -1
     );
 
     std::vector<std::pair<int, int>> GetEditsCompound(
         const std::vector<std::vector<std::string>> &refs,
-        const std::vector<std::vector<std::string>> &hyps
+        const std::vector<std::vector<std::string>> &hyps,
+        const int max_compound_words = -1
+    );
+
+    // Per-pair ins/del/sub/total statistics computed over a thread pool.
+    // Pairs with more errors than allowed by max_errors / max_err_rate
+    // (see MaxErrorsFor) get -1 in every field.
+    std::vector<error_stats> GetEditStats(
+        const std::vector<IntSequence> &refs,
+        const std::vector<IntSequence> &hyps,
+        const bool sclite_mode,
+        const int num_threads,
+        const int max_errors = -1,
+        const double max_err_rate = -1
+    );
+
+    // GetEditStats / GetAlignments with the costs of a CostTable.  The error
+    // bound is checked after the DP, which is not restricted to a band.
+    std::vector<error_stats> GetEditStatsWeighted(
+        const std::vector<IntSequence> &refs,
+        const std::vector<IntSequence> &hyps,
+        const CostTable &costs,
+        const int num_threads,
+        const int max_errors = -1,
+        const double max_err_rate = -1
+    );
+
+    std::vector<std::vector<std::pair<int, int>>> GetAlignmentsWeighted(
+        const std::vector<IntSequence> &refs,
+        const std::vector<IntSequence> &hyps,
+        const int eps_symbol,
+        const CostTable &costs,
+        const int num_threads,
+        const int max_errors = -1,
+        const double max_err_rate = -1,
+        std::vector<char> *within_limit = nullptr
+    );
+
+    std::vector<error_stats> GetEditStatsCompound(
+        const std::vector<std::vector<std::string>> &refs,
+        const std::vector<std::vector<std::string>> &hyps,
+        const bool sclite_mode,
+        const int num_threads,
+        const int max_errors = -1,
+        const double max_err_rate = -1,
+        const int max_compound_words = -1
+    );
+
+    // Alignments of every pair; pairs over the error limit get an empty
+    // alignment and false in *within_limit (if given).
+    std::vector<std::vector<std::pair<int, int>>> GetAlignments(
+        const std::vector<IntSequence> &refs,
+        const std::vector<IntSequence> &hyps,
+        const int eps_symbol,
+        const bool sclite_mode,
+        const int num_threads,
+        const int max_errors = -1,
+        const double max_err_rate = -1,
+        std::vector<char> *within_limit = nullptr
+    );
+
+    std::vector<std::vector<std::pair<std::string, std::string>>> GetAlignmentsCompound(
+        const std::vector<std::vector<std::string>> &refs,
+        const std::vector<std::vector<std::string>> &hyps,
+        const std::string &eps_symbol,
+        const bool sclite_mode,
+        const int num_threads,
+        const int max_errors = -1,
+        const double max_err_rate = -1,
+        std::vector<char> *within_limit = nullptr,
+        const int max_compound_words = -1
+    );
+
+    // Corpus-level error statistics returned by GetErrorReport.  The symbol
+    // counts are sorted by decreasing count, then by symbol ids.
+    struct ErrorReport {
+        // Substituted (ref, hyp) symbol pairs.
+        std::vector<int> sub_ref, sub_hyp;
+        std::vector<int64_t> sub_count;
+        // Inserted hyp symbols and deleted ref symbols.
+        std::vector<int> ins_symbol, del_symbol;
+        std::vector<int64_t> ins_count, del_count;
+
+        struct GroupTotals {
+            int64_t ins = 0;
+            int64_t del = 0;
+            int64_t sub = 0;
+            int64_t ref_len = 0;
+            int64_t num_utts = 0;
+            int64_t num_sent_err = 0;  // utterances with at least one error
+        };
+        std::vector<GroupTotals> groups;
+    };
+
+    // Aligns every pair (as LevenshteinAlignment) over a thread pool and
+    // aggregates the errors in hash maps keyed by symbol id, counting pair i
+    // in group groups[i] (all pairs in group 0 if groups is empty).  Only
+    // the top_k most frequent entries of each kind are returned (all of
+    // them if top_k is negative).
+    ErrorReport GetErrorReport(
+        const std::vector<IntSequence> &refs,
+        const std::vector<IntSequence> &hyps,
+        const std::vector<int> &groups,
+        const int num_groups,
+        const bool sclite_mode,
+        const int num_threads,
+        const int top_k = -1
+    );
+
+    // Summary of ScoreTextFiles.
+    struct TextScoreSummary {
+        size_t num_scored = 0;           // utterances added to the accumulator
+        size_t num_missing = 0;          // ref utterances without a hyp
+        size_t num_sentence_errors = 0;  // scored utterances with any error
+    };
+
+    // Scores two Kaldi-style text files (one "utt-id w1 w2 ..." per line).
+    // Both files are memory-mapped; lines are joined by utterance id in the
+    // order of the ref file and scored on num_threads threads into acc (with
+    // its sclite mode).  missing_hyp says what to do with ref utterances that
+    // are not in the hyp file: "strict" (throw), "present" (skip them) or
+    // "all" (score them as empty).  If per_utt_path is not empty, a
+    // "<utt-id> #csid <cor> <sub> <ins> <del>" line per utterance is written
+    // there.  Throws std::runtime_error on I/O errors and std::invalid_argument
+    // on duplicate ids or missing hyps in strict mode.
+    TextScoreSummary ScoreTextFiles(
+        const std::string &ref_path,
+        const std::string &hyp_path,
+        const std::string &missing_hyp,
+        const int num_threads,
+        const std::string &per_utt_path,
+        WerAccumulator *acc
+    );
+
+    // Per-replication WERs of a bootstrap run over one or two systems.
+    struct BootstrapResult {
+        std::vector<double> wer;   // system 1
+        std::vector<double> wer2;  // system 2 (empty for a single system)
+        double p_improv = 0.0;     // fraction of replications where system 2 has fewer errors
+    };
+
+    // Resamples the utterances `replications` times.  Replication r draws
+    // from its own random stream derived from (seed, r), so the result is
+    // the same for any num_threads.  Both systems (edit_sym_per_hyp2 may be
+    // null) are scored on the same resamples in a single pass.
+    BootstrapResult Bootstrap(
+        const std::vector<std::pair<int, int>> &edit_sym_per_hyp,
+        const std::vector<std::pair<int, int>> *edit_sym_per_hyp2,
+        const int replications,
+        const uint64_t seed,
+        const int num_threads
+    );
+
+    // Per-replication WERs of a bootstrap run over any number of systems.
+    struct MultiBootstrapResult {
+        std::vector<std::vector<double>> wer;  // per system, per replication
+        // S x S, row-major: p_improv[a * S + b] is the fraction of
+        // replications where system b has fewer errors than system a.
+        std::vector<double> p_improv;
+    };
+
+    // Bootstrap with every system scored on the same resamples, drawn as in
+    // Bootstrap: the WERs of the first two systems and p_improv[0 * S + 1]
+    // are those Bootstrap gives for them.
+    MultiBootstrapResult BootstrapMulti(
+        const std::vector<std::vector<std::pair<int, int>>> &systems,
+        const int replications,
+        const uint64_t seed,
+        const int num_threads
     );
 
+    // 95% interval of the per-replication WERs: mean +/- 1.96 standard
+    // deviations, or the 2.5th / 97.5th percentiles when percentile is true.
+    struct WerInterval {
+        double mean;
+        double interval;  // half-width of [lower, upper]
+        double lower;
+        double upper;
+    };
+
+    WerInterval GetWerInterval(std::vector<double> wer, const bool percentile);
+
     std::pair<double, double> GetBootstrapWerInterval(
         const std::vector<std::pair<int, int>> &edit_sym_per_hyp,
         const int replications,
@@ -86,4 +777,111 @@ namespace internal{
         const int replications,
         const unsigned int seed
     );
+
+    // Opt-in profiling of the scoring code (see kaldialign.profile()).
+    // While disabled every hook costs a single relaxed atomic load; once
+    // enabled, the counters and times of all threads are summed until
+    // Reset().  Only the counters are shared: the code that runs is the
+    // same whether profiling is enabled or not.
+    enum ProfileCounter {
+        kProfileDpCells,           // DP cells evaluated
+        kProfileDpBytes,           // bytes allocated for DP tables
+        kProfileCompoundAttempts,  // runs of words looked up as a compound
+        kProfileCompoundHits,      // runs spelling a word of the other sequence
+        kProfileNumCounters
+    };
+
+    // Nanosecond totals.  kProfileNative and kProfileCall are end-to-end
+    // times of calls; the other stages are exclusive: a ProfileScope pauses
+    // the scope it is nested in on the same thread.
+    enum ProfileTimer {
+        kProfileSymbols,     // symbol mapping, in SymbolTable and in Python
+        kProfileNative,      // native calls made from Python, conversions included
+        kProfileCall,        // bodies of the profiled bindings
+        kProfileBinding,     // binding code outside of the stages below
+        kProfileDp,          // filling DP tables and tracing back
+        kProfileCompound,    // finding compound candidates
+        kProfileResult,      // building the result objects
+        kProfileNumTimers
+    };
+
+    class Profiler {
+     public:
+        static bool Enabled() { return enabled_.load(std::memory_order_relaxed) > 0; }
+        // Calls nest: profiling stays enabled until every Enable(true) has
+        // been matched by an Enable(false).
+        static void Enable(bool enabled) {
+            enabled_.fetch_add(enabled ? 1 : -1, std::memory_order_relaxed);
+        }
+
+        static void Count(ProfileCounter counter, int64_t n) {
+            if (Enabled()) counters_[counter].fetch_add(n, std::memory_order_relaxed);
+        }
+
+        // A DP table of the given number of cells, allocated in bytes bytes.
+        static void CountDp(int64_t cells, int64_t bytes) {
+            if (!Enabled()) return;
+            counters_[kProfileDpCells].fetch_add(cells, std::memory_order_relaxed);
+            counters_[kProfileDpBytes].fetch_add(bytes, std::memory_order_relaxed);
+        }
+
+        static void AddTime(ProfileTimer timer, int64_t ns) {
+            if (Enabled()) ns_[timer].fetch_add(ns, std::memory_order_relaxed);
+        }
+
+        // A call of the named entry point from Python that took ns nanoseconds.
+        static void AddCall(const std::string &name, int64_t ns);
+
+        static int64_t Counter(ProfileCounter counter) {
+            return counters_[counter].load(std::memory_order_relaxed);
+        }
+        static int64_t Time(ProfileTimer timer) {
+            return ns_[timer].load(std::memory_order_relaxed);
+        }
+        static std::vector<std::pair<std::string, int64_t>> Calls();
+
+        static void Reset();
+
+        static int64_t Now() {
+            return std::chrono::duration_cast<std::chrono::nanoseconds>(
+                std::chrono::steady_clock::now().time_since_epoch()).count();
+        }
+
+     private:
+        static inline std::atomic<int> enabled_{0};
+        static inline std::atomic<int64_t> counters_[kProfileNumCounters];
+        static inline std::atomic<int64_t> ns_[kProfileNumTimers];
+    };
+
+    // Adds the time from its construction to its destruction to a stage,
+    // except for the time spent in the scopes nested in it.
+    class ProfileScope {
+     public:
+        explicit ProfileScope(ProfileTimer stage) : stage_(stage), active_(Profiler::Enabled()) {
+            if (!active_) return;
+            start_ = Profiler::Now();
+            parent_ = current_;
+            if (parent_ != nullptr) Profiler::AddTime(parent_->stage_, start_ - parent_->start_);
+            current_ = this;
+        }
+
+        ~ProfileScope() {
+            if (!active_) return;
+            const int64_t now = Profiler::Now();
+            Profiler::AddTime(stage_, now - start_);
+            current_ = parent_;
+            if (parent_ != nullptr) parent_->start_ = now;
+        }
+
+        ProfileScope(const ProfileScope &) = delete;
+        ProfileScope &operator=(const ProfileScope &) = delete;
+
+     private:
+        static inline thread_local ProfileScope *current_ = nullptr;
+
+        const ProfileTimer stage_;
+        const bool active_;
+        int64_t start_ = 0;
+        ProfileScope *parent_ = nullptr;
+    };
 }
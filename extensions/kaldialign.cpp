@@ -1,16 +1,221 @@
+#include <cstdint>
+#include <cstring>
+#include <memory>
+#include <optional>
+#include <tuple>
+#include <type_traits>
 #include "kaldi_align.h"
 #include "pybind11/pybind11.h"
 #include "pybind11/stl.h"
 namespace py = pybind11;
 
-static py::dict EditDistance(const std::vector<int> &a,
-                             const std::vector<int> &b,
-                             const bool sclite_mode) {
+using internal::ProfileScope;
+using internal::Profiler;
+
+// Call guard of the scoring functions: times their bodies (without the
+// conversion of the arguments and of the return value) and counts the time
+// outside of the native stages as binding time.  The calls themselves are
+// counted by the process_attribute specialization below.
+class ProfileCall {
+ public:
+  ProfileCall() : start_(Profiler::Enabled() ? Profiler::Now() : -1) {}
+  ~ProfileCall() {
+    if (start_ >= 0) Profiler::AddTime(internal::kProfileCall, Profiler::Now() - start_);
+  }
+
+ private:
+  const int64_t start_;
+  ProfileScope scope_{internal::kProfileBinding};
+};
+
+using profiled = py::call_guard<ProfileCall>;
+using profiled_release_gil = py::call_guard<ProfileCall, py::gil_scoped_release>;
+
+namespace pybind11::detail {
+
+// Counts the calls of every function guarded by ProfileCall under its name
+// ("Class.method" for methods) and times them end to end: pybind11 runs
+// precall before converting the arguments and postcall once the return value
+// is converted.  A call that raises is neither counted nor timed.
+template <typename... Guards>
+struct process_attribute<call_guard<ProfileCall, Guards...>>
+    : process_attribute_default<call_guard<ProfileCall, Guards...>> {
+  static void precall(function_call &) {
+    start_ = Profiler::Enabled() ? Profiler::Now() : -1;
+  }
+
+  static void postcall(function_call &call, handle) {
+    if (start_ < 0) return;
+    const int64_t ns = Profiler::Now() - start_;
+    start_ = -1;
+    std::string name = call.func.name;
+    if (call.func.is_method && call.func.scope)
+      name = call.func.scope.attr("__name__").cast<std::string>() + "." + name;
+    Profiler::AddCall(name, ns);
+  }
+
+ private:
+  static inline thread_local int64_t start_ = -1;
+};
+
+}  // namespace pybind11::detail
+
+// ProfileScope for the stages run in Python, used as a context manager.
+// The object holds no state of its own, so one instance can be shared by all
+// threads; the open scopes are kept per thread.
+class PythonProfileScope {
+ public:
+  explicit PythonProfileScope(internal::ProfileTimer stage) : stage_(stage) {}
+
+  void Enter() const {
+    OpenScopes().push_back(Profiler::Enabled() ? std::make_unique<ProfileScope>(stage_)
+                                               : nullptr);
+  }
+
+  void Exit() const {
+    if (!OpenScopes().empty()) OpenScopes().pop_back();
+  }
+
+ private:
+  static std::vector<std::unique_ptr<ProfileScope>> &OpenScopes() {
+    static thread_local std::vector<std::unique_ptr<ProfileScope>> scopes;
+    return scopes;
+  }
+
+  const internal::ProfileTimer stage_;
+};
+
+// Packs a vector of ints into a compact Python ``array.array('i')``.
+static py::object ToIntArray(const std::vector<int> &values) {
+  ProfileScope profile(internal::kProfileResult);
+  py::object arr = py::module_::import("array").attr("array")("i");
+  arr.attr("frombytes")(py::bytes(reinterpret_cast<const char *>(values.data()),
+                                  values.size() * sizeof(int)));
+  return arr;
+}
+
+static py::dict EditStatsToDict(const std::vector<error_stats> &stats,
+                                const std::vector<int> &ref_len) {
+  ProfileScope profile(internal::kProfileResult);
+  std::vector<int> ins(stats.size()), del(stats.size()), sub(stats.size()),
+      total(stats.size());
+  for (size_t i = 0; i != stats.size(); ++i) {
+    ins[i] = stats[i].ins_num;
+    del[i] = stats[i].del_num;
+    sub[i] = stats[i].sub_num;
+    total[i] = stats[i].total_num;
+  }
+  py::dict ans;
+  ans["ins"] = ToIntArray(ins);
+  ans["del"] = ToIntArray(del);
+  ans["sub"] = ToIntArray(sub);
+  ans["total"] = ToIntArray(total);
+  ans["ref_len"] = ToIntArray(ref_len);
+  return ans;
+}
+
+template <typename Seq>
+static std::vector<int> Lengths(const std::vector<Seq> &seqs) {
+  std::vector<int> ans(seqs.size());
+  for (size_t i = 0; i != seqs.size(); ++i) ans[i] = static_cast<int>(seqs[i].size());
+  return ans;
+}
+
+// Integer symbols read from a Python object supporting the buffer protocol
+// (e.g. a NumPy array or an ``array.array``).  One-dimensional buffers of
+// native int32 are used in place; other integer types and strided buffers are
+// converted once.  Must be created and destroyed with the GIL held.
+class IntBuffer {
+ public:
+  explicit IntBuffer(const py::buffer &buf) : info_(buf.request()) {
+    if (info_.ndim != 1)
+      throw py::value_error("Expected a 1-D buffer of integers, got " +
+                            std::to_string(info_.ndim) + " dimensions.");
+    std::string format = info_.format;
+    if (!format.empty() && (format[0] == '@' || format[0] == '='))
+      format.erase(0, 1);
+    const std::string kSigned = "bhilq", kUnsigned = "BHILQ";
+    if (format.size() != 1 || (kSigned.find(format[0]) == std::string::npos &&
+                               kUnsigned.find(format[0]) == std::string::npos))
+      throw py::type_error("Expected a buffer of native integers, got format '" +
+                           info_.format + "'.");
+    const bool is_signed = kSigned.find(format[0]) != std::string::npos;
+    if (is_signed && info_.itemsize == sizeof(int) && info_.strides[0] == sizeof(int) &&
+        reinterpret_cast<uintptr_t>(info_.ptr) % alignof(int) == 0)
+      return;  // Zero-copy.
+    converted_.resize(info_.shape[0]);
+    switch (info_.itemsize) {
+      case 1: is_signed ? Convert<int8_t>() : Convert<uint8_t>(); break;
+      case 2: is_signed ? Convert<int16_t>() : Convert<uint16_t>(); break;
+      case 4: is_signed ? Convert<int32_t>() : Convert<uint32_t>(); break;
+      case 8: is_signed ? Convert<int64_t>() : Convert<uint64_t>(); break;
+      default:
+        throw py::type_error("Unsupported integer size: " +
+                             std::to_string(info_.itemsize) + " bytes.");
+    }
+    copied_ = true;
+  }
+
+  IntSequence View() const {
+    if (copied_) return converted_;
+    return IntSequence(static_cast<const int *>(info_.ptr), info_.shape[0]);
+  }
+
+ private:
+  template <typename T>
+  void Convert() {
+    const char *ptr = static_cast<const char *>(info_.ptr);
+    for (size_t i = 0; i != converted_.size(); ++i, ptr += info_.strides[0]) {
+      T value;
+      std::memcpy(&value, ptr, sizeof(T));
+      if ((std::is_signed<T>::value && static_cast<int64_t>(value) < INT_MIN) ||
+          (value > 0 && static_cast<uint64_t>(value) > INT_MAX))
+        throw py::value_error("Symbol " + std::to_string(value) +
+                              " does not fit into a 32-bit integer.");
+      converted_[i] = static_cast<int>(value);
+    }
+  }
+
+  py::buffer_info info_;
+  std::vector<int> converted_;
+  bool copied_ = false;
+};
+
+static std::vector<IntSequence> Views(const std::vector<std::vector<int>> &seqs) {
+  return std::vector<IntSequence>(seqs.begin(), seqs.end());
+}
+
+static std::vector<IntSequence> Views(const std::vector<IntBuffer> &bufs) {
+  std::vector<IntSequence> ans;
+  ans.reserve(bufs.size());
+  for (const auto &buf : bufs) ans.push_back(buf.View());
+  return ans;
+}
+
+static std::vector<IntBuffer> RequestBuffers(const std::vector<py::buffer> &objs) {
+  std::vector<IntBuffer> ans;
+  ans.reserve(objs.size());
+  for (const auto &obj : objs) ans.emplace_back(obj);
+  return ans;
+}
+
+// Returns None when the distance exceeds the error bound.
+static py::object EditDistance(IntSequence a,
+                               IntSequence b,
+                               const bool sclite_mode,
+                               const int max_errors,
+                               const double max_err_rate) {
   int ins;
   int del;
   int sub;
-
-  int total = LevenshteinEditDistance(a, b, sclite_mode, &ins, &del, &sub);
+  int total;
+  {
+    py::gil_scoped_release release;
+    total = LevenshteinEditDistanceBounded(
+        a, b, sclite_mode, MaxErrorsFor(a.size(), max_errors, max_err_rate),
+        &ins, &del, &sub);
+  }
+  if (total < 0) return py::none();
   py::dict ans;
   ans["ins"] = ins;
   ans["del"] = del;
@@ -19,18 +224,266 @@ static py::dict EditDistance(const std::vector<int> &a,
   return ans;
 }
 
-static std::vector<std::pair<int, int>>
-Align(const std::vector<int> &a, const std::vector<int> &b, int eps_symbol, const bool sclite_mode) {
+// Returns None when the alignment cost exceeds the error bound.
+static py::object
+Align(IntSequence a, IntSequence b, int eps_symbol, const bool sclite_mode,
+      const std::optional<bool> linear_memory, const int max_errors,
+      const double max_err_rate) {
   std::vector<std::pair<int, int>> ans;
-  LevenshteinAlignment(a, b, eps_symbol, sclite_mode, &ans);
-  return ans;
+  bool within_limit = true;
+  {
+    py::gil_scoped_release release;
+    const int limit = MaxErrorsFor(a.size(), max_errors, max_err_rate);
+    if (limit >= 0) {
+      within_limit =
+          LevenshteinAlignmentBounded(a, b, eps_symbol, sclite_mode, limit, &ans) >= 0;
+    } else if (linear_memory.value_or(UseLinearMemoryAlignment(a.size(), b.size()))) {
+      LevenshteinAlignmentLinearMemory(a, b, eps_symbol, sclite_mode, &ans);
+    } else {
+      LevenshteinAlignment(a, b, eps_symbol, sclite_mode, &ans);
+    }
+  }
+  if (!within_limit) return py::none();
+  ProfileScope profile(internal::kProfileResult);
+  return py::cast(ans);
+}
+
+static py::object EditDistanceBuffer(const py::buffer &a, const py::buffer &b,
+                                     const bool sclite_mode, const int max_errors,
+                                     const double max_err_rate) {
+  IntBuffer a_buf(a), b_buf(b);
+  return EditDistance(a_buf.View(), b_buf.View(), sclite_mode, max_errors, max_err_rate);
+}
+
+static py::object AlignBuffer(const py::buffer &a, const py::buffer &b, int eps_symbol,
+                              const bool sclite_mode,
+                              const std::optional<bool> linear_memory,
+                              const int max_errors, const double max_err_rate) {
+  IntBuffer a_buf(a), b_buf(b);
+  return Align(a_buf.View(), b_buf.View(), eps_symbol, sclite_mode, linear_memory,
+               max_errors, max_err_rate);
+}
+
+// Returns a (ref_idx, hyp_idx, op) tuple of ``array.array('i')``, or None when
+// the alignment exceeds the error bound.
+static py::object AlignIndices(const py::buffer &a, const py::buffer &b,
+                               const bool sclite_mode, const int max_errors,
+                               const double max_err_rate) {
+  IntBuffer a_buf(a), b_buf(b);
+  std::vector<int> ref_idx, hyp_idx, ops;
+  int cost;
+  {
+    py::gil_scoped_release release;
+    const IntSequence ref = a_buf.View();
+    cost = LevenshteinAlignmentIndices(
+        ref, b_buf.View(), sclite_mode,
+        MaxErrorsFor(ref.size(), max_errors, max_err_rate), &ref_idx, &hyp_idx, &ops);
+  }
+  if (cost < 0) return py::none();
+  return py::make_tuple(ToIntArray(ref_idx), ToIntArray(hyp_idx), ToIntArray(ops));
+}
+
+// Returns a (ref_idx, hyp_idx, op) tuple of ``array.array('i')``, see
+// LevenshteinAlignmentTimed.
+static py::tuple AlignTimed(const py::buffer &a, const py::buffer &b,
+                            const std::vector<std::pair<double, double>> &a_times,
+                            const std::vector<std::pair<double, double>> &b_times,
+                            const double collar, const bool sclite_mode) {
+  IntBuffer a_buf(a), b_buf(b);
+  std::vector<int> ref_idx, hyp_idx, ops;
+  {
+    py::gil_scoped_release release;
+    LevenshteinAlignmentTimed(a_buf.View(), b_buf.View(), a_times, b_times, collar,
+                              sclite_mode, &ref_idx, &hyp_idx, &ops);
+  }
+  return py::make_tuple(ToIntArray(ref_idx), ToIntArray(hyp_idx), ToIntArray(ops));
+}
+
+// Returns (cost, lower_bound, num_anchors, ref_idx, hyp_idx, op), see
+// LevenshteinAlignmentAnchored.
+static py::tuple AlignAnchored(const py::buffer &a, const py::buffer &b,
+                               const bool sclite_mode, const int ngram,
+                               const long long max_exact_cells, const int num_threads) {
+  IntBuffer a_buf(a), b_buf(b);
+  std::vector<int> ref_idx, hyp_idx, ops;
+  AnchoredAlignmentInfo info;
+  int cost;
+  {
+    py::gil_scoped_release release;
+    cost = LevenshteinAlignmentAnchored(a_buf.View(), b_buf.View(), sclite_mode, ngram,
+                                        max_exact_cells, num_threads, &ref_idx, &hyp_idx,
+                                        &ops, &info);
+  }
+  return py::make_tuple(cost, info.lower_bound, info.num_anchors, ToIntArray(ref_idx),
+                        ToIntArray(hyp_idx), ToIntArray(ops));
+}
+
+// Alignment returned by ``align_columnar``: the AlignmentColumns stored as
+// one C-contiguous (5, n) int32 block, exported with the buffer protocol,
+// and the sequences they index into, used to build tuples on demand.
+class AlignmentResult {
+ public:
+  static const size_t kNumFields = 5;
+
+  AlignmentResult(const AlignmentColumns &columns, py::object ref, py::object hyp,
+                  const bool compound)
+      : size_(columns.Size()), ref_(std::move(ref)), hyp_(std::move(hyp)),
+        compound_(compound) {
+    data_.reserve(kNumFields * size_);
+    for (const auto *v : {&columns.ops, &columns.ref_begin, &columns.ref_end,
+                          &columns.hyp_begin, &columns.hyp_end})
+      data_.insert(data_.end(), v->begin(), v->end());
+  }
+
+  size_t Size() const { return size_; }
+  int *Data() { return data_.data(); }
+  int Get(size_t field, size_t k) const { return data_[field * size_ + k]; }
+
+  // The alignment in the format of ``align`` (``align_compound`` for
+  // compound alignments, whose words are joined by spaces).
+  py::list Pairs(const py::object &eps_symbol) const {
+    const py::object eps = compound_ ? py::str(eps_symbol) : eps_symbol;
+    const py::str space(" ");
+    auto side = [&](const py::object &seq, int begin, int end) -> py::object {
+      if (begin == end) return eps;
+      if (end - begin == 1) return seq[py::int_(begin)];
+      return space.attr("join")(seq[py::slice(begin, end, 1)]);
+    };
+    py::list ans(size_);
+    for (size_t k = 0; k < size_; k++)
+      ans[k] = py::make_tuple(side(ref_, Get(1, k), Get(2, k)), side(hyp_, Get(3, k), Get(4, k)));
+    return ans;
+  }
+
+ private:
+  size_t size_;
+  std::vector<int> data_;
+  py::object ref_, hyp_;
+  bool compound_;
+};
+
+static void BindAlignmentResult(py::module_ &m) {
+  auto cls = py::class_<AlignmentResult>(m, "AlignmentResult", py::buffer_protocol(), R"(
+Compact alignment returned by :func:`kaldialign.align_columnar`.
+
+One step of the alignment per column of a ``(5, len(result))`` int32 array,
+exposed with the buffer protocol (e.g. ``numpy.asarray(result)``) and as the
+``op``, ``ref_start``, ``ref_end``, ``hyp_start`` and ``hyp_end`` rows.  Step ``k``
+aligns ``ref[ref_start[k]:ref_end[k]]`` with ``hyp[hyp_start[k]:hyp_end[k]]``;
+``op`` is 0 for a correct word, 1 for a substitution, 2 for an insertion,
+3 for a deletion and 4 for a compound match.
+)");
+  cls.def_buffer([](AlignmentResult &r) {
+       return py::buffer_info(r.Data(), sizeof(int), py::format_descriptor<int>::format(), 2,
+                              {AlignmentResult::kNumFields, r.Size()},
+                              {sizeof(int) * r.Size(), sizeof(int)}, /*readonly=*/true);
+     })
+      .def("__len__", &AlignmentResult::Size)
+      .def("pairs", &AlignmentResult::Pairs, py::arg("eps_symbol"), profiled(),
+           "The alignment as a list of pairs, as returned by :func:`kaldialign.align`.");
+  const char *fields[] = {"op", "ref_start", "ref_end", "hyp_start", "hyp_end"};
+  for (size_t field = 0; field < AlignmentResult::kNumFields; field++) {
+    // A slice of a flat view of the object's own buffer, which keeps it alive.
+    cls.def_property_readonly(fields[field], [field](const py::object &self) -> py::object {
+      const size_t n = self.cast<const AlignmentResult &>().Size();
+      // Views of empty buffers can't be cast.
+      if (n == 0) return py::memoryview(py::bytes()).attr("cast")("i");
+      py::object flat = py::memoryview(self).attr("cast")("B").attr("cast")("i");
+      return flat[py::slice(field * n, (field + 1) * n, 1)];
+    });
+  }
+}
+
+// Returns an AlignmentResult, or None when the alignment exceeds the error
+// bound.
+static py::object AlignColumnar(const py::buffer &a, const py::buffer &b,
+                                const py::object &ref, const py::object &hyp,
+                                const bool sclite_mode, const std::optional<bool> linear_memory,
+                                const int max_errors, const double max_err_rate) {
+  IntBuffer a_buf(a), b_buf(b);
+  AlignmentColumns columns;
+  int cost;
+  {
+    py::gil_scoped_release release;
+    const IntSequence x = a_buf.View(), y = b_buf.View();
+    cost = LevenshteinAlignmentColumns(
+        x, y, sclite_mode, MaxErrorsFor(x.size(), max_errors, max_err_rate),
+        linear_memory.value_or(UseLinearMemoryAlignment(x.size(), y.size())), &columns);
+  }
+  if (cost < 0) return py::none();
+  ProfileScope profile(internal::kProfileResult);
+  return py::cast(AlignmentResult(columns, ref, hyp, false));
+}
+
+static py::object AlignColumnarCompound(const py::list &ref, const py::list &hyp,
+                                        const bool sclite_mode,
+                                        const std::optional<bool> linear_memory,
+                                        const int max_errors, const double max_err_rate,
+                                        const int max_compound_words) {
+  const auto a = ref.cast<std::vector<std::string>>();
+  const auto b = hyp.cast<std::vector<std::string>>();
+  AlignmentColumns columns;
+  bool within_limit = true;
+  {
+    py::gil_scoped_release release;
+    const int limit = MaxErrorsFor(a.size(), max_errors, max_err_rate);
+    if (limit >= 0)
+      within_limit = LevenshteinEditDistanceCompound(
+          a, b, sclite_mode, nullptr, nullptr, nullptr, max_compound_words) <= limit;
+    if (within_limit)
+      LevenshteinAlignmentCompoundColumns(
+          a, b, sclite_mode, linear_memory.value_or(UseLinearMemoryAlignment(a.size(), b.size())),
+          &columns, max_compound_words);
+  }
+  if (!within_limit) return py::none();
+  ProfileScope profile(internal::kProfileResult);
+  return py::cast(AlignmentResult(columns, ref, hyp, true));
+}
+
+// Returns (cost, ref_idx, arc_idx, ops, path) or None if no final state is
+// reachable (see LevenshteinAlignmentLattice).
+static py::object AlignLattice(IntSequence ref,
+                               const std::vector<std::tuple<int, int, int>> &arcs,
+                               const int start, const std::vector<int> &finals,
+                               const int eps_label, const bool sclite_mode) {
+  std::vector<LatticeArc> lattice(arcs.size());
+  for (size_t a = 0; a != arcs.size(); ++a)
+    lattice[a] = {std::get<0>(arcs[a]), std::get<1>(arcs[a]), std::get<2>(arcs[a])};
+  std::vector<int> ref_idx, arc_idx, ops, path;
+  int cost;
+  {
+    py::gil_scoped_release release;
+    cost = LevenshteinAlignmentLattice(ref, lattice, start, finals, eps_label, sclite_mode,
+                                       &ref_idx, &arc_idx, &ops, &path);
+  }
+  if (cost < 0) return py::none();
+  return py::make_tuple(cost, ToIntArray(ref_idx), ToIntArray(arc_idx), ToIntArray(ops),
+                        ToIntArray(path));
 }
 
 static std::vector<std::pair<int, int>> GetEdits(
     const std::vector<std::vector<int>> &refs,
-    const std::vector<std::vector<int>> &hyps
+    const std::vector<std::vector<int>> &hyps,
+    const int max_errors
 ) {
-    return internal::GetEdits(refs, hyps);
+    return internal::GetEdits(refs, hyps, max_errors);
+}
+
+// GetEdits for integer buffers, scored on num_threads threads.
+static std::vector<std::pair<int, int>> GetEditsBuffers(const std::vector<py::buffer> &refs,
+                                                        const std::vector<py::buffer> &hyps,
+                                                        const int max_errors,
+                                                        const int num_threads) {
+  const auto ref_bufs = RequestBuffers(refs);
+  const auto hyp_bufs = RequestBuffers(hyps);
+  const auto ref_views = Views(ref_bufs);
+  std::vector<std::pair<int, int>> ans(ref_views.size());
+  py::gil_scoped_release release;
+  const auto stats =
+      internal::GetEditStats(ref_views, Views(hyp_bufs), false, num_threads, max_errors);
+  for (size_t i = 0; i != stats.size(); ++i)
+    ans[i] = std::make_pair(stats[i].total_num, static_cast<int>(ref_views[i].size()));
+  return ans;
 }
 
 static py::tuple GetBootstrapWerInterval(
@@ -38,7 +491,11 @@ static py::tuple GetBootstrapWerInterval(
     const int replications,
     const unsigned int seed
 ) {
-    const auto ans = internal::GetBootstrapWerInterval(edit_sym_per_hyp, replications, seed);
+    std::pair<double, double> ans;
+    {
+        py::gil_scoped_release release;
+        ans = internal::GetBootstrapWerInterval(edit_sym_per_hyp, replications, seed);
+    }
     return py::make_tuple(ans.first, ans.second);
 }
 
@@ -51,14 +508,80 @@ static double GetPImprov(
     return internal::GetPImprov(edit_sym_per_hyp, edit_sym_per_hyp2, replications, seed);
 }
 
-static py::dict EditDistanceCompound(const std::vector<std::string> &a,
-                                      const std::vector<std::string> &b,
-                                      const bool sclite_mode) {
+static py::tuple IntervalToTuple(const internal::WerInterval &ci) {
+  return py::make_tuple(ci.mean, ci.interval, ci.lower, ci.upper);
+}
+
+// Fused bootstrap of one or two systems (edit_sym_per_hyp2 may be null).
+// Returns ((mean, interval, lower, upper), second system's tuple or None,
+// p_improv or None).
+static py::tuple Bootstrap(
+    const std::vector<std::pair<int, int>> &edit_sym_per_hyp,
+    const std::vector<std::pair<int, int>> *edit_sym_per_hyp2,
+    const int replications,
+    const uint64_t seed,
+    const int num_threads,
+    const bool percentile
+) {
+  internal::WerInterval ci, ci2;
+  internal::BootstrapResult boot;
+  {
+    py::gil_scoped_release release;
+    boot = internal::Bootstrap(edit_sym_per_hyp, edit_sym_per_hyp2, replications, seed,
+                               num_threads);
+    ci = internal::GetWerInterval(std::move(boot.wer), percentile);
+    if (edit_sym_per_hyp2) ci2 = internal::GetWerInterval(std::move(boot.wer2), percentile);
+  }
+  if (!edit_sym_per_hyp2) return py::make_tuple(IntervalToTuple(ci), py::none(), py::none());
+  return py::make_tuple(IntervalToTuple(ci), IntervalToTuple(ci2), boot.p_improv);
+}
+
+// Bootstrap of any number of systems on shared resamples.  Returns (one
+// (mean, interval, lower, upper) tuple per system, S x S p_improv matrix as
+// nested lists).
+static py::tuple BootstrapMulti(
+    const std::vector<std::vector<std::pair<int, int>>> &systems,
+    const int replications,
+    const uint64_t seed,
+    const int num_threads,
+    const bool percentile
+) {
+  internal::MultiBootstrapResult boot;
+  std::vector<internal::WerInterval> cis;
+  {
+    py::gil_scoped_release release;
+    boot = internal::BootstrapMulti(systems, replications, seed, num_threads);
+    for (auto &wer : boot.wer) cis.push_back(internal::GetWerInterval(std::move(wer), percentile));
+  }
+  const size_t S = systems.size();
+  py::list intervals, p_improv;
+  for (const auto &ci : cis) intervals.append(IntervalToTuple(ci));
+  for (size_t a = 0; a != S; ++a) {
+    py::list row;
+    for (size_t b = 0; b != S; ++b) row.append(boot.p_improv[a * S + b]);
+    p_improv.append(row);
+  }
+  return py::make_tuple(intervals, p_improv);
+}
+
+// Returns None when the distance exceeds the error bound.
+static py::object EditDistanceCompound(const std::vector<std::string> &a,
+                                       const std::vector<std::string> &b,
+                                       const bool sclite_mode,
+                                       const int max_errors,
+                                       const double max_err_rate,
+                                       const int max_compound_words) {
   int ins;
   int del;
   int sub;
-
-  int total = LevenshteinEditDistanceCompound(a, b, sclite_mode, &ins, &del, &sub);
+  int total;
+  {
+    py::gil_scoped_release release;
+    total = LevenshteinEditDistanceCompound(a, b, sclite_mode, &ins, &del, &sub,
+                                            max_compound_words);
+  }
+  const int limit = MaxErrorsFor(a.size(), max_errors, max_err_rate);
+  if (limit >= 0 && total > limit) return py::none();
   py::dict ans;
   ans["ins"] = ins;
   ans["del"] = del;
@@ -67,29 +590,718 @@ static py::dict EditDistanceCompound(const std::vector<std::string> &a,
   return ans;
 }
 
-static std::vector<std::pair<std::string, std::string>>
+// Returns None when the alignment cost exceeds the error bound.
+static py::object
 AlignCompound(const std::vector<std::string> &a, const std::vector<std::string> &b,
-              const std::string &eps_symbol, const bool sclite_mode) {
+              const std::string &eps_symbol, const bool sclite_mode,
+              const std::optional<bool> linear_memory, const int max_errors,
+              const double max_err_rate, const int max_compound_words) {
   std::vector<std::pair<std::string, std::string>> ans;
-  LevenshteinAlignmentCompound(a, b, eps_symbol, sclite_mode, &ans);
-  return ans;
+  bool within_limit = true;
+  {
+    py::gil_scoped_release release;
+    const int limit = MaxErrorsFor(a.size(), max_errors, max_err_rate);
+    if (limit >= 0)
+      within_limit = LevenshteinEditDistanceCompound(
+          a, b, sclite_mode, nullptr, nullptr, nullptr, max_compound_words) <= limit;
+    if (within_limit) {
+      if (linear_memory.value_or(UseLinearMemoryAlignment(a.size(), b.size())))
+        LevenshteinAlignmentCompoundLinearMemory(a, b, eps_symbol, sclite_mode, &ans,
+                                                 max_compound_words);
+      else
+        LevenshteinAlignmentCompound(a, b, eps_symbol, sclite_mode, &ans, max_compound_words);
+    }
+  }
+  if (!within_limit) return py::none();
+  ProfileScope profile(internal::kProfileResult);
+  return py::cast(ans);
 }
 
 static std::vector<std::pair<int, int>> GetEditsCompound(
     const std::vector<std::vector<std::string>> &refs,
-    const std::vector<std::vector<std::string>> &hyps
+    const std::vector<std::vector<std::string>> &hyps,
+    const int max_compound_words
+) {
+    return internal::GetEditsCompound(refs, hyps, max_compound_words);
+}
+
+static py::dict EditDistanceBatch(
+    const std::vector<IntSequence> &refs,
+    const std::vector<IntSequence> &hyps,
+    const bool sclite_mode,
+    const int num_threads,
+    const int max_errors,
+    const double max_err_rate
+) {
+  std::vector<error_stats> stats;
+  {
+    py::gil_scoped_release release;
+    stats = internal::GetEditStats(refs, hyps, sclite_mode, num_threads, max_errors,
+                                max_err_rate);
+  }
+  return EditStatsToDict(stats, Lengths(refs));
+}
+
+static py::dict EditDistanceBatchCompound(
+    const std::vector<std::vector<std::string>> &refs,
+    const std::vector<std::vector<std::string>> &hyps,
+    const bool sclite_mode,
+    const int num_threads,
+    const int max_errors,
+    const double max_err_rate,
+    const int max_compound_words
 ) {
-    return internal::GetEditsCompound(refs, hyps);
+  std::vector<error_stats> stats;
+  {
+    py::gil_scoped_release release;
+    stats = internal::GetEditStatsCompound(refs, hyps, sclite_mode, num_threads, max_errors,
+                                           max_err_rate, max_compound_words);
+  }
+  return EditStatsToDict(stats, Lengths(refs));
+}
+
+// Pairs whose alignment exceeds the error bound are returned as None.
+template <typename T>
+static py::list AlignmentsToList(const std::vector<std::vector<std::pair<T, T>>> &alis,
+                                 const std::vector<char> &within_limit) {
+  ProfileScope profile(internal::kProfileResult);
+  py::list ans(alis.size());
+  for (size_t i = 0; i != alis.size(); ++i)
+    ans[i] = within_limit[i] ? py::cast(alis[i]) : py::none();
+  return ans;
+}
+
+static py::list AlignBatch(
+    const std::vector<IntSequence> &refs,
+    const std::vector<IntSequence> &hyps,
+    const int eps_symbol,
+    const bool sclite_mode,
+    const int num_threads,
+    const int max_errors,
+    const double max_err_rate
+) {
+  std::vector<std::vector<std::pair<int, int>>> alis;
+  std::vector<char> within_limit;
+  {
+    py::gil_scoped_release release;
+    alis = internal::GetAlignments(refs, hyps, eps_symbol, sclite_mode, num_threads,
+                                   max_errors, max_err_rate, &within_limit);
+  }
+  return AlignmentsToList(alis, within_limit);
+}
+
+static py::list AlignBatchCompound(
+    const std::vector<std::vector<std::string>> &refs,
+    const std::vector<std::vector<std::string>> &hyps,
+    const std::string &eps_symbol,
+    const bool sclite_mode,
+    const int num_threads,
+    const int max_errors,
+    const double max_err_rate,
+    const int max_compound_words
+) {
+  std::vector<std::vector<std::pair<std::string, std::string>>> alis;
+  std::vector<char> within_limit;
+  {
+    py::gil_scoped_release release;
+    alis = internal::GetAlignmentsCompound(refs, hyps, eps_symbol, sclite_mode,
+                                           num_threads, max_errors, max_err_rate,
+                                           &within_limit, max_compound_words);
+  }
+  return AlignmentsToList(alis, within_limit);
+}
+
+template <typename Seqs>
+static py::dict EditDistanceBatchOf(const Seqs &refs, const Seqs &hyps,
+                                    const bool sclite_mode, const int num_threads,
+                                    const int max_errors, const double max_err_rate) {
+  return EditDistanceBatch(Views(refs), Views(hyps), sclite_mode, num_threads, max_errors,
+                           max_err_rate);
+}
+
+template <typename Seqs>
+static py::list AlignBatchOf(const Seqs &refs, const Seqs &hyps, const int eps_symbol,
+                             const bool sclite_mode, const int num_threads,
+                             const int max_errors, const double max_err_rate) {
+  return AlignBatch(Views(refs), Views(hyps), eps_symbol, sclite_mode, num_threads,
+                    max_errors, max_err_rate);
+}
+
+static py::dict EditDistanceBatchBuffers(const std::vector<py::buffer> &refs,
+                                         const std::vector<py::buffer> &hyps,
+                                         const bool sclite_mode, const int num_threads,
+                                         const int max_errors, const double max_err_rate) {
+  return EditDistanceBatchOf(RequestBuffers(refs), RequestBuffers(hyps), sclite_mode,
+                             num_threads, max_errors, max_err_rate);
+}
+
+static py::list AlignBatchBuffers(const std::vector<py::buffer> &refs,
+                                  const std::vector<py::buffer> &hyps, const int eps_symbol,
+                                  const bool sclite_mode, const int num_threads,
+                                  const int max_errors, const double max_err_rate) {
+  return AlignBatchOf(RequestBuffers(refs), RequestBuffers(hyps), eps_symbol, sclite_mode,
+                      num_threads, max_errors, max_err_rate);
+}
+
+// Returns None when the number of errors exceeds the error bound.
+static py::object EditDistanceWeighted(const py::buffer &a, const py::buffer &b,
+                                       const CostTable &costs, const int max_errors,
+                                       const double max_err_rate) {
+  IntBuffer a_buf(a), b_buf(b);
+  error_stats stats;
+  bool within_limit;
+  {
+    py::gil_scoped_release release;
+    const IntSequence ref = a_buf.View();
+    const int limit = MaxErrorsFor(ref.size(), max_errors, max_err_rate);
+    within_limit =
+        LevenshteinEditDistanceWeighted(ref, b_buf.View(), costs, &stats) <= limit || limit < 0;
+  }
+  if (!within_limit) return py::none();
+  py::dict ans;
+  ans["ins"] = stats.ins_num;
+  ans["del"] = stats.del_num;
+  ans["sub"] = stats.sub_num;
+  ans["total"] = stats.total_num;
+  ans["cost"] = stats.total_cost;
+  return ans;
+}
+
+// Returns None when the number of errors exceeds the error bound.
+static py::object AlignWeighted(const py::buffer &a, const py::buffer &b, int eps_symbol,
+                                const CostTable &costs,
+                                const std::optional<bool> linear_memory,
+                                const int max_errors, const double max_err_rate) {
+  IntBuffer a_buf(a), b_buf(b);
+  std::vector<std::pair<int, int>> ans;
+  bool within_limit;
+  {
+    py::gil_scoped_release release;
+    const IntSequence ref = a_buf.View(), hyp = b_buf.View();
+    LevenshteinAlignmentWeighted(
+        ref, hyp, eps_symbol, costs,
+        linear_memory.value_or(UseLinearMemoryAlignment(ref.size(), hyp.size())), &ans);
+    const int limit = MaxErrorsFor(ref.size(), max_errors, max_err_rate);
+    int errors = 0;
+    for (const auto &p : ans)
+      if (p.first != p.second) errors++;
+    within_limit = limit < 0 || errors <= limit;
+  }
+  if (!within_limit) return py::none();
+  ProfileScope profile(internal::kProfileResult);
+  return py::cast(ans);
+}
+
+static py::dict EditDistanceBatchWeighted(const std::vector<py::buffer> &refs,
+                                          const std::vector<py::buffer> &hyps,
+                                          const CostTable &costs, const int num_threads,
+                                          const int max_errors, const double max_err_rate) {
+  const auto ref_bufs = RequestBuffers(refs);
+  const auto hyp_bufs = RequestBuffers(hyps);
+  const auto ref_views = Views(ref_bufs);
+  std::vector<error_stats> stats;
+  {
+    py::gil_scoped_release release;
+    stats = internal::GetEditStatsWeighted(ref_views, Views(hyp_bufs), costs, num_threads,
+                                           max_errors, max_err_rate);
+  }
+  py::dict ans = EditStatsToDict(stats, Lengths(ref_views));
+  std::vector<int> total_cost(stats.size());
+  for (size_t i = 0; i != stats.size(); ++i) total_cost[i] = stats[i].total_cost;
+  ans["cost"] = ToIntArray(total_cost);
+  return ans;
+}
+
+static py::list AlignBatchWeighted(const std::vector<py::buffer> &refs,
+                                   const std::vector<py::buffer> &hyps, const int eps_symbol,
+                                   const CostTable &costs, const int num_threads,
+                                   const int max_errors, const double max_err_rate) {
+  const auto ref_bufs = RequestBuffers(refs);
+  const auto hyp_bufs = RequestBuffers(hyps);
+  std::vector<std::vector<std::pair<int, int>>> alis;
+  std::vector<char> within_limit;
+  {
+    py::gil_scoped_release release;
+    alis = internal::GetAlignmentsWeighted(Views(ref_bufs), Views(hyp_bufs), eps_symbol,
+                                           costs, num_threads, max_errors, max_err_rate,
+                                           &within_limit);
+  }
+  return AlignmentsToList(alis, within_limit);
+}
+
+// Returns the fields of internal::ErrorReport: "sub" as (ref ids, hyp ids,
+// counts), "ins" / "del" as (ids, counts) and "groups" as one
+// (ins, del, sub, ref_len, num_utts, num_sent_err) tuple per group.
+static py::dict ErrorReport(const std::vector<py::buffer> &refs,
+                            const std::vector<py::buffer> &hyps,
+                            const std::vector<int> &groups, const int num_groups,
+                            const bool sclite_mode, const int num_threads, const int top_k) {
+  const auto ref_bufs = RequestBuffers(refs);
+  const auto hyp_bufs = RequestBuffers(hyps);
+  if (ref_bufs.size() != hyp_bufs.size() || (!groups.empty() && groups.size() != refs.size()))
+    throw py::value_error("Inconsistent number of references, hypotheses and groups.");
+  for (const int g : groups)
+    if (g < 0 || g >= num_groups) throw py::value_error("Group id out of range.");
+  internal::ErrorReport report;
+  {
+    py::gil_scoped_release release;
+    report = internal::GetErrorReport(Views(ref_bufs), Views(hyp_bufs), groups, num_groups,
+                                      sclite_mode, num_threads, top_k);
+  }
+  py::list group_totals;
+  for (const auto &g : report.groups)
+    group_totals.append(
+        py::make_tuple(g.ins, g.del, g.sub, g.ref_len, g.num_utts, g.num_sent_err));
+  py::dict ans;
+  ans["sub"] = py::make_tuple(ToIntArray(report.sub_ref), ToIntArray(report.sub_hyp),
+                              report.sub_count);
+  ans["ins"] = py::make_tuple(ToIntArray(report.ins_symbol), report.ins_count);
+  ans["del"] = py::make_tuple(ToIntArray(report.del_symbol), report.del_count);
+  ans["groups"] = group_totals;
+  return ans;
+}
+
+// Per-hyp ins/del/sub/total arrays plus the "oracle" index.
+static py::dict EditDistanceNBest(IntSequence ref, const std::vector<IntSequence> &hyps,
+                                  const bool sclite_mode) {
+  std::vector<error_stats> stats;
+  int oracle;
+  {
+    py::gil_scoped_release release;
+    oracle = LevenshteinEditDistanceNBest(ref, hyps, sclite_mode, &stats);
+  }
+  py::dict ans = EditStatsToDict(stats, std::vector<int>(hyps.size(), ref.size()));
+  ans["ref_len"] = ref.size();
+  ans["oracle"] = oracle;
+  return ans;
+}
+
+static py::dict EditDistanceNBestBuffers(const py::buffer &ref,
+                                         const std::vector<py::buffer> &hyps,
+                                         const bool sclite_mode) {
+  IntBuffer ref_buf(ref);
+  const auto hyp_bufs = RequestBuffers(hyps);
+  return EditDistanceNBest(ref_buf.View(), Views(hyp_bufs), sclite_mode);
+}
+
+// Encodes seqs with the table, raising KeyError for unknown symbols when
+// add is false.
+static std::vector<std::vector<int>> EncodeWith(
+    SymbolTable &table, const std::vector<std::vector<std::string>> &seqs, const bool add) {
+  std::vector<std::vector<int>> ids;
+  std::pair<int, int> unknown;
+  {
+    py::gil_scoped_release release;
+    unknown = table.Encode(seqs, add, &ids);
+  }
+  if (unknown.first >= 0) throw py::key_error(seqs[unknown.first][unknown.second]);
+  return ids;
+}
+
+static std::vector<std::string> AllSymbols(const SymbolTable &table) {
+  std::vector<int> ids(table.Size());
+  for (size_t i = 0; i != ids.size(); ++i) ids[i] = static_cast<int>(i);
+  std::vector<std::string> ans;
+  table.Decode(ids, &ans);
+  return ans;
+}
+
+// The profiling counters, see kaldialign.profile_stats().
+static py::dict ProfileStats() {
+  py::dict counters, ns, calls;
+  counters["dp_cells"] = Profiler::Counter(internal::kProfileDpCells);
+  counters["dp_bytes"] = Profiler::Counter(internal::kProfileDpBytes);
+  counters["compound_attempts"] = Profiler::Counter(internal::kProfileCompoundAttempts);
+  counters["compound_hits"] = Profiler::Counter(internal::kProfileCompoundHits);
+  static const char *const kTimers[] = {"symbols", "native", "call", "binding",
+                                        "dp", "compound", "result"};
+  static_assert(sizeof(kTimers) / sizeof(kTimers[0]) == internal::kProfileNumTimers,
+                "one name per ProfileTimer");
+  for (int t = 0; t != internal::kProfileNumTimers; ++t)
+    ns[kTimers[t]] = Profiler::Time(static_cast<internal::ProfileTimer>(t));
+  for (const auto &call : Profiler::Calls()) calls[py::str(call.first)] = call.second;
+  py::dict ans;
+  ans["calls"] = calls;
+  ans["counters"] = counters;
+  ans["ns"] = ns;
+  return ans;
+}
+
+static void BindSymbolTable(py::module_ &m) {
+  py::class_<SymbolTable>(m, "SymbolTable",
+                          "Interns string symbols as consecutive ints starting from 0.\n\n"
+                          "Build it once (optionally from a vocabulary) and pass it as "
+                          "``symbols=`` to the scoring functions to avoid re-mapping the "
+                          "symbols of every call.  Encoding is done in bulk in C++; the "
+                          "table is safe to share between threads.")
+      .def(py::init([](const std::vector<std::string> &symbols) {
+             auto table = std::make_unique<SymbolTable>();
+             for (const auto &symbol : symbols) table->Intern(symbol);
+             return table;
+           }),
+           py::arg("symbols") = std::vector<std::string>())
+      .def("encode",
+           [](SymbolTable &table, std::vector<std::string> seq, const bool add) {
+             std::vector<std::vector<std::string>> seqs(1);
+             seqs[0].swap(seq);
+             return ToIntArray(EncodeWith(table, seqs, add)[0]);
+           },
+           py::arg("seq"), py::arg("add") = true, profiled(),
+           "Encode a sequence of symbols as ``array.array('i')``. Unknown symbols "
+           "are added to the table, or raise KeyError when ``add`` is False.")
+      .def("encode_batch",
+           [](SymbolTable &table, const std::vector<std::vector<std::string>> &seqs,
+              const bool add) {
+             const auto ids = EncodeWith(table, seqs, add);
+             py::list ans(ids.size());
+             for (size_t i = 0; i != ids.size(); ++i) ans[i] = ToIntArray(ids[i]);
+             return ans;
+           },
+           py::arg("seqs"), py::arg("add") = true, profiled(),
+           "Encode many sequences at once (see ``encode``).")
+      .def("decode",
+           [](const SymbolTable &table, const std::vector<int> &ids) {
+             std::vector<std::string> symbols;
+             if (!table.Decode(ids, &symbols)) throw py::index_error("Symbol id out of range.");
+             return symbols;
+           },
+           py::arg("ids"), profiled(), "Map a sequence of ids back to their symbols.")
+      .def("__getitem__",
+           [](const SymbolTable &table, const std::string &symbol) {
+             const int id = table.Find(symbol);
+             if (id < 0) throw py::key_error(symbol);
+             return id;
+           })
+      .def("__contains__",
+           [](const SymbolTable &table, const std::string &symbol) {
+             return table.Find(symbol) >= 0;
+           })
+      .def("__len__", &SymbolTable::Size)
+      .def(py::pickle(
+          [](const SymbolTable &table) { return py::make_tuple(AllSymbols(table)); },
+          [](const py::tuple &state) {
+            auto table = std::make_unique<SymbolTable>();
+            for (const auto &symbol : state[0].cast<std::vector<std::string>>())
+              table->Intern(symbol);
+            return table;
+          }));
+}
+
+static void CheckCost(const int cost) {
+  if (cost < 0) throw py::value_error("Edit costs must be non-negative, got " +
+                                      std::to_string(cost) + ".");
+}
+
+static void CheckSymbol(const int symbol) {
+  if (symbol < 0) throw py::value_error("Symbol ids must be non-negative, got " +
+                                        std::to_string(symbol) + ".");
+}
+
+static void BindCostTable(py::module_ &m) {
+  // All the costs are given to the constructor: a table is shared with DPs
+  // running without the GIL, so it cannot be changed once it exists.
+  py::class_<CostTable>(m, "CostTable", "Native storage of :class:`kaldialign.CostTable`.")
+      .def(py::init([](const int ins_cost, const int del_cost, const int sub_cost,
+                       const std::vector<std::pair<int, int>> &ins_costs,
+                       const std::vector<std::pair<int, int>> &del_costs,
+                       const std::vector<std::tuple<int, int, int>> &sub_costs,
+                       const std::vector<py::buffer> &sub_matrix) {
+             for (const int cost : {ins_cost, del_cost, sub_cost}) CheckCost(cost);
+             for (const auto &c : ins_costs) CheckSymbol(c.first), CheckCost(c.second);
+             for (const auto &c : del_costs) CheckSymbol(c.first), CheckCost(c.second);
+             for (const auto &c : sub_costs) CheckCost(std::get<2>(c));
+             const auto bufs = RequestBuffers(sub_matrix);
+             std::vector<int> matrix;
+             matrix.reserve(bufs.size() * bufs.size());
+             for (const auto &buf : bufs) {
+               const IntSequence row = buf.View();
+               if (row.size() != bufs.size())
+                 throw py::value_error("The substitution matrix must be square.");
+               for (const int cost : row) CheckCost(cost);
+               matrix.insert(matrix.end(), row.begin(), row.end());
+             }
+
+             auto table = std::make_unique<CostTable>(ins_cost, del_cost, sub_cost);
+             for (const auto &c : ins_costs) table->SetInsCost(c.first, c.second);
+             for (const auto &c : del_costs) table->SetDelCost(c.first, c.second);
+             for (const auto &c : sub_costs)
+               table->SetSubCost(std::get<0>(c), std::get<1>(c), std::get<2>(c));
+             if (!bufs.empty()) table->SetSubMatrix(matrix.data(), bufs.size());
+             return table;
+           }),
+           py::arg("ins_cost") = 1, py::arg("del_cost") = 1, py::arg("sub_cost") = 1,
+           py::arg("ins_costs") = std::vector<std::pair<int, int>>(),
+           py::arg("del_costs") = std::vector<std::pair<int, int>>(),
+           py::arg("sub_costs") = std::vector<std::tuple<int, int, int>>(),
+           py::arg("sub_matrix") = std::vector<py::buffer>(), profiled())
+      .def("ins_cost", &CostTable::InsCost, py::arg("symbol"))
+      .def("del_cost", &CostTable::DelCost, py::arg("symbol"))
+      .def("sub_cost", &CostTable::SubCost, py::arg("ref"), py::arg("hyp"));
+}
+
+// Scores every (ref, hyp) pair with the accumulator's settings and adds it.
+template <typename Seqs>
+static void AccumulateOf(WerAccumulator &acc, const Seqs &refs, const Seqs &hyps,
+                         const int num_threads) {
+  const auto ref_views = Views(refs);
+  const auto hyp_views = Views(hyps);
+  py::gil_scoped_release release;
+  acc.Add(internal::GetEditStats(ref_views, hyp_views, acc.ScliteMode(), num_threads),
+          Lengths(ref_views));
+}
+
+static std::unique_ptr<WerAccumulator> WerAccumulatorFromBytes(const py::bytes &data) {
+  auto acc = std::make_unique<WerAccumulator>();
+  if (!acc->Deserialize(data)) throw py::value_error("Invalid WerAccumulator data.");
+  return acc;
+}
+
+static void BindWerAccumulator(py::module_ &m) {
+  py::class_<WerAccumulator>(m, "WerAccumulator",
+                             "Native storage of :class:`kaldialign.WerAccumulator`.")
+      .def(py::init<bool, bool>(), py::arg("sclite_mode") = false,
+           py::arg("merge_compounds") = false)
+      .def_property_readonly("sclite_mode", &WerAccumulator::ScliteMode)
+      .def_property_readonly("merge_compounds", &WerAccumulator::MergeCompounds)
+      .def("add_batch",
+           [](WerAccumulator &acc, const std::vector<py::buffer> &refs,
+              const std::vector<py::buffer> &hyps, const int num_threads) {
+             AccumulateOf(acc, RequestBuffers(refs), RequestBuffers(hyps), num_threads);
+           },
+           py::arg("refs"), py::arg("hyps"), py::arg("num_threads") = 0, profiled())
+      .def("add_batch", &AccumulateOf<std::vector<std::vector<int>>>, py::arg("refs"),
+           py::arg("hyps"), py::arg("num_threads") = 0, profiled())
+      .def("add_batch_compound",
+           [](WerAccumulator &acc, const std::vector<std::vector<std::string>> &refs,
+              const std::vector<std::vector<std::string>> &hyps, const int num_threads,
+              const int max_compound_words) {
+             py::gil_scoped_release release;
+             acc.Add(internal::GetEditStatsCompound(refs, hyps, acc.ScliteMode(), num_threads,
+                                                    -1, -1, max_compound_words),
+                     Lengths(refs));
+           },
+           py::arg("refs"), py::arg("hyps"), py::arg("num_threads") = 0,
+           py::arg("max_compound_words") = -1, profiled())
+      .def("merge",
+           [](WerAccumulator &acc, const WerAccumulator &other) {
+             if (!acc.Merge(other))
+               throw py::value_error(
+                   "Cannot merge accumulators with different sclite_mode / merge_compounds.");
+           },
+           py::arg("other"))
+      .def("totals",
+           [](const WerAccumulator &acc) {
+             const auto t = acc.GetTotals();
+             return py::make_tuple(t.ins, t.del, t.sub, t.ref_len);
+           })
+      .def("edits", &WerAccumulator::Edits)
+      .def("bootstrap",
+           [](const WerAccumulator &acc, const WerAccumulator *other, const int replications,
+              const uint64_t seed, const int num_threads, const bool percentile) {
+             const auto edits = acc.Edits();
+             if (!other) return Bootstrap(edits, nullptr, replications, seed, num_threads,
+                                          percentile);
+             const auto edits2 = other->Edits();
+             return Bootstrap(edits, &edits2, replications, seed, num_threads, percentile);
+           },
+           py::arg("other") = py::none(), py::arg("replications") = 10000,
+           py::arg("seed") = 0, py::arg("num_threads") = 0, py::arg("percentile") = false,
+           profiled())
+      .def("to_bytes", [](const WerAccumulator &acc) { return py::bytes(acc.Serialize()); })
+      .def_static("from_bytes", &WerAccumulatorFromBytes, py::arg("data"))
+      .def("__len__", &WerAccumulator::NumUtterances)
+      .def(py::pickle(
+          [](const WerAccumulator &acc) { return py::make_tuple(py::bytes(acc.Serialize())); },
+          [](const py::tuple &state) {
+            return WerAccumulatorFromBytes(state[0].cast<py::bytes>());
+          }));
+}
+
+static void BindIncrementalAligner(py::module_ &m) {
+  py::class_<IncrementalAligner>(m, "IncrementalAligner",
+                                 "Native state of :class:`kaldialign.IncrementalAligner`.")
+      .def(py::init<const std::vector<int> &, bool>(), py::arg("ref"),
+           py::arg("sclite_mode") = false)
+      .def_property_readonly("sclite_mode", &IncrementalAligner::ScliteMode)
+      .def("extend",
+           [](IncrementalAligner &aligner, const std::vector<int> &symbols) {
+             aligner.Extend(symbols);
+           },
+           py::arg("symbols"), profiled_release_gil())
+      .def("retract", &IncrementalAligner::Retract, py::arg("n"), profiled_release_gil())
+      .def("stats",
+           [](const IncrementalAligner &aligner, const bool partial) {
+             int ref_len;
+             const error_stats s = aligner.Stats(partial, &ref_len);
+             return py::make_tuple(s.ins_num, s.del_num, s.sub_num, ref_len);
+           },
+           py::arg("partial"), profiled())
+      .def("alignment",
+           [](const IncrementalAligner &aligner, const bool partial) {
+             std::vector<int> ref_idx, hyp_idx, ops;
+             aligner.Alignment(partial, &ref_idx, &hyp_idx, &ops);
+             return py::make_tuple(ToIntArray(ref_idx), ToIntArray(hyp_idx), ToIntArray(ops));
+           },
+           py::arg("partial"), profiled())
+      .def("__len__", &IncrementalAligner::HypSize);
+}
+
+// Returns (num_scored, num_missing, num_sentence_errors).
+static py::tuple ScoreTextFiles(const std::string &ref_path, const std::string &hyp_path,
+                                WerAccumulator &acc, const std::string &missing_hyp,
+                                const int num_threads, const std::string &per_utt_path) {
+  internal::TextScoreSummary summary;
+  {
+    py::gil_scoped_release release;
+    summary = internal::ScoreTextFiles(ref_path, hyp_path, missing_hyp, num_threads,
+                                       per_utt_path, &acc);
+  }
+  return py::make_tuple(summary.num_scored, summary.num_missing, summary.num_sentence_errors);
 }
 
-PYBIND11_MODULE(_kaldialign, m) {
+// All entry points copy their arguments into native containers (or, for
+// integer buffers, hold a view of them) before the call and only touch Python
+// objects again when building the result, so the GIL is released for the
+// whole DP / bootstrap computation.  The module holds no global state and is
+// declared safe for free-threaded CPython builds.
+//
+// The integer entry points have overloads taking objects with the buffer
+// protocol; they are registered first so that e.g. NumPy arrays are not
+// converted element by element into lists.
+PYBIND11_MODULE(_kaldialign, m, py::mod_gil_not_used()) {
   m.doc() = "Python wrapper for kaldialign";
-  m.def("edit_distance", &EditDistance, py::arg("a"), py::arg("b"), py::arg("sclite_mode") = false);
-  m.def("align", &Align, py::arg("a"), py::arg("b"), py::arg("eps_symbol"), py::arg("sclite_mode") = false);
-  m.def("_get_edits", &GetEdits, py::arg("refs"), py::arg("hyps"));
-  m.def("_get_boostrap_wer_interval", &GetBootstrapWerInterval, py::arg("edit_sym_per_hyp"), py::arg("replications") = 10000, py::arg("seed") = 0);
-  m.def("_get_p_improv", &GetPImprov, py::arg("edit_sym_per_hyp"), py::arg("edit_sym_per_hyp2"), py::arg("replications") = 10000, py::arg("seed") = 0);
-  m.def("edit_distance_compound", &EditDistanceCompound, py::arg("a"), py::arg("b"), py::arg("sclite_mode") = false);
-  m.def("align_compound", &AlignCompound, py::arg("a"), py::arg("b"), py::arg("eps_symbol"), py::arg("sclite_mode") = false);
-  m.def("_get_edits_compound", &GetEditsCompound, py::arg("refs"), py::arg("hyps"));
+  BindSymbolTable(m);
+  BindWerAccumulator(m);
+  BindIncrementalAligner(m);
+  BindAlignmentResult(m);
+  BindCostTable(m);
+  m.def("edit_distance", &EditDistanceBuffer, py::arg("a"), py::arg("b"), py::arg("sclite_mode") = false,
+        py::arg("max_errors") = -1, py::arg("max_err_rate") = -1.0, profiled());
+  m.def("edit_distance", [](const std::vector<int> &a, const std::vector<int> &b,
+                            const bool sclite_mode, const int max_errors,
+                            const double max_err_rate) {
+          return EditDistance(a, b, sclite_mode, max_errors, max_err_rate);
+        }, py::arg("a"), py::arg("b"), py::arg("sclite_mode") = false,
+        py::arg("max_errors") = -1, py::arg("max_err_rate") = -1.0, profiled());
+  m.def("align", &AlignBuffer, py::arg("a"), py::arg("b"), py::arg("eps_symbol"), py::arg("sclite_mode") = false,
+        py::arg("linear_memory") = py::none(), py::arg("max_errors") = -1,
+        py::arg("max_err_rate") = -1.0, profiled());
+  m.def("align", [](const std::vector<int> &a, const std::vector<int> &b, int eps_symbol,
+                    const bool sclite_mode, const std::optional<bool> linear_memory,
+                    const int max_errors, const double max_err_rate) {
+          return Align(a, b, eps_symbol, sclite_mode, linear_memory, max_errors, max_err_rate);
+        }, py::arg("a"), py::arg("b"), py::arg("eps_symbol"), py::arg("sclite_mode") = false,
+        py::arg("linear_memory") = py::none(), py::arg("max_errors") = -1,
+        py::arg("max_err_rate") = -1.0, profiled());
+  m.def("align_indices", &AlignIndices, py::arg("a"), py::arg("b"), py::arg("sclite_mode") = false,
+        py::arg("max_errors") = -1, py::arg("max_err_rate") = -1.0, profiled());
+  m.def("align_columnar", &AlignColumnar, py::arg("a"), py::arg("b"), py::arg("ref"),
+        py::arg("hyp"), py::arg("sclite_mode") = false, py::arg("linear_memory") = py::none(),
+        py::arg("max_errors") = -1, py::arg("max_err_rate") = -1.0, profiled());
+  m.def("align_columnar_compound", &AlignColumnarCompound, py::arg("ref"), py::arg("hyp"),
+        py::arg("sclite_mode") = false, py::arg("linear_memory") = py::none(),
+        py::arg("max_errors") = -1, py::arg("max_err_rate") = -1.0,
+        py::arg("max_compound_words") = -1, profiled());
+  m.def("align_timed", &AlignTimed, py::arg("a"), py::arg("b"), py::arg("a_times"),
+        py::arg("b_times"), py::arg("collar"), py::arg("sclite_mode") = false, profiled());
+  m.def("align_anchored", &AlignAnchored, py::arg("a"), py::arg("b"),
+        py::arg("sclite_mode") = false, py::arg("ngram") = 4,
+        py::arg("max_exact_cells") = 1 << 22, py::arg("num_threads") = 0, profiled());
+  m.def("align_lattice",
+        [](const std::vector<int> &ref, const std::vector<std::tuple<int, int, int>> &arcs,
+           const int start, const std::vector<int> &finals, const int eps_label,
+           const bool sclite_mode) {
+          return AlignLattice(ref, arcs, start, finals, eps_label, sclite_mode);
+        },
+        py::arg("ref"), py::arg("arcs"), py::arg("start") = 0,
+        py::arg("finals") = std::vector<int>(), py::arg("eps_label") = -1,
+        py::arg("sclite_mode") = false, profiled());
+  m.def("_get_edits", &GetEditsBuffers, py::arg("refs"), py::arg("hyps"),
+        py::arg("max_errors") = -1, py::arg("num_threads") = 0, profiled());
+  m.def("_get_edits", &GetEdits, py::arg("refs"), py::arg("hyps"), py::arg("max_errors") = -1, profiled_release_gil());
+  m.def("_get_boostrap_wer_interval", &GetBootstrapWerInterval, py::arg("edit_sym_per_hyp"), py::arg("replications") = 10000, py::arg("seed") = 0, profiled());
+  m.def("_get_p_improv", &GetPImprov, py::arg("edit_sym_per_hyp"), py::arg("edit_sym_per_hyp2"), py::arg("replications") = 10000, py::arg("seed") = 0, profiled_release_gil());
+  m.def("_bootstrap",
+        [](const std::vector<std::pair<int, int>> &edit_sym_per_hyp,
+           const std::optional<std::vector<std::pair<int, int>>> &edit_sym_per_hyp2,
+           const int replications, const uint64_t seed, const int num_threads,
+           const bool percentile) {
+          return Bootstrap(edit_sym_per_hyp, edit_sym_per_hyp2 ? &*edit_sym_per_hyp2 : nullptr,
+                           replications, seed, num_threads, percentile);
+        },
+        py::arg("edit_sym_per_hyp"),
+        py::arg("edit_sym_per_hyp2") = py::none(), py::arg("replications") = 10000,
+        py::arg("seed") = 0, py::arg("num_threads") = 0, py::arg("percentile") = false, profiled());
+  m.def("_bootstrap_multi", &BootstrapMulti, py::arg("systems"),
+        py::arg("replications") = 10000, py::arg("seed") = 0, py::arg("num_threads") = 0,
+        py::arg("percentile") = false, profiled());
+  m.def("edit_distance_compound", &EditDistanceCompound, py::arg("a"), py::arg("b"), py::arg("sclite_mode") = false,
+        py::arg("max_errors") = -1, py::arg("max_err_rate") = -1.0,
+        py::arg("max_compound_words") = -1, profiled());
+  m.def("align_compound", &AlignCompound, py::arg("a"), py::arg("b"), py::arg("eps_symbol"), py::arg("sclite_mode") = false,
+        py::arg("linear_memory") = py::none(), py::arg("max_errors") = -1,
+        py::arg("max_err_rate") = -1.0, py::arg("max_compound_words") = -1, profiled());
+  m.def("_get_edits_compound", &GetEditsCompound, py::arg("refs"), py::arg("hyps"),
+        py::arg("max_compound_words") = -1, profiled_release_gil());
+  m.def("error_report", &ErrorReport, py::arg("refs"), py::arg("hyps"),
+        py::arg("groups") = std::vector<int>(), py::arg("num_groups") = 1,
+        py::arg("sclite_mode") = false, py::arg("num_threads") = 0, py::arg("top_k") = -1, profiled());
+  m.def("edit_distance_batch", &EditDistanceBatchBuffers, py::arg("refs"), py::arg("hyps"),
+        py::arg("sclite_mode") = false, py::arg("num_threads") = 0,
+        py::arg("max_errors") = -1, py::arg("max_err_rate") = -1.0, profiled());
+  m.def("edit_distance_batch", &EditDistanceBatchOf<std::vector<std::vector<int>>>,
+        py::arg("refs"), py::arg("hyps"), py::arg("sclite_mode") = false,
+        py::arg("num_threads") = 0, py::arg("max_errors") = -1,
+        py::arg("max_err_rate") = -1.0, profiled());
+  m.def("edit_distance_batch_compound", &EditDistanceBatchCompound, py::arg("refs"),
+        py::arg("hyps"), py::arg("sclite_mode") = false, py::arg("num_threads") = 0,
+        py::arg("max_errors") = -1, py::arg("max_err_rate") = -1.0,
+        py::arg("max_compound_words") = -1, profiled());
+  m.def("align_batch", &AlignBatchBuffers, py::arg("refs"), py::arg("hyps"),
+        py::arg("eps_symbol"), py::arg("sclite_mode") = false, py::arg("num_threads") = 0,
+        py::arg("max_errors") = -1, py::arg("max_err_rate") = -1.0, profiled());
+  m.def("align_batch", &AlignBatchOf<std::vector<std::vector<int>>>, py::arg("refs"),
+        py::arg("hyps"), py::arg("eps_symbol"), py::arg("sclite_mode") = false,
+        py::arg("num_threads") = 0, py::arg("max_errors") = -1,
+        py::arg("max_err_rate") = -1.0, profiled());
+  m.def("align_batch_compound", &AlignBatchCompound, py::arg("refs"),
+        py::arg("hyps"), py::arg("eps_symbol"), py::arg("sclite_mode") = false,
+        py::arg("num_threads") = 0, py::arg("max_errors") = -1,
+        py::arg("max_err_rate") = -1.0, py::arg("max_compound_words") = -1, profiled());
+  m.def("edit_distance_weighted", &EditDistanceWeighted, py::arg("a"), py::arg("b"),
+        py::arg("costs"), py::arg("max_errors") = -1, py::arg("max_err_rate") = -1.0,
+        profiled());
+  m.def("align_weighted", &AlignWeighted, py::arg("a"), py::arg("b"), py::arg("eps_symbol"),
+        py::arg("costs"), py::arg("linear_memory") = py::none(), py::arg("max_errors") = -1,
+        py::arg("max_err_rate") = -1.0, profiled());
+  m.def("edit_distance_batch_weighted", &EditDistanceBatchWeighted, py::arg("refs"),
+        py::arg("hyps"), py::arg("costs"), py::arg("num_threads") = 0,
+        py::arg("max_errors") = -1, py::arg("max_err_rate") = -1.0, profiled());
+  m.def("align_batch_weighted", &AlignBatchWeighted, py::arg("refs"), py::arg("hyps"),
+        py::arg("eps_symbol"), py::arg("costs"), py::arg("num_threads") = 0,
+        py::arg("max_errors") = -1, py::arg("max_err_rate") = -1.0, profiled());
+  m.def("_score_text_files", &ScoreTextFiles, py::arg("ref_path"), py::arg("hyp_path"),
+        py::arg("acc"), py::arg("missing_hyp") = "strict", py::arg("num_threads") = 0,
+        py::arg("per_utt_path") = "", profiled());
+  m.def("edit_distance_nbest", &EditDistanceNBestBuffers, py::arg("ref"), py::arg("hyps"),
+        py::arg("sclite_mode") = false, profiled());
+  m.def("edit_distance_nbest",
+        [](const std::vector<int> &ref, const std::vector<std::vector<int>> &hyps,
+           const bool sclite_mode) { return EditDistanceNBest(ref, Views(hyps), sclite_mode); },
+        py::arg("ref"), py::arg("hyps"), py::arg("sclite_mode") = false, profiled());
+  m.def("simd_backend", &SimdBackend);
+  m.def("_set_simd_backend", &SetSimdBackend, py::arg("name"));
+  m.def("_profile_enable", &Profiler::Enable, py::arg("enabled"));
+  m.def("_profile_reset", &Profiler::Reset);
+  py::class_<PythonProfileScope>(m, "_ProfileScope")
+      .def(py::init([](const std::string &stage) {
+             if (stage == "symbols") return PythonProfileScope(internal::kProfileSymbols);
+             if (stage == "result") return PythonProfileScope(internal::kProfileResult);
+             throw py::value_error("Unknown profiling stage: " + stage);
+           }),
+           py::arg("stage"))
+      .def("__enter__", &PythonProfileScope::Enter)
+      .def("__exit__", [](const PythonProfileScope &scope, const py::handle &, const py::handle &,
+                          const py::handle &) { scope.Exit(); });
+  m.def("_profile_stats", &ProfileStats);
 }
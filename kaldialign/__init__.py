@@ -1,9 +1,29 @@
+import contextlib
+import itertools
 import math
+import mmap
+import os
 import random
+import struct
+import threading
+from array import array
 from importlib.metadata import PackageNotFoundError, version
-from typing import Dict, Iterable, List, Optional, Sequence, Tuple, TypeVar, Union
+from typing import (
+    Callable,
+    Dict,
+    Hashable,
+    Iterable,
+    Iterator,
+    List,
+    Optional,
+    Sequence,
+    Tuple,
+    TypeVar,
+    Union,
+)
 
 import _kaldialign
+from _kaldialign import AlignmentResult, SymbolTable
 
 try:
     __version__ = version("kaldialign")
@@ -18,7 +38,12 @@ def edit_distance(
     hyp: Iterable[Symbol],
     sclite_mode: bool = False,
     merge_compounds: bool = False,
-) -> Dict[str, Union[int, float]]:
+    max_errors: Optional[int] = None,
+    max_err_rate: Optional[float] = None,
+    symbols: Optional[SymbolTable] = None,
+    max_compound_words: Optional[int] = None,
+    costs: Optional["CostTable"] = None,
+) -> Optional[Dict[str, Union[int, float]]]:
     """
     Compute the edit distance between sequences ``ref`` and ``hyp``.
     Both sequences can be strings or lists of strings or ints.
@@ -30,6 +55,32 @@ def edit_distance(
     may be concatenated (without separator) to match a single word in the
     other sequence at zero cost.  For example, ``["white", "paper"]`` and
     ``["whitepaper"]`` are treated as a match with 0 errors.
+    ``max_compound_words`` limits how many words a compound may consist of
+    (by default any number).  The memory used is proportional to the length
+    of ``hyp`` times the longest compound found in ``ref``, so compound-aware
+    scoring also works for long-form references.
+
+    ``max_errors`` and ``max_err_rate`` bound the number of errors we care
+    about (the rate is relative to the length of ``ref``; when both are given
+    the tighter one applies).  The computation is then restricted to a diagonal
+    band of the DP matrix and stops as soon as the bound is provably exceeded,
+    in which case ``None`` is returned.  This is much faster for near-matching
+    sequences, e.g. when filtering data by a WER threshold.
+    With ``sclite_mode`` the bound applies to the number of errors as well.
+
+    When both sequences are one-dimensional integer buffers (e.g. NumPy
+    ``int32`` arrays or ``array.array('i')``), their symbols are read in
+    place without any conversion.  Other sequences are mapped to ints,
+    either with a fresh mapping for this call or with the
+    :class:`SymbolTable` passed as ``symbols`` (which must then contain
+    strings; it is not used with ``merge_compounds``).  Reusing one table
+    across calls avoids rebuilding the mapping for every pair.
+
+    ``costs`` is an optional :class:`CostTable` with custom insertion,
+    deletion and substitution costs (it cannot be combined with
+    ``sclite_mode`` or ``merge_compounds``).  The errors counted are those of
+    the cheapest alignment under these costs, and the error bound is then
+    checked after the full DP.
 
     Returns a dict with keys:
     * ``ins`` -- the number of insertions (in ``hyp`` vs ``ref``)
@@ -38,29 +89,39 @@ def edit_distance(
     * ``total`` -- total number of errors
     * ``ref_len`` -- the number of symbols in ``ref``
     * ``err_rate`` -- the error rate  (total number of errors divided by ``ref_len``)
+    * ``cost`` -- the total cost of the alignment (only with ``costs``)
     """
-    ref = list(ref)
-    hyp = list(hyp)
-
-    if merge_compounds:
+    if costs is not None:
+        _check_costs_args(sclite_mode, merge_compounds)
+        (ref, hyp), _ = costs._encode([ref, hyp], symbols)
+        ans = _kaldialign.edit_distance_weighted(
+            ref, hyp, costs._table, *_error_bound(max_errors, max_err_rate)
+        )
+    elif not merge_compounds and _is_int_buffer(ref) and _is_int_buffer(hyp):
+        ans = _kaldialign.edit_distance(
+            ref, hyp, sclite_mode, *_error_bound(max_errors, max_err_rate)
+        )
+    elif merge_compounds:
+        ref = list(ref)
         ref_str = [str(s) for s in ref]
         hyp_str = [str(s) for s in hyp]
-        ans = _kaldialign.edit_distance_compound(ref_str, hyp_str, sclite_mode)
+        ans = _kaldialign.edit_distance_compound(
+            ref_str,
+            hyp_str,
+            sclite_mode,
+            *_error_bound(max_errors, max_err_rate),
+            _compound_limit(max_compound_words),
+        )
     else:
-        int2sym = dict(enumerate(sorted(set(ref) | set(hyp))))
-        sym2int = {v: k for k, v in int2sym.items()}
-        refi = [sym2int[sym] for sym in ref]
-        hypi = [sym2int[sym] for sym in hyp]
-        ans = _kaldialign.edit_distance(refi, hypi, sclite_mode)
+        (ref, hyp), _ = _encode([ref, hyp], symbols)
+        ans = _kaldialign.edit_distance(
+            ref, hyp, sclite_mode, *_error_bound(max_errors, max_err_rate)
+        )
 
+    if ans is None:
+        return None
     ans["ref_len"] = len(ref)
-    try:
-        ans["err_rate"] = ans["total"] / len(ref)
-    except ZeroDivisionError:
-        if ans["total"] == 0:
-            ans["err_rate"] = 0.0
-        else:
-            ans["err_rate"] = float("inf")
+    ans["err_rate"] = _err_rate(ans["total"], len(ref))
     return ans
 
 
@@ -70,7 +131,13 @@ def align(
     eps_symbol: Symbol,
     sclite_mode: bool = False,
     merge_compounds: bool = False,
-) -> List[Tuple[Symbol, Symbol]]:
+    linear_memory: Optional[bool] = None,
+    max_errors: Optional[int] = None,
+    max_err_rate: Optional[float] = None,
+    symbols: Optional[SymbolTable] = None,
+    max_compound_words: Optional[int] = None,
+    costs: Optional["CostTable"] = None,
+) -> Optional[List[Tuple[Symbol, Symbol]]]:
     """
     Compute the alignment between sequences ``ref`` and ``hyp``.
     Both sequences can be strings or lists of strings or ints.
@@ -83,12 +150,61 @@ def align(
     When ``merge_compounds`` is True, adjacent words in either sequence may
     be concatenated to match a single word in the other sequence at zero cost.
     Compound-matched groups appear as space-joined strings in the output, e.g.
-    ``("white paper", "whitepaper")``.
+    ``("white paper", "whitepaper")``.  ``max_compound_words`` limits how many
+    words a compound may consist of (by default any number).
+
+    ``linear_memory`` selects a divide-and-conquer engine whose memory grows
+    linearly with the sequence lengths instead of with their product, at the
+    cost of a few times longer running time.  It returns exactly the same
+    alignment.  By default (``None``) it is used automatically for very long
+    sequences (more than ~16M DP cells, e.g. 4k x 4k words).
+
+    ``max_errors`` and ``max_err_rate`` have the same meaning as in
+    :func:`edit_distance`: only a band of the DP matrix around the diagonal is
+    computed, and ``None`` is returned when the alignment has more errors.
+
+    Integer buffers (e.g. NumPy arrays) are read in place when ``eps_symbol``
+    is an int as well.  ``symbols`` is an optional :class:`SymbolTable` used to
+    map other sequences (and ``eps_symbol``) to ints, see :func:`edit_distance`.
+    See also :func:`align_indices`, which returns the alignment as compact
+    arrays of positions.
+
+    ``costs`` is an optional :class:`CostTable`, see :func:`edit_distance`.
 
     Returns a list of pairs of alignment symbols. The presence of ``eps_symbol``
     in the first pair index indicates insertion, and in the second pair index, deletion.
     Mismatched symbols indicate substitution.
     """
+    if costs is not None:
+        _check_costs_args(sclite_mode, merge_compounds)
+        (ai, bi, (eps_int,)), decode = costs._encode([ref, hyp, [eps_symbol]], symbols)
+        alignment = _kaldialign.align_weighted(
+            ai,
+            bi,
+            eps_int,
+            costs._table,
+            linear_memory,
+            *_error_bound(max_errors, max_err_rate),
+        )
+        if alignment is None:
+            return None
+        return _decode_alignment(alignment, decode)
+
+    if (
+        not merge_compounds
+        and isinstance(eps_symbol, int)
+        and _is_int_buffer(ref)
+        and _is_int_buffer(hyp)
+    ):
+        return _kaldialign.align(
+            ref,
+            hyp,
+            eps_symbol,
+            sclite_mode,
+            linear_memory,
+            *_error_bound(max_errors, max_err_rate),
+        )
+
     ref = list(ref)
     hyp = list(hyp)
 
@@ -96,16 +212,544 @@ def align(
         ref_str = [str(s) for s in ref]
         hyp_str = [str(s) for s in hyp]
         return _kaldialign.align_compound(
-            ref_str, hyp_str, str(eps_symbol), sclite_mode
+            ref_str,
+            hyp_str,
+            str(eps_symbol),
+            sclite_mode,
+            linear_memory,
+            *_error_bound(max_errors, max_err_rate),
+            _compound_limit(max_compound_words),
+        )
+    else:
+        (ai, bi, (eps_int,)), decode = _encode([ref, hyp, [eps_symbol]], symbols)
+        alignment = _kaldialign.align(
+            ai,
+            bi,
+            eps_int,
+            sclite_mode,
+            linear_memory,
+            *_error_bound(max_errors, max_err_rate),
+        )
+        if alignment is None:
+            return None
+        return _decode_alignment(alignment, decode)
+
+
+def align_indices(
+    ref: Iterable[Symbol],
+    hyp: Iterable[Symbol],
+    sclite_mode: bool = False,
+    max_errors: Optional[int] = None,
+    max_err_rate: Optional[float] = None,
+    symbols: Optional[SymbolTable] = None,
+) -> Optional[Tuple[array, array, array]]:
+    """
+    Compute the alignment between sequences ``ref`` and ``hyp`` as three
+    parallel ``array.array('i')`` columns ``(ref_idx, hyp_idx, op)``, one
+    entry per alignment step:
+
+    * ``ref_idx`` -- position in ``ref``, or -1 for an insertion
+    * ``hyp_idx`` -- position in ``hyp``, or -1 for a deletion
+    * ``op`` -- 0 for a correct symbol, 1 for a substitution,
+      2 for an insertion and 3 for a deletion
+
+    The columns can be wrapped without copying, e.g. with
+    ``numpy.frombuffer(x, dtype=numpy.int32)``.  No epsilon symbol is needed.
+    Integer buffers (e.g. NumPy arrays) are read in place.
+
+    ``sclite_mode``, ``max_errors``, ``max_err_rate`` and ``symbols`` have the
+    same meaning as in :func:`align`; ``None`` is returned when the error
+    bound is exceeded.
+    """
+    if not (_is_int_buffer(ref) and _is_int_buffer(hyp)):
+        (ref, hyp), _ = _encode([ref, hyp], symbols)
+    return _kaldialign.align_indices(
+        ref, hyp, sclite_mode, *_error_bound(max_errors, max_err_rate)
+    )
+
+
+def align_columnar(
+    ref: Iterable[Symbol],
+    hyp: Iterable[Symbol],
+    sclite_mode: bool = False,
+    merge_compounds: bool = False,
+    linear_memory: Optional[bool] = None,
+    max_errors: Optional[int] = None,
+    max_err_rate: Optional[float] = None,
+    symbols: Optional[SymbolTable] = None,
+    max_compound_words: Optional[int] = None,
+) -> Optional[AlignmentResult]:
+    """
+    Compute the alignment between sequences ``ref`` and ``hyp`` as an
+    :class:`AlignmentResult`: compact int32 columns with the op code and the
+    ``ref`` / ``hyp`` spans of every alignment step, exposed with the buffer
+    protocol, e.g.::
+
+        result = align_columnar(ref, hyp)
+        ops = numpy.asarray(result.op)  # or numpy.asarray(result) for all 5 rows
+        num_sub = (ops == 1).sum()
+
+    No symbol tuples (or joined compound strings) are built unless
+    ``result.pairs(eps_symbol)`` is called, which returns the same list as
+    :func:`align`.  Compound matches (with ``merge_compounds``) are single
+    steps with op code 4 spanning several words.
+
+    The arguments have the same meaning as in :func:`align`; ``None`` is
+    returned when the error bound is exceeded.
+    """
+    if merge_compounds:
+        return _kaldialign.align_columnar_compound(
+            [str(s) for s in ref],
+            [str(s) for s in hyp],
+            sclite_mode,
+            linear_memory,
+            *_error_bound(max_errors, max_err_rate),
+            _compound_limit(max_compound_words),
         )
+    if _is_int_buffer(ref) and _is_int_buffer(hyp):
+        # Indexing a memoryview gives plain ints, as align() returns.
+        ref_i, hyp_i = ref, hyp
+        ref, hyp = memoryview(ref), memoryview(hyp)
     else:
-        int2sym = dict(enumerate(sorted(set(ref) | set(hyp) | {eps_symbol})))
-        sym2int = {v: k for k, v in int2sym.items()}
-        ai = [sym2int[sym] for sym in ref]
-        bi = [sym2int[sym] for sym in hyp]
-        eps_int = sym2int[eps_symbol]
-        alignment = _kaldialign.align(ai, bi, eps_int, sclite_mode)
-        return [(int2sym[a], int2sym[b]) for a, b in alignment]
+        ref, hyp = _as_list(ref), _as_list(hyp)
+        (ref_i, hyp_i), _ = _encode([ref, hyp], symbols)
+    return _kaldialign.align_columnar(
+        ref_i,
+        hyp_i,
+        ref,
+        hyp,
+        sclite_mode,
+        linear_memory,
+        *_error_bound(max_errors, max_err_rate),
+    )
+
+
+def align_lattice(
+    ref: Iterable[Symbol],
+    arcs: Sequence[Tuple[int, int, Symbol]],
+    eps_symbol: Symbol,
+    start: int = 0,
+    finals: Optional[Sequence[int]] = None,
+    sclite_mode: bool = False,
+) -> Optional[Dict]:
+    """
+    Align ``ref`` against the best path of a hypothesis lattice (oracle alignment),
+    without expanding the lattice into its paths.
+
+    The lattice is an acyclic graph given as ``(src, dst, label)`` arcs between
+    integer states; arcs labelled ``eps_symbol`` consume no hypothesis symbol.
+    Paths go from ``start`` to any of ``finals`` (by default, every state
+    without outgoing arcs).  The running time is linear in the number of arcs
+    times the length of ``ref``.  For a lattice with a single path, the result
+    is the same as :func:`align` and :func:`edit_distance` on that path.
+
+    Returns ``None`` if no final state can be reached, otherwise a dict with keys:
+
+    * ``ins``, ``del``, ``sub``, ``total``, ``ref_len``, ``err_rate`` -- as in
+      :func:`edit_distance`, for the best path
+    * ``alignment`` -- the alignment as a list of pairs, as returned by :func:`align`
+    * ``path`` -- the indices in ``arcs`` of the best path's arcs, including
+      epsilon arcs
+
+    Raises ValueError if the lattice has a cycle.
+    """
+    ref = _as_list(ref)
+    (eps,), ref_i, labels = _encode(
+        [[eps_symbol], ref, [label for _, _, label in arcs]]
+    )[0]
+    int_arcs = [(src, dst, label) for (src, dst, _), label in zip(arcs, labels)]
+    ans = _kaldialign.align_lattice(
+        ref_i, int_arcs, start, list(finals or []), eps, sclite_mode
+    )
+    if ans is None:
+        return None
+    _, ref_idx, arc_idx, ops, path = ans
+    counts = [0] * 4
+    for op in ops:
+        counts[op] += 1
+    total = counts[1] + counts[2] + counts[3]
+    return {
+        "ins": counts[2],
+        "del": counts[3],
+        "sub": counts[1],
+        "total": total,
+        "ref_len": len(ref),
+        "err_rate": _err_rate(total, len(ref)),
+        "alignment": [
+            (
+                eps_symbol if r < 0 else ref[r],
+                eps_symbol if a < 0 else arcs[a][2],
+            )
+            for r, a in zip(ref_idx, arc_idx)
+        ],
+        "path": list(path),
+    }
+
+
+def align_timed(
+    ref: Iterable[Symbol],
+    hyp: Iterable[Symbol],
+    ref_times: Sequence[Tuple[float, float]],
+    hyp_times: Sequence[Tuple[float, float]],
+    collar: float,
+    eps_symbol: Symbol,
+    sclite_mode: bool = False,
+    symbols: Optional[SymbolTable] = None,
+) -> List[Tuple[Symbol, Symbol]]:
+    """
+    Compute the alignment between sequences ``ref`` and ``hyp`` whose words
+    have ``(start, end)`` times (e.g. from CTM files or a forced alignment),
+    given in ``ref_times`` and ``hyp_times`` in order of start time.
+
+    A reference word can only be matched with or substituted by a hypothesis
+    word if the gap between their time spans is at most ``collar`` seconds;
+    other words are aligned as insertions and deletions.  This avoids
+    aligning words minutes apart, and restricts the DP to a band along the
+    time diagonal, so that the time and memory are about linear in the
+    length of the recording.  With ``collar=math.inf`` the result is that of
+    :func:`align`.
+
+    ``eps_symbol``, ``sclite_mode`` and ``symbols`` have the same meaning as in
+    :func:`align`, and the alignment is returned in the same format.
+    Raises ValueError if the times don't match the sequences or are not sorted.
+    """
+    ref = _as_list(ref)
+    hyp = _as_list(hyp)
+    if _is_int_buffer(ref) and _is_int_buffer(hyp):
+        ref_i, hyp_i = ref, hyp
+    else:
+        (ref_i, hyp_i), _ = _encode([ref, hyp], symbols)
+    ref_idx, hyp_idx, _ = _kaldialign.align_timed(
+        ref_i, hyp_i, list(ref_times), list(hyp_times), collar, sclite_mode
+    )
+    return [
+        (eps_symbol if r < 0 else ref[r], eps_symbol if h < 0 else hyp[h])
+        for r, h in zip(ref_idx, hyp_idx)
+    ]
+
+
+def align_long(
+    ref: Iterable[Symbol],
+    hyp: Iterable[Symbol],
+    eps_symbol: Symbol,
+    sclite_mode: bool = False,
+    ngram: int = 4,
+    max_segment_cells: int = 1 << 22,
+    num_threads: int = 0,
+    symbols: Optional[SymbolTable] = None,
+) -> Dict:
+    """
+    Approximate alignment of long-form transcripts (e.g. hour-long meetings),
+    much faster than the exact but quadratic :func:`align`.
+
+    N-grams of ``ngram`` words that occur exactly once in both ``ref`` and
+    ``hyp`` are matched, the longest chain of them in monotone order is
+    kept as anchors, and only the segments between anchors are aligned
+    exactly, on ``num_threads`` worker threads (``0`` uses all available cores).
+    Segments with more than ``max_segment_cells`` DP cells (``len(ref) * len(hyp)``)
+    are anchored again; smaller inputs are aligned exactly.  A smaller
+    ``max_segment_cells`` or ``ngram`` is faster, a larger one closer to exact.
+
+    ``sclite_mode`` and ``symbols`` have the same meaning as in :func:`align`.
+
+    Returns a dict with keys:
+
+    * ``ins``, ``del``, ``sub``, ``total``, ``ref_len``, ``err_rate`` -- as in
+      :func:`edit_distance`, for the returned alignment
+    * ``alignment`` -- the alignment as a list of pairs, as returned by :func:`align`
+    * ``num_anchors`` -- the number of anchored runs of matching words
+    * ``max_excess`` -- an upper bound on how much the cost of the alignment
+      exceeds that of the exact one, i.e. on the number of extra errors
+      (in sclite cost units with ``sclite_mode``); ``0`` means it is exact
+    """
+    ref = _as_list(ref)
+    hyp = _as_list(hyp)
+    if _is_int_buffer(ref) and _is_int_buffer(hyp):
+        ref_i, hyp_i = ref, hyp
+    else:
+        (ref_i, hyp_i), _ = _encode([ref, hyp], symbols)
+    cost, lower_bound, num_anchors, ref_idx, hyp_idx, ops = _kaldialign.align_anchored(
+        ref_i, hyp_i, sclite_mode, ngram, max_segment_cells, num_threads
+    )
+    counts = [0] * 4
+    for op in ops:
+        counts[op] += 1
+    total = counts[1] + counts[2] + counts[3]
+    return {
+        "ins": counts[2],
+        "del": counts[3],
+        "sub": counts[1],
+        "total": total,
+        "ref_len": len(ref),
+        "err_rate": _err_rate(total, len(ref)),
+        "alignment": [
+            (eps_symbol if r < 0 else ref[r], eps_symbol if h < 0 else hyp[h])
+            for r, h in zip(ref_idx, hyp_idx)
+        ],
+        "num_anchors": num_anchors,
+        "max_excess": max(cost - lower_bound, 0),
+    }
+
+
+def edit_distance_batch(
+    refs: Sequence[Sequence[Symbol]],
+    hyps: Sequence[Sequence[Symbol]],
+    sclite_mode: bool = False,
+    merge_compounds: bool = False,
+    num_threads: int = 0,
+    max_errors: Optional[int] = None,
+    max_err_rate: Optional[float] = None,
+    symbols: Optional[SymbolTable] = None,
+    max_compound_words: Optional[int] = None,
+    costs: Optional["CostTable"] = None,
+) -> Dict[str, array]:
+    """
+    Compute the edit distance for every pair ``(refs[i], hyps[i])`` in a corpus.
+
+    All pairs are scored in a single native call that releases the GIL and
+    spreads the work over ``num_threads`` worker threads
+    (``0`` uses all available cores).
+
+    ``sclite_mode``, ``merge_compounds``, ``max_errors``, ``max_err_rate``,
+    ``symbols``, ``max_compound_words`` and ``costs`` have the same meaning as in
+    :func:`edit_distance`.  Pairs exceeding the error bound have ``-1`` in the
+    ``ins``, ``del``, ``sub`` and ``total`` arrays.
+
+    Returns a dict with keys ``ins``, ``del``, ``sub``, ``total`` and ``ref_len``
+    (and ``cost`` with ``costs``).
+    Each value is an ``array.array('i')`` with one entry per pair, which can be
+    wrapped without copying, e.g. with ``numpy.frombuffer(x, dtype=numpy.int32)``.
+
+    When all sequences are one-dimensional integer buffers (e.g. NumPy
+    ``int32`` arrays), they are read in place without any conversion.
+    """
+    assert len(hyps) == len(
+        refs
+    ), f"Inconsistent number of reference ({len(refs)}) and hypothesis ({len(hyps)}) sequences."
+
+    if costs is not None:
+        _check_costs_args(sclite_mode, merge_compounds)
+        encoded, _ = costs._encode([*refs, *hyps], symbols)
+        return _kaldialign.edit_distance_batch_weighted(
+            encoded[: len(refs)],
+            encoded[len(refs) :],
+            costs._table,
+            num_threads,
+            *_error_bound(max_errors, max_err_rate),
+        )
+    if merge_compounds:
+        refs_s = [[str(s) for s in seq] for seq in refs]
+        hyps_s = [[str(s) for s in seq] for seq in hyps]
+        return _kaldialign.edit_distance_batch_compound(
+            refs_s,
+            hyps_s,
+            sclite_mode,
+            num_threads,
+            *_error_bound(max_errors, max_err_rate),
+            _compound_limit(max_compound_words),
+        )
+    if _all_int_buffers(refs, hyps):
+        refs_i, hyps_i = list(refs), list(hyps)
+    else:
+        refs_i, hyps_i, _ = _convert_to_int(refs, hyps, symbols=symbols)
+    return _kaldialign.edit_distance_batch(
+        refs_i,
+        hyps_i,
+        sclite_mode,
+        num_threads,
+        *_error_bound(max_errors, max_err_rate),
+    )
+
+
+def edit_distance_nbest(
+    ref: Iterable[Symbol],
+    hyps: Sequence[Iterable[Symbol]],
+    sclite_mode: bool = False,
+    symbols: Optional[SymbolTable] = None,
+) -> Dict[str, Union[int, array]]:
+    """
+    Compute the edit distance between ``ref`` and each of ``hyps``
+    (e.g. an n-best list), and find the oracle hypothesis.
+
+    The reference is prepared once for all hypotheses, and the DP work for
+    a prefix shared by several hypotheses (typical of beam search outputs)
+    is only done once, which makes this much faster than calling
+    :func:`edit_distance` for every hypothesis.  The results are identical.
+
+    ``sclite_mode`` and ``symbols`` have the same meaning as in :func:`edit_distance`.
+    When ``ref`` and all ``hyps`` are one-dimensional integer buffers, they are
+    read in place without any conversion.
+
+    Returns a dict with keys:
+
+    * ``ins``, ``del``, ``sub``, ``total`` -- ``array.array('i')`` with one entry per hypothesis
+    * ``ref_len`` -- the number of symbols in ``ref``
+    * ``oracle`` -- the index of the hypothesis with the fewest errors
+      (the first one on ties), or ``-1`` if ``hyps`` is empty
+    """
+    if _is_int_buffer(ref) and _all_int_buffers(hyps):
+        return _kaldialign.edit_distance_nbest(ref, list(hyps), sclite_mode)
+    encoded, _ = _encode([ref, *hyps], symbols)
+    return _kaldialign.edit_distance_nbest(encoded[0], encoded[1:], sclite_mode)
+
+
+def align_batch(
+    refs: Sequence[Sequence[Symbol]],
+    hyps: Sequence[Sequence[Symbol]],
+    eps_symbol: Symbol,
+    sclite_mode: bool = False,
+    merge_compounds: bool = False,
+    num_threads: int = 0,
+    max_errors: Optional[int] = None,
+    max_err_rate: Optional[float] = None,
+    symbols: Optional[SymbolTable] = None,
+    max_compound_words: Optional[int] = None,
+    costs: Optional["CostTable"] = None,
+) -> List[Optional[List[Tuple[Symbol, Symbol]]]]:
+    """
+    Compute the alignment for every pair ``(refs[i], hyps[i])`` in a corpus.
+
+    All pairs are aligned in a single native call that releases the GIL and
+    spreads the work over ``num_threads`` worker threads
+    (``0`` uses all available cores).
+
+    The remaining arguments have the same meaning as in :func:`align`.
+    Integer buffers are read in place when ``eps_symbol`` is an int.
+
+    Returns a list with one alignment (as returned by :func:`align`) per pair;
+    pairs exceeding the error bound get ``None``.
+    """
+    assert len(hyps) == len(
+        refs
+    ), f"Inconsistent number of reference ({len(refs)}) and hypothesis ({len(hyps)}) sequences."
+
+    if costs is not None:
+        _check_costs_args(sclite_mode, merge_compounds)
+        encoded, decode = costs._encode([*refs, *hyps, [eps_symbol]], symbols)
+        alignments = _kaldialign.align_batch_weighted(
+            encoded[: len(refs)],
+            encoded[len(refs) : -1],
+            encoded[-1][0],
+            costs._table,
+            num_threads,
+            *_error_bound(max_errors, max_err_rate),
+        )
+        return [
+            None if ali is None else _decode_alignment(ali, decode)
+            for ali in alignments
+        ]
+
+    if merge_compounds:
+        refs_s = [[str(s) for s in seq] for seq in refs]
+        hyps_s = [[str(s) for s in seq] for seq in hyps]
+        return _kaldialign.align_batch_compound(
+            refs_s,
+            hyps_s,
+            str(eps_symbol),
+            sclite_mode,
+            num_threads,
+            *_error_bound(max_errors, max_err_rate),
+            _compound_limit(max_compound_words),
+        )
+
+    if isinstance(eps_symbol, int) and _all_int_buffers(refs, hyps):
+        return _kaldialign.align_batch(
+            list(refs),
+            list(hyps),
+            eps_symbol,
+            sclite_mode,
+            num_threads,
+            *_error_bound(max_errors, max_err_rate),
+        )
+
+    (refs_i, hyps_i, ((eps_int,),)), decode = _encode_sources(
+        [refs, hyps, [[eps_symbol]]], symbols
+    )
+    alignments = _kaldialign.align_batch(
+        refs_i,
+        hyps_i,
+        eps_int,
+        sclite_mode,
+        num_threads,
+        *_error_bound(max_errors, max_err_rate),
+    )
+    return [
+        None if ali is None else _decode_alignment(ali, decode) for ali in alignments
+    ]
+
+
+def error_report(
+    refs: Sequence[Sequence[Symbol]],
+    hyps: Sequence[Sequence[Symbol]],
+    groups: Optional[Sequence[Hashable]] = None,
+    sclite_mode: bool = False,
+    top_k: Optional[int] = None,
+    num_threads: int = 0,
+    symbols: Optional[SymbolTable] = None,
+) -> Dict:
+    """
+    sclite-style error analysis of a corpus: the most frequent substitutions,
+    insertions and deletions, and the totals of groups of utterances
+    (e.g. per speaker).
+
+    All pairs are aligned as with :func:`align` and the errors are counted in
+    native code on ``num_threads`` worker threads (``0`` uses all available
+    cores), without returning any alignment to Python.  ``groups`` optionally
+    gives a hashable key (e.g. the speaker) for every pair.  ``sclite_mode`` and
+    ``symbols`` have the same meaning as in :func:`align`.
+
+    Returns a dict with keys:
+
+    * ``sub`` -- ``((ref_symbol, hyp_symbol), count)`` of the substituted pairs
+    * ``ins`` -- ``(hyp_symbol, count)`` of the inserted symbols
+    * ``del`` -- ``(ref_symbol, count)`` of the deleted symbols
+    * ``total`` -- the corpus totals, with the keys of :func:`edit_distance`
+      plus ``num_utts`` and ``num_sent_err`` (utterances with errors)
+    * ``groups`` -- a dict from every group key to its totals (only with ``groups``)
+
+    The ``sub``, ``ins`` and ``del`` lists are sorted by decreasing count and
+    limited to the ``top_k`` first entries if given.
+    """
+    assert len(hyps) == len(
+        refs
+    ), f"Inconsistent number of reference ({len(refs)}) and hypothesis ({len(hyps)}) sequences."
+    assert top_k is None or top_k >= 0, "top_k must be non-negative."
+    if _all_int_buffers(refs, hyps):
+        refs_i, hyps_i, decode = list(refs), list(hyps), list
+    else:
+        (refs_i, hyps_i), decode = _encode_sources([refs, hyps], symbols)
+
+    group_ids = {}
+    if groups is not None:
+        assert len(groups) == len(
+            refs
+        ), f"Inconsistent number of sequences ({len(refs)}) and groups ({len(groups)})."
+        group_of = [group_ids.setdefault(key, len(group_ids)) for key in groups]
+    else:
+        group_of = []
+    report = _kaldialign.error_report(
+        refs_i,
+        hyps_i,
+        group_of,
+        max(len(group_ids), 1),
+        sclite_mode,
+        num_threads,
+        -1 if top_k is None else top_k,
+    )
+
+    sub_ref, sub_hyp, sub_count = report["sub"]
+    ans = {
+        "sub": list(zip(zip(decode(sub_ref), decode(sub_hyp)), sub_count)),
+        "ins": list(zip(decode(report["ins"][0]), report["ins"][1])),
+        "del": list(zip(decode(report["del"][0]), report["del"][1])),
+    }
+    totals = [_report_totals(*t) for t in report["groups"]]
+    ans["total"] = _report_totals(
+        *(sum(t[k] for t in report["groups"]) for k in range(6))
+    )
+    if groups is not None:
+        ans["groups"] = dict(zip(group_ids, totals))
+    return ans
 
 
 def bootstrap_wer_ci(
@@ -115,6 +759,10 @@ def bootstrap_wer_ci(
     replications: int = 10000,
     seed: int = 0,
     merge_compounds: bool = False,
+    symbols: Optional[SymbolTable] = None,
+    max_compound_words: Optional[int] = None,
+    num_threads: int = 0,
+    ci_method: str = "normal",
 ) -> Dict:
     """
     Compute a boostrapping of WER to extract the 95% confidence interval (CI)
@@ -131,6 +779,15 @@ def bootstrap_wer_ci(
         seed: The random seed to reproduce the results.
         merge_compounds: When True, adjacent words may be concatenated to match
             a single compound word at zero cost (see :func:`edit_distance`).
+        symbols: An optional :class:`SymbolTable` used to map string symbols to ints
+            (see :func:`edit_distance`).
+        max_compound_words: The maximum number of words in a compound when
+            ``merge_compounds`` is True (see :func:`edit_distance`).
+        num_threads: The number of threads used for scoring and resampling (0 uses all
+            available cores).
+            Every replication has its own random stream, so the results only depend on ``seed``.
+        ci_method: "normal" for ``wer +/- 1.96 * stddev`` of the replications, or "percentile"
+            for their 2.5th and 97.5th percentiles ("ci95" is then half the interval width).
 
     Returns:
         A dict with results. When scoring a single system (``hyp2_seqs=None``), the keys are:
@@ -147,85 +804,1002 @@ def bootstrap_wer_ci(
 
     [2] https://github.com/kaldi-asr/kaldi/blob/master/src/bin/compute-wer-bootci.cc
     """
-    from _kaldialign import (
-        _get_boostrap_wer_interval,
-        _get_edits,
-        _get_edits_compound,
-        _get_p_improv,
-    )
-
     assert len(hyps) == len(
         refs
     ), f"Inconsistent number of reference ({len(refs)}) and hypothesis ({len(hyps)}) sequences."
-    assert replications > 0, "The number of replications must be greater than 0."
-    assert seed >= 0, "The seed must be 0 or greater."
+    _check_bootstrap_args(replications, seed, ci_method)
     assert not isinstance(refs, str) and not isinstance(
         hyps, str
     ), "The input must be a list of strings or list of lists of ints."
+    if hyps2 is not None:
+        assert len(hyps2) == len(
+            refs
+        ), f"Inconsistent number of reference ({len(refs)}) and hypothesis ({len(hyps2)}) sequences for the second system (hyp2_seqs)."
 
+    edit_sym_per_hyp2 = None
     if merge_compounds:
+        limit = _compound_limit(max_compound_words)
         refs_s = [[str(s) for s in seq] for seq in refs]
         hyps_s = [[str(s) for s in seq] for seq in hyps]
-        edit_sym_per_hyp = _get_edits_compound(refs_s, hyps_s)
+        edit_sym_per_hyp = _kaldialign._get_edits_compound(refs_s, hyps_s, limit)
+        if hyps2 is not None:
+            hyps2_s = [[str(s) for s in seq] for seq in hyps2]
+            edit_sym_per_hyp2 = _kaldialign._get_edits_compound(refs_s, hyps2_s, limit)
     else:
-        refs_i, hyps_i, hyps2_i = _convert_to_int(refs, hyps, hyps2)
-        edit_sym_per_hyp = _get_edits(refs_i, hyps_i)
+        refs_i, hyps_i, hyps2_i = _convert_to_int(refs, hyps, hyps2, symbols=symbols)
+        edit_sym_per_hyp = _kaldialign._get_edits(
+            refs_i, hyps_i, num_threads=num_threads
+        )
+        if hyps2 is not None:
+            edit_sym_per_hyp2 = _kaldialign._get_edits(
+                refs_i, hyps2_i, num_threads=num_threads
+            )
 
-    mean, interval = _get_boostrap_wer_interval(
-        edit_sym_per_hyp, replications=replications, seed=seed
+    ci1, ci2, p_improv = _kaldialign._bootstrap(
+        edit_sym_per_hyp,
+        edit_sym_per_hyp2,
+        replications=replications,
+        seed=seed,
+        num_threads=num_threads,
+        percentile=ci_method == "percentile",
     )
-    ans1 = _build_results(mean, interval)
-    if hyps2 is None:
-        return ans1
+    return _bootstrap_results(ci1, ci2, p_improv)
 
-    assert len(hyps2) == len(
-        refs
-    ), f"Inconsistent number of reference ({len(refs)}) and hypothesis ({len(hyps2)}) sequences for the second system (hyp2_seqs)."
+
+def bootstrap_compare(
+    refs: Sequence[Sequence[Symbol]],
+    systems: Sequence[Sequence[Sequence[Symbol]]],
+    replications: int = 10000,
+    seed: int = 0,
+    merge_compounds: bool = False,
+    symbols: Optional[SymbolTable] = None,
+    max_compound_words: Optional[int] = None,
+    num_threads: int = 0,
+    ci_method: str = "normal",
+) -> Dict:
+    """
+    Compare any number of systems on the same references with the bootstrap
+    method of :func:`bootstrap_wer_ci`.
+
+    Every system in ``systems`` (a list of hypothesis lists, one per system)
+    is aligned against ``refs`` once, then all of them are scored on a single
+    shared set of ``replications`` resamples of the utterances, drawn in
+    parallel by ``num_threads`` native threads.  This gives the confidence
+    interval of every system and the probability of every system improving
+    over every other one, for the cost of one resampling pass.  With two
+    systems the results are those of ``bootstrap_wer_ci(refs, hyps, hyps2)``
+    with the same ``seed``.
+
+    The other arguments have the same meaning as in :func:`bootstrap_wer_ci`.
+
+    Returns:
+        A dict with keys:
+            - "systems": one dict per system with the keys of a single-system
+              :func:`bootstrap_wer_ci` result ("wer", "ci95", "ci95min", "ci95max"),
+            - "p_improv": a list of lists, where ``p_improv[i][j]`` is the
+              probability of system ``j`` improving over system ``i`` (the
+              fraction of resamples where it has fewer errors).
+    """
+    _check_bootstrap_args(replications, seed, ci_method)
+    systems = list(systems)
+    assert systems, "At least one system is required."
+    for i, hyps in enumerate(systems):
+        assert len(hyps) == len(
+            refs
+        ), f"Inconsistent number of reference ({len(refs)}) and hypothesis ({len(hyps)}) sequences for system {i}."
 
     if merge_compounds:
-        hyps2_s = [[str(s) for s in seq] for seq in hyps2]
-        edit_sym_per_hyp2 = _get_edits_compound(refs_s, hyps2_s)
+        limit = _compound_limit(max_compound_words)
+        refs_s = [[str(s) for s in seq] for seq in refs]
+        edits = [
+            _kaldialign._get_edits_compound(
+                refs_s, [[str(s) for s in seq] for seq in hyps], limit
+            )
+            for hyps in systems
+        ]
     else:
-        edit_sym_per_hyp2 = _get_edits(refs_i, hyps2_i)
+        (refs_i, *systems_i), _ = _encode_sources([refs, *systems], symbols)
+        edits = [
+            _kaldialign._get_edits(refs_i, hyps_i, num_threads=num_threads)
+            for hyps_i in systems_i
+        ]
 
-    mean2, interval2 = _get_boostrap_wer_interval(
-        edit_sym_per_hyp2, replications=replications, seed=seed
-    )
-    p_improv = _get_p_improv(
-        edit_sym_per_hyp, edit_sym_per_hyp2, replications=replications, seed=seed
+    intervals, p_improv = _kaldialign._bootstrap_multi(
+        edits,
+        replications=replications,
+        seed=seed,
+        num_threads=num_threads,
+        percentile=ci_method == "percentile",
     )
+    return {
+        "systems": [_build_results(*ci) for ci in intervals],
+        "p_improv": p_improv,
+    }
+
+
+class WerAccumulator:
+    """
+    Streaming corpus-level WER statistics for map-reduce scoring.
+
+    Pairs are scored in native code as they are added; only the running
+    ins/del/sub/ref_len totals and a per-utterance ``(errors, ref_len)``
+    array are kept, never the transcripts.  Accumulators built on different
+    shards can be serialized with :meth:`to_bytes`, combined with
+    :meth:`merge`, and used for the corpus WER (:meth:`stats`) and its
+    confidence interval (:meth:`bootstrap_wer_ci`).
+
+    ``sclite_mode``, ``merge_compounds``, ``symbols`` and ``max_compound_words``
+    have the same meaning as in :func:`edit_distance`.  Only accumulators with
+    the same ``sclite_mode`` and ``merge_compounds`` can be merged.
+
+    Example::
+
+        acc = WerAccumulator()
+        for ref, hyp in shard:
+            acc.add(ref, hyp)
+        blob = acc.to_bytes()
+        ...
+        total = WerAccumulator.from_bytes(blobs[0])
+        for blob in blobs[1:]:
+            total.merge(WerAccumulator.from_bytes(blob))
+        print(total.stats()["err_rate"], total.bootstrap_wer_ci())
+    """
+
+    def __init__(
+        self,
+        sclite_mode: bool = False,
+        merge_compounds: bool = False,
+        symbols: Optional[SymbolTable] = None,
+        max_compound_words: Optional[int] = None,
+    ) -> None:
+        self._acc = _kaldialign.WerAccumulator(sclite_mode, merge_compounds)
+        self.symbols = symbols
+        self.max_compound_words = max_compound_words
+
+    @property
+    def sclite_mode(self) -> bool:
+        return self._acc.sclite_mode
+
+    @property
+    def merge_compounds(self) -> bool:
+        return self._acc.merge_compounds
+
+    def add(self, ref: Iterable[Symbol], hyp: Iterable[Symbol]) -> None:
+        """Score a single ``(ref, hyp)`` pair and add it."""
+        self.add_batch([ref], [hyp], num_threads=1)
+
+    def add_batch(
+        self,
+        refs: Sequence[Sequence[Symbol]],
+        hyps: Sequence[Sequence[Symbol]],
+        num_threads: int = 0,
+    ) -> None:
+        """
+        Score many pairs at once and add them in order, spreading the work over
+        ``num_threads`` worker threads (see :func:`edit_distance_batch`).
+        """
+        assert len(hyps) == len(
+            refs
+        ), f"Inconsistent number of reference ({len(refs)}) and hypothesis ({len(hyps)}) sequences."
+        if self.merge_compounds:
+            refs_s = [[str(s) for s in seq] for seq in refs]
+            hyps_s = [[str(s) for s in seq] for seq in hyps]
+            self._acc.add_batch_compound(
+                refs_s, hyps_s, num_threads, _compound_limit(self.max_compound_words)
+            )
+            return
+        if _all_int_buffers(refs, hyps):
+            refs_i, hyps_i = list(refs), list(hyps)
+        else:
+            refs_i, hyps_i, _ = _convert_to_int(refs, hyps, symbols=self.symbols)
+        self._acc.add_batch(refs_i, hyps_i, num_threads)
+
+    def merge(self, other: "WerAccumulator") -> "WerAccumulator":
+        """
+        Append the utterances of ``other`` to this accumulator and return it,
+        so that shards can be combined with ``functools.reduce``.
+        Raises ValueError if the two were built with different settings.
+        """
+        self._acc.merge(other._acc)
+        return self
+
+    def stats(self) -> Dict[str, Union[int, float]]:
+        """
+        Corpus totals with the same keys as :func:`edit_distance`
+        (``ins``, ``del``, ``sub``, ``total``, ``ref_len``, ``err_rate``)
+        plus ``num_utts``.
+        """
+        ins, dels, sub, ref_len = self._acc.totals()
+        total = ins + dels + sub
+        return {
+            "ins": ins,
+            "del": dels,
+            "sub": sub,
+            "total": total,
+            "ref_len": ref_len,
+            "err_rate": _err_rate(total, ref_len),
+            "num_utts": len(self),
+        }
+
+    def edits(self) -> List[Tuple[int, int]]:
+        """The ``(errors, ref_len)`` pair of every utterance, in the order added."""
+        return self._acc.edits()
+
+    def bootstrap_wer_ci(
+        self,
+        other: Optional["WerAccumulator"] = None,
+        replications: int = 10000,
+        seed: int = 0,
+        num_threads: int = 0,
+        ci_method: str = "normal",
+    ) -> Dict:
+        """
+        Bootstrap confidence interval of the accumulated WER, with the same
+        arguments and results as :func:`bootstrap_wer_ci`.  Passing the
+        accumulator of a second system scored on the same utterances (in the
+        same order) as ``other`` also compares the two systems.
+        """
+        _check_bootstrap_args(replications, seed, ci_method)
+        if other is not None:
+            assert len(other) == len(
+                self
+            ), f"Inconsistent number of utterances ({len(self)} and {len(other)}) for the two systems."
+        ci1, ci2, p_improv = self._acc.bootstrap(
+            None if other is None else other._acc,
+            replications=replications,
+            seed=seed,
+            num_threads=num_threads,
+            percentile=ci_method == "percentile",
+        )
+        return _bootstrap_results(ci1, ci2, p_improv)
+
+    def to_bytes(self) -> bytes:
+        """
+        Serialize the accumulated statistics and the ``sclite_mode`` /
+        ``merge_compounds`` settings to a compact binary blob.
+        """
+        return self._acc.to_bytes()
+
+    @classmethod
+    def from_bytes(
+        cls,
+        data: bytes,
+        symbols: Optional[SymbolTable] = None,
+        max_compound_words: Optional[int] = None,
+    ) -> "WerAccumulator":
+        """
+        Restore an accumulator written by :meth:`to_bytes`.
+        Raises ValueError if ``data`` is not a valid blob.
+        """
+        acc = cls.__new__(cls)
+        acc._acc = _kaldialign.WerAccumulator.from_bytes(data)
+        acc.symbols = symbols
+        acc.max_compound_words = max_compound_words
+        return acc
+
+    def __len__(self) -> int:
+        return len(self._acc)
+
+    def __reduce__(self):
+        return self.from_bytes, (self.to_bytes(), self.symbols, self.max_compound_words)
+
+
+class IncrementalAligner:
+    """
+    Align a fixed reference against a hypothesis that changes at its end,
+    like the partial results of a streaming recognizer.
+
+    The DP column of every hypothesis symbol is kept, so :meth:`extend` costs
+    O(``len(ref)``) per new symbol (much less with unit costs) and
+    :meth:`retract` drops symbols without recomputing anything.
+    :meth:`update` moves to a new partial hypothesis by retracting only
+    the suffix that changed.
+
+    With ``partial=True`` (the default), :meth:`edit_distance` and :meth:`align`
+    align the hypothesis against the prefix of ``ref`` it has covered so far
+    (the one with the cheapest alignment, the longest one on ties), so that
+    the words not spoken yet are not counted as deletions.  With
+    ``partial=False`` the results are those of :func:`edit_distance` and
+    :func:`align` on the whole ``ref``.
+
+    ``sclite_mode`` has the same meaning as in :func:`edit_distance`.
+
+    Example::
+
+        aligner = IncrementalAligner("the cat sat on the mat".split())
+        for partial_result in stream:
+            aligner.update(partial_result.split())
+            print(aligner.edit_distance()["err_rate"])
+    """
+
+    def __init__(self, ref: Iterable[Symbol], sclite_mode: bool = False) -> None:
+        self.ref = list(ref)
+        # Hyp symbols missing from ref get -1, which matches nothing.
+        self._sym2int = {}
+        ref_i = [self._sym2int.setdefault(sym, len(self._sym2int)) for sym in self.ref]
+        self._aligner = _kaldialign.IncrementalAligner(ref_i, sclite_mode)
+        self._hyp = []
+
+    @property
+    def sclite_mode(self) -> bool:
+        return self._aligner.sclite_mode
+
+    @property
+    def hyp(self) -> List[Symbol]:
+        """A copy of the current hypothesis."""
+        return list(self._hyp)
+
+    def extend(self, symbols: Iterable[Symbol]) -> None:
+        """Append ``symbols`` to the hypothesis."""
+        symbols = list(symbols)
+        self._aligner.extend([self._sym2int.get(sym, -1) for sym in symbols])
+        self._hyp.extend(symbols)
+
+    def retract(self, n: int = 1) -> None:
+        """Remove the last ``n`` symbols of the hypothesis (all of them if there are fewer)."""
+        assert n >= 0, "The number of symbols to retract must be non-negative."
+        n = min(n, len(self._hyp))
+        self._aligner.retract(n)
+        del self._hyp[len(self._hyp) - n :]
+
+    def update(self, hyp: Iterable[Symbol]) -> None:
+        """
+        Replace the hypothesis with ``hyp``, keeping the work done for the
+        prefix it shares with the current one.
+        """
+        hyp = list(hyp)
+        common = 0
+        limit = min(len(hyp), len(self._hyp))
+        while common < limit and hyp[common] == self._hyp[common]:
+            common += 1
+        self.retract(len(self._hyp) - common)
+        self.extend(hyp[common:])
+
+    def edit_distance(self, partial: bool = True) -> Dict[str, Union[int, float]]:
+        """
+        The errors of the current hypothesis, as a dict with the keys of
+        :func:`edit_distance`.  With ``partial=True``, ``ref_len`` is the length
+        of the reference prefix the hypothesis was aligned against.
+        """
+        ins, dels, sub, ref_len = self._aligner.stats(partial)
+        total = ins + dels + sub
+        return {
+            "ins": ins,
+            "del": dels,
+            "sub": sub,
+            "total": total,
+            "ref_len": ref_len,
+            "err_rate": _err_rate(total, ref_len),
+        }
+
+    def align(
+        self, eps_symbol: Symbol, partial: bool = True
+    ) -> List[Tuple[Symbol, Symbol]]:
+        """The alignment of the current hypothesis, in the format of :func:`align`."""
+        ref_idx, hyp_idx, _ = self._aligner.alignment(partial)
+        return [
+            (
+                eps_symbol if r < 0 else self.ref[r],
+                eps_symbol if h < 0 else self._hyp[h],
+            )
+            for r, h in zip(ref_idx, hyp_idx)
+        ]
+
+    def __len__(self) -> int:
+        return len(self._hyp)
+
+
+class CostTable:
+    """
+    Custom edit costs for :func:`edit_distance`, :func:`align` and their
+    batch versions (passed as ``costs=``).
+
+    ``ins_cost``, ``del_cost`` and ``sub_cost`` are the default costs of an
+    insertion, a deletion and a substitution.  They can be overridden per
+    symbol with ``ins_costs`` / ``del_costs`` (``{symbol: cost}``) and per
+    pair of symbols with a dense ``sub_matrix`` (``sub_matrix[ref][hyp]``,
+    indexed by symbol ids; e.g. a square NumPy array or a list of lists) and
+    a sparse ``sub_costs`` map (``{(ref, hyp): cost}``), which takes
+    precedence over the matrix.  Matching a symbol with itself always costs 0.
+    All costs are non-negative integers.
+
+    With ``symbols`` (a :class:`SymbolTable`), the keys are symbols and the
+    scored sequences are encoded with that table; the ids indexing
+    ``sub_matrix`` are those of the table.  Otherwise the keys are ints and the
+    sequences must consist of ints.
+
+    The costs are evaluated inside the native DP, which reads them from rows
+    prepared once per pair of sequences.  ``CostTable(3, 3, 4)`` gives the same
+    results as ``sclite_mode=True`` (which is faster, as it is vectorized).
+
+    Example::
+
+        costs = CostTable(
+            sub_costs={("a", "the"): 0, ("the", "a"): 0},
+            del_costs={"uh": 0, "um": 0},
+            symbols=SymbolTable(),
+        )
+        edit_distance(ref, hyp, costs=costs)
+    """
+
+    def __init__(
+        self,
+        ins_cost: int = 1,
+        del_cost: int = 1,
+        sub_cost: int = 1,
+        ins_costs: Optional[Dict[Symbol, int]] = None,
+        del_costs: Optional[Dict[Symbol, int]] = None,
+        sub_costs: Optional[Dict[Tuple[Symbol, Symbol], int]] = None,
+        sub_matrix=None,
+        symbols: Optional[SymbolTable] = None,
+    ) -> None:
+        self.symbols = symbols
+        ins_costs = ins_costs or {}
+        del_costs = del_costs or {}
+        sub_costs = sub_costs or {}
+        refs = self._ids([ref for ref, _ in sub_costs])
+        hyps = self._ids([hyp for _, hyp in sub_costs])
+        rows = [] if sub_matrix is None else sub_matrix
+        self._table = _kaldialign.CostTable(
+            ins_cost,
+            del_cost,
+            sub_cost,
+            ins_costs=list(zip(self._ids(ins_costs), ins_costs.values())),
+            del_costs=list(zip(self._ids(del_costs), del_costs.values())),
+            sub_costs=list(zip(refs, hyps, sub_costs.values())),
+            sub_matrix=[
+                row if _is_int_buffer(row) else array("i", row) for row in rows
+            ],
+        )
+
+    def ins_cost(self, symbol: Symbol) -> int:
+        """The cost of inserting ``symbol``."""
+        return self._table.ins_cost(self._ids([symbol])[0])
+
+    def del_cost(self, symbol: Symbol) -> int:
+        """The cost of deleting ``symbol``."""
+        return self._table.del_cost(self._ids([symbol])[0])
+
+    def sub_cost(self, ref: Symbol, hyp: Symbol) -> int:
+        """The cost of substituting ``hyp`` for ``ref``."""
+        ref_id, hyp_id = self._ids([ref, hyp])
+        return self._table.sub_cost(ref_id, hyp_id)
+
+    def _ids(self, keys: Iterable[Symbol]) -> Sequence[int]:
+        if self.symbols is None:
+            return list(keys)
+        return self.symbols.encode(list(keys))
+
+    def _encode(
+        self, seqs: Sequence[Iterable[Symbol]], symbols: Optional[SymbolTable]
+    ) -> Tuple[List, Callable[[Sequence[int]], List[Symbol]]]:
+        # Like _encode, but with the ids the costs are defined for.
+        assert (
+            symbols is None or symbols is self.symbols
+        ), "symbols must be the SymbolTable of the CostTable."
+        if self.symbols is not None:
+            return _encode(seqs, self.symbols)
+        encoded = [seq if _is_int_buffer(seq) else array("i", seq) for seq in seqs]
+        return encoded, list
+
+
+class Corpus:
+    """
+    A pre-tokenized corpus stored on disk and memory-mapped: its symbol table,
+    an array of sequence offsets and one flat buffer of int32 symbol ids.
+
+    Write it once with :meth:`write` and open it with ``Corpus(path)``, which
+    does not read or parse anything: the sequences are zero-copy views of
+    the mapped file, so opening is instant and all processes scoring against
+    the same file share its pages.  A corpus can be passed in place of
+    ``refs`` / ``hyps`` to :func:`edit_distance_batch`, :func:`align_batch`,
+    :func:`error_report`, :func:`bootstrap_wer_ci` and
+    :meth:`WerAccumulator.add_batch`.  Plain sequences scored against it are
+    encoded with its :attr:`symbols` (symbols it doesn't know get new ids for
+    that call only, leaving the table of the corpus unchanged), and
+    two corpora can be scored against each other when one vocabulary extends
+    the other (e.g. when the hypotheses were written with ``symbols`` set to
+    the table of the references).
+
+    Every item is a one-dimensional ``int32`` memoryview.  The file is unmapped
+    once the corpus and all the views taken from it are garbage collected.
+
+    Example::
+
+        Corpus.write("refs.kac", ref_texts)  # once
+        refs = Corpus("refs.kac")
+        for system in systems:
+            print(bootstrap_wer_ci(refs, system.hyps))
+    """
+
+    def __init__(self, path: Union[str, os.PathLike]) -> None:
+        self.path = os.fspath(path)
+        with open(self.path, "rb") as f:
+            size = os.fstat(f.fileno()).st_size
+            if size < _CORPUS_HEADER.size:
+                raise ValueError(f"{self.path} is not a kaldialign corpus.")
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        (
+            magic,
+            version,
+            flags,
+            byte_order,
+            num_seqs,
+            num_tokens,
+            num_symbols,
+            symbol_bytes,
+        ) = _CORPUS_HEADER.unpack_from(self._mmap)
+        if magic != _CORPUS_MAGIC or version != _CORPUS_VERSION:
+            raise ValueError(f"{self.path} is not a kaldialign corpus (version 1).")
+        if byte_order != _CORPUS_BYTE_ORDER:
+            raise ValueError(f"{self.path} was written with a different byte order.")
+        layout = _corpus_layout(num_seqs, num_tokens, num_symbols, symbol_bytes)
+        if layout[-1] != size:
+            raise ValueError(f"{self.path} is truncated or corrupted.")
+
+        view = memoryview(self._mmap)
+        self.has_symbols = bool(flags & _CORPUS_HAS_SYMBOLS)
+        self.offsets = view[layout[0] : layout[1]].cast("q")
+        self.tokens = view[layout[1] : layout[1] + 4 * num_tokens].cast("i")
+        self._symbol_offsets = view[layout[2] : layout[3]].cast("q")
+        self._symbol_bytes = view[layout[3] : layout[3] + symbol_bytes]
+        self._symbols = None
+        self._lock = threading.Lock()
+
+    @classmethod
+    def write(
+        cls,
+        path: Union[str, os.PathLike],
+        seqs: Iterable[Iterable[Symbol]],
+        symbols: Optional[SymbolTable] = None,
+    ) -> "Corpus":
+        """
+        Encode ``seqs``, write them to ``path`` and open the result.
+
+        Only sequences of ints or of strings are supported (TypeError is
+        raised otherwise).  The sequences are encoded with ``symbols`` (a
+        :class:`SymbolTable`, which is stored in the file as a whole).  Without
+        it, sequences of ints are stored as they are, without a symbol table,
+        and sequences of strings are encoded with a new table.  The file is
+        written under a temporary name and renamed, so readers never see a
+        partial corpus; the temporary file is removed if writing fails.
+        """
+        seqs = [seq if _is_int_buffer(seq) else _as_list(seq) for seq in seqs]
+        if symbols is None:
+            try:
+                encoded = [_as_int32(seq) for seq in seqs]
+            except TypeError:
+                symbols = SymbolTable()
+        vocab = []
+        if symbols is not None:
+            try:
+                encoded = symbols.encode_batch(seqs)
+            except TypeError:
+                raise TypeError(
+                    "A Corpus can only store sequences of ints or of strings."
+                ) from None
+            vocab = [sym.encode() for sym in symbols.decode(range(len(symbols)))]
+
+        offsets = array(
+            "q", itertools.accumulate((len(seq) for seq in encoded), initial=0)
+        )
+        symbol_offsets = array("q", itertools.accumulate(map(len, vocab), initial=0))
+        header = _CORPUS_HEADER.pack(
+            _CORPUS_MAGIC,
+            _CORPUS_VERSION,
+            0 if symbols is None else _CORPUS_HAS_SYMBOLS,
+            _CORPUS_BYTE_ORDER,
+            len(encoded),
+            offsets[-1],
+            len(vocab),
+            symbol_offsets[-1],
+        )
+        layout = _corpus_layout(
+            len(encoded), offsets[-1], len(vocab), symbol_offsets[-1]
+        )
+
+        tmp = f"{os.fspath(path)}.{os.getpid()}.tmp"
+        try:
+            with open(tmp, "wb") as f:
+                f.write(header)
+                f.write(offsets)
+                for seq in encoded:
+                    f.write(memoryview(seq).cast("B"))
+                f.write(bytes(layout[2] - f.tell()))
+                f.write(symbol_offsets)
+                f.writelines(vocab)
+                f.write(bytes(layout[4] - f.tell()))
+            os.replace(tmp, path)
+        except BaseException:
+            with contextlib.suppress(FileNotFoundError):
+                os.unlink(tmp)
+            raise
+        return cls(path)
+
+    @property
+    def symbols(self) -> Optional[SymbolTable]:
+        """
+        The :class:`SymbolTable` of the corpus (built on first use), or
+        ``None`` if it stores plain ints.
+        """
+        if not self.has_symbols:
+            return None
+        with self._lock:
+            if self._symbols is None:
+                self._symbols = SymbolTable(self.vocabulary())
+            return self._symbols
+
+    def vocabulary(self) -> List[str]:
+        """The symbols of the corpus, in the order of their ids."""
+        ends = self._symbol_offsets
+        return [
+            str(self._symbol_bytes[ends[i] : ends[i + 1]], "utf-8")
+            for i in range(len(ends) - 1)
+        ]
+
+    def decode(self, i: int) -> List[Symbol]:
+        """The symbols of the ``i``-th sequence."""
+        ids = self[i]
+        return list(ids) if self.symbols is None else self.symbols.decode(ids)
+
+    def __len__(self) -> int:
+        return len(self.offsets) - 1
+
+    def __getitem__(self, i: int) -> memoryview:
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError("Corpus index out of range.")
+        return self.tokens[self.offsets[i] : self.offsets[i + 1]]
+
+    def __iter__(self) -> Iterator[memoryview]:
+        tokens, offsets = self.tokens, self.offsets
+        return (tokens[offsets[i] : offsets[i + 1]] for i in range(len(self)))
+
+    def __reduce__(self):
+        # Other processes map the same file instead of receiving a copy.
+        return Corpus, (self.path,)
+
+    def _extends(self, other: "Corpus") -> bool:
+        # True if the ids of ``other`` stand for the same symbols here.
+        if self.has_symbols != other.has_symbols:
+            return False
+        n = len(other._symbol_offsets)
+        return (
+            n <= len(self._symbol_offsets)
+            and self._symbol_offsets[:n] == other._symbol_offsets
+            and self._symbol_bytes[: len(other._symbol_bytes)] == other._symbol_bytes
+        )
+
+
+def simd_backend() -> str:
+    """
+    Name of the SIMD instruction set used for the weighted (``sclite_mode``)
+    DP: ``"avx2"``, ``"sse2"``, ``"neon"``, ``"simd128"`` or ``"scalar"``.
+    The best one supported by the CPU is chosen when the module is loaded.
+    """
+    return _kaldialign.simd_backend()
+
+
+def set_simd_backend(name: str) -> bool:
+    """
+    Select the SIMD instruction set of the weighted DP by name (see
+    :func:`simd_backend`), e.g. to compare a backend with ``"scalar"``;
+    ``"auto"`` restores the best one.  Returns False, keeping the current
+    backend, when ``name`` is not supported by this CPU or build.
+    """
+    return _kaldialign._set_simd_backend(name)
+
+
+@contextlib.contextmanager
+def profile() -> Iterator[Dict]:
+    """
+    Profile the scoring done inside a ``with`` block::
+
+        with kaldialign.profile() as stats:
+            kaldialign.align(ref, hyp, "*")
+        print(stats["dp_cells"], stats["ns"]["dp"])
+
+    The yielded dict is filled when the block exits, with the counters of
+    :func:`profile_stats` accumulated inside of it.  Profiling is
+    process-wide (calls made by other threads during the block are counted
+    too) and blocks may be nested; the code that runs is the same either way.
+    Outside of them every instrumented stage costs a single relaxed atomic
+    load (plus an empty ``with`` block for the few stages timed in Python).
+    """
+    _kaldialign._profile_enable(True)
+    before = _kaldialign._profile_stats()
+    stats = {}
+    try:
+        yield stats
+    finally:
+        stats.update(_profile_summary(_kaldialign._profile_stats(), before))
+        _kaldialign._profile_enable(False)
+
+
+def profile_stats() -> Dict:
+    """
+    Counters accumulated by all the :func:`profile` blocks so far::
+
+        {
+            "calls": {"align": 3, ...},   # calls per native function / method
+            "dp_cells": ...,              # DP cells evaluated
+            "dp_bytes": ...,              # bytes allocated for DP tables
+            "compound_attempts": ...,     # runs of words looked up as compounds
+            "compound_hits": ...,         # ... that spell a word of the other side
+            "ns": {
+                "native": ...,    # native calls, end to end
+                "symbols": ...,   # symbol mapping (SymbolTable and Python side)
+                "convert": ...,   # pybind11 argument and return value conversion
+                "binding": ...,   # the rest of the native wrappers
+                "dp": ...,        # dynamic programming and traceback
+                "compound": ...,  # finding compound candidates (string merging)
+                "result": ...,    # building the result lists / dicts / arrays
+            },
+        }
+
+    The stage times are summed over threads, so with ``num_threads > 1``
+    ``dp`` may exceed ``native``.
+    """
+    return _profile_summary(_kaldialign._profile_stats())
+
+
+def _profile_summary(raw: Dict, base: Optional[Dict] = None) -> Dict:
+    # ``raw`` and ``base`` are native snapshots; returns their difference.
+    def delta(group: str, key: str) -> int:
+        return raw[group][key] - (base[group].get(key, 0) if base else 0)
+
+    calls = {name: delta("calls", name) for name in raw["calls"]}
+    ns = {key: delta("ns", key) for key in raw["ns"]}
+    return {
+        "calls": {name: n for name, n in calls.items() if n},
+        **{key: delta("counters", key) for key in raw["counters"]},
+        "ns": {
+            "native": ns["native"],
+            "symbols": ns["symbols"],
+            "convert": max(ns["native"] - ns["call"], 0),
+            "binding": ns["binding"],
+            "dp": ns["dp"],
+            "compound": ns["compound"],
+            "result": ns["result"],
+        },
+    }
+
+
+def _check_bootstrap_args(replications: int, seed: int, ci_method: str) -> None:
+    assert replications > 0, "The number of replications must be greater than 0."
+    assert seed >= 0, "The seed must be 0 or greater."
+    assert ci_method in (
+        "normal",
+        "percentile",
+    ), f"Unknown ci_method: {ci_method!r} (expected 'normal' or 'percentile')."
+
+
+def _bootstrap_results(
+    ci1: Tuple, ci2: Optional[Tuple], p_improv: Optional[float]
+) -> Dict:
+    ans1 = _build_results(*ci1)
+    if ci2 is None:
+        return ans1
     return {
         "system1": ans1,
-        "system2": _build_results(mean2, interval2),
+        "system2": _build_results(*ci2),
         "p_s2_improv_over_s1": p_improv,
     }
 
 
-def _build_results(mean: float, interval: float) -> Dict[str, float]:
+def _build_results(
+    mean: float, interval: float, lower: float, upper: float
+) -> Dict[str, float]:
     return {
         "wer": mean,
         "ci95": interval,
-        "ci95min": mean - interval,
-        "ci95max": mean + interval,
+        "ci95min": lower,
+        "ci95max": upper,
     }
 
 
+def _report_totals(
+    ins: int, dels: int, sub: int, ref_len: int, num_utts: int, num_sent_err: int
+) -> Dict[str, Union[int, float]]:
+    total = ins + dels + sub
+    return {
+        "ins": ins,
+        "del": dels,
+        "sub": sub,
+        "total": total,
+        "ref_len": ref_len,
+        "err_rate": _err_rate(total, ref_len),
+        "num_utts": num_utts,
+        "num_sent_err": num_sent_err,
+    }
+
+
+def _err_rate(total: int, ref_len: int) -> float:
+    try:
+        return total / ref_len
+    except ZeroDivisionError:
+        return 0.0 if total == 0 else float("inf")
+
+
+_INT_BUFFER_FORMATS = frozenset("bBhHiIlLqQ")
+
+# Stages of profile() that run in Python.
+_PROFILE_SYMBOLS = _kaldialign._ProfileScope("symbols")
+_PROFILE_RESULT = _kaldialign._ProfileScope("result")
+
+# Corpus file header: magic, version, flags, byte order mark and the number
+# of sequences, tokens, symbols and bytes of symbol text.
+_CORPUS_HEADER = struct.Struct("=8sIIIxxxxQQQQ")
+_CORPUS_MAGIC = b"KALDICRP"
+_CORPUS_VERSION = 1
+_CORPUS_HAS_SYMBOLS = 1
+_CORPUS_BYTE_ORDER = 0x01020304
+
+
+def _is_int_buffer(seq) -> bool:
+    # One-dimensional buffers of native integers (NumPy integer arrays,
+    # ``array.array``, ...) are passed to the native code as they are.
+    try:
+        view = memoryview(seq)
+    except TypeError:
+        return False
+    with view:
+        return view.ndim == 1 and view.format.lstrip("@=") in _INT_BUFFER_FORMATS
+
+
+def _all_int_buffers(*sources: Sequence) -> bool:
+    # The ids of a Corpus are only meaningful with its symbol table.
+    return not any(isinstance(source, Corpus) for source in sources) and all(
+        _is_int_buffer(seq) for source in sources for seq in source
+    )
+
+
+def _error_bound(
+    max_errors: Optional[int], max_err_rate: Optional[float]
+) -> Tuple[int, float]:
+    # The native side uses negative values for "no bound".
+    assert max_errors is None or max_errors >= 0, "max_errors must be non-negative."
+    assert (
+        max_err_rate is None or max_err_rate >= 0
+    ), "max_err_rate must be non-negative."
+    return (
+        -1 if max_errors is None else max_errors,
+        -1.0 if max_err_rate is None else max_err_rate,
+    )
+
+
+def _check_costs_args(sclite_mode: bool, merge_compounds: bool) -> None:
+    assert not (
+        sclite_mode or merge_compounds
+    ), "costs cannot be combined with sclite_mode or merge_compounds."
+
+
+def _compound_limit(max_compound_words: Optional[int]) -> int:
+    # The native side uses -1 for "no limit".
+    assert (
+        max_compound_words is None or max_compound_words >= 1
+    ), "max_compound_words must be positive."
+    return -1 if max_compound_words is None else max_compound_words
+
+
 def _convert_to_int(
     ref: Sequence[Sequence[Symbol]],
     hyp: Sequence[Sequence[Symbol]],
     hyp2: Sequence[Sequence[Symbol]] = None,
-) -> Tuple[List[List[Symbol]], ...]:
+    symbols: Optional[SymbolTable] = None,
+) -> Tuple[List[array], ...]:
     sources = [ref, hyp]
     if hyp2 is not None:
         sources.append(hyp2)
 
-    symbols = sorted(
-        set(symbol for source in sources for seq in source for symbol in seq)
-    )
-    int2sym = dict(enumerate(symbols))
-    sym2int = {v: k for k, v in int2sym.items()}
-
-    ints = [[[sym2int[item] for item in seq] for seq in source] for source in sources]
+    ints, _ = _encode_sources(sources, symbols)
     if hyp2 is None:
         ints.append(None)
     return tuple(ints)
+
+
+def _encode_sources(
+    sources: Sequence[Sequence[Iterable[Symbol]]],
+    symbols: Optional[SymbolTable] = None,
+) -> Tuple[List[List], Callable[[Sequence[int]], List[Symbol]]]:
+    """
+    :func:`_encode` for several lists of sequences, returning one list of
+    encoded sequences per source.  The sequences of a :class:`Corpus` are used
+    as they are and the other sources are encoded with its symbol table.
+    """
+    corpora = [source for source in sources if isinstance(source, Corpus)]
+    if not corpora:
+        encoded, decode = _encode(
+            [seq for source in sources for seq in source], symbols
+        )
+        ends = itertools.accumulate(len(source) for source in sources)
+        return [
+            encoded[end - len(src) : end] for src, end in zip(sources, ends)
+        ], decode
+
+    largest = max(corpora, key=lambda corpus: len(corpus._symbol_offsets))
+    if not all(largest._extends(corpus) for corpus in corpora):
+        raise ValueError("The corpora were written with incompatible symbol tables.")
+    table = largest.symbols
+    assert (
+        symbols is None or symbols is table
+    ), "symbols cannot be combined with a Corpus, which has its own symbol table."
+    ans = [list(source) if isinstance(source, Corpus) else None for source in sources]
+    plain = [i for i, source in enumerate(sources) if ans[i] is None]
+    if table is None:
+        for i in plain:
+            ans[i] = [_as_int32(seq) for seq in sources[i]]
+        return ans, list
+
+    seqs = [[_as_list(seq) for seq in sources[i]] for i in plain]
+    try:
+        encoded = [table.encode_batch(batch, add=False) for batch in seqs]
+    except KeyError:
+        # Symbols missing from the corpus get new ids in a copy of its table,
+        # which has to keep matching the file.
+        table = SymbolTable(largest.vocabulary())
+        encoded = [table.encode_batch(batch) for batch in seqs]
+    for i, ids in zip(plain, encoded):
+        ans[i] = ids
+    return ans, table.decode
+
+
+def _encode(
+    seqs: Sequence[Iterable[Symbol]], symbols: Optional[SymbolTable] = None
+) -> Tuple[List[array], Callable[[Sequence[int]], List[Symbol]]]:
+    """
+    Map every sequence in ``seqs`` to an ``array.array('i')`` of symbol ids,
+    using ``symbols`` if given and otherwise ids assigned in the order of
+    first occurrence (so the symbols only need to be hashable).
+    Also returns a function mapping a list of ids back to the symbols.
+    """
+    with _PROFILE_SYMBOLS:
+        if symbols is not None:
+            encoded = symbols.encode_batch([_as_list(seq) for seq in seqs])
+            return encoded, symbols.decode
+        sym2int = {}
+        encoded = [
+            array("i", [sym2int.setdefault(sym, len(sym2int)) for sym in seq])
+            for seq in seqs
+        ]
+    int2sym = list(sym2int)
+    return encoded, lambda ids: [int2sym[i] for i in ids]
+
+
+def _decode_alignment(
+    alignment: List[Tuple[int, int]], decode: Callable[[Sequence[int]], List[Symbol]]
+) -> List[Tuple[Symbol, Symbol]]:
+    with _PROFILE_RESULT:
+        flat = decode([i for pair in alignment for i in pair])
+        return list(zip(flat[::2], flat[1::2]))
+
+
+def _as_int32(seq: Iterable[int]) -> Union[array, memoryview]:
+    # The symbols of ``seq`` as a contiguous int32 buffer, without a copy if
+    # they already are one.
+    if _is_int_buffer(seq):
+        view = memoryview(seq)
+        if view.format.lstrip("@=") == "i" and view.c_contiguous:
+            return view
+    return array("i", seq)
+
+
+def _corpus_layout(
+    num_seqs: int, num_tokens: int, num_symbols: int, symbol_bytes: int
+) -> List[int]:
+    # Start of the offsets, tokens, symbol offsets and symbols, and the file
+    # size; every section starts at a multiple of 8 bytes.
+    def align(n):
+        return (n + 7) & ~7
+
+    layout = [_CORPUS_HEADER.size]
+    layout.append(layout[-1] + 8 * (num_seqs + 1))
+    layout.append(align(layout[-1] + 4 * num_tokens))
+    layout.append(layout[-1] + 8 * (num_symbols + 1))
+    layout.append(align(layout[-1] + symbol_bytes))
+    return layout
+
+
+def _as_list(seq: Iterable[Symbol]) -> Union[list, tuple]:
+    return seq if isinstance(seq, (list, tuple)) else list(seq)
@@ -0,0 +1,102 @@
+"""
+Score Kaldi-style text files (one ``utt-id w1 w2 ...`` line per utterance)::
+
+    python -m kaldialign ref.txt hyp.txt [--per-utt per_utt.txt] [--bootstrap]
+
+Both files are memory-mapped, joined by utterance id and scored in native
+code on all available cores; the output follows Kaldi's ``compute-wer``
+(and ``compute-wer-bootci`` with ``--bootstrap``).
+"""
+
+import argparse
+import sys
+from typing import List, Optional
+
+import _kaldialign
+
+from kaldialign import WerAccumulator
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(
+        prog="kaldialign",
+        description="Compute the WER of a hypothesis text file against a reference "
+        "text file, both with one 'utt-id w1 w2 ...' line per utterance.",
+    )
+    parser.add_argument("ref", help="Reference text file.")
+    parser.add_argument("hyp", help="Hypothesis text file.")
+    parser.add_argument(
+        "--mode",
+        choices=("strict", "present", "all"),
+        default="strict",
+        help="What to do with reference utterances missing from the hypotheses: "
+        "fail (strict), skip them (present) or score them as empty (all).",
+    )
+    parser.add_argument(
+        "--sclite-mode",
+        action="store_true",
+        help="Use sclite costs (ins/del 3, sub 4) for the alignment.",
+    )
+    parser.add_argument(
+        "-j",
+        "--num-threads",
+        type=int,
+        default=0,
+        help="Number of worker threads (0 uses all available cores).",
+    )
+    parser.add_argument(
+        "--per-utt",
+        metavar="FILE",
+        help="Write '<utt-id> #csid <cor> <sub> <ins> <del>' for every utterance to FILE.",
+    )
+    parser.add_argument(
+        "--bootstrap",
+        action="store_true",
+        help="Also print the bootstrap 95%% confidence interval of the WER.",
+    )
+    parser.add_argument("--replications", type=int, default=10000)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument(
+        "--ci-method", choices=("normal", "percentile"), default="normal"
+    )
+    args = parser.parse_args(argv)
+
+    acc = WerAccumulator(sclite_mode=args.sclite_mode)
+    try:
+        num_scored, num_missing, num_sent_err = _kaldialign._score_text_files(
+            args.ref,
+            args.hyp,
+            acc._acc,
+            missing_hyp=args.mode,
+            num_threads=args.num_threads,
+            per_utt_path=args.per_utt or "",
+        )
+    except (RuntimeError, ValueError) as e:
+        print(f"kaldialign: error: {e}", file=sys.stderr)
+        return 1
+
+    stats = acc.stats()
+    print(
+        f"%WER {100 * stats['err_rate']:.2f} [ {stats['total']} / {stats['ref_len']}, "
+        f"{stats['ins']} ins, {stats['del']} del, {stats['sub']} sub ]"
+    )
+    ser = 100 * num_sent_err / num_scored if num_scored else 0.0
+    print(f"%SER {ser:.2f} [ {num_sent_err} / {num_scored} ]")
+    print(f"Scored {num_scored} sentences, {num_missing} not present in hyp.")
+
+    if args.bootstrap and num_scored:
+        ans = acc.bootstrap_wer_ci(
+            replications=args.replications,
+            seed=args.seed,
+            num_threads=args.num_threads,
+            ci_method=args.ci_method,
+        )
+        print(
+            f"Set1: %WER {100 * ans['wer']:.2f} 95% Conf Interval "
+            f"[ {100 * ans['ci95min']:.2f}, {100 * ans['ci95max']:.2f} ]"
+        )
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
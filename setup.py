@@ -122,6 +122,7 @@ setuptools.setup(
     long_description_content_type="text/markdown",
     ext_modules=[cmake_extension("_kaldialign")],
     cmdclass={"build_ext": BuildExtension},
+    entry_points={"console_scripts": ["kaldialign=kaldialign.__main__:main"]},
     extras_require={"test": ["pytest"]},
     python_requires=">=3.10",
     keywords=[
@@ -136,6 +137,7 @@ setuptools.setup(
         "Programming Language :: Python :: 3.12",
         "Programming Language :: Python :: 3.13",
         "Programming Language :: Python :: 3.14",
+        "Programming Language :: Python :: Free Threading :: 2 - Beta",
         "Development Status :: 5 - Production/Stable",
         "Intended Audience :: Developers",
         "Operating System :: OS Independent",
@@ -1,8 +1,37 @@
+import math
+import pickle
+import random
+from array import array
+from collections import Counter
 from functools import partial
 
+import _kaldialign
 import pytest
 
-from kaldialign import align, bootstrap_wer_ci, edit_distance
+from kaldialign import (
+    Corpus,
+    CostTable,
+    IncrementalAligner,
+    SymbolTable,
+    WerAccumulator,
+    align,
+    align_batch,
+    align_columnar,
+    align_indices,
+    align_lattice,
+    align_long,
+    align_timed,
+    bootstrap_compare,
+    bootstrap_wer_ci,
+    edit_distance,
+    edit_distance_batch,
+    edit_distance_nbest,
+    error_report,
+    profile,
+    profile_stats,
+    set_simd_backend,
+    simd_backend,
+)
 
 EPS = "*"
 
@@ -185,6 +214,45 @@ def test_bootstrap_wer_ci_2system():
     assert ans["p_s2_improv_over_s1"] == 1.0
 
 
+def test_bootstrap_wer_ci_thread_count_invariant():
+    rng = random.Random(0)
+    ref = [[rng.randint(0, 9) for _ in range(rng.randint(1, 8))] for _ in range(50)]
+    hyp = [[w if rng.random() < 0.8 else -1 for w in seq] for seq in ref]
+    hyp2 = [[w if rng.random() < 0.9 else -1 for w in seq] for seq in ref]
+
+    expected = bootstrap_wer_ci(ref, hyp, hyp2, replications=500, seed=7, num_threads=1)
+    for num_threads in (2, 3, 0):
+        assert (
+            bootstrap_wer_ci(
+                ref, hyp, hyp2, replications=500, seed=7, num_threads=num_threads
+            )
+            == expected
+        )
+    assert bootstrap_wer_ci(ref, hyp, replications=500, seed=7) == expected["system1"]
+    assert bootstrap_wer_ci(ref, hyp, replications=500, seed=8) != expected["system1"]
+
+
+def test_bootstrap_wer_ci_percentile():
+    ref = [
+        ("a", "b", "c"),
+        ("d", "e", "f"),
+    ]
+    hyp = [
+        ("a", "b", "d"),
+        ("e", "f", "f"),
+    ]
+
+    ans = bootstrap_wer_ci(ref, hyp, ci_method="percentile")
+    assert ans["wer"] == approx(0.50)
+    # Each resample has 0, 1 or 2 errors out of 6 words.
+    assert ans["ci95min"] == approx(1 / 3)
+    assert ans["ci95max"] == approx(2 / 3)
+    assert ans["ci95"] == approx(1 / 6)
+
+    with pytest.raises(AssertionError):
+        bootstrap_wer_ci(ref, hyp, ci_method="bca")
+
+
 # --- Compound word matching tests ---
 
 
@@ -276,6 +344,47 @@ def test_align_compound_mixed():
     ]
 
 
+def test_compound_repeated_and_empty_words():
+    # Runs are matched by content, including repeated and empty words.
+    ref = ["ab", "ab", "a", "", "b", "abab"]
+    hyp = ["abab", "ab", "ab", "ab"]
+    ans = edit_distance(ref, hyp, merge_compounds=True)
+    assert ans["total"] == 0
+    ali = align(ref, hyp, EPS, merge_compounds=True)
+    assert ali == [("ab ab", "abab"), ("a  b", "ab"), ("abab", "ab ab")]
+    assert ali == align(ref, hyp, EPS, merge_compounds=True, linear_memory=True)
+
+
+def test_compound_max_compound_words():
+    ref = ["a", "b", "c", "d", "e"]
+    hyp = ["abc", "de"]
+    assert edit_distance(ref, hyp, merge_compounds=True)["total"] == 0
+    assert edit_distance(ref, hyp, merge_compounds=True, max_compound_words=2) == (
+        edit_distance(["x", "b", "c", "d", "e"], hyp, merge_compounds=True)
+    )
+    ali = align(ref, hyp, EPS, merge_compounds=True, max_compound_words=2)
+    assert ("d e", "de") in ali and ("a b c", "abc") not in ali
+    ans = edit_distance_batch([ref], [hyp], merge_compounds=True, max_compound_words=2)
+    assert list(ans["total"]) == [3]
+
+
+def test_compound_long_form():
+    rng = random.Random(9)
+    vocab = [f"w{i}" for i in range(50)]
+    ref = [rng.choice(vocab) for _ in range(3000)]
+    hyp = list(ref)
+    for _ in range(100):
+        pos = rng.randrange(len(hyp) - 3)
+        hyp[pos : pos + 2] = ["".join(hyp[pos : pos + 2])]
+    hyp[10] = "oov"
+    ans = edit_distance(ref, hyp, merge_compounds=True)
+    assert ans["total"] == sum(
+        1
+        for r, h in align(ref, hyp, EPS, merge_compounds=True)
+        if r != h and " " not in r + h
+    )
+
+
 def test_bootstrap_wer_ci_compound():
     ref = [
         ("white", "paper"),
@@ -287,3 +396,1173 @@ def test_bootstrap_wer_ci_compound():
     ]
     ans = bootstrap_wer_ci(ref, hyp, merge_compounds=True)
     assert ans["wer"] == approx(0.0)
+
+
+# --- Batch API tests ---
+
+
+BATCH_REFS = [
+    ["a", "b", "c"],
+    ["a", "b"],
+    ["the", "white", "paper", "is", "here"],
+    [],
+]
+BATCH_HYPS = [
+    ["a", "s", "x", "c"],
+    ["b", "c"],
+    ["the", "whitepaper", "was", "here"],
+    ["a"],
+]
+
+
+@pytest.mark.parametrize("merge_compounds", [False, True])
+@pytest.mark.parametrize("sclite_mode", [False, True])
+@pytest.mark.parametrize("num_threads", [1, 4])
+def test_edit_distance_batch(merge_compounds, sclite_mode, num_threads):
+    ans = edit_distance_batch(
+        BATCH_REFS,
+        BATCH_HYPS,
+        sclite_mode=sclite_mode,
+        merge_compounds=merge_compounds,
+        num_threads=num_threads,
+    )
+    for i, (ref, hyp) in enumerate(zip(BATCH_REFS, BATCH_HYPS)):
+        expected = edit_distance(
+            ref, hyp, sclite_mode=sclite_mode, merge_compounds=merge_compounds
+        )
+        for key in ("ins", "del", "sub", "total", "ref_len"):
+            assert ans[key][i] == expected[key]
+
+
+@pytest.mark.parametrize("merge_compounds", [False, True])
+@pytest.mark.parametrize("num_threads", [1, 4])
+def test_align_batch(merge_compounds, num_threads):
+    ans = align_batch(
+        BATCH_REFS,
+        BATCH_HYPS,
+        EPS,
+        merge_compounds=merge_compounds,
+        num_threads=num_threads,
+    )
+    assert ans == [
+        align(ref, hyp, EPS, merge_compounds=merge_compounds)
+        for ref, hyp in zip(BATCH_REFS, BATCH_HYPS)
+    ]
+
+
+def test_concurrent_calls_from_threads():
+    from concurrent.futures import ThreadPoolExecutor
+
+    pairs = list(zip(BATCH_REFS, BATCH_HYPS)) * 50
+    expected = [edit_distance(ref, hyp) for ref, hyp in pairs]
+    with ThreadPoolExecutor(max_workers=4) as pool:
+        results = list(pool.map(lambda p: edit_distance(*p), pairs))
+    assert results == expected
+
+
+# --- Linear-memory alignment tests ---
+
+
+@pytest.mark.parametrize("merge_compounds", [False, True])
+def test_align_linear_memory_small(merge_compounds):
+    ref = ["the", "white", "paper", "is", "here"]
+    hyp = ["the", "whitepaper", "was", "here", "now"]
+    assert align(
+        ref, hyp, EPS, merge_compounds=merge_compounds, linear_memory=True
+    ) == align(ref, hyp, EPS, merge_compounds=merge_compounds, linear_memory=False)
+
+
+@pytest.mark.parametrize("merge_compounds", [False, True])
+@pytest.mark.parametrize("sclite_mode", [False, True])
+def test_align_linear_memory_matches_full_table(sclite_mode, merge_compounds):
+    # Large enough for the divide-and-conquer engine to recurse a few times.
+    rng = random.Random(0)
+    vocab = ["a", "b", "ab", "ba", "c", "abc", "bc"]
+    ref = [rng.choice(vocab) for _ in range(1200)]
+    hyp = [rng.choice(vocab) if rng.random() < 0.3 else w for w in ref]
+    hyp = [w for w in hyp if rng.random() > 0.05]
+    kwargs = dict(sclite_mode=sclite_mode, merge_compounds=merge_compounds)
+    assert align(ref, hyp, EPS, linear_memory=True, **kwargs) == align(
+        ref, hyp, EPS, linear_memory=False, **kwargs
+    )
+
+
+# --- Bit-parallel edit distance tests ---
+
+
+def _count_ops(ali):
+    ins = sum(1 for r, h in ali if r == EPS)
+    dels = sum(1 for r, h in ali if h == EPS)
+    subs = sum(1 for r, h in ali if r != EPS and h != EPS and r != h)
+    return {"ins": ins, "del": dels, "sub": subs, "total": ins + dels + subs}
+
+
+@pytest.mark.parametrize("ref_len", [5, 63, 64, 65, 200, 700])
+@pytest.mark.parametrize("vocab_size", [2, 30, 1000])
+def test_edit_distance_bit_parallel_matches_alignment(ref_len, vocab_size):
+    # The unit-cost path runs on the bit-parallel engine; its breakdown must
+    # follow the same tie-breaking as the full-table alignment.
+    rng = random.Random(ref_len * vocab_size)
+    for _ in range(5):
+        ref = [str(rng.randrange(vocab_size)) for _ in range(ref_len)]
+        hyp = [
+            str(rng.randrange(vocab_size)) if rng.random() < 0.2 else w
+            for w in ref
+            if rng.random() > 0.1
+        ]
+        hyp += [str(rng.randrange(vocab_size)) for _ in range(rng.randint(0, 3))]
+        dist = edit_distance(ref, hyp)
+        assert {k: dist[k] for k in ("ins", "del", "sub", "total")} == _count_ops(
+            align(ref, hyp, EPS)
+        )
+
+
+# --- Bounded edit distance tests ---
+
+
+@pytest.mark.parametrize("sclite_mode", [False, True])
+def test_edit_distance_bounded(sclite_mode):
+    ref = ["a", "b", "c", "d", "e"]
+    hyp = ["a", "x", "c", "e", "f"]
+    full = edit_distance(ref, hyp, sclite_mode=sclite_mode)
+    assert full["total"] == 3
+    assert edit_distance(ref, hyp, sclite_mode=sclite_mode, max_errors=3) == full
+    assert edit_distance(ref, hyp, sclite_mode=sclite_mode, max_errors=2) is None
+    assert edit_distance(ref, hyp, sclite_mode=sclite_mode, max_err_rate=0.6) == full
+    assert edit_distance(ref, hyp, sclite_mode=sclite_mode, max_err_rate=0.5) is None
+    assert edit_distance(ref, ref, sclite_mode=sclite_mode, max_errors=0)["total"] == 0
+
+
+def test_align_bounded():
+    ref = ["a", "b", "c", "d", "e"]
+    hyp = ["a", "x", "c", "e", "f"]
+    assert align(ref, hyp, EPS, max_errors=3) == align(ref, hyp, EPS)
+    assert align(ref, hyp, EPS, max_errors=2) is None
+    assert align([], ["a"], EPS, max_errors=0) is None
+    assert align([], ["a"], EPS, max_errors=1) == [(EPS, "a")]
+
+
+def test_edit_distance_bounded_compound():
+    ref = ["the", "white", "paper", "is", "here"]
+    hyp = ["the", "whitepaper", "was", "here"]
+    assert edit_distance(ref, hyp, merge_compounds=True, max_errors=0) is None
+    assert edit_distance(ref, hyp, merge_compounds=True, max_errors=1)["total"] == 1
+    assert align(ref, hyp, EPS, merge_compounds=True, max_errors=0) is None
+    assert align(ref, hyp, EPS, merge_compounds=True, max_errors=1) == align(
+        ref, hyp, EPS, merge_compounds=True
+    )
+
+
+@pytest.mark.parametrize("sclite_mode", [False, True])
+def test_bounded_matches_unbounded(sclite_mode):
+    rng = random.Random(5)
+    for _ in range(300):
+        ref_len = rng.randint(0, 150)
+        ref = [rng.randrange(20) for _ in range(ref_len)]
+        hyp = [rng.randrange(20) if rng.random() < 0.1 else w for w in ref]
+        hyp = [w for w in hyp if rng.random() > 0.05]
+        hyp += [rng.randrange(20) for _ in range(rng.randint(0, 5))]
+        max_errors = rng.randint(0, 30)
+        full = edit_distance(ref, hyp, sclite_mode=sclite_mode)
+        bounded = edit_distance(
+            ref, hyp, sclite_mode=sclite_mode, max_errors=max_errors
+        )
+        ali = align(ref, hyp, -1, sclite_mode=sclite_mode, max_errors=max_errors)
+        if full["total"] <= max_errors:
+            assert bounded == full
+            assert ali == align(ref, hyp, -1, sclite_mode=sclite_mode)
+        else:
+            assert bounded is None
+            assert ali is None
+
+
+def test_batch_bounded():
+    refs = [["a", "b", "c"], ["a", "b", "c"], []]
+    hyps = [["a", "b", "c"], ["x", "y"], ["a"]]
+    ans = edit_distance_batch(refs, hyps, max_errors=1, num_threads=2)
+    assert list(ans["total"]) == [0, -1, 1]
+    assert list(ans["sub"]) == [0, -1, 0]
+    assert list(ans["ref_len"]) == [3, 3, 0]
+    ans = edit_distance_batch(refs, hyps, max_err_rate=0.5, merge_compounds=True)
+    assert list(ans["total"]) == [0, -1, -1]
+    alis = align_batch(refs, hyps, EPS, max_errors=1)
+    assert alis == [align(refs[0], hyps[0], EPS), None, [(EPS, "a")]]
+    alis = align_batch(refs, hyps, EPS, merge_compounds=True, max_errors=1)
+    assert alis[1] is None
+
+
+# --- Integer buffer input tests ---
+
+
+@pytest.mark.parametrize("typecode", ["i", "q", "H", "b"])
+def test_int_buffer_inputs(typecode):
+    ref = [1, 2, 3, 4, 5, 6]
+    hyp = [1, 3, 3, 5, 6, 7]
+    ref_b, hyp_b = array(typecode, ref), array(typecode, hyp)
+    assert edit_distance(ref_b, hyp_b) == edit_distance(ref, hyp)
+    assert edit_distance(ref_b, hyp_b, sclite_mode=True, max_errors=1) is None
+    assert align(ref_b, hyp_b, 0) == align(ref, hyp, 0)
+    assert edit_distance_batch([ref_b, hyp_b], [hyp_b, ref_b]) == edit_distance_batch(
+        [ref, hyp], [hyp, ref]
+    )
+    assert align_batch([ref_b], [hyp_b], 0) == align_batch([ref], [hyp], 0)
+
+
+def test_int_buffer_out_of_range():
+    with pytest.raises(ValueError):
+        edit_distance(array("q", [2**40]), array("q", [1]))
+
+
+def test_align_indices():
+    ref_idx, hyp_idx, ops = align_indices(["a", "b", "c"], ["x", "a", "c"])
+    assert list(ref_idx) == [-1, 0, 1, 2]
+    assert list(hyp_idx) == [0, 1, -1, 2]
+    assert list(ops) == [2, 0, 3, 0]
+    assert align_indices([], []) == (array("i"), array("i"), array("i"))
+    assert align_indices("abc", "xyz", max_errors=2) is None
+
+
+def test_align_indices_matches_align():
+    rng = random.Random(6)
+    for _ in range(100):
+        ref = array("i", [rng.randrange(-3, 3) for _ in range(rng.randint(0, 40))])
+        hyp = array("i", [rng.randrange(-3, 3) for _ in range(rng.randint(0, 40))])
+        for sclite_mode in (False, True):
+            ref_idx, hyp_idx, ops = align_indices(ref, hyp, sclite_mode=sclite_mode)
+            ali = align(list(ref), list(hyp), -100, sclite_mode=sclite_mode)
+            assert len(ops) == len(ali)
+            for i, j, op, (r, h) in zip(ref_idx, hyp_idx, ops, ali):
+                assert (ref[i] if i >= 0 else -100) == r
+                assert (hyp[j] if j >= 0 else -100) == h
+                assert op == (2 if i < 0 else 3 if j < 0 else int(r != h))
+
+
+def test_numpy_inputs():
+    np = pytest.importorskip("numpy")
+    ref = np.array([1, 2, 3, 4], dtype=np.int32)
+    hyp = np.array([1, 3, 3], dtype=np.int64)
+    assert edit_distance(ref, hyp) == edit_distance(list(ref), list(hyp))
+    assert edit_distance(ref[::2], hyp[::2]) == edit_distance([1, 3], [1, 3])
+    ref_idx, _, ops = align_indices(ref, hyp)
+    assert np.frombuffer(ref_idx, dtype=np.int32).tolist() == [0, 1, 2, 3]
+    assert np.frombuffer(ops, dtype=np.int32).tolist() == [0, 1, 0, 3]
+
+
+# --- SymbolTable tests ---
+
+
+def test_symbol_table():
+    table = SymbolTable(["a", "b"])
+    assert len(table) == 2
+    assert list(table.encode(["b", "c", "a"])) == [1, 2, 0]
+    assert "c" in table and table["c"] == 2
+    assert table.decode([2, 0]) == ["c", "a"]
+    assert [list(x) for x in table.encode_batch([["x"], ["a"]])] == [[3], [0]]
+    with pytest.raises(KeyError):
+        table.encode(["unknown"], add=False)
+    assert "unknown" not in table
+    with pytest.raises(IndexError):
+        table.decode([100])
+    restored = pickle.loads(pickle.dumps(table))
+    assert restored.decode(range(len(restored))) == ["a", "b", "c", "x"]
+
+
+def test_symbol_table_scoring():
+    table = SymbolTable()
+    ref = ["a", "b", "c"]
+    hyp = ["a", "s", "x", "c"]
+    assert edit_distance(ref, hyp, symbols=table) == edit_distance(ref, hyp)
+    assert align(ref, hyp, EPS, symbols=table) == align(ref, hyp, EPS)
+    assert align_indices(ref, hyp, symbols=table) == align_indices(ref, hyp)
+    assert edit_distance_batch(
+        [ref, hyp], [hyp, ref], symbols=table
+    ) == edit_distance_batch([ref, hyp], [hyp, ref])
+    assert align_batch([ref], [hyp], EPS, symbols=table) == [align(ref, hyp, EPS)]
+    assert bootstrap_wer_ci([ref], [hyp], symbols=table) == bootstrap_wer_ci(
+        [ref], [hyp]
+    )
+    assert len(table) == 6
+
+
+def test_mixed_symbol_types():
+    # Symbols only need to be hashable, not mutually comparable.
+    ref = [1, "a", (2, 3)]
+    hyp = [1, "b", (2, 3)]
+    assert edit_distance(ref, hyp)["sub"] == 1
+    assert align(ref, hyp, None) == [(1, 1), ("a", "b"), ((2, 3), (2, 3))]
+    assert align_batch([ref], [hyp], None) == [align(ref, hyp, None)]
+
+
+# --- N-best scoring tests ---
+
+
+@pytest.mark.parametrize("sclite_mode", [False, True])
+def test_edit_distance_nbest(sclite_mode):
+    rng = random.Random(0)
+    ref = [rng.randint(0, 5) for _ in range(80)]
+    base = [w if rng.random() < 0.8 else rng.randint(0, 5) for w in ref]
+    hyps = [
+        base[: rng.randint(0, 80)] + [rng.randint(0, 5)] * rng.randint(0, 3)
+        for _ in range(40)
+    ]
+    hyps += [[], list(hyps[3]), ref[:-1]]
+
+    ans = edit_distance_nbest(ref, hyps, sclite_mode=sclite_mode)
+    expected = [edit_distance(ref, hyp, sclite_mode=sclite_mode) for hyp in hyps]
+    for key in ("ins", "del", "sub", "total"):
+        assert list(ans[key]) == [e[key] for e in expected]
+    assert ans["ref_len"] == 80
+    assert ans["oracle"] == len(hyps) - 1
+
+
+def test_edit_distance_nbest_inputs():
+    ans = edit_distance_nbest("abc", ["abd", "abc", "ab", "abc"])
+    assert list(ans["total"]) == [1, 0, 1, 0]
+    assert ans["oracle"] == 1
+    assert edit_distance_nbest("abc", [])["oracle"] == -1
+
+    table = SymbolTable()
+    assert edit_distance_nbest(
+        ["a", "b"], [["a"], ["b"]], symbols=table
+    ) == edit_distance_nbest(["a", "b"], [["a"], ["b"]])
+    ref = array("i", [1, 2, 3])
+    assert (
+        edit_distance_nbest(ref, [array("i", [1, 3]), array("q", [1, 2, 3])])["oracle"]
+        == 1
+    )
+
+
+# --- Lattice alignment tests ---
+
+
+def test_align_lattice_best_path():
+    arcs = [
+        (0, 1, "a"),
+        (1, 2, "x"),
+        (1, 2, "b"),
+        (2, 3, EPS),
+        (2, 3, "c"),
+        (3, 4, "d"),
+    ]
+    ans = align_lattice("abc", arcs, EPS)
+    assert ans["alignment"] == [("a", "a"), ("b", "b"), ("c", "c"), (EPS, "d")]
+    assert (ans["ins"], ans["del"], ans["sub"], ans["total"]) == (1, 0, 0, 1)
+    assert ans["path"] == [0, 2, 4, 5]
+
+    # Stopping at state 3 avoids the insertion.
+    ans = align_lattice("abc", arcs, EPS, finals=[3])
+    assert ans["total"] == 0 and ans["path"] == [0, 2, 4]
+    ans = align_lattice("ab", arcs, EPS, finals=[3])
+    assert ans["alignment"] == [("a", "a"), ("b", "b")]
+    assert ans["path"] == [0, 2, 3]
+
+    assert align_lattice("ab", [(0, 1, "a"), (2, 3, "b")], EPS, finals=[3]) is None
+    with pytest.raises(ValueError):
+        align_lattice("ab", [(0, 1, "a"), (1, 0, "b")], EPS)
+
+
+@pytest.mark.parametrize("sclite_mode", [False, True])
+def test_align_lattice_linear_matches_align(sclite_mode):
+    rng = random.Random(0)
+    for _ in range(50):
+        ref = [rng.randint(0, 3) for _ in range(rng.randint(0, 10))]
+        hyp = [rng.randint(0, 3) for _ in range(rng.randint(0, 10))]
+        chain = [(j, j + 1, w) for j, w in enumerate(hyp)]
+        ans = align_lattice(ref, chain, -1, sclite_mode=sclite_mode)
+        assert ans["alignment"] == align(ref, hyp, -1, sclite_mode=sclite_mode)
+        expected = edit_distance(ref, hyp, sclite_mode=sclite_mode)
+        assert {k: ans[k] for k in expected} == expected
+
+
+# --- WerAccumulator tests ---
+
+
+def _random_corpus(n, seed):
+    rng = random.Random(seed)
+    refs = [
+        [rng.choice("abcdefg") for _ in range(rng.randint(0, 10))] for _ in range(n)
+    ]
+    hyps = [
+        [
+            w if rng.random() < 0.8 else rng.choice("abcdefg")
+            for w in ref
+            if rng.random() < 0.9
+        ]
+        for ref in refs
+    ]
+    return refs, hyps
+
+
+def test_wer_accumulator_totals():
+    refs, hyps = _random_corpus(40, seed=0)
+    acc = WerAccumulator()
+    for ref, hyp in zip(refs, hyps):
+        acc.add(ref, hyp)
+
+    per_pair = [edit_distance(ref, hyp) for ref, hyp in zip(refs, hyps)]
+    stats = acc.stats()
+    for key in ("ins", "del", "sub", "total", "ref_len"):
+        assert stats[key] == sum(d[key] for d in per_pair)
+    assert stats["err_rate"] == stats["total"] / stats["ref_len"]
+    assert stats["num_utts"] == len(acc) == 40
+    assert acc.edits() == [(d["total"], d["ref_len"]) for d in per_pair]
+
+    batch = WerAccumulator()
+    batch.add_batch(refs, hyps, num_threads=3)
+    assert batch.to_bytes() == acc.to_bytes()
+    assert WerAccumulator().stats()["err_rate"] == 0.0
+
+
+def test_wer_accumulator_merge_and_serialize():
+    refs, hyps = _random_corpus(30, seed=1)
+    full = WerAccumulator()
+    full.add_batch(refs, hyps)
+
+    shards = []
+    for i in range(0, 30, 7):
+        shard = WerAccumulator()
+        shard.add_batch(refs[i : i + 7], hyps[i : i + 7])
+        shards.append(shard.to_bytes())
+    merged = WerAccumulator.from_bytes(shards[0])
+    for blob in shards[1:]:
+        merged.merge(WerAccumulator.from_bytes(blob))
+
+    assert merged.to_bytes() == full.to_bytes()
+    assert merged.stats() == full.stats()
+    assert pickle.loads(pickle.dumps(full)).edits() == full.edits()
+    assert merged.bootstrap_wer_ci(replications=200) == bootstrap_wer_ci(
+        refs, hyps, replications=200
+    )
+
+    with pytest.raises(ValueError):
+        merged.merge(WerAccumulator(sclite_mode=True))
+    with pytest.raises(ValueError):
+        WerAccumulator.from_bytes(full.to_bytes()[:-1])
+    with pytest.raises(ValueError):
+        WerAccumulator.from_bytes(b"not an accumulator")
+
+
+def test_wer_accumulator_two_systems():
+    refs, hyps = _random_corpus(20, seed=2)
+    _, hyps2 = _random_corpus(20, seed=2)
+    hyps2 = [list(ref) for ref in refs[:10]] + hyps2[10:]
+    acc1, acc2 = WerAccumulator(), WerAccumulator()
+    acc1.add_batch(refs, hyps)
+    acc2.add_batch(refs, hyps2)
+    assert acc1.bootstrap_wer_ci(
+        acc2, replications=300, ci_method="percentile"
+    ) == bootstrap_wer_ci(refs, hyps, hyps2, replications=300, ci_method="percentile")
+
+
+def test_wer_accumulator_compound():
+    acc = WerAccumulator(merge_compounds=True)
+    acc.add(["white", "paper"], ["whitepaper"])
+    acc.add(["hello"], ["hello", "world"])
+    assert acc.merge_compounds
+    assert acc.stats()["total"] == 1
+    restored = WerAccumulator.from_bytes(acc.to_bytes())
+    assert restored.merge_compounds and not restored.sclite_mode
+    with pytest.raises(ValueError):
+        restored.merge(WerAccumulator())
+
+
+# --- Command-line scorer tests ---
+
+
+def _write(path, lines):
+    path.write_text("".join(line + "\n" for line in lines))
+    return str(path)
+
+
+def test_cli_scores_text_files(tmp_path, capsys):
+    from kaldialign.__main__ import main
+
+    ref = _write(tmp_path / "ref.txt", ["u1 a b c", "u2 d e f", "", "u3 x y"])
+    hyp = _write(tmp_path / "hyp.txt", ["u2 e f f\r", "u1  a b d", "u4 z"])
+    per_utt = tmp_path / "per_utt.txt"
+
+    assert main([ref, hyp]) == 1
+    assert "'u3' is missing" in capsys.readouterr().err
+
+    assert main([ref, hyp, "--mode", "all", "--per-utt", str(per_utt)]) == 0
+    out = capsys.readouterr().out.splitlines()
+    assert out == [
+        "%WER 62.50 [ 5 / 8, 1 ins, 3 del, 1 sub ]",
+        "%SER 100.00 [ 3 / 3 ]",
+        "Scored 3 sentences, 1 not present in hyp.",
+    ]
+    assert per_utt.read_text().splitlines() == [
+        "u1 #csid 2 1 0 0",
+        "u2 #csid 2 0 1 1",
+        "u3 #csid 0 0 0 2",
+    ]
+
+    assert main([ref, hyp, "--mode", "present", "--bootstrap", "-j", "2"]) == 0
+    out = capsys.readouterr().out.splitlines()
+    assert out[0] == "%WER 50.00 [ 3 / 6, 1 ins, 1 del, 1 sub ]"
+    expected = bootstrap_wer_ci(
+        [["a", "b", "c"], ["d", "e", "f"]], [["a", "b", "d"], ["e", "f", "f"]]
+    )
+    assert out[3] == (
+        f"Set1: %WER {100 * expected['wer']:.2f} 95% Conf Interval "
+        f"[ {100 * expected['ci95min']:.2f}, {100 * expected['ci95max']:.2f} ]"
+    )
+
+
+def test_cli_matches_edit_distance(tmp_path, capsys):
+    from kaldialign.__main__ import main
+
+    refs, hyps = _random_corpus(100, seed=3)
+    ref = _write(
+        tmp_path / "ref.txt", [f"utt{i} " + " ".join(r) for i, r in enumerate(refs)]
+    )
+    hyp = _write(
+        tmp_path / "hyp.txt",
+        [f"utt{i} " + " ".join(h) for i, h in reversed(list(enumerate(hyps)))],
+    )
+    for flags, sclite_mode in (([], False), (["--sclite-mode"], True)):
+        assert main([ref, hyp, *flags]) == 0
+        acc = WerAccumulator(sclite_mode=sclite_mode)
+        acc.add_batch(refs, hyps)
+        stats = acc.stats()
+        assert capsys.readouterr().out.splitlines()[0] == (
+            f"%WER {100 * stats['err_rate']:.2f} [ {stats['total']} / {stats['ref_len']}, "
+            f"{stats['ins']} ins, {stats['del']} del, {stats['sub']} sub ]"
+        )
+
+    dup = _write(tmp_path / "dup.txt", ["u1 a", "u1 b"])
+    assert main([dup, dup]) == 1
+    assert "Duplicate utterance id 'u1'" in capsys.readouterr().err
+    assert main([str(tmp_path / "missing.txt"), dup]) == 1
+    assert "Cannot open" in capsys.readouterr().err
+
+
+# --- Incremental alignment tests ---
+
+
+def test_incremental_aligner_partial():
+    aligner = IncrementalAligner("the cat sat on the mat".split())
+    assert aligner.edit_distance()["ref_len"] == 0
+    aligner.extend(["the", "cat"])
+    ans = aligner.edit_distance()
+    assert (ans["total"], ans["ref_len"]) == (0, 2)
+    assert aligner.edit_distance(partial=False)["del"] == 4
+
+    # The last word is revised while decoding.
+    aligner.extend(["sad"])
+    assert aligner.align(EPS) == [("the", "the"), ("cat", "cat"), ("sat", "sad")]
+    aligner.update(["the", "cat", "sat", "on"])
+    assert aligner.hyp == ["the", "cat", "sat", "on"]
+    assert aligner.edit_distance()["total"] == 0
+    aligner.retract(10)
+    assert len(aligner) == 0 and aligner.edit_distance()["total"] == 0
+
+
+@pytest.mark.parametrize("sclite_mode", [False, True])
+def test_incremental_aligner_matches_align(sclite_mode):
+    rng = random.Random(0)
+    for _ in range(30):
+        ref = [rng.randint(0, 4) for _ in range(rng.choice([0, 10, 70, 150]))]
+        aligner = IncrementalAligner(ref, sclite_mode=sclite_mode)
+        for _ in range(5):
+            if rng.random() < 0.3:
+                aligner.retract(rng.randint(0, 4))
+            aligner.extend(rng.randint(0, 5) for _ in range(rng.randint(0, 20)))
+            hyp = aligner.hyp
+            assert aligner.edit_distance(partial=False) == edit_distance(
+                ref, hyp, sclite_mode=sclite_mode
+            )
+            assert aligner.align(EPS, partial=False) == align(
+                ref, hyp, EPS, sclite_mode=sclite_mode
+            )
+            prefix = ref[: aligner.edit_distance()["ref_len"]]
+            assert aligner.align(EPS) == align(
+                prefix, hyp, EPS, sclite_mode=sclite_mode
+            )
+
+
+# --- Long-form alignment tests ---
+
+
+def test_align_long_small_input_is_exact():
+    ans = align_long("abcdef", "abxdf", EPS)
+    assert ans["alignment"] == align("abcdef", "abxdf", EPS)
+    assert (ans["sub"], ans["del"], ans["num_anchors"], ans["max_excess"]) == (
+        1,
+        1,
+        0,
+        0,
+    )
+
+
+@pytest.mark.parametrize("sclite_mode", [False, True])
+def test_align_long_anchored(sclite_mode):
+    rng = random.Random(0)
+    ref = [rng.randrange(200) for _ in range(2000)]
+    hyp = []
+    for w in ref:
+        r = rng.random()
+        if r < 0.1:
+            hyp.append(rng.randrange(200))
+        elif r < 0.95:
+            hyp.append(w)
+    ans = align_long(ref, hyp, -1, sclite_mode=sclite_mode, max_segment_cells=10000)
+    assert ans["num_anchors"] > 0
+    assert [r for r, _ in ans["alignment"] if r != -1] == ref
+    assert [h for _, h in ans["alignment"] if h != -1] == hyp
+
+    costs = (3, 3, 4) if sclite_mode else (1, 1, 1)
+    cost = lambda d: sum(c * d[k] for c, k in zip(costs, ("ins", "del", "sub")))
+    excess = cost(ans) - cost(edit_distance(ref, hyp, sclite_mode=sclite_mode))
+    assert 0 <= excess <= ans["max_excess"]
+    assert ans == align_long(
+        ref, hyp, -1, sclite_mode=sclite_mode, max_segment_cells=10000, num_threads=1
+    )
+
+
+# --- Time-constrained alignment tests ---
+
+
+def test_align_timed_collar():
+    ref = ["a", "b", "c"]
+    hyp = ["a", "c"]
+    ref_times = [(0.0, 0.5), (0.5, 1.0), (1.0, 1.5)]
+    # "c" is recognized 10 seconds later than it was spoken.
+    hyp_times = [(0.0, 0.5), (11.0, 11.5)]
+    assert align_timed(ref, hyp, ref_times, hyp_times, 1.0, EPS) == [
+        ("a", "a"),
+        ("b", EPS),
+        ("c", EPS),
+        (EPS, "c"),
+    ]
+    assert align_timed(ref, hyp, ref_times, hyp_times, 10.0, EPS) == align(
+        ref, hyp, EPS
+    )
+    with pytest.raises(ValueError):
+        align_timed(ref, hyp, ref_times[:2], hyp_times, 1.0, EPS)
+    with pytest.raises(ValueError):
+        align_timed(ref, hyp, ref_times[::-1], hyp_times, 1.0, EPS)
+
+
+@pytest.mark.parametrize("sclite_mode", [False, True])
+def test_align_timed_infinite_collar_matches_align(sclite_mode):
+    rng = random.Random(0)
+    for _ in range(50):
+        ref = [rng.randint(0, 3) for _ in range(rng.randint(0, 15))]
+        hyp = [rng.randint(0, 3) for _ in range(rng.randint(0, 15))]
+        ref_times = [(i, i + 1) for i in range(len(ref))]
+        hyp_times = [(2 * j, 2 * j + 1) for j in range(len(hyp))]
+        assert align_timed(
+            ref, hyp, ref_times, hyp_times, math.inf, -1, sclite_mode=sclite_mode
+        ) == align(ref, hyp, -1, sclite_mode=sclite_mode)
+
+
+# --- Columnar alignment tests ---
+
+
+def test_align_columnar():
+    result = align_columnar(["a", "b", "c"], ["a", "s", "x", "c"])
+    assert len(result) == 4
+    assert list(result.op) == [0, 1, 2, 0]
+    assert list(result.ref_start) == [0, 1, 2, 2]
+    assert list(result.ref_end) == [1, 2, 2, 3]
+    assert list(result.hyp_start) == [0, 1, 2, 3]
+    assert list(result.hyp_end) == [1, 2, 3, 4]
+    view = memoryview(result)
+    assert view.shape == (5, 4) and view.format == "i" and view.readonly
+    assert result.pairs(EPS) == [("a", "a"), ("b", "s"), (EPS, "x"), ("c", "c")]
+
+    # The columns stay valid after the result is gone.
+    ops = align_columnar("ab", "b").op
+    assert list(ops) == [3, 0]
+
+    result = align_columnar(
+        ["white", "paper", "x"], ["whitepaper"], merge_compounds=True
+    )
+    assert list(result.op) == [4, 3]
+    assert result.pairs(EPS) == [("white paper", "whitepaper"), ("x", EPS)]
+    assert align_columnar("abc", "xyz", max_errors=1) is None
+    assert len(align_columnar([], [])) == 0
+
+
+@pytest.mark.parametrize("merge_compounds", [False, True])
+def test_align_columnar_pairs_match_align(merge_compounds):
+    rng = random.Random(0)
+    words = ["a", "b", "ab", "ba", "c"]
+    for _ in range(100):
+        ref = [rng.choice(words) for _ in range(rng.randint(0, 10))]
+        hyp = [rng.choice(words) for _ in range(rng.randint(0, 10))]
+        for sclite_mode in (False, True):
+            kwargs = dict(sclite_mode=sclite_mode, merge_compounds=merge_compounds)
+            result = align_columnar(ref, hyp, **kwargs)
+            assert result.pairs(EPS) == align(ref, hyp, EPS, **kwargs)
+            assert list(result.ref_end)[-1:] == ([len(ref)] if len(result) else [])
+
+
+# --- Error report tests ---
+
+
+def test_error_report():
+    refs = [["a", "b", "c"], ["a", "b"], ["c"]]
+    hyps = [["a", "x", "c", "d"], ["a", "x"], ["c"]]
+    report = error_report(refs, hyps, groups=["spk1", "spk2", "spk1"])
+    assert report["sub"] == [(("b", "x"), 2)]
+    assert report["ins"] == [("d", 1)]
+    assert report["del"] == []
+    assert report["total"] == {
+        "ins": 1,
+        "del": 0,
+        "sub": 2,
+        "total": 3,
+        "ref_len": 6,
+        "err_rate": 0.5,
+        "num_utts": 3,
+        "num_sent_err": 2,
+    }
+    assert report["groups"]["spk1"]["total"] == 2
+    assert report["groups"]["spk1"]["num_utts"] == 2
+    assert report["groups"]["spk2"]["err_rate"] == 0.5
+    assert "groups" not in error_report(refs, hyps)
+    assert error_report([], [])["total"]["err_rate"] == 0.0
+
+    ids = error_report([array("i", [1, 2])], [array("i", [1, 3, 4])])
+    assert ids["sub"] == [((2, 3), 1)] and ids["ins"] == [(4, 1)]
+
+
+@pytest.mark.parametrize("sclite_mode", [False, True])
+def test_error_report_matches_align(sclite_mode):
+    rng = random.Random(0)
+    words = ["a", "b", "c", "d"]
+    refs, hyps, groups = [], [], []
+    for i in range(200):
+        refs.append([rng.choice(words) for _ in range(rng.randint(0, 8))])
+        hyps.append([rng.choice(words) for _ in range(rng.randint(0, 8))])
+        groups.append(i % 3)
+    sub, ins, dels = Counter(), Counter(), Counter()
+    for ref, hyp in zip(refs, hyps):
+        for r, h in align(ref, hyp, EPS, sclite_mode=sclite_mode):
+            if r == EPS:
+                ins[h] += 1
+            elif h == EPS:
+                dels[r] += 1
+            elif r != h:
+                sub[r, h] += 1
+
+    report = error_report(refs, hyps, groups, sclite_mode=sclite_mode, num_threads=4)
+    assert dict(report["sub"]) == sub
+    assert dict(report["ins"]) == ins
+    assert dict(report["del"]) == dels
+    counts = [c for _, c in report["sub"]]
+    assert counts == sorted(counts, reverse=True)
+    for g in range(3):
+        stats = [
+            edit_distance(ref, hyp, sclite_mode=sclite_mode)
+            for ref, hyp, key in zip(refs, hyps, groups)
+            if key == g
+        ]
+        assert report["groups"][g]["total"] == sum(s["total"] for s in stats)
+        assert report["groups"][g]["ref_len"] == sum(s["ref_len"] for s in stats)
+
+    top = error_report(refs, hyps, sclite_mode=sclite_mode, top_k=3)
+    assert [c for _, c in top["sub"]] == counts[:3]
+    assert len(top["ins"]) == 3 and top["total"] == report["total"]
+
+
+# --- SIMD tests ---
+
+SIMD_BACKENDS = [
+    name for name in ("sse2", "neon", "simd128", "avx2") if set_simd_backend(name)
+]
+set_simd_backend("auto")
+
+
+@pytest.fixture
+def scalar_and(request):
+    """Runs a function with the scalar DP and with the SIMD backend under test."""
+
+    def run(fn):
+        try:
+            assert set_simd_backend("scalar")
+            expected = fn()
+            assert set_simd_backend(request.param)
+            return expected, fn()
+        finally:
+            set_simd_backend("auto")
+
+    return run
+
+
+def test_simd_backend():
+    assert simd_backend() in ("avx2", "sse2", "neon", "simd128", "scalar")
+    assert not set_simd_backend("no-such-isa")
+
+
+@pytest.mark.parametrize("scalar_and", SIMD_BACKENDS, indirect=True)
+def test_simd_matches_scalar(scalar_and):
+    rng = random.Random(0)
+    for _ in range(300):
+        n = rng.choice([0, 1, 2, 7, 16, 17, 33, 100])
+        vocab = rng.choice([2, 3, 100])
+        ref = [rng.randrange(vocab) for _ in range(n)]
+        hyp = [rng.randrange(vocab) for _ in range(max(0, n + rng.randint(-5, 5)))]
+        for sclite_mode in (False, True):
+            expected, actual = scalar_and(
+                lambda: (
+                    edit_distance(ref, hyp, sclite_mode=sclite_mode),
+                    align(ref, hyp, EPS, sclite_mode=sclite_mode),
+                )
+            )
+            assert actual == expected
+
+    # Costs that do not fit in 16-bit lanes.
+    ref = [rng.randrange(3) for _ in range(6000)]
+    hyp = [rng.randrange(3) for _ in range(5000)]
+    expected, actual = scalar_and(lambda: edit_distance(ref, hyp, sclite_mode=True))
+    assert actual == expected
+
+
+@pytest.mark.parametrize("scalar_and", SIMD_BACKENDS, indirect=True)
+def test_simd_packed_batch_matches_scalar(scalar_and):
+    rng = random.Random(1)
+    refs, hyps = [], []
+    for _ in range(500):
+        n = rng.choice([0, 1, 5, 20, 30, 256, 257, 300])
+        refs.append([rng.randrange(5) for _ in range(n)])
+        hyps.append([rng.randrange(5) for _ in range(max(0, n + rng.randint(-3, 3)))])
+    expected, actual = scalar_and(
+        lambda: {
+            k: list(v)
+            for k, v in edit_distance_batch(refs, hyps, sclite_mode=True).items()
+        }
+    )
+    assert actual == expected
+    assert expected["total"] == [
+        edit_distance(r, h, sclite_mode=True)["total"] for r, h in zip(refs, hyps)
+    ]
+
+
+# --- Profiling tests ---
+
+
+def test_profile_counts_calls_and_cells():
+    ref = [random.Random(0).randrange(10) for _ in range(100)]
+    hyp = ref[:50] + ref[60:]
+    with profile() as stats:
+        edit_distance(ref, hyp)
+        align(ref, hyp, EPS, sclite_mode=True)
+        edit_distance_batch([ref] * 3, [hyp] * 3, num_threads=2)
+    assert stats["calls"] == {"edit_distance": 1, "align": 1, "edit_distance_batch": 1}
+    assert stats["dp_cells"] == 5 * len(ref) * len(hyp)
+    assert stats["dp_bytes"] > 0
+    assert stats["compound_attempts"] == stats["compound_hits"] == 0
+    ns = stats["ns"]
+    assert set(ns) == {
+        "native",
+        "symbols",
+        "convert",
+        "binding",
+        "dp",
+        "compound",
+        "result",
+    }
+    assert ns["dp"] > 0 and ns["symbols"] > 0 and ns["native"] > 0
+    assert ns["compound"] == 0
+
+
+def test_profile_compounds():
+    with profile() as stats:
+        ans = align(["a", "b", "c"], ["ab", "c"], EPS, merge_compounds=True)
+    assert ans == [("a b", "ab"), ("c", "c")]
+    assert stats["calls"] == {"align_compound": 1}
+    assert stats["compound_hits"] == 1
+    assert stats["compound_attempts"] >= 1
+    assert stats["ns"]["compound"] > 0 and stats["ns"]["result"] > 0
+
+
+def test_profile_nested_and_disabled():
+    import kaldialign
+
+    before = profile_stats()
+    edit_distance("abc", "abd")
+    assert profile_stats() == before
+
+    with profile() as outer:
+        edit_distance("abc", "abd")
+        with profile() as inner:
+            align("abc", "abd", EPS)
+        edit_distance("abc", "abd")
+    assert inner["calls"] == {"align": 1}
+    assert outer["calls"] == {"edit_distance": 2, "align": 1}
+    assert outer["dp_cells"] == 27
+    assert kaldialign._kaldialign is _kaldialign
+    assert profile_stats()["dp_cells"] == before["dp_cells"] + 27
+
+
+def test_profile_bootstrap():
+    refs = [["a", "b", "c"], ["d", "e"]]
+    hyps = [["a", "x", "c"], ["d"]]
+    with profile() as stats:
+        bootstrap_wer_ci(refs, hyps, hyps, replications=50)
+        bootstrap_compare(refs, [hyps, hyps], replications=50)
+    assert stats["calls"] == {"_get_edits": 4, "_bootstrap": 1, "_bootstrap_multi": 1}
+    assert stats["ns"]["native"] > 0
+
+    with profile() as stats:
+        bootstrap_wer_ci(refs, hyps, merge_compounds=True, replications=50)
+    assert stats["calls"] == {"_get_edits_compound": 1, "_bootstrap": 1}
+
+
+def test_profile_native_methods():
+    import kaldialign
+
+    table = SymbolTable()
+    with profile() as stats:
+        # Profiling only collects counters; it doesn't change what is called.
+        assert kaldialign._kaldialign is _kaldialign
+        ids = table.encode_batch([["a", "b"], ["b", "c"]])
+        _kaldialign.edit_distance(ids[0], ids[1])
+        edit_distance(["a", "b"], ["b", "c"], symbols=table)
+        acc = WerAccumulator()
+        acc.add_batch([["a", "b"]], [["b"]])
+    assert stats["calls"] == {
+        "SymbolTable.encode_batch": 2,
+        "WerAccumulator.add_batch": 1,
+        "edit_distance": 2,
+    }
+    assert stats["ns"]["symbols"] > 0
+
+
+# --- Cost table tests ---
+
+
+def _random_pairs(rng, n, vocab=6, max_len=12):
+    return [
+        (
+            [rng.randrange(vocab) for _ in range(rng.randrange(max_len))],
+            [rng.randrange(vocab) for _ in range(rng.randrange(max_len))],
+        )
+        for _ in range(n)
+    ]
+
+
+def _weighted_distance(ref, hyp, costs):
+    prev = [0]
+    for h in hyp:
+        prev.append(prev[-1] + costs.ins_cost(h))
+    for r in ref:
+        cur = [prev[0] + costs.del_cost(r)]
+        for j, h in enumerate(hyp):
+            cur.append(
+                min(
+                    prev[j] + costs.sub_cost(r, h),
+                    prev[j + 1] + costs.del_cost(r),
+                    cur[j] + costs.ins_cost(h),
+                )
+            )
+        prev = cur
+    return prev[-1]
+
+
+@pytest.mark.parametrize("sclite_mode", [False, True])
+def test_cost_table_matches_builtin_costs(sclite_mode):
+    rng = random.Random(0)
+    costs = CostTable(3, 3, 4) if sclite_mode else CostTable()
+    for ref, hyp in _random_pairs(rng, 200):
+        expected = edit_distance(ref, hyp, sclite_mode=sclite_mode)
+        ans = edit_distance(ref, hyp, costs=costs)
+        assert ans.pop("cost") == _weighted_distance(ref, hyp, costs)
+        assert ans == expected
+        expected = align(ref, hyp, -1, sclite_mode=sclite_mode)
+        assert align(ref, hyp, -1, costs=costs) == expected
+        assert align(ref, hyp, -1, costs=costs, linear_memory=True) == expected
+
+
+def test_cost_table_custom_costs():
+    rng = random.Random(1)
+    matrix = [[rng.randrange(6) for _ in range(5)] for _ in range(5)]
+    costs = CostTable(
+        ins_cost=2,
+        del_cost=3,
+        sub_cost=5,
+        ins_costs={0: 0, 1: 4},
+        del_costs={2: 1},
+        sub_costs={(1, 5): 0, (6, 6): 9},
+        sub_matrix=matrix,
+    )
+    assert costs.sub_cost(3, 4) == matrix[3][4]
+    assert costs.sub_cost(1, 5) == 0 and costs.sub_cost(5, 1) == 5
+    assert costs.sub_cost(6, 6) == 0 and costs.ins_cost(0) == 0
+    for ref, hyp in _random_pairs(rng, 200, vocab=8):
+        ans = edit_distance(ref, hyp, costs=costs)
+        assert ans["cost"] == _weighted_distance(ref, hyp, costs)
+        ali = align(ref, hyp, -1, costs=costs)
+        assert ali == align(ref, hyp, -1, costs=costs, linear_memory=True)
+        assert ans["cost"] == sum(
+            (
+                costs.ins_cost(h)
+                if r == -1
+                else costs.del_cost(r) if h == -1 else costs.sub_cost(r, h)
+            )
+            for r, h in ali
+        )
+        assert ans["total"] == sum(r != h for r, h in ali)
+
+
+def test_cost_table_symbols():
+    costs = CostTable(
+        sub_costs={("a", "the"): 0},
+        del_costs={"uh": 0},
+        symbols=SymbolTable(),
+    )
+    ref = "uh the cat sat".split()
+    hyp = "a cat sat".split()
+    # The overrides are directional; zero-cost substitutions still count.
+    ans = edit_distance(ref, hyp, costs=costs)
+    assert (ans["sub"], ans["del"], ans["cost"]) == (1, 1, 1)
+    ans = edit_distance(hyp, ref[1:], costs=costs)
+    assert (ans["sub"], ans["del"], ans["cost"]) == (1, 0, 0)
+    assert align(ref, ["the", "cat"], "*", costs=costs) == [
+        ("uh", "*"),
+        ("the", "the"),
+        ("cat", "cat"),
+        ("sat", "*"),
+    ]
+    with pytest.raises(AssertionError):
+        edit_distance(ref, hyp, costs=costs, sclite_mode=True)
+    with pytest.raises(AssertionError):
+        align(ref, hyp, "*", costs=costs, symbols=SymbolTable())
+    with pytest.raises(ValueError):
+        CostTable(ins_cost=-1)
+    with pytest.raises(ValueError):
+        CostTable(sub_matrix=[[0, 1], [1]])
+    # The native table is shared with DPs running without the GIL, so it
+    # cannot be modified after construction.
+    assert not any(name.startswith("set_") for name in dir(costs._table))
+
+
+def test_cost_table_batch():
+    rng = random.Random(2)
+    costs = CostTable(1, 2, 3, sub_costs={(0, 1): 1, (1, 0): 1})
+    pairs = _random_pairs(rng, 100, vocab=4)
+    refs = [array("i", ref) for ref, _ in pairs]
+    hyps = [array("i", hyp) for _, hyp in pairs]
+    ans = edit_distance_batch(refs, hyps, costs=costs, num_threads=4, max_errors=4)
+    alis = align_batch(refs, hyps, -1, costs=costs, num_threads=4, max_errors=4)
+    for i, (ref, hyp) in enumerate(pairs):
+        single = edit_distance(ref, hyp, costs=costs, max_errors=4)
+        if single is None:
+            assert ans["total"][i] == -1 and alis[i] is None
+            continue
+        assert [ans[k][i] for k in ("ins", "del", "sub", "total", "cost")] == [
+            single[k] for k in ("ins", "del", "sub", "total", "cost")
+        ]
+        assert alis[i] == align(ref, hyp, -1, costs=costs)
+
+
+# --- Corpus tests ---
+
+
+def _fail(exc, *args):
+    raise exc
+
+
+def test_corpus_roundtrip(tmp_path, monkeypatch):
+    refs = [["a", "b", "c"], [], ["ć", "a"]]
+    corpus = Corpus.write(tmp_path / "refs.kac", refs)
+    assert len(corpus) == 3
+    assert [corpus.decode(i) for i in range(3)] == refs
+    assert corpus.vocabulary() == ["a", "b", "c", "ć"]
+    assert list(corpus[-1]) == [3, 0] and corpus[0].format == "i"
+    with pytest.raises(IndexError):
+        corpus[3]
+    copy = pickle.loads(pickle.dumps(corpus))
+    assert copy.path == corpus.path and list(copy[0]) == [0, 1, 2]
+
+    ints = Corpus.write(tmp_path / "ints.kac", [array("q", [5, 7]), [1]])
+    assert ints.symbols is None and [list(seq) for seq in ints] == [[5, 7], [1]]
+
+    with pytest.raises(TypeError, match="ints or of strings"):
+        Corpus.write(tmp_path / "tuples.kac", [[("a", 1)]])
+    with monkeypatch.context() as m:
+        m.setattr("os.replace", partial(_fail, KeyboardInterrupt))
+        with pytest.raises(KeyboardInterrupt):
+            Corpus.write(tmp_path / "partial.kac", refs)
+    assert sorted(p.name for p in tmp_path.iterdir()) == ["ints.kac", "refs.kac"]
+
+    (tmp_path / "bad.kac").write_bytes(b"not a corpus" * 10)
+    with pytest.raises(ValueError):
+        Corpus(tmp_path / "bad.kac")
+
+
+def test_corpus_scoring(tmp_path):
+    rng = random.Random(0)
+    vocab = [f"w{i}" for i in range(50)]
+    refs = [[rng.choice(vocab) for _ in range(rng.randrange(20))] for _ in range(50)]
+    hyps = [[w if rng.random() < 0.8 else rng.choice(vocab) for w in r] for r in refs]
+    ref_corpus = Corpus.write(tmp_path / "refs.kac", refs)
+    hyp_corpus = Corpus.write(tmp_path / "hyps.kac", hyps, symbols=ref_corpus.symbols)
+    ref_corpus = Corpus(tmp_path / "refs.kac")
+
+    expected = edit_distance_batch(refs, hyps)
+    assert edit_distance_batch(ref_corpus, hyp_corpus) == expected
+    assert edit_distance_batch(ref_corpus, hyps) == expected
+    assert align_batch(ref_corpus, hyps, "*") == align_batch(refs, hyps, "*")
+    assert bootstrap_wer_ci(ref_corpus, hyp_corpus, replications=100) == (
+        bootstrap_wer_ci(refs, hyps, replications=100)
+    )
+    acc = WerAccumulator()
+    acc.add_batch(ref_corpus, hyp_corpus)
+    assert acc.stats()["ref_len"] == sum(map(len, refs))
+    assert error_report(ref_corpus, hyp_corpus) == error_report(refs, hyps)
+
+    # Unknown symbols are scored without being added to the corpus' table.
+    oov = [hyp + ["oov"] for hyp in hyps]
+    num_symbols = len(ref_corpus.symbols)
+    assert edit_distance_batch(ref_corpus, oov) == edit_distance_batch(refs, oov)
+    assert error_report(ref_corpus, oov) == error_report(refs, oov)
+    assert len(ref_corpus.symbols) == num_symbols
+
+    other = Corpus.write(tmp_path / "other.kac", [["x"]] * len(refs))
+    with pytest.raises(ValueError):
+        edit_distance_batch(other, hyp_corpus)
+
+
+# --- Multi-system bootstrap tests ---
+
+
+def test_bootstrap_compare():
+    rng = random.Random(0)
+    vocab = [f"w{i}" for i in range(30)]
+    refs = [[rng.choice(vocab) for _ in range(rng.randrange(1, 15))] for _ in range(60)]
+    systems = [
+        [[w if rng.random() > err else rng.choice(vocab) for w in ref] for ref in refs]
+        for err in (0.3, 0.1, 0.2, 0.0)
+    ]
+    ans = bootstrap_compare(refs, systems, replications=300, seed=5, num_threads=3)
+    assert len(ans["systems"]) == 4
+    p = ans["p_improv"]
+    assert [p[i][i] for i in range(4)] == [0.0] * 4
+    assert p[0][3] == 1.0 and p[3][0] == 0.0
+    for i in range(4):
+        for j in range(4):
+            assert p[i][j] + p[j][i] <= 1.0
+
+    for i, j in [(0, 1), (2, 3), (3, 1)]:
+        pair = bootstrap_wer_ci(refs, systems[i], systems[j], replications=300, seed=5)
+        assert pair["system1"] == ans["systems"][i]
+        assert pair["system2"] == ans["systems"][j]
+        assert pair["p_s2_improv_over_s1"] == p[i][j]
+    assert bootstrap_compare(refs, systems[:1], replications=300, seed=5) == {
+        "systems": [bootstrap_wer_ci(refs, systems[0], replications=300, seed=5)],
+        "p_improv": [[0.0]],
+    }
+
+
+def test_bootstrap_compare_compounds():
+    refs = [["a", "b", "c"], ["d", "e"]]
+    systems = [[["ab", "c"], ["d", "e"]], [["a", "x", "c"], ["d"]]]
+    ans = bootstrap_compare(refs, systems, replications=100, merge_compounds=True)
+    assert ans["systems"][0]["wer"] == 0.0
+    assert ans["p_improv"][1][0] == 1.0
+    with pytest.raises(AssertionError):
+        bootstrap_compare(refs, [systems[0][:1]])